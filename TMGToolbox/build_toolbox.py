@@ -30,7 +30,7 @@
 #     file). EMME is a product of INRO Consultants Inc.
 #
 #     Usage: build_toolbox.py [-p toolbox_path] [-t toolbox_title] [-n toolbox_namespace] [-s source_folder]
-#             [-c]
+#             [-c] [-i] [-j jobs] [-r report_path]
 #
 #         [-p toolbox_path]: Optional argument. Specifies the name of the MTBX file. If omitted,
 #             defaults to 'TMG_Toolbox.mtbx' inside the working directory.
@@ -48,15 +48,32 @@
 #             will be 'consolidated' (e.g., instead of referencing the source code files, it will
 #             contain the compiled Python code).
 #
+#         [-i]: Incremental build flag (optional argument). If included, a manifest of source file hashes
+#             is kept next to the MTBX file ('<toolbox_path>.manifest.json'). Only modules which have changed
+#             since the last build are recompiled, and if the toolbox structure is unchanged, only their rows
+#             of the existing MTBX file are updated.
+#
+#         [-j jobs]: Optional argument. Number of worker processes used to compile modules in an incremental,
+#             consolidated build. If omitted, defaults to the number of CPUs.
+#
+#         [-r report_path]: Optional argument. Specifies the path of the JSON build report (per-module compile
+#             time, size, and failures) written by incremental builds. If omitted, defaults to
+#             '<toolbox_path>.build.json'.
+#
 
 from __future__ import print_function
 
 import base64
+import hashlib
+import json
+import multiprocessing
 import os
 import pickle
 import py_compile
 import sqlite3.dbapi2 as sqllib
 import subprocess
+import tempfile
+import time
 from datetime import datetime
 
 import inro.director.util.ucs as ucslib
@@ -121,6 +138,34 @@ def get_emme_version(return_type=str):
         raise TypeError("Type %s not accepted for getting EMME version" % return_type)
 
 
+def compile_script(script_path_py):
+    """Compiles a single script into the encoded form stored in consolidated toolboxes. Returns a tuple of
+    (code, compile time in seconds, error message). The code is None if the script failed to compile. This is
+    a top-level function so that it can be run in worker processes."""
+
+    start = time.time()
+    handle, script_path_pyc = tempfile.mkstemp(suffix='.pyc')
+    os.close(handle)
+    try:
+        py_compile.compile(script_path_py, cfile=script_path_pyc, doraise=True)
+        with open(script_path_pyc, 'rb') as reader:
+            compiled_binary = reader.read()
+    except py_compile.PyCompileError as e:
+        return None, time.time() - start, e.msg
+    finally:
+        os.remove(script_path_pyc)
+    code = base64.b64encode(pickle.dumps(compiled_binary))
+    return ucslib.transform(code), time.time() - start, None
+
+
+def hash_file(fp):
+    """Returns the SHA-1 hex digest of a file's contents."""
+    sha = hashlib.sha1()
+    with open(fp, 'rb') as reader:
+        sha.update(reader.read())
+    return sha.hexdigest()
+
+
 class InvalidNamespaceError(Exception):
     pass
 
@@ -162,9 +207,9 @@ class ElementTree(object):
 
         return node
 
-    def add_tool(self, title, namespace, script_path, consolidate):
+    def add_tool(self, title, namespace, script_path, consolidate, code=None):
         try:
-            node = ToolNode(self.next_id(), title, namespace, script_path, consolidate)
+            node = ToolNode(self.next_id(), title, namespace, script_path, consolidate, code)
         except Exception as e:
             print(type(e), str(e))
             return None
@@ -197,9 +242,9 @@ class FolderNode(object):
 
         return node
 
-    def add_tool(self, title, namespace, script_path, consolidate):
+    def add_tool(self, title, namespace, script_path, consolidate, code=None):
         try:
-            node = ToolNode(self.root.next_id(), title, namespace, script_path, consolidate)
+            node = ToolNode(self.root.next_id(), title, namespace, script_path, consolidate, code)
         except Exception as e:
             print(type(e), str(e))
             return None
@@ -213,7 +258,7 @@ class FolderNode(object):
 
 class ToolNode(object):
 
-    def __init__(self, element_id, title, namespace, script_path, consolidate):
+    def __init__(self, element_id, title, namespace, script_path, consolidate, code=None):
         check_namespace(namespace)
 
         self.element_id = element_id
@@ -229,19 +274,19 @@ class ToolNode(object):
             self.script = ''
             self.extension = '.pyc'
 
-            script_path_pyc = script_path + '.pyc'
-            py_compile.compile(script_path_py, cfile=script_path_pyc)
-            with open(script_path_pyc, 'rb') as reader:
-                compiled_binary = reader.read()
-            os.remove(script_path_pyc)
-            code = base64.b64encode(pickle.dumps(compiled_binary))
-            self.code = ucslib.transform(code)
+            if code is None:  # Not pre-compiled by an incremental build
+                code, _, error = compile_script(script_path_py)
+                if code is None:
+                    raise RuntimeError(error)
+            self.code = code
 
         else:
             self.script = script_path_py
             self.code = ''
             self.extension = '.py'
 
+        self.script_path = script_path
+
 
 class MTBXDatabase(object):
     """Handles the lower-level creation of the MTBX file.
@@ -256,10 +301,7 @@ class MTBXDatabase(object):
 
     def __init__(self, fp, title):
         if os.path.exists(fp):  # Remove the file if it already exists
-            # Check if the MTBX file is in use by EMME
-            check_file = '%s-wal' % fp
-            if os.path.exists(check_file):
-                raise RuntimeError('`%s` is currently in use by EMME. Please close EMME before running this script.' % fp)
+            MTBXDatabase.check_not_in_use(fp)
             os.remove(fp)
 
         self.db = sqllib.connect(fp)
@@ -271,6 +313,41 @@ class MTBXDatabase(object):
 
         self._initialize_documents_table(title)
 
+    @staticmethod
+    def check_not_in_use(fp):
+        """Checks if the MTBX file is in use by EMME"""
+        check_file = '%s-wal' % fp
+        if os.path.exists(check_file):
+            raise RuntimeError('`%s` is currently in use by EMME. Please close EMME before running this script.' % fp)
+
+    @staticmethod
+    def read_tool_codes(fp):
+        """Reads the compiled code of every tool in an existing MTBX file. Returns a dictionary of
+        element id : code."""
+        db = sqllib.connect(fp)
+        try:
+            sql = """SELECT element_id, value FROM attributes WHERE name = 'code';"""
+            return dict(db.execute(sql).fetchall())
+        finally:
+            db.close()
+
+    @staticmethod
+    def update_tools(fp, tree, tool_nodes):
+        """Updates the rows of an existing MTBX file for the given tool nodes only, along with the toolbox's
+        'begin' timestamp. The toolbox structure (element ids, folders, and namespaces) must be unchanged."""
+        MTBXDatabase.check_not_in_use(fp)
+        db = sqllib.connect(fp)
+        try:
+            sql = """UPDATE attributes SET value = ? WHERE element_id = ? AND name = ?;"""
+            db.execute(sql, (tree.begin, tree.element_id, 'begin'))
+            for node in tool_nodes:
+                db.execute(sql, (node.code, node.element_id, 'code'))
+                db.execute(sql, (node.script, node.element_id, 'script'))
+                db.execute(sql, (node.extension, node.element_id, 'python_suffix'))
+            db.commit()
+        finally:
+            db.close()
+
     def _create_attribute_table(self):
         sql = """CREATE TABLE attributes(
             element_id INTEGER REFERENCES elements(element_id),
@@ -449,34 +526,218 @@ def build_toolbox(fp, source, title='TMG Toolbox', namespace='tmg', consolidate=
     print("Done!")
 
 
-def explore_source_folder(root_folder_path, parent_node, consolidate):
-    """Recursive function for building the pseudo-Toolbox structure"""
-    folders = []
-    files = []
-    for item in os.listdir(root_folder_path):
-        item_path = os.path.join(root_folder_path, item)
-        if os.path.isfile(item_path):
-            name, extension = os.path.splitext(item)
-            if extension == '.py':
-                files.append(name)
-        else:
-            folders.append(item)
+def build_toolbox_incremental(fp, source, title='TMG Toolbox', namespace='tmg', consolidate=False, jobs=None,
+                              report_path=None):
+    """Builds the toolbox, re-using the results of the previous build wherever the source code is unchanged.
+
+    A manifest of source file hashes (along with the toolbox settings and structure) is kept next to the MTBX
+    file. Changed modules are compiled across a pool of worker processes, and the code of unchanged modules is
+    read back from the existing MTBX file. If the toolbox structure is the same as in the previous build, only
+    the rows of changed tools are updated; otherwise the MTBX file is rebuilt from the (cached) results."""
+    print("------------------------")
+    print(" Build Toolbox Utility")
+    print("------------------------\n")
+    print("toolbox: %s" % fp)
+    print("source folder: %s" % source)
+    print("title: %s" % title)
+    print("namespace: %s" % namespace)
+    print("consolidate: %s" % consolidate)
+    print("incremental: True")
+
+    start = time.time()
+    manifest_path = fp + '.manifest.json'
+    if report_path is None:
+        report_path = fp + '.build.json'
+
+    tree = ElementTree(title, namespace)
+    settings = {'title': title, 'namespace': namespace, 'consolidate': consolidate, 'version': tree.version,
+                'source': os.path.abspath(source)}
+
+    manifest = None
+    if os.path.exists(manifest_path) and os.path.exists(fp):
+        with open(manifest_path) as reader:
+            manifest = json.load(reader)
+        if manifest.get('settings') != settings:
+            print("\nToolbox settings have changed since the last build, rebuilding all modules")
+            manifest = None
+    old_modules = manifest['modules'] if manifest is not None else {}
+
+    print("\nHashing source files")
+    script_paths = list(find_scripts(source))
+    hashes = {}
+    changed = []
+    for script_path in script_paths:
+        relative_path = os.path.relpath(script_path, source).replace(os.sep, '/')
+        hashes[script_path] = hash_file(script_path + '.py')
+        if old_modules.get(relative_path, {}).get('hash') != hashes[script_path]:
+            changed.append(script_path)
+    print("Done! %s of %s modules have changed." % (len(changed), len(script_paths)))
+
+    records = {}
+    codes = {}
+    for script_path in script_paths:
+        relative_path = os.path.relpath(script_path, source).replace(os.sep, '/')
+        records[script_path] = {'module': relative_path, 'size': os.path.getsize(script_path + '.py'),
+                                'compile_seconds': 0.0, 'status': 'unchanged', 'error': None}
+        codes[script_path] = None
+
+    if consolidate:
+        old_codes = MTBXDatabase.read_tool_codes(fp) if manifest is not None else {}
+        for script_path in script_paths:
+            if script_path in changed: continue
+            relative_path = records[script_path]['module']
+            code = old_codes.get(old_modules[relative_path]['element_id'])
+            if code is None:  # Missing from the existing toolbox, so it needs to be compiled again
+                changed.append(script_path)
+            else:
+                codes[script_path] = code
+
+        if changed:
+            print("\nCompiling %s modules" % len(changed))
+            to_compile = [script_path + '.py' for script_path in changed]
+            if len(changed) > 1 and jobs != 1:
+                pool = multiprocessing.Pool(jobs)
+                try:
+                    results = pool.map(compile_script, to_compile)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [compile_script(script_path_py) for script_path_py in to_compile]
+            for script_path, (code, seconds, error) in zip(changed, results):
+                record = records[script_path]
+                record['compile_seconds'] = seconds
+                if code is None:
+                    record['status'] = 'failed'
+                    record['error'] = error
+                    del codes[script_path]
+                    print("Failed to compile %s: %s" % (record['module'], error))
+                else:
+                    record['status'] = 'compiled'
+                    codes[script_path] = code
+            print("Done!")
+    else:
+        for script_path in changed:
+            records[script_path]['status'] = 'changed'
+
+    print("\nLoading toolbox structure")
+    explore_source_folder(source, tree, consolidate, codes)
+    print("Done! Found %s elements." % tree.next_element_id)
+
+    structure = get_tree_structure(tree)
+    tool_nodes = get_tool_nodes(tree)
+    if manifest is not None and manifest.get('structure') == structure:
+        updated = [tool_nodes[script_path] for script_path in changed if script_path in tool_nodes]
+        print("\nUpdating %s tools in MTBX file..." % len(updated))
+        MTBXDatabase.update_tools(fp, tree, updated)
+        mode = 'partial'
+    else:
+        print("\nBuilding MTBX file...")
+        mtbx = MTBXDatabase(fp, title)
+        mtbx.populate_tables_from_tree(tree)
+        mtbx.db.close()
+        mode = 'full'
+    print("Done!")
+
+    # Failed modules are left out of the manifest, so that they are retried on the next build
+    modules = {}
+    for script_path, node in tool_nodes.items():
+        modules[records[script_path]['module']] = {'hash': hashes[script_path], 'element_id': node.element_id}
+    with open(manifest_path, 'w') as writer:
+        json.dump({'settings': settings, 'structure': structure, 'modules': modules}, writer, indent=1,
+                  sort_keys=True)
+
+    report_modules = [records[script_path] for script_path in script_paths]
+    failures = [record for record in report_modules if record['status'] == 'failed']
+    report = {
+        'toolbox': fp,
+        'begin': tree.begin,
+        'mode': mode,
+        'duration_seconds': time.time() - start,
+        'module_count': len(report_modules),
+        'changed_count': len(changed),
+        'failure_count': len(failures),
+        'modules': report_modules
+    }
+    with open(report_path, 'w') as writer:
+        json.dump(report, writer, indent=1)
+
+    print("\nBuild report written to %s" % report_path)
+    if failures:
+        print("%s modules failed to compile" % len(failures))
+    return report
+
+
+def explore_source_folder(root_folder_path, parent_node, consolidate, codes=None):
+    """Recursive function for building the pseudo-Toolbox structure. If given, codes is a dictionary of
+    script path : pre-compiled code, used instead of compiling the scripts."""
+    folders, files = list_source_folder(root_folder_path)
 
     for folder in folders:
-        if folder in ['.vs', '.idea', '.vscode', '.git', '__pycache__']:
-            continue
         folder_path = os.path.join(root_folder_path, folder)
         namespace = folder
         title = capitalize_name(namespace)
 
         folder_node = parent_node.add_folder(title, namespace)
-        explore_source_folder(folder_path, folder_node, consolidate)
+        explore_source_folder(folder_path, folder_node, consolidate, codes)
 
     for file in files:
         namespace = file
         title = capitalize_name(namespace)
         script_path = os.path.join(root_folder_path, file)
-        parent_node.add_tool(title, namespace, script_path, consolidate)
+        if codes is None:
+            parent_node.add_tool(title, namespace, script_path, consolidate)
+        elif script_path in codes:
+            parent_node.add_tool(title, namespace, script_path, consolidate, codes[script_path])
+
+
+def list_source_folder(root_folder_path):
+    """Returns the lists of sub-folder names and Python script names (without extension) of a source folder, in
+    the order in which they are added to the toolbox."""
+    folders = []
+    files = []
+    for item in os.listdir(root_folder_path):
+        item_path = os.path.join(root_folder_path, item)
+        if os.path.isfile(item_path):
+            name, extension = os.path.splitext(item)
+            if extension == '.py':
+                files.append(name)
+        elif item not in ['.vs', '.idea', '.vscode', '.git', '__pycache__']:
+            folders.append(item)
+    return folders, files
+
+
+def find_scripts(root_folder_path):
+    """Yields the path (without extension) of every script in a source folder, in toolbox order."""
+    folders, files = list_source_folder(root_folder_path)
+    for folder in folders:
+        for script_path in find_scripts(os.path.join(root_folder_path, folder)):
+            yield script_path
+    for file in files:
+        yield os.path.join(root_folder_path, file)
+
+
+def get_tree_structure(node, path=''):
+    """Flattens a toolbox tree into a list of [element id, namespace path, is tool] entries, used to check if
+    the structure of a toolbox has changed between builds."""
+    structure = []
+    for child in node.children:
+        child_path = path + '.' + child.namespace if path else child.namespace
+        structure.append([child.element_id, child_path, isinstance(child, ToolNode)])
+        if not isinstance(child, ToolNode):
+            structure.extend(get_tree_structure(child, child_path))
+    return structure
+
+
+def get_tool_nodes(node):
+    """Returns a dictionary of script path : ToolNode for every tool in a toolbox tree."""
+    tools = {}
+    for child in node.children:
+        if isinstance(child, ToolNode):
+            tools[child.script_path] = child
+        else:
+            tools.update(get_tool_nodes(child))
+    return tools
 
 
 if __name__ == "__main__":
@@ -491,6 +752,15 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--consolidate',
                         help="Flag indicating if the output toolbox is to be consolidated (compiled).",
                         action='store_true')
+    parser.add_argument('-i', '--incremental',
+                        help="Flag indicating if only the modules changed since the last build are to be rebuilt.",
+                        action='store_true')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="Number of processes used to compile modules in an incremental build. Default is the "
+                             "number of CPUs.")
+    parser.add_argument('-r', '--report',
+                        help="Path to the JSON build report of an incremental build. Default is "
+                             "'<toolbox path>.build.json'.")
 
     args = parser.parse_args()
 
@@ -501,4 +771,8 @@ if __name__ == "__main__":
     toolbox_namespace = 'tmg' if args.namespace is None else args.namespace
     consolidate_flag = args.consolidate
 
-    build_toolbox(toolbox_fp, src_folder, toolbox_title, toolbox_namespace, consolidate_flag)
+    if args.incremental:
+        build_toolbox_incremental(toolbox_fp, src_folder, toolbox_title, toolbox_namespace, consolidate_flag,
+                                  args.jobs, args.report)
+    else:
+        build_toolbox(toolbox_fp, src_folder, toolbox_title, toolbox_namespace, consolidate_flag)
@@ -21,6 +21,7 @@ import os
 import inro.modeller as _m
 import traceback as _traceback
 _util = _m.Modeller().module('tmg.common.utilities')
+import six
 
 class ExportMatrix(_m.Tool()):
     
@@ -39,35 +40,66 @@ class ExportMatrix(_m.Tool()):
         
         return pb.render()
 
-    def __call__(self, MatrixId, Filename, ScenarioNumber):        
-        with _m.logbook_trace("Exporting matrix %s to XTMF" %MatrixId): 
+    def __call__(self, MatrixId, Filename, ScenarioNumber):
+        '''
+        Exports one or more full matrices. Several matrices can be exported in one call by
+        passing lists (or ';'-separated strings) of matrix numbers and file names.
+        
+        Files ending in '.mtx' are written in the binary format of the Export Binary Matrix
+        tool ('.mtx.gz' to also compress them); any other file gets the text (prompt data)
+        format.
+        '''
+        matrixIds = self._ParseList(MatrixId)
+        filenames = self._ParseList(Filename)
+        if len(matrixIds) != len(filenames):
+            raise Exception("Got %s matrices but %s file names to export to" %(len(matrixIds), len(filenames)))
+        
+        with _m.logbook_trace("Exporting matrix %s to XTMF" %", ".join(str(id) for id in matrixIds)): 
             scenario = _m.Modeller().emmebank.scenario(ScenarioNumber)
             if (scenario is None):
                 raise Exception("Scenario %s was not found!" %ScenarioNumber)
             
             try:
+                self._tracker.reset(len(matrixIds))
+                
                 tool = None
                 try:
                     tool = _m.Modeller().tool('inro.emme.standard.data.matrix.export_matrices')
                 except Exception as e:
                     tool = _m.Modeller().tool('inro.emme.data.matrix.export_matrices')
                 
-                mtx = _m.Modeller().emmebank.matrix("mf%s" %MatrixId)
-                if mtx is None:
-                    raise Exception("No matrix found with id '%s'" %MatrixId)
-                self._tracker.runTool(tool,
-                                      export_file=Filename,
-                                      field_separator=' ',
-                                      matrices=[mtx],
-                                      full_matrix_line_format="ONE_ENTRY_PER_LINE",
-                                      export_format="PROMPT_DATA_FORMAT",
-                                      scenario=scenario,
-                                      skip_default_values=False)
+                for matrixId, filename in zip(matrixIds, filenames):
+                    mtx = _m.Modeller().emmebank.matrix("mf%s" %matrixId)
+                    if mtx is None:
+                        raise Exception("No matrix found with id '%s'" %matrixId)
+                    
+                    if self._IsBinary(filename):
+                        _util.exportBinaryMatrix(mtx.get_data(scenario.number), filename)
+                        self._tracker.completeTask()
+                    else:
+                        self._tracker.runTool(tool,
+                                              export_file=filename,
+                                              field_separator=' ',
+                                              matrices=[mtx],
+                                              full_matrix_line_format="ONE_ENTRY_PER_LINE",
+                                              export_format="PROMPT_DATA_FORMAT",
+                                              scenario=scenario,
+                                              skip_default_values=False)
                 
             except Exception as e:
                 raise Exception(_traceback.format_exc())
+    
+    def _ParseList(self, value):
+        if isinstance(value, six.string_types):
+            return [item.strip() for item in value.split(';') if item.strip()]
+        if isinstance(value, (list, tuple)):
+            return list(value)
+        return [value]
+    
+    def _IsBinary(self, filename):
+        filename = filename.lower()
+        return filename.endswith('.mtx') or filename.endswith('.mtx.gz')
 
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
         return self._tracker.getProgress()
-    
\ No newline at end of file
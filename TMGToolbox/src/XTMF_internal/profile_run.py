@@ -0,0 +1,84 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+#---METADATA---------------------
+'''
+Profile Run
+
+    Authors: TMG
+
+    Latest revision by: TMG
+    
+    
+    This tool will allow XTMF to switch the toolbox's timing profiler on
+    at the start of a model run, and off at the end, writing the timing
+    spans of every tool run in between to a Chrome trace and/or a summary
+    CSV.
+        
+'''
+#---VERSION HISTORY
+'''
+    0.0.1 Created on 2026-10-19
+    
+    
+'''
+import inro.modeller as _m
+import traceback as _traceback
+_MODELLER = _m.Modeller() #Instantiate Modeller once.
+_util = _MODELLER.module('tmg.common.utilities')
+
+class ProfileRun(_m.Tool()):
+    version = '0.0.1'
+    Action = _m.Attribute(str)
+    TrackMemory = _m.Attribute(bool)
+    TraceFile = _m.Attribute(str)
+    SummaryFile = _m.Attribute(str)
+    
+    def page(self):
+        pb = _m.ToolPageBuilder(self, title="Profile Run",
+                     runnable=False,
+                     description="Cannot be called from Modeller.",
+                     branding_text="XTMF")
+        
+        return pb.render()
+    
+    def run(self):
+        pass
+
+    def __call__(self, Action, TrackMemory=False, TraceFile="", SummaryFile=""):
+        try:
+            self._execute(Action, TrackMemory, TraceFile, SummaryFile)
+        except Exception as e:
+            raise Exception(_traceback.format_exc())
+
+    def _execute(self, Action, TrackMemory, TraceFile, SummaryFile):
+        if Action == "Start":
+            _util.startProfiling(TrackMemory)
+            print("Started profiling")
+        elif Action == "Stop":
+            profiler = _util.stopProfiling()
+            if profiler is None:
+                print("A profile was requested but profiling was not started.")
+                return
+            if TraceFile:
+                profiler.writeTrace(TraceFile)
+            if SummaryFile:
+                profiler.writeSummary(SummaryFile)
+            print(profiler.formatSummary())
+        else:
+            raise Exception("Unknown action '%s', expected 'Start' or 'Stop'" % Action)
@@ -35,6 +35,13 @@ Returb Boardings
     0.0.1 Created on 2014-02-05 by pkucirek
     
     0.1.0 Upgraded to work with get_attribute_values (partial read)
+    
+    0.2.0 Uses the common transit boardings engine to aggregate lines to groups. Added the
+            optional ResultsFile argument, to also save the results as CSV, JSON or NumPy
+            binary (.npz).
+            The aggregation check now reports lines without a line grouping when there are
+            unmapped network lines; it used to test the lines missing from the network
+            instead, so the report could be skipped, or printed with an empty list.
 '''
 
 import inro.modeller as _m
@@ -42,6 +49,7 @@ import traceback as _traceback
 #from json import loads
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
+_boardings = _MODELLER.module('tmg.common.transit_boardings')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 # import six library for python2 to python3 conversion
 import six 
@@ -52,7 +60,7 @@ _util.initalizeModellerTypes(_m)
 
 class ReturnBoardings(_m.Tool()):
     
-    version = '0.1.0'
+    version = '0.2.0'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -80,7 +88,7 @@ class ReturnBoardings(_m.Tool()):
     
     ##########################################################################################################
             
-    def __call__(self, xtmf_ScenarioNumber, xtmf_LineAggregationFile, xtmf_CheckAggregationFlag):
+    def __call__(self, xtmf_ScenarioNumber, xtmf_LineAggregationFile, xtmf_CheckAggregationFlag, ResultsFile=None):
         
         _m.logbook_write("Extracting boarding results")
         
@@ -93,6 +101,7 @@ class ReturnBoardings(_m.Tool()):
         
         self.xtmf_LineAggregationFile = xtmf_LineAggregationFile
         self.xtmf_CheckAggregationFlag = xtmf_CheckAggregationFlag
+        self.ResultsFile = ResultsFile
         
         try:
             return self._Execute(scenario)
@@ -104,51 +113,19 @@ class ReturnBoardings(_m.Tool()):
     
     def _Execute(self, scenario):
         
-        lineAggregation = self._LoadLineAggregationFile()
+        lineAggregation = _boardings.load_line_aggregation_file(self.xtmf_LineAggregationFile)
         
-        lineBoardings = self._GetLineResults(scenario)
-        netSet = set([key for key in six.iterkeys(lineBoardings)])
+        result = _boardings.extract_boardings(scenario)
         if self.xtmf_CheckAggregationFlag:
-            self._CheckAggregationFile(netSet, lineAggregation)
+            self._CheckAggregationFile(set(result.line_ids), lineAggregation)
         self.TRACKER.completeTask()
         
-        results = {}
-        self.TRACKER.startProcess(len(lineBoardings))
-        for lineId, lineCount in six.iteritems(lineBoardings):
-            if not lineId in lineAggregation:
-                self.TRACKER.completeSubtask()
-                continue #Skip unmapped lines
-            lineGroupId = lineAggregation[lineId]
-            
-            if lineGroupId in results:
-                results[lineGroupId] += lineCount
-            else:
-                results[lineGroupId] = lineCount
-            self.TRACKER.completeSubtask()
+        result.aggregate(lineAggregation)
+        if self.ResultsFile:
+            result.write(self.ResultsFile)
             
         print("Extracted results from Emme")
-        return str(results)            
-    
-    def _LoadLineAggregationFile(self):
-        mapping = {}
-        with open(self.xtmf_LineAggregationFile) as reader:
-            reader.readline()
-            for line in reader:
-                cells = line.strip().split(',')
-                key = cells[0].strip()
-                val = cells[1].strip()
-                mapping[key] = val
-        return mapping
-    
-    def _GetLineResults(self, scenario):
-        
-        results = _util.fastLoadSummedSegmentAttributes(scenario, ['transit_boardings'])
-        retVal = {}
-        for lineId, attributes in six.iteritems(results):
-            id = str(lineId)
-            retVal[id] = attributes['transit_boardings']
-        
-        return retVal
+        return str(result.to_dict())
         
     def _CheckAggregationFile(self, netSet, lineAggregation):
         aggSet = set([key for key in six.iterkeys(lineAggregation)])
@@ -156,7 +133,7 @@ class ReturnBoardings(_m.Tool()):
         linesInNetworkButNotMapped = [id for id in (netSet - aggSet)]
         linesMappedButNotInNetwork = [id for id in (aggSet - netSet)]
         
-        if len(linesMappedButNotInNetwork) > 0:
+        if len(linesInNetworkButNotMapped) > 0:
             msg = "%s lines have been found in the network without a line grouping: " %len(linesInNetworkButNotMapped)
             msg += ",".join(linesInNetworkButNotMapped[:10])
             if len(linesInNetworkButNotMapped) > 10:
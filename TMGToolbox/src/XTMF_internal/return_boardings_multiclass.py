@@ -28,21 +28,21 @@ Return Boardings
 #---VERSION HISTORY
 '''
     0.0.1 Created on 2016-07-25 by nasterska
+    
+    0.1.0 Uses the common transit boardings engine: all classes are read back in one partial
+            read and aggregated with NumPy. Added the optional ResultsFile argument, to save
+            the results for all classes together as CSV, JSON or NumPy binary (.npz).
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
-import csv
 import re
 import os
-from json import loads as _parsedict
-from os.path import dirname
-from os.path import exists
 from multiprocessing import cpu_count
 
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
-networkResultsTool = _MODELLER.tool('inro.emme.transit_assignment.extended.network_results')
+_boardings = _MODELLER.module('tmg.common.transit_boardings')
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 # import six library for python2 to python3 conversion
 import six 
@@ -53,7 +53,7 @@ _util.initalizeModellerTypes(_m)
 
 class ReturnBoardings(_m.Tool()):
     
-    version = '0.0.1'
+    version = '0.1.0'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -82,7 +82,7 @@ class ReturnBoardings(_m.Tool()):
     
     ##########################################################################################################
             
-    def __call__(self, xtmf_ScenarioNumber, xtmf_LineAggregationFile, xtmf_OutputDirectory):
+    def __call__(self, xtmf_ScenarioNumber, xtmf_LineAggregationFile, xtmf_OutputDirectory, ResultsFile=None):
         
         _m.logbook_write("Extracting boarding results")
         
@@ -96,6 +96,7 @@ class ReturnBoardings(_m.Tool()):
         self.NumberOfProcessors = cpu_count()
         self.xtmf_LineAggregationFile = xtmf_LineAggregationFile
         self.xtmf_OutputDirectory = xtmf_OutputDirectory
+        self.ResultsFile = ResultsFile
         
         #self.xtmf_CheckAggregationFlag = xtmf_CheckAggregationFlag
         
@@ -110,176 +111,35 @@ class ReturnBoardings(_m.Tool()):
     def _Execute(self, scenario):
         
         print("Extracting Boarding Results")
-        self.classDemandMatrixId = _util.DetermineAnalyzedTransitDemandId(EMME_VERSION, scenario)
-        lineAggregation = self._LoadLineAggregationFile()
-
-        lineBoardings = self._GetLineResults(scenario)
+        classDemandMatrixId = _util.DetermineAnalyzedTransitDemandId(EMME_VERSION, scenario)
+        lineAggregation = _boardings.load_line_aggregation_file(self.xtmf_LineAggregationFile)
 
-        for PersonClass in lineBoardings:
-            netSet = set([key for key in PersonClass])
-            #if self.xtmf_CheckAggregationFlag:
-            #self._CheckAggregationFile(netSet, lineAggregation)
-        
+        #Runs the network results for every class, then reads all classes back at once
+        result = _boardings.extract_boardings(scenario, classDemandMatrixId,
+                                              num_processors=self.NumberOfProcessors, tracker=self.TRACKER)
+        result.aggregate(lineAggregation)
         self.TRACKER.completeTask()
-        
-        self.TRACKER.startProcess(len(lineBoardings))
-        
-
-        allResults = []
-        for PersonClass in lineBoardings:
-            results = {}
-            for lineId, lineCount in six.iteritems(PersonClass):
-                if lineId == 'name':
-                    results[lineId] = lineCount
-                else:
-                    if not lineId in lineAggregation:
-                        continue #Skip unmapped lines
-                    lineGroupId = lineAggregation[lineId]
-            
-                    if lineGroupId in results:
-                        results[lineGroupId] += lineCount
-                    else:
-                        results[lineGroupId] = lineCount
-            self.TRACKER.completeSubtask()
-            allResults.append(results)
             
         print("Extracted results from Emme")
-        self._OutputResults(allResults)       
-    
-    def _LoadLineAggregationFile(self):  
-        mapping = {}
-        with open(self.xtmf_LineAggregationFile) as reader:
-            reader.readline()
-            for line in reader:
-                cells = line.strip().split(',')
-                key = cells[0].strip()
-                val = cells[1].strip()
-                mapping[key] = val
-        return mapping
-    
-    def _GetLineResults(self, scenario):
-
-        multiBoardings = []
-        classDemandMatrixId = _util.DetermineAnalyzedTransitDemandId(EMME_VERSION, scenario)
-        '''configPath = dirname(_MODELLER.desktop.project_file_name()) \
-                    + "/Database/STRATS_s%s/config" %scenario
-        
-        if not exists(configPath): 
-            print("path cannot be found")
-            return []
-        
-        with open(configPath) as reader:
-            config = _parsedict(reader.readline())
-        
-        classDemandMatrix = {}
-        for info in config['strat_files']:
-            className = info['name']
-            print(className)
-            if(info['data'] is not None):
-                classDemandMatrix[className] = info['data']['demand']
-        '''
-        if type(classDemandMatrixId) == type(dict()):
-            for PersonClass in classDemandMatrixId:
-                with _util.tempExtraAttributeMANAGER(scenario, 'TRANSIT_SEGMENT') as ClassBoardings:
-                    spec=     {
-                        "on_links": None,
-                        "on_segments": {
-                            "total_boardings": ClassBoardings.id,
-                            },
-                        "aggregated_from_segments": None,
-                        "analyzed_demand": classDemandMatrixId[PersonClass],
-                        "constraint": None,
-                        "type": "EXTENDED_TRANSIT_NETWORK_RESULTS"
-                    }
-                    if EMME_VERSION >= (4,3,2):
-                        self.TRACKER.runTool(networkResultsTool, scenario = scenario, specification = spec, class_name = PersonClass, num_processors = self.NumberOfProcessors)
-                    else:
-                        self.TRACKER.runTool(networkResultsTool, scenario = scenario, specification = spec, class_name = PersonClass)
-                    
-                    results = _util.fastLoadSummedSegmentAttributes(scenario, [ClassBoardings.id])
-            
-                    retVal = {}
-                    for lineId, attributes in six.iteritems(results):
-                        id = str(lineId)
-                        retVal[id] = attributes[ClassBoardings.id]
-          
-                retVal['name'] = PersonClass
-
-                multiBoardings.append(retVal)
-        else:
-            with _util.tempExtraAttributeMANAGER(scenario, 'TRANSIT_SEGMENT') as ClassBoardings:
-                spec=     {
-                    "on_links": None,
-                    "on_segments": {
-                        "total_boardings": ClassBoardings.id,
-                        },
-                    "aggregated_from_segments": None,
-                    "analyzed_demand": classDemandMatrixId,
-                    "constraint": None,
-                    "type": "EXTENDED_TRANSIT_NETWORK_RESULTS"
-                }
-                if EMME_VERSION >= (4,3,2):
-                    self.TRACKER.runTool(networkResultsTool, scenario = scenario, specification = spec, num_processors = self.NumberOfProcessors)
-                else:
-                    self.TRACKER.runTool(networkResultsTool, scenario = scenario, specification = spec)
-                results = _util.fastLoadSummedSegmentAttributes(scenario, [ClassBoardings.id])
-            
-                retVal = {}
-                for lineId, attributes in six.iteritems(results):
-                    id = str(lineId)
-                    retVal[id] = attributes[ClassBoardings.id]
-          
-            #retVal['name'] = PersonClass
-
-            multiBoardings.append(retVal)
-            '''
-        for PersonClass in classDemandMatrix:
-            with _util.tempExtraAttributeMANAGER(scenario, 'TRANSIT_SEGMENT') as ClassBoardings:
-
-                spec=     {
-                    "on_links": None,
-                    "on_segments": {
-                        "total_boardings": ClassBoardings.id,
-                        },
-                    "aggregated_from_segments": None,
-                    "analyzed_demand":classDemandMatrix[PersonClass],
-                    "constraint": None,
-                    "type": "EXTENDED_TRANSIT_NETWORK_RESULTS"
-                }
-
-                self.TRACKER.runTool(networkResultsTool, scenario = scenario, specification = spec, class_name = PersonClass)
-                    
-                results = _util.fastLoadSummedSegmentAttributes(scenario, [ClassBoardings.id])
-            
-                retVal = {}
-                for lineId, attributes in results.iteritems():
-                    id = str(lineId)
-                    retVal[id] = attributes[ClassBoardings.id]
-          
-            retVal['name'] = PersonClass
-
-            multiBoardings.append(retVal)'''
-
-        return multiBoardings
+        self._OutputResults(result)
+        if self.ResultsFile:
+            result.write(self.ResultsFile)
             
     ##########################################################################################################
-    def _OutputResults(self, valueDict):
+    def _OutputResults(self, result):
 
-        fileName = ""
         removeSpecialString = "[^A-Za-z0-9]+"
 
         #check if output directory exists
         if not os.path.exists(self.xtmf_OutputDirectory):
                 os.makedirs(self.xtmf_OutputDirectory)
 
-        for personClass in valueDict:
-            fileName = self.xtmf_OutputDirectory + "\\" + re.sub(removeSpecialString, '', personClass["name"]) + ".csv"
+        for index, className in enumerate(result.class_names):
+            if className is None:
+                className = "boardings"
+            fileName = self.xtmf_OutputDirectory + "\\" + re.sub(removeSpecialString, '', className) + ".csv"
             print(fileName)
-            del personClass["name"]
-            with _util.open_csv_writer(fileName) as wr:
-                wr.writerow(['line', 'boardings'])
-                for line in sorted(personClass.items()):
-                    wr.writerow(line)
+            result.write_csv(fileName, class_index=index)
 
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
@@ -37,14 +37,17 @@ Return Line Group Boardings
     0.1.0 Upgraded to work with get_attribute_values (partial read)
     
     0.2.0 Modified to return a comma-separated string (instead of a dictionary)
+    
+    0.3.0 Line groups are now evaluated locally from their filters, instead of with one Network
+            Calculator run per group, and boardings are aggregated with the common transit
+            boardings engine. Added the optional ResultsFile argument.
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
-from contextlib import contextmanager
-import shutil as _shutil
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
+_boardings = _MODELLER.module('tmg.common.transit_boardings')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 # import six library for python2 to python3 conversion
 import six 
@@ -60,24 +63,10 @@ class LineGroup():
         self.index = index
         self.filter = filter
         self.name = name
-    
-    def select(self, scenario):
-        spec= {
-                    "result": "@ltype",
-                    "expression": str(self.index),
-                    "aggregation": None,
-                    "selections": {
-                        "transit_line": self.filter
-                    },
-                    "type": "NETWORK_CALCULATION"
-                }
-        
-        tool = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
-        tool(spec, scenario= scenario)
 
 class ReturnBoardings(_m.Tool()):
     
-    version = '0.2.0'
+    version = '0.3.0'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -120,7 +109,7 @@ class ReturnBoardings(_m.Tool()):
     
     ##########################################################################################################
             
-    def __call__(self, xtmf_ScenarioNumber):
+    def __call__(self, xtmf_ScenarioNumber, ResultsFile=None):
         
         _m.logbook_write("Extracting boarding results")
         
@@ -131,6 +120,8 @@ class ReturnBoardings(_m.Tool()):
         if not scenario.has_transit_results:
             raise Exception("Scenario %s does not have transit assignment results" %xtmf_ScenarioNumber)              
         
+        self.ResultsFile = ResultsFile
+        
         try:
             return self._Execute(scenario)
         except Exception as e:
@@ -141,84 +132,22 @@ class ReturnBoardings(_m.Tool()):
     
     def _Execute(self, scenario):
         print("Extracting results from Emme")
-                
-        with self._lineTypeAttributeMANAGER(scenario):
-            self._CalcLineType(scenario)
-            lineTypes = self._GetLineTypes(scenario)
-            self.TRACKER.completeTask()
         
-        lineBoardings = self._GetLineResults(scenario)
+        #Lines not selected by any group default to group 0, as with a zero-initialized @ltype
+        lineGroups = _boardings.line_groups_from_selections(
+            scenario, [(group.name, group.filter) for group in self.LINE_GROUPS], default=self.LINE_GROUPS[0].name)
         self.TRACKER.completeTask()
         
-        results = {}
-        self.TRACKER.startProcess(len(lineBoardings))
-        for lineId, lineCount in six.iteritems(lineBoardings):
-            type = lineTypes[lineId]
-            typeName = self.LINE_GROUP_MAP[type].name
-            
-            if not typeName in results:
-                results[typeName] = lineCount
-            else:
-                results[typeName] += lineCount
-            self.TRACKER.completeSubtask()
-        
         keys = [group.name for group in self.LINE_GROUPS]
         keys.sort()
+        result = _boardings.extract_boardings(scenario).aggregate(lineGroups, group_ids=keys)
+        if self.ResultsFile:
+            result.write(self.ResultsFile)
+        self.TRACKER.completeTask()
+        
+        results = result.to_dict()
         retval = [str(results[key]) for key in keys]
         return ",".join(retval)
-                
-    
-
-    
-    ##########################################################################################################
-    
-    #----CONTEXT MANAGERS---------------------------------------------------------------------------------
-    '''
-    Context managers for temporary database modifications.
-    '''
-    
-    @contextmanager
-    def _lineTypeAttributeMANAGER(self, scenario):
-        #Code here is executed upon entry
-        
-        typeAttribute = scenario.create_extra_attribute('TRANSIT_LINE', '@ltype')
-        
-        try:
-            yield
-            # Code here is executed upon clean exit
-        finally:
-            # Code here is executed in all cases.
-            scenario.delete_extra_attribute('@ltype')
-    
-    #----SUB FUNCTIONS---------------------------------------------------------------------------------
-        
-    def _CalcLineType(self, scenario):
-        for group in self.LINE_GROUPS:
-            group.select(scenario)
-    
-    def _GetLineResults(self, scenario):
-        
-        results = _util.fastLoadSummedSegmentAttributes(scenario, ['transit_boardings'])
-        retVal = {}
-        for lineId, attributes in six.iteritems(results):
-            id = str(lineId)
-            retVal[id] = attributes['transit_boardings']
-        
-        return retVal
-    
-    def _GetLineTypes(self, scenario):
-        #Performs a partial read of the network. The data structure is undocumented
-        # so this method is subject to change in future versions of Emme.
-        
-        q = scenario.get_attribute_values('TRANSIT_LINE', ['@ltype'])
-        indices = q[0]
-        values = q[1]
-        
-        retval = {}
-        for id, index in six.iteritems(indices):
-            id = str(id) #Normally stored in unicode.
-            retval[id] = int(values[index])
-        return retval
     
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
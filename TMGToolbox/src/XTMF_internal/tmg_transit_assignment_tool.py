@@ -28,6 +28,7 @@ from re import split as _regex_split
 from json import loads as _parsedict
 import inro.modeller as _m
 import csv
+import numpy as _np
 
 # import six library for python2 to python3 conversion
 import six
@@ -41,6 +42,7 @@ _util = _MODELLER.module("tmg.common.utilities")
 _util.initalizeModellerTypes(_m)
 _tmgTPB = _MODELLER.module("tmg.common.TMG_tool_page_builder")
 _netEdit = _MODELLER.module("tmg.common.network_editing")
+_netArrays = _MODELLER.module("tmg.common.network_arrays")
 # congestedAssignmentTool = _MODELLER.tool('inro.emme.transit_assignment.congested_transit_assignment')
 _dbUtils = _MODELLER.module("inro.emme.utility.database_utilities")
 extendedAssignmentTool = _MODELLER.tool("inro.emme.transit_assignment.extended_transit_assignment")
@@ -54,7 +56,7 @@ EMME_VERSION = _util.getEmmeVersion(tuple)
 
 
 class TransitAssignmentTool(_m.Tool()):
-    version = "1.0.0"
+    version = "1.1.0"
     tool_run_msg = ""
     number_of_tasks = 15
 
@@ -1097,44 +1099,60 @@ class TransitAssignmentTool(_m.Tool()):
         if "transit_alightings" not in network.attributes("TRANSIT_SEGMENT"):
             network.create_attribute("TRANSIT_SEGMENT", "transit_alightings", 0.0)
         has_doors = self.Scenario.extra_attribute("@doors") is not None
-        for line in network.transit_lines():
-            prev_volume = 0.0
-            headway = line.headway
-            number_of_trips = self.AssignmentPeriod * 60.0 / headway
 
-            # Get the STSU model to use
-            if line[str(stsu_att.id)] != 0.0:
-                model = self.models[int(line[str(stsu_att.id)]) - 1]
-            else:
-                continue
+        line_attributes = ["headway", str(stsu_att.id)] + (["@doors"] if has_doors else [])
+        line_package = network.get_attribute_values("TRANSIT_LINE", line_attributes)
+        segment_attributes = ["transit_boardings", "transit_volume", "@tstop", "dwell_time", "transit_alightings"]
+        segment_package = network.get_attribute_values("TRANSIT_SEGMENT", segment_attributes)
+        line_ids, positions, offsets = segment_layout(segment_package[0])
+
+        # Line-level inputs, aligned with line_ids
+        line_positions = _np.array([line_package[0][line_id] for line_id in line_ids], dtype=_np.int64)
+        headways = _np.asarray(line_package[1], dtype=_np.float64)[line_positions]
+        model_index = _np.asarray(line_package[2], dtype=_np.float64)[line_positions].astype(_np.int64) - 1
+        has_model = model_index >= 0
+        if has_doors:
+            doors = _np.asarray(line_package[3], dtype=_np.float64)[line_positions]
+            door_pairs = _np.where(doors != 0.0, doors / 2.0, 1.0)
+        else:
+            door_pairs = _np.ones(len(line_ids))
+
+        boarding_duration = _np.zeros(len(line_ids))
+        alighting_duration = _np.zeros(len(line_ids))
+        default_duration = _np.zeros(len(line_ids))
+        inv_door_pair_runs = _np.zeros(len(line_ids))
+        for i, model in enumerate(self.models):
+            selected = model_index == i
+            boarding_duration[selected] = model["boarding_duration"]
+            alighting_duration[selected] = model["alighting_duration"]
+            default_duration[selected] = model["default_duration"]
+        number_of_trips = self.AssignmentPeriod * 60.0 / headways[has_model]
+        inv_door_pair_runs[has_model] = 1.0 / (door_pairs[has_model] * number_of_trips)
+
+        segment_tables = [_np.asarray(table, dtype=_np.float64) for table in segment_package[1:]]
+        boardings, volumes, stops, dwell_times, alightings = [table[positions] for table in segment_tables]
+        dwell_times, alightings = stsu_dwell_times(
+            offsets,
+            has_model,
+            boarding_duration,
+            alighting_duration,
+            default_duration,
+            inv_door_pair_runs,
+            boardings,
+            volumes,
+            stops,
+            dwell_times,
+            alightings,
+            lambdaK,
+        )
+        dwell_table = segment_tables[3]
+        alighting_table = segment_tables[4]
+        dwell_table[positions] = dwell_times
+        alighting_table[positions] = alightings
+        network.set_attribute_values(
+            "TRANSIT_SEGMENT", ["dwell_time", "transit_alightings"], [segment_package[0], dwell_table, alighting_table]
+        )
 
-            boarding_duration = model["boarding_duration"]
-            alighting_duration = model["alighting_duration"]
-            default_duration = model["default_duration"]
-            correlation = model["correlation"]
-            mode_filter = model["mode_filter"]
-            door_pairs = line["@doors"] / 2.0 if has_doors and line["@doors"] != 0.0 else 1.0
-            inv_door_pair_runs = 1.0 / (door_pairs * number_of_trips)
-            for segment in line.segments(include_hidden=False):
-                segment_number = segment.number
-                if segment_number > 0 and segment.j_node is not None:
-                    segment.transit_alightings = max(
-                        prev_volume + segment.transit_boardings - segment.transit_volume, 0.0
-                    )
-                else:
-                    continue
-                # prev_volume is used above for the previous segments volume, the first segment is always ignored.
-                prev_volume = segment.transit_volume
-                segment_dwell_time = min(
-                    99.8,
-                    (
-                        (boarding_duration * segment.transit_boardings * inv_door_pair_runs)
-                        + (alighting_duration * segment.transit_alightings * inv_door_pair_runs)
-                        + (segment["@tstop"] * default_duration)
-                    )
-                    / 60,
-                )
-                segment.dwell_time = segment.dwell_time * (1 - lambdaK) + segment_dwell_time * lambdaK
         data = network.get_attribute_values("TRANSIT_SEGMENT", ["dwell_time", "transit_time_func"])
         self.Scenario.set_attribute_values("TRANSIT_SEGMENT", ["dwell_time", "transit_time_func"], data)
         return network
@@ -1940,3 +1958,192 @@ class TransitAssignmentTool(_m.Tool()):
     @_m.method(return_type=six.text_type)
     def tool_run_msg_status(self):
         return self.tool_run_msg
+
+
+# ---SURFACE TRANSIT SPEED UPDATE-----------------------------------------------------------------------
+
+
+def segment_layout(index_data):
+    """
+    Orders the transit segments of a get_attribute_values("TRANSIT_SEGMENT", ...) index by line.
+
+    Segments are stored line by line in itinerary order, so sorting the data positions of a line's
+    segments gives its itinerary. The last segment of each line is the hidden segment (with no j-node).
+
+    Returns: A tuple of (line ids, segment data positions, line offsets), where the segments of
+        line_ids[k] are at positions[offsets[k]:offsets[k + 1]].
+    """
+    line_positions = {}
+    for line_id, i_node, position in _netArrays.iter_segment_index(index_data):
+        line_positions.setdefault(line_id, []).append(position)
+
+    line_ids = sorted(line_positions)
+    positions = _np.concatenate(
+        [_np.sort(_np.array(line_positions[line_id], dtype=_np.int64)) for line_id in line_ids]
+        + [_np.zeros(0, dtype=_np.int64)]
+    )
+    counts = _np.array([len(line_positions[line_id]) for line_id in line_ids], dtype=_np.int64)
+    offsets = _np.concatenate(([0], _np.cumsum(counts)))
+    return line_ids, positions, offsets
+
+
+def stsu_dwell_times(
+    offsets,
+    has_model,
+    boarding_duration,
+    alighting_duration,
+    default_duration,
+    inv_door_pair_runs,
+    boardings,
+    volumes,
+    stops,
+    dwell_times,
+    alightings,
+    lambdaK,
+):
+    """
+    Computes segment alightings and the surface transit speed update dwell times on segment-indexed
+    arrays.
+
+    Segment arrays are ordered line by line, with the segments of line k in [offsets[k], offsets[k + 1]).
+    Line arrays (has_model, the three durations and inv_door_pair_runs) are aligned with offsets[:-1].
+    Lines without a model, the first segment of each line, and each line's hidden last segment are left
+    unchanged.
+
+    Returns: A tuple of (dwell times, alightings) arrays.
+    """
+    counts = _np.diff(offsets)
+    line_of_segment = _np.repeat(_np.arange(len(counts)), counts)
+    segment_number = _np.arange(len(line_of_segment)) - _np.repeat(offsets[:-1], counts)
+    updated = (segment_number > 0) & (segment_number < counts[line_of_segment] - 1) & has_model[line_of_segment]
+
+    # The first segment's volume is never carried forward, so the second segment sees a previous volume of 0
+    previous_volumes = _np.zeros(len(volumes))
+    previous_volumes[1:] = volumes[:-1]
+    previous_volumes[segment_number <= 1] = 0.0
+
+    alightings = alightings.copy()
+    alightings[updated] = _np.maximum(previous_volumes + boardings - volumes, 0.0)[updated]
+
+    inv_runs = inv_door_pair_runs[line_of_segment]
+    segment_dwell_times = _np.minimum(
+        99.8,
+        (
+            boarding_duration[line_of_segment] * boardings * inv_runs
+            + alighting_duration[line_of_segment] * alightings * inv_runs
+            + stops * default_duration[line_of_segment]
+        )
+        / 60,
+    )
+    dwell_times = dwell_times.copy()
+    dwell_times[updated] = (dwell_times * (1 - lambdaK) + segment_dwell_times * lambdaK)[updated]
+    return dwell_times, alightings
+
+
+def stsu_dwell_times_reference(lines, lambdaK):
+    """
+    Line-by-line reference implementation of the surface transit speed update, following the original
+    per-segment loop. Used to check stsu_dwell_times.
+
+    Args:
+        - lines: List of dictionaries, one per line, with the keys 'model' (a dictionary with
+            'boarding_duration', 'alighting_duration' and 'default_duration', or None), 'inv_door_pair_runs',
+            and 'segments' (a list of dictionaries with 'boardings', 'volume', 'stops', 'dwell_time' and
+            'alightings', in itinerary order, including the hidden last segment).
+        - lambdaK: The step size
+
+    Returns: A tuple of (dwell times, alightings) lists, in the same order as the segments.
+    """
+    dwell_times = []
+    alightings = []
+    for line in lines:
+        segments = [dict(segment) for segment in line["segments"]]
+        model = line["model"]
+        if model is not None:
+            prev_volume = 0.0
+            for segment_number, segment in enumerate(segments[:-1]):
+                if segment_number == 0:
+                    continue
+                segment["alightings"] = max(prev_volume + segment["boardings"] - segment["volume"], 0.0)
+                prev_volume = segment["volume"]
+                segment_dwell_time = min(
+                    99.8,
+                    (
+                        (model["boarding_duration"] * segment["boardings"] * line["inv_door_pair_runs"])
+                        + (model["alighting_duration"] * segment["alightings"] * line["inv_door_pair_runs"])
+                        + (segment["stops"] * model["default_duration"])
+                    )
+                    / 60,
+                )
+                segment["dwell_time"] = segment["dwell_time"] * (1 - lambdaK) + segment_dwell_time * lambdaK
+        dwell_times.extend(segment["dwell_time"] for segment in segments)
+        alightings.extend(segment["alightings"] for segment in segments)
+    return dwell_times, alightings
+
+
+def make_synthetic_stsu_lines(number_of_lines=200, max_segments=60, seed=0):
+    """
+    Generates random lines for stsu_dwell_times_reference. About a tenth of the lines have no STSU model.
+    """
+    random = _np.random.RandomState(seed)
+    models = [
+        {"boarding_duration": 1.9, "alighting_duration": 1.4, "default_duration": 7.4},
+        {"boarding_duration": 2.5, "alighting_duration": 1.2, "default_duration": 10.0},
+    ]
+    lines = []
+    for _ in range(number_of_lines):
+        number_of_segments = random.randint(2, max_segments + 1)
+        boardings = random.exponential(20.0, number_of_segments)
+        volumes = _np.maximum(_np.cumsum(boardings - random.exponential(18.0, number_of_segments)), 0.0)
+        segments = [
+            {
+                "boardings": boardings[k],
+                "volume": volumes[k],
+                "stops": float(random.randint(0, 4)),
+                "dwell_time": random.uniform(0.0, 0.5),
+                "alightings": 0.0,
+            }
+            for k in range(number_of_segments)
+        ]
+        model = None if random.uniform() < 0.1 else models[random.randint(len(models))]
+        lines.append({"model": model, "inv_door_pair_runs": 1.0 / random.uniform(1.0, 40.0), "segments": segments})
+    return lines
+
+
+def check_stsu_parity(number_of_lines=200, max_segments=60, seed=0, lambdaK=0.5):
+    """
+    Compares stsu_dwell_times against the line-by-line reference on a synthetic network.
+
+    Returns: A tuple of (maximum absolute dwell time difference, maximum absolute alighting difference).
+    """
+    lines = make_synthetic_stsu_lines(number_of_lines, max_segments, seed)
+    expected_dwell_times, expected_alightings = stsu_dwell_times_reference(lines, lambdaK)
+
+    counts = _np.array([len(line["segments"]) for line in lines], dtype=_np.int64)
+    offsets = _np.concatenate(([0], _np.cumsum(counts)))
+    has_model = _np.array([line["model"] is not None for line in lines])
+
+    def line_values(key):
+        return _np.array([line["model"][key] if line["model"] is not None else 0.0 for line in lines])
+
+    def segment_values(key):
+        return _np.array([segment[key] for line in lines for segment in line["segments"]], dtype=_np.float64)
+
+    dwell_times, alightings = stsu_dwell_times(
+        offsets,
+        has_model,
+        line_values("boarding_duration"),
+        line_values("alighting_duration"),
+        line_values("default_duration"),
+        _np.array([line["inv_door_pair_runs"] for line in lines]),
+        segment_values("boardings"),
+        segment_values("volume"),
+        segment_values("stops"),
+        segment_values("dwell_time"),
+        segment_values("alightings"),
+        lambdaK,
+    )
+    return (
+        _np.abs(dwell_times - _np.array(expected_dwell_times)).max(),
+        _np.abs(alightings - _np.array(expected_alightings)).max(),
+    )
@@ -38,6 +38,13 @@ Export Aggregate Average Matrix by Partition
         the Modeller side.
 
     0.1.1 Updated to allow for multi-threaded matrix calcs in 4.2.1+
+
+    0.2.0 Averages are computed in memory with NumPy (tmg.common.partition_aggregation),
+        instead of with two partition aggregations and three matrix calculations on
+        temporary matrices. Exports to a .mtx or .mtx.gz file are written in binary.
+    
+    0.2.1 Fixed corrupt .mtx.gz exports (the rows bypassed gzip), and zones missing from the
+        partition now raise an error naming them.
     
 '''
 
@@ -47,6 +54,7 @@ from multiprocessing import cpu_count
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_partitionAgg = _MODELLER.module('tmg.common.partition_aggregation')
 
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 
@@ -59,9 +67,9 @@ _util.initalizeModellerTypes(_m)
 
 class ExportAggregateAverageMatrix(_m.Tool()):
     
-    version = '0.1.1'
+    version = '0.2.1'
     tool_run_msg = ""
-    number_of_tasks = 6 # For progress reporting, enter the integer number of tasks here
+    number_of_tasks = 2 # For progress reporting, enter the integer number of tasks here
     
     # Tool Input Parameters
     #    Only those parameters neccessary for Modeller and/or XTMF to dock with
@@ -92,8 +100,8 @@ class ExportAggregateAverageMatrix(_m.Tool()):
                      description="Exports a result matrix (e.g. travel times), averaged \
                          over a given zone partition for a given matrix (e.g. demand). \
                          Zone groups with a zero summed weight will be averaged equally \
-                         over all zones equally.\
-                         <br><br><b>Temporary storage requirements:</b> 3 matrices",
+                         over all zones equally. Files ending in .mtx or .mtx.gz \
+                         are exported in binary.",
                      branding_text="- TMG Toolbox")
         
         if self.tool_run_msg != "": # to display messages in the page
@@ -163,83 +171,29 @@ class ExportAggregateAverageMatrix(_m.Tool()):
     def _Execute(self, writeToFile):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
-
-            with _util.tempMatrixMANAGER() as denominatorMatrix, _util.tempMatrixMANAGER() as adjustedDemandMatrix, _util.tempMatrixMANAGER() as finalAggregateMatrix:
-                try:
-                    partitionAggTool = _MODELLER.tool('inro.emme.matrix_calculation.matrix_partition_aggregation')
-                    matrixCalcTool = _MODELLER.tool('inro.emme.matrix_calculation.matrix_calculator')
-                    exportMatrixTool = _MODELLER.tool('inro.emme.data.matrix.export_matrices')
-                except Exception as e:
-                    partitionAggTool = _MODELLER.tool('inro.emme.standard.matrix_calculation.matrix_partition_aggregation')
-                    matrixCalcTool = _MODELLER.tool('inro.emme.standard.matrix_calculation.matrix_calculator')
-                    exportMatrixTool = _MODELLER.tool('inro.emme.standard.data.matrix.export_matrices')
-                
-                matrixToAggregate = _MODELLER.emmebank.matrix(self.MatrixIdToAggregate)
-                finalAggregateMatrix.description = matrixToAggregate.description 
-                
-                #Copy the weighting matrix into adjustedDemandMatrix
-                if EMME_VERSION >= (4,2,1):
-                    self.TRACKER.runTool(matrixCalcTool, 
-                                     specification=self._GetMatrixCopySpec(adjustedDemandMatrix.id),
-                                     scenario = self.Scenario, num_processors=self.NumberOfProcessors)
-                else:
-                    self.TRACKER.runTool(matrixCalcTool, 
-                                     specification=self._GetMatrixCopySpec(adjustedDemandMatrix.id),
-                                     scenario = self.Scenario)
-                #Aggregate weighting matrix into denominatorMatrix
-                weightingMatrix = _MODELLER.emmebank.matrix(self.WeightingMatrixId)
-                self.TRACKER.runTool(partitionAggTool,
-                                     matrix=weightingMatrix,
-                                     origin_partition=self.Partition,
-                                     destination_partition=self.Partition,
-                                     operator='sum',
-                                     result_matrix=denominatorMatrix,
-                                     scenario=self.Scenario)
-                
-                #For partitions with no trips (e.g. '0'), weight every cell with '1'
-                if EMME_VERSION >= (4,2,1):
-                    self.TRACKER.runTool(matrixCalcTool,
-                                     specification=self._GetFixDemandSpec(adjustedDemandMatrix.id,
-                                                                          denominatorMatrix.id),
-                                     scenario=self.Scenario, num_processors=self.NumberOfProcessors)
-                else:
-                    self.TRACKER.runTool(matrixCalcTool,
-                                     specification=self._GetFixDemandSpec(adjustedDemandMatrix.id,
-                                                                          denominatorMatrix.id),
-                                     scenario=self.Scenario)
-                
-                #Re-aggregate the denominator from the adjusted demand matrix
-                self.TRACKER.runTool(partitionAggTool,
-                                     matrix=adjustedDemandMatrix,
-                                     origin_partition=self.Partition,
-                                     destination_partition=self.Partition,
-                                     operator='sum',
-                                     result_matrix=denominatorMatrix)
-                
-                #Calculate the average
-                if EMME_VERSION >= (4,2,1):
-                    self.TRACKER.runTool(matrixCalcTool,
-                        specification=self._GetAggregateAverageSpec(adjustedDemandMatrix.id,
-                                                                    denominatorMatrix.id,
-                                                                    finalAggregateMatrix.id),
-                        scenario=self.Scenario, num_processors=self.NumberOfProcessors)
+            
+            matrixToAggregate = _MODELLER.emmebank.matrix(self.MatrixIdToAggregate)
+            weightingMatrix = _MODELLER.emmebank.matrix(self.WeightingMatrixId)
+            
+            values = matrixToAggregate.get_numpy_data(self.Scenario.id)
+            weights = weightingMatrix.get_numpy_data(self.Scenario.id)
+            zoneGroups = _partitionAgg.get_zone_groups(self.Partition, self.Scenario)
+            self.TRACKER.completeTask()
+            
+            groupNumbers, averages = _partitionAgg.partition_averages(values, weights, zoneGroups)
+            retVal = _partitionAgg.PartitionMatrixData(groupNumbers, averages[0])
+            self.TRACKER.completeTask()
+            
+            if writeToFile:
+                if self.ExportFile.lower().endswith(('.mtx', '.mtx.gz')):
+                    _util.exportBinaryMatrix(retVal, self.ExportFile)
                 else:
-                    self.TRACKER.runTool(matrixCalcTool,
-                        specification=self._GetAggregateAverageSpec(adjustedDemandMatrix.id,
-                                                                    denominatorMatrix.id,
-                                                                    finalAggregateMatrix.id),
-                        scenario=self.Scenario)
-                
-                #Return the average matrix
-                retVal = partitionAggTool(finalAggregateMatrix, self.Partition, self.Partition,scenario=self.Scenario)
-                
-                if writeToFile:
                     title = ["Value Matrix: %s" %matrixToAggregate.description,
                              "Weight Matrix: %s" %weightingMatrix.description,
                              "Partition: %s - %s" %(self.Partition.id, self.Partition.description)]
-                    self._WriteToFile(retVal, "\n".join(title))
-                
-                return retVal
+                    _partitionAgg.write_averages(self.ExportFile, groupNumbers, averages, "\n".join(title))
+            
+            return retVal
                 
     ##########################################################################################################  
     
@@ -253,82 +207,6 @@ class ExportAggregateAverageMatrix(_m.Tool()):
             
         return atts 
     
-    def _GetMatrixCopySpec(self, resultMatrixId):
-        return {
-                "expression": self.WeightingMatrixId,
-                "result": resultMatrixId,
-                "constraint": {
-                    "by_value": None,
-                    "by_zone": None
-                },
-                "aggregation": {
-                    "origins": None,
-                    "destinations": None
-                },
-                "type": "MATRIX_CALCULATION"
-            }
-    
-    def _GetFixDemandSpec(self, adjustedDemandMatrixId, denominatorMatrixId):
-        return {
-                "expression": "1",
-                "result": adjustedDemandMatrixId,
-                "constraint": {
-                    "by_value": {
-                        "interval_min": 0,
-                        "interval_max": 0,
-                        "condition": "INCLUDE",
-                        "od_values": denominatorMatrixId
-                    },
-                    "by_zone": None
-                },
-                "aggregation": {
-                    "origins": None,
-                    "destinations": None
-                },
-                "type": "MATRIX_CALCULATION"
-            }
-    
-    def _GetAggregateAverageSpec(self, adjustedDemandMatrixId, denominatorMatrixId, resultMatrixId):
-        expression = "{weight} * {matrix} / {denom}".format(weight=adjustedDemandMatrixId,
-                                                            matrix=self.MatrixIdToAggregate,
-                                                            denom=denominatorMatrixId)
-        
-        return {
-                "type": "MATRIX_CALCULATION",
-                "expression": expression,
-                "result": resultMatrixId,
-                "aggregation": {
-                    "origins": None,
-                    "destinations": None
-                },
-                "constraint": {
-                    "by_value": None,
-                    "by_zone": None
-                }
-            }
-    
-    def _WriteToFile(self, data, title):
-        with open(self.ExportFile, 'w') as writer:
-            writer.write(title)
-            writer.write("\nO D Val\n")
-            writer.write(self._MatrixDataToString(data))
-    
-    @staticmethod
-    def _MatrixDataToString(data):
-        rows = []
-        
-        dim1 = data.indices[0]
-        dim2 = data.indices[1]
-        
-        for i, row in enumerate(data.raw_data):
-            index1 = dim1[i]
-            for j, cell in enumerate(row):
-                index2 = dim2[j]
-                s = "%s %s %s" %(index1, index2, cell)
-                rows.append(s)
-        
-        return "\n".join(rows)
-    
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
         return self.TRACKER.getProgress()
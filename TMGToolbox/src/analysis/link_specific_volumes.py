@@ -34,6 +34,11 @@ Export Specific Link Volumes
 '''
     0.0.1 Created on 2015-06-03 by tnikolov
     0.1.0 Added the option to export total transit volumes on the link
+    0.2.0 Filters are now evaluated locally against link and segment arrays loaded once
+        per scenario, instead of calling the Network Calculator for each filter. Filters
+        which cannot be parsed locally still fall back to the Network Calculator.
+    0.2.1 Filters naming link ids which select no links report "N/A" again, as the
+        Network Calculator did.
     
 '''
 
@@ -44,6 +49,7 @@ import csv
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_selection = _MODELLER.module('tmg.common.selection_expressions')
 networkCalculator = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 # import six library for python2 to python3 conversion
@@ -124,23 +130,29 @@ class LinkSpecificVolumes(_m.Tool()):
             for scenario in self.Scenarios:
                 self.Scenario = _MODELLER.emmebank.scenario(scenario.id)
                 self.results[scenario.id] = {}
+
+                #Evaluate all filters against arrays loaded once per scenario
+                selector = _selection.NetworkSelector(self.Scenario)
+                autoVolumes = selector.link_values('volau')
+
                 if self.TransitFlag:
-                    network = _MODELLER.emmebank.scenario(str(int(scenario.id) + 1)).get_network()
+                    #transit scenario hard-coded as "the next" scenario
+                    transitScenario = _MODELLER.emmebank.scenario(str(int(scenario.id) + 1))
+                    network = transitScenario.get_network()
+                    transitSelector = _selection.NetworkSelector(network)
+                    transitVolumes = transitSelector.segment_values('voltr')
+                    linksByShape = self._IndexLinksByShape(network)
             
                 for filter in parsed_filter_list:                                
-                
-                    spec1 = {
-                        "expression": "volau",                    
-                        "selections": {
-                            "link": filter[1]
-                            },
-                        "type": "NETWORK_CALCULATION"
-                    }
                     try:
-                        report1 = networkCalculator(spec1, scenario=self.Scenario)
-                        outputAuto = report1['sum']
-                    except:
-                        outputAuto = "N/A"
+                        mask = selector.link_mask(filter[1])
+                        if not mask.any() and self._NamesLinkIds(filter[1]):
+                            #Matches the Network Calculator, which fails on links not in the network
+                            outputAuto = "N/A"
+                        else:
+                            outputAuto = float(autoVolumes[mask].sum())
+                    except _selection.SelectionSyntaxError:
+                        outputAuto = self._CalculateAutoVolume(filter[1])
 
                     if self.TransitFlag:
                         # consider adding an option to search for links with the same coordinates 
@@ -152,23 +164,12 @@ class LinkSpecificVolumes(_m.Tool()):
                             baseLink = filter[1].strip('link=').split(",")
                             baseLinkI = baseLink[0]
                             baseLinkJ = baseLink[1]
-                            for link in network.links():
-                                if link.shape == network.link(baseLinkI, baseLinkJ).shape:
-                                    linkSelection += " or link=" + link.id.replace("-",",")
-
-                            spec2 = {
-                                "expression": "voltr",                    
-                                "selections": {
-                                    "link": linkSelection,
-                                    "transit_line": "all"
-                                    },
-                                "type": "NETWORK_CALCULATION"
-                            }
-
-                            #transit scenario hard-coded as "the next" scenario
-                        
-                            report2 = networkCalculator(spec2, scenario=_MODELLER.emmebank.scenario(str(int(scenario.id) + 1)))
-                            outputTransit = report2['sum']
+                            shape = self._GetShapeKey(network.link(baseLinkI, baseLinkJ))
+                            for link in linksByShape[shape]:
+                                linkSelection += " or link=" + link.id.replace("-",",")
+
+                            mask = transitSelector.segment_mask(link_expression= linkSelection)
+                            outputTransit = float(transitVolumes[mask].sum())
                         except:
                             outputTransit = "N/A"
                         self.results[scenario.id][filter[0]] = [outputAuto, outputTransit]
@@ -176,6 +177,34 @@ class LinkSpecificVolumes(_m.Tool()):
                     else:
                         self.results[scenario.id][filter[0]] = [outputAuto]
 
+    def _CalculateAutoVolume(self, linkFilter):
+        #Falls back to the Network Calculator for filters which can't be evaluated locally
+        spec = {
+            "expression": "volau",                    
+            "selections": {
+                "link": linkFilter
+                },
+            "type": "NETWORK_CALCULATION"
+        }
+        try:
+            report = networkCalculator(spec, scenario=self.Scenario)
+            return report['sum']
+        except:
+            return "N/A"
+
+    def _NamesLinkIds(self, linkFilter):
+        return any(isinstance(token, tuple) and token[0] == 'link'
+                   for token in _selection.tokenize(linkFilter))
+
+    def _GetShapeKey(self, link):
+        return tuple(tuple(point) for point in link.shape)
+
+    def _IndexLinksByShape(self, network):
+        linksByShape = {}
+        for link in network.links():
+            linksByShape.setdefault(self._GetShapeKey(link), []).append(link)
+        return linksByShape
+
     def _ParseFilterString(self, filterString):
         filterList = []
         components = _regex_split('\n|;', filterString) #Supports newline and/or semi-colons
@@ -28,12 +28,21 @@
 '''
     1.0.0 Created by Peter Lai on 2020-08-26
 
+    1.0.1 Direction pairing now uses a memoized search over the remaining lines in each direction, instead of
+          expanding every branch of the recursive pairing into a full list of combinations.
+
+    1.1.0 The Service Table is parsed once into a typed, columnar table (and re-used while the file is unchanged).
+          Line properties, vehicle counts, revenue hours and revenue km are computed with grouped array operations.
+          Added CostSweep to produce reports for several cost parameter files from a single set of route statistics.
+
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 import datetime
 import math
+import os
+import numpy as _np
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
 # import six library for python2 to python3 conversion
@@ -45,8 +54,9 @@ _util.initalizeModellerTypes(_m)
 
 class EstimateTransitOperatingCosts(_m.Tool()):
 
-    version = '1.0.0'
+    version = '1.1.0'
     tool_run_msg = ""
+    _service_table_cache = None  # (file key, ServiceTable) of the last service table parsed
     Scenario = _m.Attribute(_m.InstanceType)
     xtmf_ScenarioNumber = _m.Attribute(int)
     ServiceTableFile = _m.Attribute(str)
@@ -168,29 +178,78 @@ class EstimateTransitOperatingCosts(_m.Tool()):
             self.tool_run_msg = _m.PageBuilder.format_exception(e, _traceback.format_exc())
             raise
 
-    def _Execute(self):
+    def CostSweep(self, xtmf_ScenarioNumber, ServiceTableFile, CostParamsFiles, ReportFiles):
+        """
+        Runs the tool once for each of several cost parameter files, writing one report per file. The service
+        table, line properties and route statistics are only computed once for the whole sweep.
+
+        CostParamsFiles and ReportFiles are either lists or semicolon-separated strings of the same length.
+        """
+        if isinstance(CostParamsFiles, six.string_types):
+            CostParamsFiles = [f for f in CostParamsFiles.split(';') if f]
+        if isinstance(ReportFiles, six.string_types):
+            ReportFiles = [f for f in ReportFiles.split(';') if f]
+        if len(CostParamsFiles) != len(ReportFiles):
+            raise Exception("The number of cost parameter files (%s) does not match the number of report files (%s)"
+                            % (len(CostParamsFiles), len(ReportFiles)))
+
+        self.Scenario = _MODELLER.emmebank.scenario(xtmf_ScenarioNumber)
+        if self.Scenario is None:
+            raise Exception("Scenario %s was not found!" % xtmf_ScenarioNumber)
+
+        self._GetScenarioTimePeriodInfo()
+        self.ServiceTableFile = ServiceTableFile
+
+        try:
+            stats = None
+            for cost_params_file, report_file in zip(CostParamsFiles, ReportFiles):
+                self.CostParamsFile = cost_params_file
+                self.ReportFile = report_file
+                stats = self._Execute(stats)
+        except Exception as e:
+            self.tool_run_msg = _m.PageBuilder.format_exception(e, _traceback.format_exc())
+            raise
+
+    def _Execute(self, stats=None):
 
         with _m.logbook_trace(
                 name="{classname} v{version}".format(classname=self.__class__.__name__, version=self.version),
                 attributes=self._GetLogbookAttributes()):
 
-            lines = self._GetAllLinesInfo()
-            servt = self._ReadInputCSV(self.ServiceTableFile)
             self.params = self._ReadInputCSV(self.CostParamsFile)
             self._ValidateCostParamsFile()
 
-            lines = self._CalculatePrelimLineProperties(lines, servt)
-            routes = self._GroupLinesIntoRoutes(lines)
-            routes = self._CleanDuplicateLines(routes)
-            routes_unbalanced = list(routes)
+            if stats is None:
+                stats = self._ComputeRouteStatistics()
+
+            cost = self._ComputeCost(stats)
+
+            self._ExportResults(self.ReportFile, stats['route_ids'], stats['mode'], stats['rev_hr'],
+                                stats['rev_km'], stats['veh_no'], cost)
+
+        return stats
+
+    def _ComputeRouteStatistics(self):
+        # everything which does not depend on the cost parameters: line properties, route grouping, balancing,
+        # pairing, vehicle counts, and revenue hours / km
+
+        lines = self._GetAllLinesInfo()
+        servt = self._LoadServiceTable(self.ServiceTableFile)
+
+        lines = self._CalculatePrelimLineProperties(lines, servt)
+        table = self._BuildLineTable(lines)
+        routes = self._GroupLinesIntoRoutes(lines)
+        routes = self._CleanDuplicateLines(routes)
+        routes_unbalanced = list(routes)
 
-            routes, do_not_pair = self._BalanceDirections(routes)
-            pairs = self._GenerateDirectionPairs(routes, do_not_pair)
+        routes, do_not_pair = self._BalanceDirections(routes)
+        pairs = self._GenerateDirectionPairs(routes, do_not_pair)
 
-            route_ids, veh_no, mode = self._ComputeVehicleCount(routes, pairs)
-            rev_hr, rev_km, cost = self._ComputeCost(routes_unbalanced, veh_no)
+        route_ids, veh_no, mode = self._ComputeVehicleCount(routes, pairs, table)
+        rev_hr, rev_km = self._ComputeRevenueStatistics(routes_unbalanced, table)
 
-            self._ExportResults(self.ReportFile, route_ids, mode, rev_hr, rev_km, veh_no, cost)
+        return {'route_ids': route_ids, 'mode': mode, 'veh_no': veh_no, 'rev_hr': rev_hr, 'rev_km': rev_km,
+                'route_lines': [route[0] for route in routes_unbalanced]}
 
     #######################################################################################################
 
@@ -272,6 +331,15 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         # self._WriteDebugFile(self.DebugFile, r[1:])
         return r[1:]
 
+    def _LoadServiceTable(self, file):
+        # the parsed service table only depends on the file, so re-use it for as long as the file is unchanged
+        key = (os.path.abspath(file), os.path.getmtime(file), os.path.getsize(file))
+        cached = EstimateTransitOperatingCosts._service_table_cache
+        if cached is None or cached[0] != key:
+            cached = (key, ServiceTable(file, self._FormatTime))
+            EstimateTransitOperatingCosts._service_table_cache = cached
+        return cached[1]
+
     def _WriteDebugFile(self, file, content):
         with open(file, 'w') as writer_debug:
             for row in content:
@@ -296,79 +364,101 @@ class EstimateTransitOperatingCosts(_m.Tool()):
 
         lines = []
 
+        # select the trips departing within the time period, grouped by line in Service Table order
+        valid = servt.valid_trips(self.time_period_start, self.time_period_end)
+        if self.time_period == 'ON':
+            # morning trips (before 06:00) come before the night trips (24:00 or later) of the same line
+            subgroup = (servt.depart_hour[valid] > 23).astype(_np.int64)
+        else:
+            subgroup = _np.zeros(len(valid), dtype=_np.int64)
+        order = _np.lexsort((valid, subgroup, servt.line_index[valid]))
+        trips = valid[order]
+        subgroup = subgroup[order]
+        n_lines = len(servt.line_ids)
+        n_groups = n_lines * 2
+
+        trip_line = servt.line_index[trips]
+        trip_group = trip_line * 2 + subgroup
+        runtimes = servt.time_diff(servt.depart[trips], servt.arrive[trips])
+
+        # headways between subsequent trips of the same line (and sub-group)
+        same_group = trip_group[1:] == trip_group[:-1]
+        hdwy_groups = trip_group[:-1][same_group]
+        hdwys = servt.time_diff(servt.depart[trips[:-1][same_group]], servt.depart[trips[1:][same_group]])
+
+        trip_count = _np.bincount(trip_line, minlength=n_lines)
+        group_count = _np.bincount(trip_group, minlength=n_groups)
+        runtime_sum = _np.bincount(trip_line, weights=runtimes, minlength=n_lines)
+        hdwy_sum = _np.bincount(hdwy_groups, weights=hdwys, minlength=n_groups)
+        hdwy_count = _np.bincount(hdwy_groups, minlength=n_groups)
+
         for line in lines_og:
             id = line[0]
-            trips = [trip for trip in servt if trip[0] == id and self._CheckTripValidity(trip)]
-            if len(trips) == 0:
+            li = servt.line_position(id)
+            if li is not None:
+                servt.check_line_rows(li)
+            if li is None or trip_count[li] == 0:
                 _m.logbook_write("WARNING: Cannot find any trips in this time period for line " + id)
-            elif self.time_period == 'ON':
-                morning = []
-                night = []
-                for t in trips:
-                    if int(self._FormatTime(t[1])[0:2]) < 6:
-                        morning.append(t)
-                    elif int(self._FormatTime(t[1])[0:2]) > 23:
-                        night.append(t)
-                line_runtimes = []
-                morning_hdwys = []
-                night_hdwys = []
-                if len(morning) >= 1:
-                    for j in range(0, len(morning) - 1, 1):
-                        morning_hdwys.append(self._GetTimeDiff(morning[j][1], morning[j + 1][1]))
-                        line_runtimes.append(self._GetTimeDiff(morning[j][1], morning[j][2]))
-                    line_runtimes.append(self._GetTimeDiff(morning[-1][1], morning[-1][2]))
-                if len(night) >= 1:
-                    for j in range(0, len(night) - 1, 1):
-                        night_hdwys.append(self._GetTimeDiff(night[j][1], night[j + 1][1]))
-                        line_runtimes.append(self._GetTimeDiff(night[j][1], night[j][2]))
-                    line_runtimes.append(self._GetTimeDiff(night[-1][1], night[-1][2]))
-                avg_runtime = sum(line_runtimes) / float(len(line_runtimes))
-                if len(morning) > len(night):
-                    if len(morning) == 1:
+                continue
+            tc = int(trip_count[li])
+            avg_runtime = runtime_sum[li] / float(tc)
+            if self.time_period == 'ON':
+                n_morning = group_count[2 * li]
+                n_night = group_count[2 * li + 1]
+                if n_morning > n_night:
+                    if n_morning == 1:
                         line_hdwy = 360.00
                     else:
-                        line_hdwy = sum(morning_hdwys) / float(len(morning_hdwys))
-                elif len(night) > len(morning):
-                    if len(night) == 1:
+                        line_hdwy = hdwy_sum[2 * li] / float(hdwy_count[2 * li])
+                elif n_night > n_morning:
+                    if n_night == 1:
                         line_hdwy = 360.00
                     else:
-                        line_hdwy = sum(night_hdwys) / float(len(night_hdwys))
+                        line_hdwy = hdwy_sum[2 * li + 1] / float(hdwy_count[2 * li + 1])
                 else:
-                    if len(night) == 1:  # if both night and morning each have one trip
+                    if n_night == 1:  # if both night and morning each have one trip
                         line_hdwy = 180.00
                     else:
-                        line_hdwy = (sum(morning_hdwys) + sum(night_hdwys)) / \
-                                    float(len(morning_hdwys) + len(night_hdwys))
-                line.append("{:.2f}".format(avg_runtime))
-                line.append("{:.2f}".format(line_hdwy))
-                line.append("{:d}".format(len(line_runtimes)))  # trip count
-                lines.append(line)
+                        line_hdwy = (hdwy_sum[2 * li] + hdwy_sum[2 * li + 1]) / \
+                                    float(hdwy_count[2 * li] + hdwy_count[2 * li + 1])
+            elif tc == 1:
+                # set headway to length of entire time period
+                line_hdwy = 60.00 * self.time_period_duration
             else:
-                if len(trips) == 1:
-                    line.append("{:.2f}".format(self._GetTimeDiff(trips[0][1], trips[0][2])))
-                    # set headway to length of entire time period
-                    line.append("{:.2f}".format(60.00 * self.time_period_duration))
-                    line.append('1')
-                    lines.append(line)
-                else:
-                    line_hdwys = []
-                    line_runtimes = []
-                    for j in range(0, len(trips) - 1, 1):
-                        line_hdwys.append(self._GetTimeDiff(trips[j][1], trips[j + 1][1]))
-                        line_runtimes.append(self._GetTimeDiff(trips[j][1], trips[j][2]))
-                    # calculate runtime of the last trip
-                    line_runtimes.append(self._GetTimeDiff(trips[-1][1], trips[-1][2]))
-                    line_hdwy = sum(line_hdwys) / float(len(line_hdwys))
-                    avg_runtime = sum(line_runtimes) / float(len(line_runtimes))
-                    line.append("{:.2f}".format(avg_runtime))
-                    line.append("{:.2f}".format(line_hdwy))
-                    line.append("{:d}".format(len(line_runtimes)))
-                    lines.append(line)
+                line_hdwy = hdwy_sum[2 * li] / float(hdwy_count[2 * li])
+            line.append("{:.2f}".format(avg_runtime))
+            line.append("{:.2f}".format(line_hdwy))
+            line.append("{:d}".format(tc))  # trip count
+            lines.append(line)
 
         # self._WriteDebugFile(self.DebugFile, lines)
 
         return lines
 
+    def _BuildLineTable(self, lines):
+        # typed, columnar copy of the line properties, indexed by line ID. Values are parsed from the formatted
+        # line rows, so that all results are identical to working on the rows directly.
+        table = {'index': dict((line[0], i) for i, line in enumerate(lines))}
+        columns = [('len', self.idx_len), ('time_act', self.idx_time_act), ('time_sch', self.idx_time_sch),
+                   ('hdwy', self.idx_hdwy_new), ('tc', self.idx_tc)]
+        for name, idx in columns:
+            table[name] = _np.array([float(line[idx]) for line in lines], dtype=_np.float64)
+        table['loop'] = _np.array([line[self.idx_startpt] == line[self.idx_endpt] for line in lines], dtype=bool)
+        table['dir'] = _np.array([self._GetLineDir(line) for line in lines])
+        table['lay_dur'] = _np.array([self._GetLayDur(line) for line in lines], dtype=_np.float64)
+        table['lay_fac'] = _np.array([self._GetLayFac(line) for line in lines], dtype=_np.float64)
+        table['bad'] = (table['len'] <= self.short_len_th) | (table['tc'] <= self.low_freq_th)
+
+        # vehicles needed by each line when operated on its own, including layover
+        table['veh_single'] = _np.minimum(_np.ceil((table['time_sch'] + table['lay_dur']) / table['hdwy']),
+                                          table['tc'])
+        # vehicles needed by each line when operated in one direction only (see _OneWayLine)
+        tc_int = _np.floor(table['tc'])
+        cycle_veh = _np.minimum(tc_int, _np.ceil(table['time_sch'] * 2.0 / table['hdwy']))
+        table['veh_one_way'] = _np.where(table['loop'], _np.ceil(table['time_sch'] / table['hdwy']),
+                                         _np.where(table['len'] > 10.00, tc_int, cycle_veh))
+        return table
+
     def _GroupLinesIntoRoutes(self, lines):
         routes_r = []
         cur_route_id = self._GetRouteID(lines[0])
@@ -478,98 +568,123 @@ class EstimateTransitOperatingCosts(_m.Tool()):
 
         return routes_dir_pairs
 
-    def _ComputeVehicleCount(self, routes, routes_dir_pairs):
+    def _ComputeVehicleCount(self, routes, routes_dir_pairs, table):
         route_ids_r = []
         veh_no_r = []
         mode_r = []
 
-        routes_iter = iter(routes)
+        index = table['index']
+        n_routes = len(routes)
 
-        for route_dir_pairs in routes_dir_pairs:
-            route = next(routes_iter)
+        # vehicles of lines which are not paired, summed by route: all lines, and lines without an a/b direction
+        line_route = []
+        line_rows = []
+        for route_no, route in enumerate(routes):
+            for line in route:
+                line_route.append(route_no)
+                line_rows.append(index[line[0]])
+        line_route = _np.array(line_route, dtype=_np.int64)
+        line_rows = _np.array(line_rows, dtype=_np.int64)
+        veh_single = table['veh_single'][line_rows]
+        line_dirs = table['dir'][line_rows]
+        not_ab = (line_dirs != 'a') & (line_dirs != 'b')
+        veh_all_by_route = _np.bincount(line_route, weights=veh_single, minlength=n_routes)
+        veh_other_by_route = _np.bincount(line_route[not_ab], weights=veh_single[not_ab], minlength=n_routes)
+
+        # vehicles of paired lines, evaluated for all pairs of all routes at once
+        pair_route = []
+        rows1 = []
+        rows2 = []
+        for route_no, route_dir_pairs in enumerate(routes_dir_pairs):
+            for pair in route_dir_pairs:
+                pair_route.append(route_no)
+                rows1.append(index[pair[0]])
+                rows2.append(index[pair[1]])
+        pair_route = _np.array(pair_route, dtype=_np.int64)
+        rows1 = _np.array(rows1, dtype=_np.int64)
+        rows2 = _np.array(rows2, dtype=_np.int64)
+
+        tc1 = table['tc'][rows1]
+        tc2 = table['tc'][rows2]
+        bad1 = table['bad'][rows1]
+        bad2 = table['bad'][rows2]
+        cycle_time = (table['time_sch'][rows1] + table['time_sch'][rows2]) * table['lay_fac'][rows1]
+        avg_hdwy = (table['hdwy'][rows1] + table['hdwy'][rows2]) / 2.0
+        veh_count = _np.ceil(cycle_time / avg_hdwy)
+        veh_contrib = _np.where((tc1 > self.tccond_th) & (tc2 > self.tccond_th), veh_count,
+                                _np.minimum(_np.minimum(tc1, tc2), veh_count))
+        # if only one line of the pair is short / infrequent, only the other line is counted
+        only1 = ~bad1 & bad2
+        only2 = bad1 & ~bad2
+        veh_count = _np.where(only1, table['veh_one_way'][rows1], _np.where(only2, table['veh_one_way'][rows2],
+                                                                             veh_count))
+        veh_contrib = _np.where(only1 | only2, veh_count, veh_contrib)
+
+        veh_pairs_by_route = _np.bincount(pair_route, weights=veh_contrib, minlength=n_routes)
+        veh_notccond_by_route = _np.bincount(pair_route, weights=veh_count, minlength=n_routes)
+
+        for route_no, route in enumerate(routes):
             route_id = self._GetRouteID(route[0])
             route_ids_r.append(route_id)
             mode_r.append(route[0][self.idx_mode])
-            if route_dir_pairs == []:  # if no pair
-                veh_accum = 0
+            if routes_dir_pairs[route_no] == []:  # if no pair
                 if len(route) == 1 and route[0][self.idx_startpt] != route[0][self.idx_endpt] and 'HM' not in route_id:
                     # if route is only one direction (and not a loop line)
                     veh_accum = self._OneWayLine(route[0])
                 else:
-                    for line in route:
-                        veh_computed = math.ceil(
-                            (float(line[self.idx_time_sch]) + self._GetLayDur(line)) / float(line[self.idx_hdwy_new]))
-                        veh_accum += min(veh_computed, float(line[self.idx_tc]))
+                    veh_accum = veh_all_by_route[route_no]
             else:  # if there are pairings
-                veh_accum = 0
-                veh_accum_notccond = 0
-                for pair in route_dir_pairs:
-                    line1 = next(line for line in route if line[0] == pair[0])
-                    line2 = next(line for line in route if line[0] == pair[1])
-                    line1bad = (float(line1[self.idx_len]) <= self.short_len_th or
-                                float(line1[self.idx_tc]) <= self.low_freq_th)
-                    line2bad = (float(line2[self.idx_len]) <= self.short_len_th or
-                                float(line2[self.idx_tc]) <= self.low_freq_th)
-                    if (not line1bad) and (line2bad):
-                        veh_count = self._OneWayLine(line1)
-                        veh_accum += veh_count
-                    elif (line1bad) and (not line2bad):
-                        veh_count = self._OneWayLine(line2)
-                        veh_accum += veh_count
-                    else:
-                        cycle_time = (float(line1[self.idx_time_sch]) +
-                                      float(line2[self.idx_time_sch])) * self._GetLayFac(line1)
-                        avg_hdwy = (float(line1[self.idx_hdwy_new]) + float(line2[self.idx_hdwy_new])) / 2.0
-                        veh_count = math.ceil(cycle_time / avg_hdwy)
-                        if float(line1[self.idx_tc]) > self.tccond_th and float(line2[self.idx_tc]) > self.tccond_th:
-                            veh_accum += veh_count
-                        else:  # make sure the vehicle count for the branch does not exceed the trip count
-                            veh_accum += min(float(line1[self.idx_tc]), float(line2[self.idx_tc]), veh_count)
-                    veh_accum_notccond += veh_count
+                veh_accum = veh_pairs_by_route[route_no]
                 if veh_accum == 0:
-                    veh_accum = veh_accum_notccond
+                    veh_accum = veh_notccond_by_route[route_no]
                 # now add the vehicles from the 'c' routes
-                lines_other = [line for line in route if self._GetLineDir(line) not in ['a', 'b']]
-                for line in lines_other:
-                    veh_computed = math.ceil((float(line[self.idx_time_sch]) + self._GetLayDur(line))
-                                             / float(line[self.idx_hdwy_new]))
-                    veh_accum += min(veh_computed, float(line[self.idx_tc]))
+                veh_accum += veh_other_by_route[route_no]
             veh_no_r.append(str(int(veh_accum)))
 
         return route_ids_r, veh_no_r, mode_r
 
-    def _ComputeCost(self, routes_unbalanced, veh_no):
-        revhr_r = []
-        revkm_r = []
-        cost_r = []
+    def _ComputeRevenueStatistics(self, routes_unbalanced, table):
+        index = table['index']
 
-        veh_no_iter = iter(veh_no)
+        line_route = []
+        line_rows = []
+        for route_no, route in enumerate(routes_unbalanced):
+            for line in route:
+                line_route.append(route_no)
+                line_rows.append(index[line[0]])
+        line_route = _np.array(line_route, dtype=_np.int64)
+        line_rows = _np.array(line_rows, dtype=_np.int64)
+
+        tc = table['tc'][line_rows]
+        if self.time_period == 'ON':
+            runtime = table['time_sch'][line_rows]
+        else:
+            runtime = _np.maximum(table['time_sch'][line_rows], table['time_act'][line_rows])
+        revhr = _np.bincount(line_route, weights=runtime * tc / 60.00, minlength=len(routes_unbalanced))
+        revkm = _np.bincount(line_route, weights=table['len'][line_rows] * tc, minlength=len(routes_unbalanced))
 
-        for route in routes_unbalanced:
+        for route_no, route in enumerate(routes_unbalanced):
             route_id = self._GetRouteID(route[0])
-            revhr = 0.0
-            revkm = 0.0
-            for line in route:
-                if self.time_period == 'ON':
-                    revhr += float(line[self.idx_time_sch]) * float(line[self.idx_tc]) / 60.00
-                else:
-                    runtime = max(float(line[self.idx_time_sch]), float(line[self.idx_time_act]))
-                    revhr += runtime * float(line[self.idx_tc]) / 60.00
-                revkm += float(line[self.idx_len]) * float(line[self.idx_tc])
             if 'TS' in route_id:  # address how the op stats for the TTC rail routes are on a per-car basis
                 if route_id == 'TS03' or route_id == 'TS04':  # Line 3, 4 are 4 cars per set
-                    revhr = revhr * 4.00
-                    revkm = revkm * 4.00
+                    revhr[route_no] *= 4.00
+                    revkm[route_no] *= 4.00
                 else:  # Lines 1, 2 are 6 cars per set
-                    revhr = revhr * 6.00
-                    revkm = revkm * 6.00
-            [uc_hr, uc_km, uc_veh] = self._GetCostParams(route_id, route[0])
-            cost = uc_hr * revhr + uc_km * revkm + uc_veh * int(next(veh_no_iter))
-            revhr_r.append("{:.4f}".format(revhr))
-            revkm_r.append("{:.4f}".format(revkm))
+                    revhr[route_no] *= 6.00
+                    revkm[route_no] *= 6.00
+
+        return revhr, revkm
+
+    def _ComputeCost(self, stats):
+        cost_r = []
+
+        for route_id, line, revhr, revkm, veh_no in zip(stats['route_ids'], stats['route_lines'], stats['rev_hr'],
+                                                         stats['rev_km'], stats['veh_no']):
+            [uc_hr, uc_km, uc_veh] = self._GetCostParams(route_id, line)
+            cost = uc_hr * revhr + uc_km * revkm + uc_veh * int(veh_no)
             cost_r.append("$" + "{:.2f}".format(cost))
 
-        return revhr_r, revkm_r, cost_r
+        return cost_r
 
     def _ExportResults(self, file, route_ids, mode, revhr, revkm, veh_no, cost):
         mode_iter = iter(mode)
@@ -581,7 +696,8 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         with open(file, 'w') as writer:
             writer.write(','.join(['route_id', 'mode', 'rev_hr', 'rev_km', 'no_veh', 'op_cost']) + '\n')
             for route_id in route_ids:
-                w = [route_id, next(mode_iter), next(revhr_iter), next(revkm_iter), next(veh_no_iter), next(cost_iter)]
+                w = [route_id, next(mode_iter), "{:.4f}".format(next(revhr_iter)), "{:.4f}".format(next(revkm_iter)),
+                     next(veh_no_iter), next(cost_iter)]
                 writer.write(','.join(w) + '\n')
 
 
@@ -598,32 +714,6 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         else:
             return t
 
-    def _GetTimeDiff(self, time1, time2):
-        # computes time gap between two times, returns it in minutes (type float)
-        # time1 is earlier time, time2 is later time
-        start_str = self._FormatTime(time1)
-        end_str = self._FormatTime(time2)
-        if int(start_str[0:2]) > 23 or int(end_str[0:2]) > 23:
-            start_str = str(int(start_str[0:2]) - 12) + start_str[2:]
-            end_str = str(int(end_str[0:2]) - 12) + end_str[2:]
-        t1 = datetime.datetime.strptime(start_str, '%H:%M:%S')
-        t2 = datetime.datetime.strptime(end_str, '%H:%M:%S')
-        diff = t2 - t1
-        return diff.seconds / 60.00
-
-    def _CheckTripValidity(self, trip):
-        # checks if the trip start time is within the time period
-        if len(trip) != 3:
-            raise Exception("Not all rows of Service Table have three columns.")
-        start_str = self._FormatTime(trip[1])
-        if int(start_str[0:2]) > 23:
-            start_str = str(int(start_str[0:2]) - 24) + start_str[2:]
-        start = datetime.datetime.strptime(start_str, '%H:%M:%S').time()
-        if self.time_period_start <= start <= self.time_period_end:
-            return True
-        else:
-            return False
-
 
     # ---------- Sub Functions: Obtaining Values and Parameters ----------
 
@@ -807,6 +897,12 @@ class EstimateTransitOperatingCosts(_m.Tool()):
 
         return [r, error]
 
+    def _FindLine(self, route, line_id):
+        # route is either a list of lines or a dictionary of lines keyed by line ID
+        if isinstance(route, dict):
+            return route[line_id]
+        return next(line for line in route if line[0] == line_id)
+
     def _CheckPairValidity(self, route, pair):
         # given a pair of lines in a route, check whether at least one of them are short / infrequent, and if so, flag
         # so that the pair is not added
@@ -814,7 +910,7 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         modes = []
         hdwys = []
         for pair_line_id in pair:
-            line_match = next(line for line in route if line[0] == pair_line_id)
+            line_match = self._FindLine(route, pair_line_id)
             modes.append(line_match[self.idx_mode])
             hdwys.append(float(line_match[self.idx_hdwy_new]))
             if float(line_match[self.idx_len]) <= self.short_len_th or \
@@ -849,56 +945,66 @@ class EstimateTransitOperatingCosts(_m.Tool()):
     def _EvalGeo(self, route, pairing_combo):
         mismatch_count = 0
         for p in pairing_combo:
-            l1 = next(line for line in route if line[0] == p[0])
-            l2 = next(line for line in route if line[0] == p[1])
+            l1 = self._FindLine(route, p[0])
+            l2 = self._FindLine(route, p[1])
             if not (l1[self.idx_startpt] == l2[self.idx_endpt] and l1[self.idx_endpt] == l2[self.idx_startpt]):
                 mismatch_count += 1
         return mismatch_count
 
-    def _RecursivePair(self, dir_a, dir_b):
-        # takes two lists containing lines in each direction (lengths of both lists must be equal)
-        # picks the smallest line from each direction, both in terms of length, and trip count; pair those lines up
-        # passes the remaining lines into the recursive call
-        # base case: pairs the only line in each direction and return it
-        # format of the data structure: list of tuples; each tuple is a node-stems pair: (node, stems)
-        # node is a list indicating the pair ['line1', 'line2']
-        # stems is a list of tuples
-
-        if len(dir_a) == 1 and len(dir_b) == 1:
-            return [(sorted([dir_a[0][0], dir_b[0][0]]), [])]
-        else:
-            # len:
-            line_a_len = min(dir_a, key=lambda x: (float(x[self.idx_len]), float(x[self.idx_tc])))
-            line_b_len = min(dir_b, key=lambda x: (float(x[self.idx_len]), float(x[self.idx_tc])))
-            pair_len = sorted([line_a_len[0], line_b_len[0]])
-            # tc:
-            line_a_tc = min(dir_a, key=lambda x: (float(x[self.idx_tc]), float(x[self.idx_len])))
-            line_b_tc = min(dir_b, key=lambda x: (float(x[self.idx_tc]), float(x[self.idx_len])))
-            pair_tc = sorted([line_a_tc[0], line_b_tc[0]])
-            if pair_len == pair_tc:
-                new_dir_a = [line for line in dir_a if line != line_a_len]
-                new_dir_b = [line for line in dir_b if line != line_b_len]
-                r = [(pair_len, self._RecursivePair(new_dir_a, new_dir_b))]
-                return r
+    def _NextPairs(self, dir_a, dir_b):
+        # picks the smallest line from each direction, both in terms of length, and trip count, and returns the
+        # distinct candidate pairs as (pair, line_a, line_b) branches; length-first always comes first
+        line_a_len = min(dir_a, key=lambda x: (float(x[self.idx_len]), float(x[self.idx_tc])))
+        line_b_len = min(dir_b, key=lambda x: (float(x[self.idx_len]), float(x[self.idx_tc])))
+        pair_len = tuple(sorted([line_a_len[0], line_b_len[0]]))
+        line_a_tc = min(dir_a, key=lambda x: (float(x[self.idx_tc]), float(x[self.idx_len])))
+        line_b_tc = min(dir_b, key=lambda x: (float(x[self.idx_tc]), float(x[self.idx_len])))
+        pair_tc = tuple(sorted([line_a_tc[0], line_b_tc[0]]))
+        if pair_len == pair_tc:
+            return [(pair_len, line_a_len, line_b_len)]
+        return [(pair_len, line_a_len, line_b_len), (pair_tc, line_a_tc, line_b_tc)]
+
+    def _SearchPairCombos(self, dir_a, dir_b, pair_is_valid):
+        # memoized search over the (remaining-a, remaining-b) states. At each state, the smallest lines by length
+        # and by trip count are paired, branching when the two disagree. Returns the unique pairing combos (as
+        # frozensets of valid pairs) in the order in which a full depth-first expansion would first produce them.
+        memo = {}
+
+        def search(rem_a, rem_b):
+            key = (frozenset(line[0] for line in rem_a), frozenset(line[0] for line in rem_b))
+            if key in memo:
+                return memo[key]
+            if len(rem_a) == 1 and len(rem_b) == 1:
+                pair = tuple(sorted([rem_a[0][0], rem_b[0][0]]))
+                combos = [frozenset([pair]) if pair_is_valid(pair) else frozenset()]
             else:
-                new_dir_a_len = [line for line in dir_a if line != line_a_len]
-                new_dir_b_len = [line for line in dir_b if line != line_b_len]
-                new_dir_a_tc = [line for line in dir_a if line != line_a_tc]
-                new_dir_b_tc = [line for line in dir_b if line != line_b_tc]
-
-                return [(pair_len, self._RecursivePair(new_dir_a_len, new_dir_b_len)),
-                        (pair_tc, self._RecursivePair(new_dir_a_tc, new_dir_b_tc))]
-
-    def _ParseRecPair(self, recpair, rl):
-        # parses the result of running the recursive pair function into a list of different pairing combinations
-        if len(recpair) == 1 and recpair[0][1] == []:
-            # base case: if the list only has one tuple and the tuple has no further stems, return the tuple's node
-            return [rl + [recpair[0][0]]]
-        else:
-            r = []
-            for tup in recpair:  # for each tuple in the list
-                r += self._ParseRecPair(tup[1], rl + [tup[0]])
-            return r
+                combos = []
+                seen = set()
+                for pair, line_a, line_b in self._NextPairs(rem_a, rem_b):
+                    head = frozenset([pair]) if pair_is_valid(pair) else frozenset()
+                    new_a = [line for line in rem_a if line[0] != line_a[0]]
+                    new_b = [line for line in rem_b if line[0] != line_b[0]]
+                    for tail in search(new_a, new_b):
+                        combo = head | tail
+                        if combo not in seen:
+                            seen.add(combo)
+                            combos.append(combo)
+            memo[key] = combos
+            return combos
+
+        return search(dir_a, dir_b)
+
+    def _LastPairCombo(self, dir_a, dir_b):
+        # returns the last pairing combo of a full depth-first expansion, i.e. the one following the trip-count-first
+        # branch whenever the two orderings disagree
+        combo = []
+        while not (len(dir_a) == 1 and len(dir_b) == 1):
+            pair, line_a, line_b = self._NextPairs(dir_a, dir_b)[-1]
+            combo.append(list(pair))
+            dir_a = [line for line in dir_a if line[0] != line_a[0]]
+            dir_b = [line for line in dir_b if line[0] != line_b[0]]
+        combo.append(sorted([dir_a[0][0], dir_b[0][0]]))
+        return combo
 
     def _GetDirPairs(self, route):
 
@@ -928,30 +1034,32 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         if len(lines_a) != len(lines_b):
             return []
 
-        pair_combos = self._ParseRecPair(self._RecursivePair(lines_a, lines_b), [])
+        # validity, geo and similarity scores only depend on the two lines of a pair, so compute each once
+        route_index = dict((rline[0], rline) for rline in route)
+        pair_valid = {}
+        pair_geo = {}
+        pair_sim = {}
 
-        # filter pairing combos: remove the invalid pairs from each combo
-        pair_combos_fltr = []
-        for combo in pair_combos:
-            combo_fltr = []
-            for pair in combo:
-                if self._CheckPairValidity(route, pair):
-                    combo_fltr.append(pair)
-            pair_combos_fltr.append(combo_fltr)
+        def pair_is_valid(pair):
+            if pair not in pair_valid:
+                pair_valid[pair] = self._CheckPairValidity(route_index, pair)
+            return pair_valid[pair]
 
-        # filter pairing combos: remove blank ones and duplicates
-        pair_combos_fltr_unique = []
-        for combo in pair_combos_fltr:
-            if not combo == []:
-                combo = sorted(combo, key=lambda x: x[0])
-                if combo not in pair_combos_fltr_unique:
-                    pair_combos_fltr_unique.append(combo)
+        def combo_score(scores, evaluator, combo):
+            total = 0
+            for pair in combo:
+                pair = tuple(pair)
+                if pair not in scores:
+                    scores[pair] = evaluator(route_index, [pair])
+                total += scores[pair]
+            return total
 
-        pair_combos_fltr = list(pair_combos_fltr_unique)
-        del pair_combos_fltr_unique
+        # filter pairing combos: remove the invalid pairs from each combo, then remove blank ones and duplicates
+        pair_combos_fltr = [sorted([list(pair) for pair in combo], key=lambda x: x[0])
+                            for combo in self._SearchPairCombos(lines_a, lines_b, pair_is_valid) if combo]
 
         if pair_combos_fltr == []:
-            pair_combos_fltr = list(self._NoValidCombo(route, pair_combos))
+            pair_combos_fltr = list(self._NoValidCombo(route_index, [self._LastPairCombo(lines_a, lines_b)]))
 
         # filter pairing combos: if the resulting combos have unequal lengths ...
         # ... remove the ones whose lengths are not half of the final length count
@@ -970,7 +1078,7 @@ class EstimateTransitOperatingCosts(_m.Tool()):
 
         pair_combos_geo = []
         for combo in pair_combos_fltr:
-            pair_combos_geo.append(combo + [self._EvalGeo(route, combo)])
+            pair_combos_geo.append(combo + [combo_score(pair_geo, self._EvalGeo, combo)])
 
         min_geo_score = min(pair_combos_geo, key=lambda x: x[-1])[-1]
         # print(min_geo_score)
@@ -982,7 +1090,7 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         else:
             pair_combos_sim = []
             for combo in pair_combos_fltr:
-                pair_combos_sim.append(combo + [self._EvalSim(route, combo)])
+                pair_combos_sim.append(combo + [combo_score(pair_sim, self._EvalSim, combo)])
             min_sim_score = min(pair_combos_sim, key=lambda x: x[-1])[-1]
             # print(min_sim_score)
             min_sim_combos = [combo[:-1] for combo in pair_combos_sim if combo[-1] == min_sim_score]
@@ -996,8 +1104,8 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         # takes a combo of pairs and looks at how closely the lines in each pair match, in terms of hdwy, len, tc
         mismatch_count = 0
         for p in pairing_combo:
-            l1 = next(line for line in route if line[0] == p[0])
-            l2 = next(line for line in route if line[0] == p[1])
+            l1 = self._FindLine(route, p[0])
+            l2 = self._FindLine(route, p[1])
             if abs(float(l1[self.idx_hdwy_new]) - float(l2[self.idx_hdwy_new])) > self.hdwy_diff_th:
                 mismatch_count += 1
             elif abs(float(l1[self.idx_len]) - float(l2[self.idx_len])) > self.len_diff_th:
@@ -1020,8 +1128,8 @@ class EstimateTransitOperatingCosts(_m.Tool()):
         cur_best_pair_tc = 0
         for combo in pair_combos_og:
             for pair in combo:
-                l1 = next(line for line in route if line[0] == pair[0])
-                l2 = next(line for line in route if line[0] == pair[1])
+                l1 = self._FindLine(route, pair[0])
+                l2 = self._FindLine(route, pair[1])
                 if (float(l1[self.idx_tc]) + float(l2[self.idx_tc])) > cur_best_pair_tc:
                     cur_best_pair = pair
         return [[cur_best_pair]]
@@ -1049,3 +1157,73 @@ class EstimateTransitOperatingCosts(_m.Tool()):
             return route
         return r
 
+
+#######################################################################################################
+
+
+class ServiceTable(object):
+    """
+    Typed, columnar representation of a Service Table file (emme_id, trip_depart, trip_arrive). Times are stored
+    as seconds since midnight of the service day, so trips after midnight (e.g. 25:10:00) are kept as such.
+
+    Rows which cannot be parsed are not rejected immediately; they only raise an error once their line is used,
+    which matches how the tool validates trips.
+    """
+
+    def __init__(self, file, format_time):
+        line_index = {}
+        rows_line = []
+        depart = []
+        arrive = []
+        errors = {}
+
+        with open(file) as reader:
+            reader.readline()  # skip the header
+            for row_number, l in enumerate(reader):
+                cells = l.strip().split(',')
+                rows_line.append(line_index.setdefault(cells[0], len(line_index)))
+                try:
+                    if len(cells) != 3:
+                        raise Exception("Not all rows of Service Table have three columns.")
+                    depart.append(self._ParseTime(format_time(cells[1])))
+                    arrive.append(self._ParseTime(format_time(cells[2])))
+                except Exception as e:
+                    errors[row_number] = e
+                    depart.append(0)
+                    arrive.append(0)
+
+        self.line_ids = sorted(line_index, key=line_index.get)
+        self._line_index = line_index
+        self.line_index = _np.array(rows_line, dtype=_np.int64)
+        self.depart = _np.array(depart, dtype=_np.int64)
+        self.arrive = _np.array(arrive, dtype=_np.int64)
+        self.depart_hour = self.depart // 3600
+        self.valid = _np.ones(len(self.depart), dtype=bool)
+        self._errors = {}
+        for row_number, e in six.iteritems(errors):
+            self.valid[row_number] = False
+            self._errors.setdefault(self.line_index[row_number], e)
+
+    @staticmethod
+    def _ParseTime(t):
+        return int(t[0:2]) * 3600 + int(t[3:5]) * 60 + int(t[6:8])
+
+    @staticmethod
+    def time_diff(start, end):
+        # time gap in minutes between two arrays of times, wrapping around midnight
+        return ((end - start) % 86400) / 60.00
+
+    def line_position(self, line_id):
+        return self._line_index.get(line_id)
+
+    def check_line_rows(self, line_position):
+        # raises the parsing error of the first unreadable row belonging to the line, if any
+        if line_position in self._errors:
+            raise self._errors[line_position]
+
+    def valid_trips(self, period_start, period_end):
+        # row numbers (in file order) of the readable trips starting within the time period
+        start = self.depart - _np.where(self.depart_hour > 23, 86400, 0)
+        period_start = period_start.hour * 3600 + period_start.minute * 60 + period_start.second
+        period_end = period_end.hour * 3600 + period_end.minute * 60 + period_end.second
+        return _np.flatnonzero(self.valid & (start >= period_start) & (start <= period_end))
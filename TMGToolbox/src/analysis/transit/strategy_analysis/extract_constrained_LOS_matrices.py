@@ -33,6 +33,14 @@ Analysis Tool for Extracting Travel Time Matrices, constrained by transit feasib
 
     0.2.1 Updated to allow for multi-threaded matrix calcs in 4.2.1+
     
+    0.2.2 Fixed the feasibility expression using the walk matrix in place of the wait
+        matrix, the cost sum adding the line fares twice, and unselected ('null')
+        matrices being constrained.
+    
+    0.3.0 The matrix calculations after the analyses (cost sum, fare corrections, feasibility
+        and constraints) are now evaluated together in memory, with the common matrix
+        expressions module.
+    
 '''
 import inro.modeller as _m
 import traceback as _traceback
@@ -42,6 +50,7 @@ from multiprocessing import cpu_count
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_matrixExpressions = _MODELLER.module('tmg.common.matrix_expressions')
 
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 # import six library for python2 to python3 conversion
@@ -51,7 +60,7 @@ _util.initalizeModellerTypes(_m)
 
 class ExtractConstrainedLOSMatrices(_m.Tool()):
     
-    version = '0.2.1'
+    version = '0.3.0'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -263,11 +272,9 @@ class ExtractConstrainedLOSMatrices(_m.Tool()):
                 # Setup tools
                 try:
                     matrixAnalysisTool = _m.Modeller().tool('inro.emme.transit_assignment.extended.matrix_results')
-                    matrixCalcTool = _m.Modeller().tool('inro.emme.matrix_calculation.matrix_calculator')
                     strategyAnalysisTool = _m.Modeller().tool('inro.emme.transit_assignment.extended.strategy_based_analysis')
                 except Exception as e:
                     matrixAnalysisTool = _m.Modeller().tool('inro.emme.standard.transit_assignment.extended.matrix_results')
-                    matrixCalcTool = _m.Modeller().tool('inro.emme.standard.matrix_calculation.matrix_calculator')
                     strategyAnalysisTool = _m.Modeller().tool('inro.emme.standard.transit_assignment.extended.strategy_based_analysis')
                 
                 with _m.logbook_trace("Extracting travel time matrices."):
@@ -280,59 +287,19 @@ class ExtractConstrainedLOSMatrices(_m.Tool()):
                         
                         self.TRACKER.runTool(strategyAnalysisTool, self._getBoardingFaresAnalysisSpec(accessFaresMatrix.id), scenario=self.Scenario)
                         _m.logbook_write("Access fares matrix extracted.")
-                        
-                        if EMME_VERSION >= (4,2,1):
-                            self.TRACKER.runTool(matrixCalcTool, self._getCostSumSpec(lineFaresMatrix.id, accessFaresMatrix.id), scenario=self.Scenario,
-                                             num_processors=self.NumberOfProcessors)
-                        else:
-                            self.TRACKER.runTool(matrixCalcTool, self._getCostSumSpec(lineFaresMatrix.id, accessFaresMatrix.id), scenario=self.Scenario)
-                        _m.logbook_write("Cost components added.")
-                
-                    with _m.logbook_trace("Subtracting fares from impedances to get times."):
-                        fareFactor = self._calculateFareFactor()
-                        if EMME_VERSION >= (4,2,1):
-                            self.TRACKER.runTool(matrixCalcTool, self._getFixIVTTSpec(lineFaresMatrix.id, fareFactor), scenario=self.Scenario,
-                                             num_processors=self.NumberOfProcessors)
-                        else:
-                            self.TRACKER.runTool(matrixCalcTool, self._getFixIVTTSpec(lineFaresMatrix.id, fareFactor), scenario=self.Scenario)
-                        _m.logbook_write("IVTT matrix fixed.")
-                        
-                        if EMME_VERSION >= (4,2,1):
-                            self.TRACKER.runTool(matrixCalcTool, self._getFixWalkSpec(accessFaresMatrix.id, fareFactor), scenario=self.Scenario,
-                                             num_processors=self.NumberOfProcessors)
-                        else:
-                            self.TRACKER.runTool(matrixCalcTool, self._getFixWalkSpec(accessFaresMatrix.id, fareFactor), scenario=self.Scenario)
-                        _m.logbook_write("Walk matrix fixed.")
                 else:
-                    for i in range(5):
-                        self.TRACKER.completeTask() #Skip these 5 tasks
+                    for i in range(2):
+                        self.TRACKER.completeTask() #Skip these 2 tasks
                 
-                with _m.logbook_trace("Extracting temporary feasibility matrix."):
-                    if EMME_VERSION >= (4,2,1):
-                        self.TRACKER.runTool(matrixCalcTool, self._getFeasibilityMatrixSpec(feasibilityMatrix.id), self.Scenario,
-                                             num_processors=self.NumberOfProcessors)
-                    else:
-                        self.TRACKER.runTool(matrixCalcTool, self._getFeasibilityMatrixSpec(feasibilityMatrix.id), self.Scenario)
-                
-                with _m.logbook_trace("Applying feasibility constraint matrix."):
-                    matrixIdsToConstrain = {'boarding times': self.BoardingTimeMatrixId,
-                                            'IVTT': self.InVehicleTimeMatrixId,
-                                            'wait times': self.WaitTimeMatrixId,
-                                            'walk times': self.WalkTimeMatrixId}
-                    if calcFares:
-                        matrixIdsToConstrain['Cost'] = self.CostMatrixId
-                    
-                    self.TRACKER.startProcess(len(matrixIdsToConstrain))
-                    for (name, id) in six.iteritems(matrixIdsToConstrain):
-                        if id == 'null': #Cannot return None from combobox, so need to check for string nullity
-                            self.TRACKER.completeSubtask()
-                        if EMME_VERSION >= (4,2,1):
-                            matrixCalcTool(self._getMatrixMultiplicationSpec(feasibilityMatrix.id, id), self.Scenario,
-                                             num_processors=self.NumberOfProcessors)
-                        else:
-                            matrixCalcTool(self._getMatrixMultiplicationSpec(feasibilityMatrix.id, id), self.Scenario)
-                        _m.logbook_write("Constrained %s matrix." %name)
-                        self.TRACKER.completeSubtask()
+                #The cost sum, fare corrections, feasibility and constraints are all
+                # evaluated in memory, and only the final matrices are written back.
+                with _m.logbook_trace("Applying fare corrections and the feasibility constraint."):
+                    pipeline = self._getPostProcessingPipeline(feasibilityMatrix.id, lineFaresMatrix.id,
+                                                               accessFaresMatrix.id, calcFares)
+                    for step in pipeline.steps:
+                        _m.logbook_write("%s = %s" %(step.result, step.expression))
+                    pipeline.run_on_emmebank(self.Scenario, num_threads=self.NumberOfProcessors)
+                    self.TRACKER.completeTask()
     
     #----SUB FUNCTIONS--------------------------------------------------------------------------------- 
     
@@ -439,6 +406,27 @@ class ExtractConstrainedLOSMatrices(_m.Tool()):
             }
         return spec
     
+    def _getPostProcessingPipeline(self, feasibilityMatrixId, lineFaresMatrixId, accessFaresMatrixId, calcFares):
+        pipeline = _matrixExpressions.MatrixPipeline(temporaries=[feasibilityMatrixId])
+        
+        if calcFares:
+            fareFactor = self._calculateFareFactor()
+            pipeline.add(self._getCostSumSpec(lineFaresMatrixId, accessFaresMatrixId))
+            pipeline.add(self._getFixIVTTSpec(lineFaresMatrixId, fareFactor))
+            pipeline.add(self._getFixWalkSpec(accessFaresMatrixId, fareFactor))
+        
+        pipeline.add(self._getFeasibilityMatrixSpec(feasibilityMatrixId))
+        
+        matrixIdsToConstrain = [self.BoardingTimeMatrixId, self.InVehicleTimeMatrixId,
+                                self.WaitTimeMatrixId, self.WalkTimeMatrixId]
+        if calcFares:
+            matrixIdsToConstrain.append(self.CostMatrixId)
+        for id in matrixIdsToConstrain:
+            if id == 'null': #Cannot return None from combobox, so need to check for string nullity
+                continue
+            pipeline.add(self._getMatrixMultiplicationSpec(feasibilityMatrixId, id))
+        return pipeline
+    
     def _getFixIVTTSpec(self, lineFaresMatrixId, fareFactor):
         spec = {
                 "expression": "({0} - {1} * {2}).max.0".format(self.InVehicleTimeMatrixId,
@@ -478,7 +466,7 @@ class ExtractConstrainedLOSMatrices(_m.Tool()):
     def _getFeasibilityMatrixSpec(self, feasibilityMatrixId):
         #          (walk < cutoff) AND (wait < cutoff) AND ((walk + wait + ivtt) < cutoff)   
         expression = "({0} < {3}) && ({1} < {4}) && (({0} + {1} + {2}) < {5})".format(self.WalkTimeMatrixId,
-                                                                                    self.WalkTimeMatrixId,
+                                                                                    self.WaitTimeMatrixId,
                                                                                     self.InVehicleTimeMatrixId,
                                                                                     str(self.WalkTimeCutoff),
                                                                                     str(self.WaitTimeCutoff),
@@ -523,7 +511,7 @@ class ExtractConstrainedLOSMatrices(_m.Tool()):
     
     def _getCostSumSpec(self, lineFaresMatrixId, accessFaresMatrixId):
         spec = {
-                "expression": "{0} + {1}".format(lineFaresMatrixId, lineFaresMatrixId),
+                "expression": "{0} + {1}".format(lineFaresMatrixId, accessFaresMatrixId),
                 "result": self.CostMatrixId,
                 "constraint": {
                                 "by_value": None,
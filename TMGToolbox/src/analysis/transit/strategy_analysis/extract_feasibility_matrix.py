@@ -28,6 +28,7 @@ import traceback as _traceback
 from multiprocessing import cpu_count
 _util = _m.Modeller().module('tmg.common.utilities')
 _tmgTPB = _m.Modeller().module('tmg.common.TMG_tool_page_builder')
+_matrixExpressions = _m.Modeller().module('tmg.common.matrix_expressions')
 
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 # import six library for python2 to python3 conversion
@@ -37,7 +38,7 @@ _util.initalizeModellerTypes(_m)
 
 class ExtractFeasibilityMatrix(_m.Tool()):
     
-    version = '0.1.1'
+    version = '0.2.0'
     tool_run_msg = ""
     
     #---Variable definitions
@@ -64,10 +65,8 @@ class ExtractFeasibilityMatrix(_m.Tool()):
 
         try:
             self.matrixResultTool = _m.Modeller().tool('inro.emme.standard.transit_assignment.extended.matrix_results')
-            self.matrixCalcTool = _m.Modeller().tool('inro.emme.standard.matrix_calculation.matrix_calculator')
         except Exception as e:
             self.matrixResultTool = _m.Modeller().tool('inro.emme.transit_assignment.extended.matrix_results')
-            self.matrixCalcTool = _m.Modeller().tool('inro.emme.matrix_calculation.matrix_calculator')
     
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="Extract Feasibility Matrix",
@@ -182,22 +181,18 @@ class ExtractFeasibilityMatrix(_m.Tool()):
             self._assignmentCheck()
             
             #---1 Initialize temporary matrices for storing walk, wait, and in-vehicle times
-            with nested(_util.tempMatrixMANAGER(description='Temp walk time matrix'),
-                        _util.tempMatrixMANAGER(description='Temp wait time matrix'),
-                        _util.tempMatrixMANAGER(description='Temp ivtt matrix'))\
-                    as (self.walkMatrix, self.waitMatrix, self.ivttMatrix):
+            with _util.tempMatrixMANAGER(description='Temp walk time matrix') as self.walkMatrix,\
+                    _util.tempMatrixMANAGER(description='Temp wait time matrix') as self.waitMatrix,\
+                    _util.tempMatrixMANAGER(description='Temp ivtt matrix') as self.ivttMatrix:
             
                 #---2 Compute the temporary matrices
                 _m.logbook_write("Computing temporary matrices")
                 self.matrixResultTool(self._getStrategyAnalysisSpec())
                 
-                #---3 Compute the final results matrix
+                #---3 Compute the final results matrix in memory
                 _m.logbook_write("Computing feasibility matrix")
-                if EMME_VERSION >= (4,2,1):
-                    self.matrixCalcTool(self._getMatrixCalcSpec(), self.scenario,
-                                             num_processors=self.NumberOfProcessors)  
-                else: 
-                    self.matrixCalcTool(self._getMatrixCalcSpec(), self.scenario)         
+                pipeline = _matrixExpressions.MatrixPipeline([self._getMatrixCalcSpec()])
+                pipeline.run_on_emmebank(self.scenario, num_threads=self.NumberOfProcessors)
     
     def _assignmentCheck(self):
         if self.scenario.transit_assignment_type != 'EXTENDED_TRANSIT_ASSIGNMENT':
@@ -35,6 +35,9 @@ Extract Link Transfers
 '''
 	0.0.1 Created on 2016-02-16 by Matt Austin: Initial build
 	0.0.2 Created on 2016-05-09 by Matt Austin: Added ability to restrict to a set of lines on each link
+	0.1.0 Batched link pairs: the network is loaded once, hypernetwork twins are found with a
+		shape index, markers are written and volumes read as attribute arrays, and line filters
+		are evaluated locally.
 '''
 
 import inro.modeller as _m
@@ -44,6 +47,7 @@ from re import split as _regex_split
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _spindex = _MODELLER.module('tmg.common.spatial_index')
+_selection = _MODELLER.module('tmg.common.selection_expressions')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 networkCalcTool = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
 pathAnalysis = _m.Modeller().tool("inro.emme.transit_assignment.extended.path_based_analysis")
@@ -58,7 +62,7 @@ _util.initalizeModellerTypes(_m)
 
 class ExtractLinkTransfers(_m.Tool()):
 	
-	version = '0.0.2'
+	version = '0.1.0'
 	tool_run_msg = ""
 	number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
 	
@@ -218,54 +222,58 @@ class ExtractLinkTransfers(_m.Tool()):
 			else:
 				demandMatrixId = self.DemandMatrix.id			 
 			
-			for linkPair in linkLists:
-				fullLinkSet = linkPair[0:3]
-				link1List = [linkPair[1]] # maintain a list of links at and above link 1 for volume summing later (sums at/above link 1 and 2 will be identical)
-				if self.HypernetworkFlag: # search for links 'above' the initial link pair in the hypernetwork
-					print("Looking for links in the hypernetwork")
-					network = self.BaseScenario.get_network()					 
-					initialLink1 = self._ParseIndividualLink(linkPair[1])
-					initialLink2 = self._ParseIndividualLink(linkPair[2])
-					inode1 = initialLink1[0]
-					inode2 = initialLink2[0]
-					jnode1 = initialLink1[1]
-					jnode2 = initialLink2[1]
-					for link in network.links():
-						if link.shape == network.link(inode1, jnode1).shape:
-							linkString = self._LinkToString(link)
+			with _util.tempExtraAttributeMANAGER(self.BaseScenario, 'LINK', description= 'Link Flag') as linkMarkerAtt, _util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_LINE', description= 'Line Flag') as lineMarkerAtt, _util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_SEGMENT', description= 'Transit Volumes') as segVol:
+				
+				#The network is loaded once. Link and line markers are set on it and copied to the
+				#scenario in one array write per pair, and volumes are read back in one array read
+				network = self.BaseScenario.get_network()
+				print('Network loaded')
+				selector = _selection.NetworkSelector(network)
+				if self.HypernetworkFlag:
+					shapeIndex = self._BuildShapeIndex(network)
+				
+				markedLinks = []
+				markedLines = []
+				for linkPair in linkLists:
+					fullLinkSet = linkPair[0:3]
+					link1List = [linkPair[1]] # maintain a list of links at and above link 1 for volume summing later (sums at/above link 1 and 2 will be identical)
+					if self.HypernetworkFlag: # add links 'above' the initial link pair in the hypernetwork
+						for linkString in self._GetTwinLinks(network, shapeIndex, linkPair[1]):
 							if linkString not in fullLinkSet:
 								fullLinkSet.append(linkString)
 								link1List.append(linkString)
-						if link.shape == network.link(inode2, jnode2).shape:
-							linkString = self._LinkToString(link)
+						for linkString in self._GetTwinLinks(network, shapeIndex, linkPair[2]):
 							if linkString not in fullLinkSet:
 								fullLinkSet.append(linkString)
-
-				with _util.tempExtraAttributeMANAGER(self.BaseScenario, 'LINK', description= 'Link Flag') as linkMarkerAtt, _util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_LINE', description= 'Line Flag') as lineMarkerAtt, _util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_SEGMENT', description= 'Transit Volumes') as segVol:
 					
-					networkCalcTool(self._MarkLinks(fullLinkSet, linkMarkerAtt.id), scenario=self.BaseScenario)
+					markedLinks = self._SetMarkers(network, 'LINK', linkMarkerAtt.id, markedLinks,
+												   [self._GetLink(network, link) for link in fullLinkSet[1:]], 10)
 					print ('Finished marking links for %s' %fullLinkSet[0])
 					if len(linkPair) == 5: #check if there are line filters
-						networkCalcTool(self._MarkLines(linkPair[3], lineMarkerAtt.id), scenario=self.BaseScenario)
-						networkCalcTool(self._MarkLines(linkPair[4], lineMarkerAtt.id), scenario=self.BaseScenario)
+						try:
+							lineMask = selector.line_mask(linkPair[3]) | selector.line_mask(linkPair[4])
+							markedLines = self._SetMarkers(network, 'TRANSIT_LINE', lineMarkerAtt.id, markedLines,
+														   [network.transit_line(id) for id in selector.line_ids[lineMask]], 1)
+						except _selection.SelectionSyntaxError:
+							#Filters which cannot be evaluated locally are run through the Network Calculator
+							markedLines = self._SetMarkers(network, 'TRANSIT_LINE', lineMarkerAtt.id, markedLines, [], 1)
+							networkCalcTool(self._MarkLines(linkPair[3], lineMarkerAtt.id), scenario=self.BaseScenario)
+							networkCalcTool(self._MarkLines(linkPair[4], lineMarkerAtt.id), scenario=self.BaseScenario)
 						pathAnalysis(self._PathVolumeWithLines(linkMarkerAtt.id, segVol.id, demandMatrixId, lineMarkerAtt.id), scenario=self.BaseScenario)  
-						print ('Finished running path analysis for %s' %fullLinkSet[0])						
 					else:
 						pathAnalysis(self._PathVolume(linkMarkerAtt.id, segVol.id, demandMatrixId), scenario=self.BaseScenario)	 
-						print ('Finished running path analysis for %s' %fullLinkSet[0])
-											
-					network = self.BaseScenario.get_network()
-					print('Network loaded')
+					print ('Finished running path analysis for %s' %fullLinkSet[0])
+					
+					network.set_attribute_values('TRANSIT_SEGMENT', [segVol.id],
+												 self.BaseScenario.get_attribute_values('TRANSIT_SEGMENT', [segVol.id]))
 					linkSum = 0
 					for link in link1List: #evaluate all links at/above link 1
-						singleLinkList = self._ParseIndividualLink(link)
-						for s in network.link(singleLinkList[0], singleLinkList[1]).segments(): #iterate through segments on the link
+						for s in self._GetLink(network, link).segments(): #iterate through segments on the link
 							linkSum += s[segVol.id]
 					linkSum /= self.PeakHourFactor
 					results.append([fullLinkSet[0],linkSum]) #add label and sum
 					print('Results calculated for %s' %fullLinkSet[0])
 
-
 			self._WriteResultsToFile(results)
 
 			self.TRACKER.completeTask()
@@ -307,7 +315,7 @@ class ExtractLinkTransfers(_m.Tool()):
 		if len(indLinkList) != 2:
 			print(linkString)
 			msg = "Error parsing link. Link must be in the form 1000,1001"
-			msg += ". [%s]" %component 
+			msg += ". [%s]" %linkString 
 			raise SyntaxError(msg)
 		return indLinkList
 
@@ -316,34 +324,31 @@ class ExtractLinkTransfers(_m.Tool()):
 		return linkStr
 
 	
-	def _MarkLinks(self, linkList, markerId):
-		linkString = ""
-		count = 0
-		for item in linkList:
-			if count == 0:
-				count += 1
-				continue
-			elif count == 1:
-				count += 1
-				linkString += "link="
-				linkString += item
-			else:
-				count += 1
-				linkString += " or link="
-				linkString += item
-	
-		
-		spec = {
-					"result": markerId,
-					"expression": '10', #to avoid the situation where an extra line use replaces a link use, we use a larger value for links
-					"aggregation": None,
-					"selections": {
-						"link": linkString
-					},
-					"type": "NETWORK_CALCULATION"
-				}
-		return spec
-		
+	def _GetLink(self, network, linkString):
+		inode, jnode = self._ParseIndividualLink(linkString)
+		link = network.link(inode.strip(), jnode.strip())
+		if link is None:
+			raise Exception("Link %s does not exist" %linkString)
+		return link
+
+	def _BuildShapeIndex(self, network): #maps each link shape to the links sharing it, to find hypernetwork twins
+		shapeIndex = {}
+		for link in network.links():
+			shapeIndex.setdefault(tuple(link.shape), []).append(self._LinkToString(link))
+		return shapeIndex
+
+	def _GetTwinLinks(self, network, shapeIndex, linkString):
+		return shapeIndex.get(tuple(self._GetLink(network, linkString).shape), [])
+
+	def _SetMarkers(self, network, domain, markerId, previousElements, elements, value):
+		#Clears the previous markers, sets the new ones, and writes the attribute to the scenario
+		for element in previousElements:
+			element[markerId] = 0
+		for element in elements:
+			element[markerId] = value
+		self.BaseScenario.set_attribute_values(domain, [markerId], network.get_attribute_values(domain, [markerId]))
+		return elements
+
 	def _MarkLines(self, lineString, markerId):
 		spec = {
 					"result": markerId,
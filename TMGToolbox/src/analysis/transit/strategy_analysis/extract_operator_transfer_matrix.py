@@ -42,6 +42,10 @@ Extract Operator Transfer Matrix
     
     1.1.2 Updated to allow for multi-threaded matrix calcs in 4.2.1+
     
+    1.2.0 Traversal results are now parsed in chunks straight into NumPy arrays (with support
+        for gzipped files), and the files of multiple classes are parsed in worker processes
+        when running outside of Modeller.
+    
 '''
 
 import inro.modeller as _m
@@ -53,7 +57,14 @@ from json import loads as _parsedict
 from os.path import dirname
 import tempfile as _tf
 import shutil as _shutil
+import gzip as _gzip
+import os as _os
+import sys as _sys
+from itertools import islice as _islice
+import multiprocessing as _multiprocessing
 from multiprocessing import cpu_count
+import numpy as _np
+import pickle as _pickle
 
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
@@ -88,6 +99,122 @@ def getTemporaryFolder():
     finally:
         _shutil.rmtree(folder)
 
+TRAVERSAL_CHUNK_LINES = 200000 # Number of lines of a traversal file parsed at once
+
+def _openTraversalFile(filepath):
+    if filepath.endswith('.gz'):
+        if six.PY2:
+            return _gzip.open(filepath, 'rb')
+        return _gzip.open(filepath, 'rt')
+    return open(filepath)
+
+def parseTraversalFile(filepath, sparse= False, chunkLines= TRAVERSAL_CHUNK_LINES):
+    '''
+    Parses an Emme traversal analysis file (optionally gzipped) of 'origin destination value'
+    records, reading at most chunkLines lines at a time. Values of repeated pairs are summed.
+    
+    Args:
+        - filepath: The path to the traversal file. Files ending in '.gz' are decompressed.
+        - sparse (=False): Flag to return the results as coordinate arrays instead of a
+            dense matrix. Use for files with many distinct gate values (e.g. zones).
+        - chunkLines (=TRAVERSAL_CHUNK_LINES): The maximum number of lines held in memory.
+    
+    Returns: If sparse is False, a tuple of (labels, matrix), where labels is a sorted array
+        of every gate value found, and matrix is a dense (labels x labels) array. If sparse is
+        True, a tuple of (origins, destinations, values) arrays, sorted by origin and destination.
+    '''
+    keys = []
+    values = []
+    with _openTraversalFile(filepath) as reader:
+        line = ""
+        while not line.startswith("a"):
+            line = reader.readline()
+            if not line: break
+        while True:
+            lines = list(_islice(reader, chunkLines))
+            if not lines: break
+            cells = []
+            for line in lines:
+                lineCells = line.split()
+                if len(lineCells) == 3: cells.extend(lineCells)
+            if not cells: continue
+            table = _np.array(cells, dtype= object).reshape(-1, 3)
+            try:
+                chunkValues = table[:, 2].astype(_np.float64)
+            except ValueError:
+                chunkValues = _np.array([cell.replace('u', '.') for cell in table[:, 2]], dtype= _np.float64)
+            chunkKeys = _np.column_stack((table[:, 0].astype(_np.int64), table[:, 1].astype(_np.int64)))
+            
+            #Collapse each chunk down to its distinct pairs, to keep memory bounded
+            chunkKeys, inverse = _np.unique(chunkKeys, axis= 0, return_inverse= True)
+            keys.append(chunkKeys)
+            values.append(_np.bincount(inverse.ravel(), weights= chunkValues, minlength= len(chunkKeys)))
+            if len(keys) > 8:
+                keys, values = _collapseTraversalChunks(keys, values)
+    
+    if keys:
+        keys, values = _collapseTraversalChunks(keys, values)
+        keys, values = keys[0], values[0]
+    else:
+        keys, values = _np.zeros((0, 2), dtype= _np.int64), _np.zeros(0)
+    
+    if sparse:
+        return keys[:, 0], keys[:, 1], values
+    
+    labels = _np.unique(keys)
+    matrix = _np.zeros((len(labels), len(labels)))
+    matrix[_np.searchsorted(labels, keys[:, 0]), _np.searchsorted(labels, keys[:, 1])] = values
+    return labels, matrix
+
+def _collapseTraversalChunks(keys, values):
+    keys, inverse = _np.unique(_np.concatenate(keys), axis= 0, return_inverse= True)
+    values = _np.bincount(inverse.ravel(), weights= _np.concatenate(values), minlength= len(keys))
+    return [keys], [values]
+
+def _canUseWorkerProcesses():
+    #Inside Modeller, sys.executable is the Emme desktop application, which cannot host workers.
+    #Workers also need to be able to import this module by name.
+    if not _os.path.basename(_sys.executable).lower().startswith('python'):
+        return False
+    try:
+        _pickle.dumps(parseTraversalFile)
+    except Exception:
+        return False
+    return True
+
+def parseTraversalFiles(filepaths, processes= None):
+    '''
+    Parses several traversal files (see parseTraversalFile), in worker processes if possible.
+    
+    Returns: A list of (labels, matrix) tuples, in the same order as filepaths.
+    '''
+    if processes is None: processes = cpu_count()
+    processes = min(processes, len(filepaths))
+    if processes > 1 and _canUseWorkerProcesses():
+        try:
+            pool = _multiprocessing.Pool(processes)
+            try:
+                return pool.map(parseTraversalFile, filepaths)
+            finally:
+                pool.close()
+                pool.join()
+        except Exception as e:
+            print("Could not parse traversal files in parallel (%s), parsing them one at a time" %e)
+    return [parseTraversalFile(filepath) for filepath in filepaths]
+
+def combineTraversalMatrices(matrices, weights):
+    '''
+    Sums weighted (labels, matrix) tuples over the union of their labels.
+    
+    Returns: A tuple of (labels, matrix).
+    '''
+    labels = _np.unique(_np.concatenate([l for l, m in matrices] + [_np.zeros(0, dtype= _np.int64)]))
+    combined = _np.zeros((len(labels), len(labels)))
+    for (classLabels, matrix), weight in zip(matrices, weights):
+        positions = _np.searchsorted(labels, classLabels)
+        combined[_np.ix_(positions, positions)] += weight * matrix
+    return labels, combined
+
 LINE_GROUPS_ALPHA_OP = [(1, "line=B_____", "Brampton"),
                             (2, "line=HB____", "Burlington"),
                                (3, "line=D_____", "Durham"),
@@ -156,7 +283,7 @@ LINE_GROUPS_GTAMV4_PREM = [(1, "line=B_____", "Brampton"),
 
 class OperatorTransferMatrix(_m.Tool()):
     
-    version = '1.1.2'
+    version = '1.2.0'
     tool_run_msg = ""
     number_of_tasks = 8 # For progress reporting, enter the integer number of tasks here
     
@@ -693,20 +820,22 @@ class OperatorTransferMatrix(_m.Tool()):
         #---4. Load or load and combine traversal matrices
         self.TRACKER.startProcess(nTasks)
         if classWeights:
-            transferMatrix = {}
+            classMatrices = parseTraversalFiles([files[className] for className, weight in classWeights],
+                                                self.NumberOfProcessors)
+            labels, matrix = combineTraversalMatrices(classMatrices, [weight for className, weight in classWeights])
             for className, weight in classWeights:
-                filepath = files[className]
-                classMatrix = self._ParseTraversalResults(filepath)
-                for key, value in six.iteritems(classMatrix):
-                    weightedValue = weight * value
-                    if key in transferMatrix: transferMatrix[key] += weightedValue
-                    else: transferMatrix[key] = weightedValue
                 self.TRACKER.completeSubtask()
                 print("Loaded class %s" %className)
         else:
-            filepath = files
-            transferMatrix = self._ParseTraversalResults(filepath) 
+            labels, matrix = self._ParseTraversalResults(files)
         self.TRACKER.completeTask()
+        
+        #The group-to-group matrix is small, so convert it to the dictionary used by the rest of the tool
+        labels = [int(label) for label in labels]
+        transferMatrix = {}
+        for row, origin in enumerate(labels):
+            for column, destination in enumerate(labels):
+                transferMatrix[(origin, destination)] = float(matrix[row, column])
         print("Aggregated transfer matrix.")
         
         return transferMatrix
@@ -751,25 +880,7 @@ class OperatorTransferMatrix(_m.Tool()):
                                   scenario= self.Scenario)
             
     def _ParseTraversalResults(self, filepath):
-        retval = {}
-        
-        with open(filepath) as reader:
-            line = ""
-            while not line.startswith("a"):
-                line = reader.readline()
-            for line in reader:
-                cells = line.strip().split()
-                if len(cells) != 3: continue
-                o = int(cells[0])
-                d = int(cells[1])
-                try:
-                    val = float(cells[2])
-                except ValueError:
-                    val = cells[2].replace('u', '.')
-                    val = float(val)
-                od = (o,d)
-                retval[od] = val
-        return retval
+        return parseTraversalFile(filepath)
     
     def _GetBoardingsAndAlightings(self, transferMatrix, lineGroupAtributeID, boardingAttributeId,
                                    alightingAttributeId):
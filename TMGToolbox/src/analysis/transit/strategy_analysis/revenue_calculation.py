@@ -32,6 +32,9 @@ Volume per Operator
 #---VERSION HISTORY
 '''
     0.0.1 Created on 2015-05-04 by tnikolov
+    1.1.0 Line filters are now evaluated locally against segment arrays loaded once per
+        scenario, instead of calling the Network Calculator for each filter. Filters which
+        cannot be parsed locally still fall back to the Network Calculator.
 '''
 
 import inro.modeller as _m
@@ -46,6 +49,7 @@ from re import split as _regex_split
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_selection = _MODELLER.module('tmg.common.selection_expressions')
 networkCalculator = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
 traversalAnalysisTool = _MODELLER.tool('inro.emme.transit_assignment.extended.traversal_analysis')
 networkResultsTool = _MODELLER.tool('inro.emme.transit_assignment.extended.network_results')
@@ -96,7 +100,7 @@ class RevenueCalculation(_m.Tool()):
     scenario = _m.Attribute(_m.InstanceType) #_m.Attribute(str)
     LineFilter = _m.Attribute(str)
     ReportFile = _m.Attribute(str)
-    version = '1.0.0'
+    version = '1.1.0'
             
     def __init__(self):
         #---Init internal variables
@@ -207,18 +211,29 @@ class RevenueCalculation(_m.Tool()):
             self.Scenario = _MODELLER.emmebank.scenario(scenario.id)
             self.results[scenario.id] = {}
             
+            #Evaluate all filters against segment arrays loaded once per scenario
+            selector = _selection.NetworkSelector(self.Scenario)
+            revenues = selector.segment_values('voltr') * selector.segment_values('@sfare')
+            
             for filter in parsed_filter_list:
-                spec = {
-                    "expression": "voltr*@sfare",                    
-                    "selections": {
-                        "link": "all",
-                        "transit_line": filter[1]
-                        },
-                    "type": "NETWORK_CALCULATION"
-                }
-                report = networkCalculator(spec, scenario=self.Scenario)                               
-
-                self.results[scenario.id][filter[1]] =  report['sum']                     
+                try:
+                    mask = selector.segment_mask(line_expression= filter[1])
+                    self.results[scenario.id][filter[1]] = float(revenues[mask].sum())
+                except _selection.SelectionSyntaxError:
+                    self.results[scenario.id][filter[1]] = self._CalculateRevenue(filter[1])
+    
+    def _CalculateRevenue(self, lineFilter):
+        #Falls back to the Network Calculator for filters which can't be evaluated locally
+        spec = {
+            "expression": "voltr*@sfare",                    
+            "selections": {
+                "link": "all",
+                "transit_line": lineFilter
+                },
+            "type": "NETWORK_CALCULATION"
+        }
+        report = networkCalculator(spec, scenario=self.Scenario)
+        return report['sum']
       
     def _ParseFilterString(self, filterString):
         filterList = []
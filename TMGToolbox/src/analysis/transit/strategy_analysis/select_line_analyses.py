@@ -40,6 +40,10 @@ EXTRACT SELECT LINE COMPONENT MATRICES
     0.3.1 Fixed a bug in which unselected optional matrices caused a null reference exception.
 
     0.3.2 Updated to allow multi-threaded matrix calcs in 4.2.1+
+    
+    0.4.0 The matrix calculations (select-line cleanup, feasibility, fare corrections and
+        constraints) are now evaluated together in memory, with the common matrix
+        expressions module.
 '''
 
 import inro.modeller as _m
@@ -47,6 +51,7 @@ import traceback as _traceback
 from multiprocessing import cpu_count
 _util = _m.Modeller().module('tmg.common.utilities')
 _tmgTPB = _m.Modeller().module('tmg.common.TMG_tool_page_builder')
+_matrixExpressions = _m.Modeller().module('tmg.common.matrix_expressions')
 
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 
@@ -59,7 +64,7 @@ _util.initalizeModellerTypes(_m)
 
 class ExtractSelectLineTimesAndCosts(_m.Tool()):
     
-    version = '0.3.2'
+    version = '0.4.0'
     tool_run_msg = ""
     
     # Variables marked with a '#' are used in the main block, and are assigned by both run and call
@@ -251,15 +256,12 @@ class ExtractSelectLineTimesAndCosts(_m.Tool()):
             
             strategyAnalysisTool = None
             matrixAnalysisTool = None
-            matrixCalcTool = None
             try:
                 strategyAnalysisTool = _m.Modeller().tool('inro.emme.transit_assignment.extended.strategy_based_analysis')
                 matrixAnalysisTool = _m.Modeller().tool('inro.emme.transit_assignment.extended.matrix_results')
-                matrixCalcTool = _m.Modeller().tool('inro.emme.matrix_calculation.matrix_calculator')
             except Exception as e:
                 strategyAnalysisTool = _m.Modeller().tool('inro.emme.standard.transit_assignment.extended.strategy_based_analysis')
                 matrixAnalysisTool = _m.Modeller().tool('inro.emme.standard.transit_assignment.extended.matrix_results')
-                matrixCalcTool = _m.Modeller().tool('inro.emme.standard.matrix_calculation.matrix_calculator')
             
             #Create four temporary matrix managers
             with _util.tempMatrixMANAGER(description="Select-line matrix") as self._selectLineMatrix,\
@@ -269,23 +271,11 @@ class ExtractSelectLineTimesAndCosts(_m.Tool()):
                 
                 with _m.logbook_trace("Extracting select-line matrix:"):
                     strategyAnalysisTool(self._getSelectLineAnalysisSpec(), self.scenario)
-                    if EMME_VERSION >= (4,2,1):
-                        matrixCalcTool(self._getMatrixCleanupSpec(), self.scenario,
-                                             num_processors=self.NumberOfProcessors)
-                    else:
-                        matrixCalcTool(self._getMatrixCleanupSpec(), self.scenario)
                 
                 with _m.logbook_trace("Extracting travel component matrices:"):
                     matrixAnalysisTool(self._getTimeComponentAnalysisSpec(), self.scenario)
                     strategyAnalysisTool(self._getCostAnalysisSpec(), self.scenario)
                 
-                with _m.logbook_trace("Extracting temporary feasibility matrix:"):
-                    if EMME_VERSION >= (4,2,1):
-                        matrixCalcTool(self._getFeasibilityMatrixSpec(), self.scenario,
-                                             num_processors=self.NumberOfProcessors)
-                    else:
-                        matrixCalcTool(self._getFeasibilityMatrixSpec(), self.scenario)
-
                 #---Recover walk and in-vehicle times if a fare-based assignment has been run.
                 if self.FarePerception != 0:
                     with _m.logbook_trace("Extracting line-fares matrix:"):
@@ -293,40 +283,14 @@ class ExtractSelectLineTimesAndCosts(_m.Tool()):
                     
                     with _m.logbook_trace("Extracting access-fare matrix:"):
                         strategyAnalysisTool(self._getBoardingFaresAnalysisSpec(), scenario=self.scenario)
-                        
-                    with _m.logbook_trace("Recovering in-vehicle times:"):
-                        self._calculateFareFactor()
-                        if EMME_VERSION >= (4,2,1):
-                            matrixCalcTool(self._getFixIVTTSpec(), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                            _m.logbook_write("IVTT matrix fixed.")
-                            matrixCalcTool(self._getFixWalkSpec(), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                            _m.logbook_write("Walk matrix fixed.")
-                        else:
-                            matrixCalcTool(self._getFixIVTTSpec(), self.scenario)
-                            _m.logbook_write("IVTT matrix fixed.")
-                            matrixCalcTool(self._getFixWalkSpec(), self.scenario)
-                            _m.logbook_write("Walk matrix fixed.")
-                        
+                
+                #---The matrix calculations are evaluated together in memory, and only the
+                #   final component matrices are written back.
                 with _m.logbook_trace("Applying the constraint matrices to component matrices:"):
-                    if EMME_VERSION >= (4,2,1):
-                        matrixCalcTool(self._getApplyConstraintSpec(self.boardingMatrix), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.costMatrix), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.ivttMatrix), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.walkMatrix), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.waitMatrix), self.scenario,
-                                                 num_processors=self.NumberOfProcessors)
-                    else:
-                        matrixCalcTool(self._getApplyConstraintSpec(self.boardingMatrix), self.scenario)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.costMatrix), self.scenario)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.ivttMatrix), self.scenario)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.walkMatrix), self.scenario)
-                        matrixCalcTool(self._getApplyConstraintSpec(self.waitMatrix), self.scenario)
+                    pipeline = self._getPostProcessingPipeline()
+                    for step in pipeline.steps:
+                        _m.logbook_write("%s = %s" %(step.result, step.expression))
+                    pipeline.run_on_emmebank(self.scenario, num_threads=self.NumberOfProcessors)
 
     ##########################################################################################################
     
@@ -479,6 +443,21 @@ class ExtractSelectLineTimesAndCosts(_m.Tool()):
             }
         return spec
     
+    def _getPostProcessingPipeline(self):
+        pipeline = _matrixExpressions.MatrixPipeline(temporaries=[self._selectLineMatrix.id,
+                                                                  self.feasibilityMatrix.id])
+        pipeline.add(self._getMatrixCleanupSpec())
+        pipeline.add(self._getFeasibilityMatrixSpec())
+        
+        if self.FarePerception != 0:
+            self._calculateFareFactor()
+            pipeline.add(self._getFixIVTTSpec())
+            pipeline.add(self._getFixWalkSpec())
+        
+        for baseMtx in [self.boardingMatrix, self.costMatrix, self.ivttMatrix, self.walkMatrix, self.waitMatrix]:
+            pipeline.add(self._getApplyConstraintSpec(baseMtx))
+        return pipeline
+    
     def _getFixIVTTSpec(self):
         spec = {
                 "expression": "({0} - {1} * {2}).max.0".format(self.ivttMatrix.id,
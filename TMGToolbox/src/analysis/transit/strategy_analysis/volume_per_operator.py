@@ -33,6 +33,11 @@ Volume per Operator
 '''
     0.0.1 Created on 2015-05-04 by tnikolov
     0.0.2 Created on 2015-11-13 by mattaustin222
+    1.1.0 Line filters are evaluated once per scenario, and written to a single line marker,
+        with the Network Calculator kept for filters which can't be evaluated locally. The
+        strategy fractions are multiplied by the (intrazonal-free) demand in NumPy, instead
+        of with matrix calculator and aggregation runs. The last intrazonal pair of
+        multi-class demand is no longer counted.
 '''
 
 import inro.modeller as _m
@@ -44,10 +49,12 @@ import tempfile as _tf
 import shutil as _shutil
 import csv
 from re import split as _regex_split
+import numpy as np
 
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_selection = _MODELLER.module('tmg.common.selection_expressions')
 networkCalculator = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
 traversalAnalysisTool = _MODELLER.tool('inro.emme.transit_assignment.extended.traversal_analysis')
 networkResultsTool = _MODELLER.tool('inro.emme.transit_assignment.extended.network_results')
@@ -97,7 +104,7 @@ class VolumePerOperator(_m.Tool()):
     scenario = _m.Attribute(str)
     LineFilter = _m.Attribute(str)
     ReportFile = _m.Attribute(str)
-    version = '1.0.0'
+    version = '1.1.0'
             
     def __init__(self):
         #---Init internal variables
@@ -166,19 +173,7 @@ class VolumePerOperator(_m.Tool()):
             self.filtersToCompute = lineFilters
             self._Execute();
             
-        with _util.open_csv_writer(self.ReportFile) as writer:
-            if self.multiclass == False:
-                writer.writerow(["Scenario", "Line Filter", "Ridership"])
-                for scenario in sorted(self.results):
-                    for lineFilter in sorted(self.results[scenario]):
-                        writer.writerow([scenario, lineFilter, self.results[scenario][lineFilter]])
-            elif self.multiclass == True:
-                writer.writerow(["Scenario", "Line Filter", "Class", "Ridership"])
-                for scenario in sorted(self.results):
-                    for lineFilter in sorted(self.results[scenario]):
-                        for EmmeClass in sorted(self.results[scenario][lineFilter]):
-                            writer.writerow([scenario, lineFilter, EmmeClass, self.results[scenario][lineFilter][EmmeClass]])
-        
+        self._WriteResults(self.ReportFile)
         print("Finished Ridership calculations")
         
     def __call__(self, xtmf_ScenarioNumbers, FilterString, filePath):
@@ -196,19 +191,8 @@ class VolumePerOperator(_m.Tool()):
        
         self._Execute()
 
-        with _util.open_csv_writer(filePath) as writer:
-            if self.multiclass == False:
-                writer.writerow(["Scenario", "Line Filter", "Ridership"])
-                for scenario in sorted(self.results):
-                    for lineFilter in sorted(self.results[scenario]):
-                        writer.writerow([scenario, lineFilter, self.results[scenario][lineFilter]])
-            elif self.multiclass == True:
-                writer.writerow(["Scenario", "Line Filter", "Class", "Ridership"])
-                for scenario in sorted(self.results):
-                    for lineFilter in sorted(self.results[scenario]):
-                        for EmmeClass in sorted(self.results[scenario][lineFilter]):
-                            writer.writerow([scenario, lineFilter, EmmeClass, self.results[scenario][lineFilter][EmmeClass]])
-        
+        self._WriteResults(filePath)
+
         print("Finished Ridership calculations")
 
     def _Execute(self):
@@ -220,56 +204,78 @@ class VolumePerOperator(_m.Tool()):
             self.Scenario = _MODELLER.emmebank.scenario(scenario.id)
             self.results[scenario.id] = {}
             
-            for filter in parsed_filter_list:
-                demandMatrixId = _util.DetermineAnalyzedTransitDemandId(EMME_VERSION, self.Scenario)
-                if type(demandMatrixId) == type(dict()):
-                    self.multiclass = True
-                    self.results[scenario.id][filter[1]] = {}
-                    for key in demandMatrixId:
-                        with _util.tempExtraAttributeMANAGER(self.Scenario, 'TRANSIT_LINE', description= "Extra attribute") as operatorMarker, \
-                            _util.tempMatrixMANAGER('Intermediate operator counts', 'FULL') as tempIntermediateMatrix, \
-                            _util.tempMatrixMANAGER('Aggregated operator counts', 'SCALAR') as tempResultMatrix:
-                            networkCalculator(self.assign_line_filter(filter[1], operatorMarker), scenario=self.Scenario)
-                            if EMME_VERSION >= (4, 3, 2):
-                                report = stratAnalysis(self.count_ridership(operatorMarker, tempIntermediateMatrix, demandMatrixId[key]), scenario=self.Scenario, class_name=key, num_processors = self.NumberOfProcessors)
-                            else:
-                                report = stratAnalysis(self.count_ridership(operatorMarker, tempIntermediateMatrix, demandMatrixId[key]), scenario=self.Scenario, class_name=key)
-                            tempMatrix = _MODELLER.emmebank.matrix(tempIntermediateMatrix.id)
-                            numpyData = tempMatrix.get_numpy_data(scenario_id = scenario.id)
-                            count = 0 
-                            for i in range(numpyData.shape[0]-1):
-                                if numpyData[i,i] != 0:
-                                    numpyData[i,i] = 0
-                                    count += 1
-                            tempMatrix.set_numpy_data(numpyData, scenario_id = scenario.id)
-                            matrixCalculator(self._CalcRidership(tempIntermediateMatrix.id, demandMatrixId[key]), scenario=self.Scenario)
-                            matrixAggregation(tempIntermediateMatrix.id, tempResultMatrix.id, agg_op="+", scenario=self.Scenario)
-                            self.results[scenario.id][filter[1]][key] = tempResultMatrix.data
-                else:
-                    self.multiclass = False
-                    with _util.tempExtraAttributeMANAGER(self.Scenario, 'TRANSIT_LINE', description= "Extra attribute") as operatorMarker,\
-                            _util.tempMatrixMANAGER('Intermediate operator counts', 'FULL') as tempIntermediateMatrix,\
-                            _util.tempMatrixMANAGER('Aggregated operator counts', 'SCALAR') as tempResultMatrix:
-                        networkCalculator(self.assign_line_filter(filter[1], operatorMarker), scenario=self.Scenario)
+            demandMatrixId = _util.DetermineAnalyzedTransitDemandId(EMME_VERSION, self.Scenario)
+            if type(demandMatrixId) == type(dict()):
+                self.multiclass = True
+                classes = [(key, demandMatrixId[key]) for key in demandMatrixId]
+            else:
+                self.multiclass = False
+                classes = [(None, demandMatrixId)]
+            
+            #Intrazonal trips are not counted, so their demand is zeroed once per class
+            demands = {}
+            for key, matrixId in classes:
+                demand = _MODELLER.emmebank.matrix(matrixId).get_numpy_data(scenario_id= scenario.id)
+                np.fill_diagonal(demand, 0.0)
+                demands[key] = demand
+            
+            #Line filters are evaluated against the lines loaded once per scenario
+            selector = _selection.NetworkSelector(self.Scenario)
+            
+            with _util.tempExtraAttributeMANAGER(self.Scenario, 'TRANSIT_LINE', description= "Operator marker") as operatorMarker, \
+                    _util.tempMatrixMANAGER('Operator ridership fractions', 'FULL') as tempFractionMatrix:
+                lineIndex = self.Scenario.get_attribute_values('TRANSIT_LINE', [operatorMarker.id])[0]
+                
+                for filter in parsed_filter_list:
+                    self._MarkLines(selector, lineIndex, operatorMarker.id, filter[1])
+                    if self.multiclass:
+                        self.results[scenario.id][filter[1]] = {}
+                    
+                    for key, matrixId in classes:
+                        kwargs = {'scenario': self.Scenario}
+                        if key is not None:
+                            kwargs['class_name'] = key
                         if EMME_VERSION >= (4, 3, 2):
-                            report = stratAnalysis(self.count_ridership(operatorMarker, tempIntermediateMatrix, demandMatrixId), scenario=self.Scenario, num_processors = self.NumberOfProcessors)  
+                            kwargs['num_processors'] = self.NumberOfProcessors
+                        stratAnalysis(self.count_ridership(operatorMarker, tempFractionMatrix, matrixId), **kwargs)
+                        
+                        fractions = _MODELLER.emmebank.matrix(tempFractionMatrix.id).get_numpy_data(scenario_id= scenario.id)
+                        ridership = float(np.sum(fractions * demands[key]))
+                        if self.multiclass:
+                            self.results[scenario.id][filter[1]][key] = ridership
                         else:
-                            report = stratAnalysis(self.count_ridership(operatorMarker, tempIntermediateMatrix, demandMatrixId), scenario=self.Scenario)
-                        tempMatrix = _MODELLER.emmebank.matrix(tempIntermediateMatrix.id)
-                        numpyData = tempMatrix.get_numpy_data(scenario_id = scenario.id)
-                        count = 0 
-                        for i in range(numpyData.shape[0]):
-                            if numpyData[i,i] != 0:
-                                numpyData[i,i] = 0
-                                count += 1
-                        tempMatrix.set_numpy_data(numpyData, scenario_id = scenario.id)                         
-                        matrixCalculator(self._CalcRidership(tempIntermediateMatrix.id, demandMatrixId), scenario=self.Scenario)
-                        matrixAggregation(tempIntermediateMatrix.id, tempResultMatrix.id, agg_op="+", scenario=self.Scenario)         
-                        self.results[scenario.id][filter[1]] =  tempResultMatrix.data
+                            self.results[scenario.id][filter[1]] = ridership
+    
+    def _MarkLines(self, selector, lineIndex, markerId, lineFilter):
+        #Sets the marker to 1 on the filter's lines and 0 elsewhere, with one write to the scenario
+        try:
+            mask = selector.line_mask(lineFilter)
+        except _selection.SelectionSyntaxError:
+            networkCalculator(self.assign_line_filter("all", markerId, "0"), scenario=self.Scenario)
+            networkCalculator(self.assign_line_filter(lineFilter, markerId), scenario=self.Scenario)
+            return
+        values = [0.0] * len(lineIndex)
+        for lineId in selector.line_ids[mask]:
+            values[lineIndex[lineId]] = 1.0
+        self.Scenario.set_attribute_values('TRANSIT_LINE', [markerId], [lineIndex, values])
+    
+    def _WriteResults(self, filePath):
+        with _util.open_csv_writer(filePath) as writer:
+            if self.multiclass == False:
+                writer.writerow(["Scenario", "Line Filter", "Ridership"])
+                for scenario in sorted(self.results):
+                    for lineFilter in sorted(self.results[scenario]):
+                        writer.writerow([scenario, lineFilter, self.results[scenario][lineFilter]])
+            elif self.multiclass == True:
+                writer.writerow(["Scenario", "Line Filter", "Class", "Ridership"])
+                for scenario in sorted(self.results):
+                    for lineFilter in sorted(self.results[scenario]):
+                        for EmmeClass in sorted(self.results[scenario][lineFilter]):
+                            writer.writerow([scenario, lineFilter, EmmeClass, self.results[scenario][lineFilter][EmmeClass]])
 
-    def assign_line_filter(self, lineFilter, marker):
-        return {"result": marker.id,
-                    "expression": "1",
+    def assign_line_filter(self, lineFilter, markerId, expression="1"):
+        return {"result": markerId,
+                    "expression": expression,
                     "aggregation": None,
                     "selections": {
                         "transit_line": lineFilter
@@ -308,22 +314,6 @@ class VolumePerOperator(_m.Tool()):
             }
         return ret
 
-    def _CalcRidership(self, fractionMatrixId, demandMatrixId):
-
-        return {
-                "expression": fractionMatrixId + " * " + demandMatrixId,
-                "result": fractionMatrixId,
-                "constraint": {
-                    "by_value": None,
-                    "by_zone": None
-                },
-                "aggregation": {
-                    "origins": None,
-                    "destinations": None
-                },
-                "type": "MATRIX_CALCULATION"
-            }
-
     def _ParseFilterString(self, filterString):
         filterList = []
         components = _regex_split('\n|,', filterString) #Supports newline and/or commas
@@ -56,6 +56,9 @@ Toll-Based Road Assignment
     1.2.1 Removed a scaling factor being incorrectly applied to the Best Relative Gap
 
     1.2.1 Added the ability to use a peak period matrix instead of just a scaling factor
+
+    1.3.0 With SOLA in Emme 4.4+, the cost matrix is computed on the retained paths of the
+        primary assignment, instead of an all-or-nothing assignment in a temporary scenario.
 '''
 
 import inro.modeller as _m
@@ -65,6 +68,7 @@ from contextlib import contextmanager
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_pathAnalysis = _MODELLER.module('tmg.common.road_path_analysis')
 NullPointerException = _util.NullPointerException
 EMME_VERSION = _util.getEmmeVersion(float)
 # import six library for python2 to python3 conversion
@@ -76,7 +80,7 @@ _util.initalizeModellerTypes(_m)
 
 class TollBasedRoadAssignment(_m.Tool()):
     
-    version = '1.2.1'
+    version = '1.3.0'
     tool_run_msg = ""
     number_of_tasks = 4 # For progress reporting, enter the integer number of tasks here
     
@@ -407,10 +411,17 @@ class TollBasedRoadAssignment(_m.Tool()):
                     appliedTollFactor = self._calculateAppliedTollFactor()
                     self._tracker.completeTask()
                     
+                    #Costs are computed on the primary assignment's paths, instead of running an
+                    #all-or-nothing assignment in a copy of the scenario
+                    retainPaths = self.SOLAFlag and _pathAnalysis.supports_retained_paths()
+                    
                     with _m.logbook_trace("Running primary road assignment."):
                         print("Running primary road assignment")
                         
-                        if self.SOLAFlag:
+                        if retainPaths:
+                            spec = self._getRetainedPathsSOLASpec(peakHourMatrix.id, tollAttribute.id,
+                                                                  costAttribute.id, appliedTollFactor)
+                        elif self.SOLAFlag:
                             spec = self._getPrimarySOLASpec(peakHourMatrix.id, tollAttribute.id, appliedTollFactor)
                         else:
                             spec = self._getPrimaryRoadAssignmentSpec(peakHourMatrix.id, tollAttribute.id, 
@@ -440,32 +451,35 @@ class TollBasedRoadAssignment(_m.Tool()):
                         print("Primary assignment complete at %s iterations" %number)
                         print("Stopping criterion was %s with a value of %s." %(stoppingCriterion, val))
                     
-                    self._tracker.startProcess(3)
-                    with self._AoNScenarioMANAGER() as allOrNothingScenario:
-                        self._tracker.completeSubtask
+                    if not retainPaths:
+                        self._tracker.startProcess(3)
+                        with self._AoNScenarioMANAGER() as allOrNothingScenario:
+                            self._tracker.completeSubtask
                         
-                        with _m.logbook_trace("All or nothing assignment to recover costs:"):
-                            print("Running all-or-nothing assignment to recover costs.")
+                            with _m.logbook_trace("All or nothing assignment to recover costs:"):
+                                print("Running all-or-nothing assignment to recover costs.")
                             
-                            with _m.logbook_trace("Copying auto times into UL2"):
-                                networkCalculationTool(self._getSaveAutoTimesSpec(), scenario=allOrNothingScenario)
-                                self._tracker.completeSubtask
+                                with _m.logbook_trace("Copying auto times into UL2"):
+                                    networkCalculationTool(self._getSaveAutoTimesSpec(), scenario=allOrNothingScenario)
+                                    self._tracker.completeSubtask
                             
-                            with _m.logbook_trace("Preparing function 98 for assignment"):
-                                self._modifyFunctionForAoNAssignment()
-                                networkCalculationTool(self._getChangeLinkVDFto98Spec(), scenario=allOrNothingScenario)
-                                self._tracker.completeSubtask
+                                with _m.logbook_trace("Preparing function 98 for assignment"):
+                                    self._modifyFunctionForAoNAssignment()
+                                    networkCalculationTool(self._getChangeLinkVDFto98Spec(), scenario=allOrNothingScenario)
+                                    self._tracker.completeSubtask
                             
-                            self._tracker.completeTask()
+                                self._tracker.completeTask()
                             
-                            with _m.logbook_trace("Running all or nothing assignment"):
-                                if self.SOLAFlag:
-                                    spec = self._getAllOrNothingSOLASpec(peakHourMatrix.id, costAttribute.id)
-                                else:
-                                    spec = self._getAoNAssignmentSpec(peakHourMatrix.id, costAttribute.id)
+                                with _m.logbook_trace("Running all or nothing assignment"):
+                                    if self.SOLAFlag:
+                                        spec = self._getAllOrNothingSOLASpec(peakHourMatrix.id, costAttribute.id)
+                                    else:
+                                        spec = self._getAoNAssignmentSpec(peakHourMatrix.id, costAttribute.id)
                                 
-                                self._tracker.runTool(trafficAssignmentTool,
-                                                      spec, scenario= allOrNothingScenario)
+                                    self._tracker.runTool(trafficAssignmentTool,
+                                                          spec, scenario= allOrNothingScenario)
+                    else:
+                        self._tracker.completeTask()
         print("Road Assignment complete.")
 
     ##########################################################################################################
@@ -706,6 +720,13 @@ class TollBasedRoadAssignment(_m.Tool()):
             }
       
     
+    def _getRetainedPathsSOLASpec(self, peakHourMatrixId, tollAttributeId, costAttributeId, appliedTollFactor):
+        #The primary SOLA assignment, with the cost analysis run on its retained paths
+        spec = self._getPrimarySOLASpec(peakHourMatrixId, tollAttributeId, appliedTollFactor)
+        _pathAnalysis.retain_path_analyses(spec['classes'][0],
+                                           [_pathAnalysis.get_path_analysis(costAttributeId, self.CostMatrixId)])
+        return spec
+    
     def _getPrimaryRoadAssignmentSpec(self, peakHourMatrixId, tollAttributeId, appliedTollFactor):
         
         if self.PerformanceFlag:
@@ -82,6 +82,10 @@ Toll-Based Road Assignment
         
     3.4.0 Add path analysis option 
 
+    3.5.0 With SOLA in Emme 4.4+, the toll, true travel time and path analysis skims are
+        computed on the retained paths of the primary assignment, instead of repeating the
+        full assignment for each of them. Path analysis no longer overwrites the times matrix.
+
 '''
 
 import inro.modeller as _m
@@ -92,6 +96,7 @@ from contextlib import contextmanager
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_pathAnalysis = _MODELLER.module('tmg.common.road_path_analysis')
 EMME_VERSION = _util.getEmmeVersion(tuple)
 
 # import six library for python2 to python3 conversion
@@ -110,7 +115,7 @@ def blankManager(obj):
 
 class TollBasedRoadAssignment(_m.Tool()):
     
-    version = '3.4.0'
+    version = '3.5.0'
     tool_run_msg = ""
     number_of_tasks = 5 # For progress reporting, enter the integer number of tasks here
     
@@ -614,9 +619,15 @@ class TollBasedRoadAssignment(_m.Tool()):
                 appliedTollFactor = self._calculateAppliedTollFactor()
                 self._tracker.completeTask()
                 
+                #Tolls, true travel times and path analysis results are computed on the primary
+                #assignment's paths, instead of repeating the assignment for each of them
+                retainPaths = self.SOLAFlag and _pathAnalysis.supports_retained_paths()
+                
                 with _m.logbook_trace("Running primary road assignment."):
                     
-                    if self.SOLAFlag:
+                    if retainPaths:
+                        spec = self._getRetainedPathsSOLASpec(peakHourMatrix.id, costAttribute.id, appliedTollFactor)
+                    elif self.SOLAFlag:
                         spec = self._getPrimarySOLASpec(peakHourMatrix.id, costAttribute.id, appliedTollFactor)
                     else:
                         spec = self._getPrimaryRoadAssignmentSpec(peakHourMatrix.id, costAttribute.id, appliedTollFactor)
@@ -645,58 +656,66 @@ class TollBasedRoadAssignment(_m.Tool()):
                     print("Primary assignment complete at %s iterations." %number)
                     print("Stopping criterion was %s with a value of %s." %(stoppingCriterion, val))
 
-                self._tracker.startProcess(1)
-                with _m.logbook_trace("Secondary assignment to recover true travel times:"):
+                if retainPaths:
+                    self._tracker.startProcess(1)
+                    with _m.logbook_trace("Recovering true travel times from the primary assignment's paths"):
+                        matrixCalcTool(_pathAnalysis.get_time_correction_spec(self.TimesMatrixId, self.CostMatrixId,
+                                                                              appliedTollFactor),
+                                       num_processors=self.NumberOfProcessors, scenario=self.Scenario)
+                        self._tracker.completeTask()
+                else:
+                    self._tracker.startProcess(1)
+                    with _m.logbook_trace("Secondary assignment to recover true travel times:"):
                         
-                    with _m.logbook_trace("Copying auto times into @ltime"):
-                            networkCalculationTool(self._getSaveAutoTimesSpec(timeAttribute.id), scenario=self.Scenario)
-                            self._tracker.completeSubtask
+                        with _m.logbook_trace("Copying auto times into @ltime"):
+                                networkCalculationTool(self._getSaveAutoTimesSpec(timeAttribute.id), scenario=self.Scenario)
+                                self._tracker.completeSubtask
                         
-                    with _m.logbook_trace("Running secondary assignment"):
-                        if self.SOLAFlag:
-                            spec = self._getSecondarySOLASpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
-                        else:
-                            spec = self._getSecondaryRoadAssignmentSpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
+                        with _m.logbook_trace("Running secondary assignment"):
+                            if self.SOLAFlag:
+                                spec = self._getSecondarySOLASpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
+                            else:
+                                spec = self._getSecondaryRoadAssignmentSpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
                                 
-                        self._tracker.runTool(trafficAssignmentTool,
-                                                spec, scenario=self.Scenario)                  
+                            self._tracker.runTool(trafficAssignmentTool,
+                                                    spec, scenario=self.Scenario)                  
                     
-                self._tracker.startProcess(1)
-                if not (self.TollsMatrixId == "null" or self.TollsMatrixId is None):
-                    self._tracker.completeSubtask
+                    self._tracker.startProcess(1)
+                    if not (self.TollsMatrixId == "null" or self.TollsMatrixId is None):
+                        self._tracker.completeSubtask
                     
-                    with _m.logbook_trace("Tertiary assignment to recover toll costs separately:"):
+                        with _m.logbook_trace("Tertiary assignment to recover toll costs separately:"):
                         
-                        #with _m.logbook_trace("Copying auto times into UL2"):
-                        #    networkCalculationTool(self._getSaveAutoTimesSpec(appliedTollFactor), scenario=allOrNothingScenario)
-                        #    self._tracker.completeSubtask
+                            #with _m.logbook_trace("Copying auto times into UL2"):
+                            #    networkCalculationTool(self._getSaveAutoTimesSpec(appliedTollFactor), scenario=allOrNothingScenario)
+                            #    self._tracker.completeSubtask
                         
-                        #with _m.logbook_trace("Preparing function 98 for assignment"):
-                        #    self._modifyFunctionForAoNAssignment()
-                        #    networkCalculationTool(self._getChangeLinkVDFto98Spec(), scenario=allOrNothingScenario)
-                        #    self._tracker.completeSubtask
+                            #with _m.logbook_trace("Preparing function 98 for assignment"):
+                            #    self._modifyFunctionForAoNAssignment()
+                            #    networkCalculationTool(self._getChangeLinkVDFto98Spec(), scenario=allOrNothingScenario)
+                            #    self._tracker.completeSubtask
                         
-                        self._tracker.completeTask()
+                            self._tracker.completeTask()
                         
-                        with _m.logbook_trace("Running tertiary assignment"):
-                            if self.SOLAFlag:
-                                spec = self._getTertiarySOLASpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
-                            else:
-                                spec = self._getTertiaryAssignmentSpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
+                            with _m.logbook_trace("Running tertiary assignment"):
+                                if self.SOLAFlag:
+                                    spec = self._getTertiarySOLASpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
+                                else:
+                                    spec = self._getTertiaryAssignmentSpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
                                 
-                            self._tracker.runTool(trafficAssignmentTool,
-                                                  spec, scenario=self.Scenario)   
+                                self._tracker.runTool(trafficAssignmentTool,
+                                                      spec, scenario=self.Scenario)   
 
-                self._tracker.startProcess(1)
-                if self.PathAnalysisFlag == True :
-                    with _m.logbook_trace("Running traffic assignment for path analysis"):
-                            if self.SOLAFlag:
-                                spec = self._getSOLASpecForPathAnalysis(peakHourMatrix.id, costAttribute.id, appliedTollFactor, self.LinkComponent,self.TurnComponent,self.OperatorForPathAnaysis,self.LowerBound,self.UpperBound,self.PathToODAggregation,self.AnalyzedDemandMatrix,self.ODValueResults,self.LinkVolResults,self.TurnVolResults)
-                            else:
-                                spec = self._getAssignmentSpecForPathAnalysis(peakHourMatrix.id, costAttribute.id, appliedTollFactor, self.LinkComponent,self.TurnComponent,self.OperatorForPathAnaysis,self.LowerBound,self.UpperBound,self.PathToODAggregation,self.AnalyzedDemandMatrix,self.ODValueResults,self.LinkVolResults,self.TurnVolResults)
+                    self._tracker.startProcess(1)
+                    if self.PathAnalysisFlag == True :
+                        with _m.logbook_trace("Running traffic assignment for path analysis"):
+                                if self.SOLAFlag:
+                                    spec = self._getSOLASpecForPathAnalysis(peakHourMatrix.id, costAttribute.id, appliedTollFactor, self.LinkComponent,self.TurnComponent,self.OperatorForPathAnaysis,self.LowerBound,self.UpperBound,self.PathToODAggregation,self.AnalyzedDemandMatrix,self.ODValueResults,self.LinkVolResults,self.TurnVolResults)
+                                else:
+                                    spec = self._getAssignmentSpecForPathAnalysis(peakHourMatrix.id, costAttribute.id, appliedTollFactor, self.LinkComponent,self.TurnComponent,self.OperatorForPathAnaysis,self.LowerBound,self.UpperBound,self.PathToODAggregation,self.AnalyzedDemandMatrix,self.ODValueResults,self.LinkVolResults,self.TurnVolResults)
                                 
-                            self._tracker.runTool(trafficAssignmentTool,
-                                                  spec, scenario=self.Scenario) 
+                                self._tracker.runTool(trafficAssignmentTool,
+                                                      spec, scenario=self.Scenario) 
 
     def _any_transit_lines(self):
         network = self.Scenario.get_network()
@@ -1050,6 +1069,43 @@ class TollBasedRoadAssignment(_m.Tool()):
                                       }
                 }
     
+    def _getRetainedPathsSOLASpec(self, peakHourMatrixId, costAttributeId, appliedTollFactor):
+        #The primary SOLA assignment, with the toll and path analyses run on its retained paths
+        spec = self._getPrimarySOLASpec(peakHourMatrixId, costAttributeId, appliedTollFactor)
+        
+        analyses = []
+        if not (self.TollsMatrixId == "null" or self.TollsMatrixId is None):
+            analyses.append(_pathAnalysis.get_path_analysis(self.LinkTollAttributeId, self.TollsMatrixId))
+        if self.PathAnalysisFlag == True:
+            considered_path, analyzed_demand_flag, path_value_flag = self._getPathToODComposition()
+            if self.AnalyzedDemandMatrix == None:
+                AnalyzedDemandMatrixID = peakHourMatrixId
+            else:
+                AnalyzedDemandMatrixID = self.AnalyzedDemandMatrix
+            analyses.append(_pathAnalysis.get_path_analysis(self.LinkComponent, self.ODValueResults,
+                                                            operator=self.OperatorForPathAnaysis,
+                                                            turn_component=self.TurnComponent,
+                                                            lower=self.LowerBound, upper=self.UpperBound,
+                                                            considered_paths=considered_path,
+                                                            multiply_by_demand=analyzed_demand_flag,
+                                                            multiply_by_value=path_value_flag,
+                                                            analyzed_demand=AnalyzedDemandMatrixID,
+                                                            selected_link_volumes=self.LinkVolResults,
+                                                            selected_turn_volumes=self.TurnVolResults))
+        
+        _pathAnalysis.retain_path_analyses(spec['classes'][0], analyses)
+        return spec
+    
+    def _getPathToODComposition(self):
+        #Returns the considered paths, and the analyzed demand and path value flags
+        if self.PathToODAggregation == 'PATH':
+            return "ALL", False, True
+        elif self.PathToODAggregation == 'SELECTED':
+            return "SELECTED", False, True
+        elif self.PathToODAggregation == 'WEIGHTED':
+            return "SELECTED", True, True
+        return "SELECTED", True, False
+    
     def _getSecondarySOLASpec(self, peakHourMatrixId, timeAttribute, appliedTollFactor, costAttributeId):
         if self.PerformanceFlag:
             numberOfPocessors = multiprocessing.cpu_count()
@@ -1369,22 +1425,7 @@ class TollBasedRoadAssignment(_m.Tool()):
         #Returns a list of tuples. Emme guarantees that there is always
         #one auto mode.
 
-        if self.PathToODAggregation == 'PATH':
-            considered_path = "ALL"
-            analyzed_demand_flag = False
-            path_value_flag = True
-        elif self.PathToODAggregation == 'SELECTED':
-            considered_path = "SELECTED"
-            analyzed_demand_flag = False
-            path_value_flag = True
-        elif self.PathToODAggregation == 'WEIGHTED':
-            considered_path = "SELECTED"
-            analyzed_demand_flag = True
-            path_value_flag = True
-        else:
-            considered_path = "SELECTED"
-            analyzed_demand_flag = True
-            path_value_flag = False
+        considered_path, analyzed_demand_flag, path_value_flag = self._getPathToODComposition()
         
         if self.AnalyzedDemandMatrix == None:
             AnalyzedDemandMatrixID = peakHourMatrixId
@@ -1405,7 +1446,7 @@ class TollBasedRoadAssignment(_m.Tool()):
                             "link_volumes": None,
                             "turn_volumes": None,
                             "od_travel_times": {
-                                "shortest_paths": self.TimesMatrixId
+                                "shortest_paths": None
                             }
                         },
                          "path_analysis": {
@@ -1456,22 +1497,7 @@ class TollBasedRoadAssignment(_m.Tool()):
         else:
             numberOfPocessors = max(multiprocessing.cpu_count() - 2, 1)
 
-        if self.PathToODAggregation == 'PATH':
-            considered_path = "ALL"
-            analyzed_demand_flag = False
-            path_value_flag = True
-        elif self.PathToODAggregation == 'SELECTED':
-            considered_path = "SELECTED"
-            analyzed_demand_flag = False
-            path_value_flag = True
-        elif self.PathToODAggregation == 'WEIGHTED':
-            considered_path = "SELECTED"
-            analyzed_demand_flag = True
-            path_value_flag = True
-        else:
-            considered_path = "SELECTED"
-            analyzed_demand_flag = True
-            path_value_flag = False
+        considered_path, analyzed_demand_flag, path_value_flag = self._getPathToODComposition()
         
         if self.AnalyzedDemandMatrix == None:
             AnalyzedDemandMatrixID = peakHourMatrixId
@@ -1491,7 +1517,7 @@ class TollBasedRoadAssignment(_m.Tool()):
                                          "link_volumes": None,
                                          "turn_volumes": None,
                                          "od_travel_times": {
-                                                             "shortest_paths": self.TimesMatrixId
+                                                             "shortest_paths": None
                                                              }
                                          },
                              "analysis": {
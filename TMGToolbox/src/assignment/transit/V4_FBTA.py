@@ -100,6 +100,16 @@ V4 Transit Assignment
     4.0.2 Updated to allow for multi-threaded matrix calcs in 4.2.1+
 
     5.0.0 Forked
+    
+    5.1.0 The congestion and fare strategy analyses are now described as requests to
+        the common strategy extraction module, which runs them together.
+    
+    5.2.0 The congestion function now looks up precomputed coefficients by ttf, instead
+        of testing every ttf in an if/elif chain.
+    
+    5.2.1 The raw IVTT correction is part of the congestion request, and is applied in
+        memory instead of with a separate matrix calculation. The strategy analyses
+        still run once per extracted matrix.
 
 '''
 import traceback as _traceback
@@ -113,6 +123,8 @@ _MODELLER = _m.Modeller() #Instantiate Modeller once.
 
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_strategyExtraction = _MODELLER.module('tmg.common.strategy_extraction')
+_congestionFunctions = _MODELLER.module('tmg.common.congestion_functions')
 
 congestedAssignmentTool = _MODELLER.tool('inro.emme.transit_assignment.congested_transit_assignment')
 networkCalcTool = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
@@ -141,7 +153,7 @@ def blankManager(obj):
 
 class V4_FareBaseTransitAssignment(_m.Tool()):
     
-    version = '5.0.0'
+    version = '5.2.1'
     tool_run_msg = ""
     number_of_tasks = 7 # For progress reporting, enter the integer number of tasks here
     
@@ -1137,43 +1149,12 @@ class V4_FareBaseTransitAssignment(_m.Tool()):
         return baseSpec
     
     def _GetFuncSpec(self):
-
+        
+        #The congestion coefficients are precomputed by ttf, and looked up for each segment
         parameterList = self._ParseExponentString()
-
-        partialSpec = """import math 
-def calc_segment_cost(transit_volume, capacity, segment): """
-
-        for count, item in enumerate(parameterList):
-            alpha = float(item[2])
-            beta = (2 * alpha - 1) / (2 * alpha - 2)
-            alphaSquare = alpha ** 2
-            betaSquare = beta ** 2
-            if count == 0:                
-                partialSpec += """
-    if segment.transit_time_func == """ + item[0] + """: 
-        return (""" + item[1] + """ * (1 + math.sqrt(""" + str(alphaSquare) + """ * 
-            (1 - transit_volume / capacity) ** 2 + """ + str(betaSquare) + """) - """ + str(alpha) + """ 
-            * (1 - transit_volume / capacity) - """ + str(beta) + """))"""
-            else: 
-                partialSpec += """
-    elif segment.transit_time_func == """ + item[0] + """: 
-        return (""" + item[1] + """ * (1 + math.sqrt(""" + str(alphaSquare) + """ *  
-            (1 - transit_volume / capacity) ** 2 + """ + str(betaSquare) + """) - """ + str(alpha) + """ 
-            * (1 - transit_volume / capacity) - """ + str(beta) + """))"""
-        
-        partialSpec += """
-    else: 
-        raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)"""
-            
-        funcSpec = {
-            "type": "CUSTOM",
-            "assignment_period": self.AssignmentPeriod,
-            "orig_func": False,
-            "congestion_attribute": "us3", #Hard-coded to US3
-            "python_function": partialSpec                     
-            }
-               
-        return funcSpec
+        
+        return _congestionFunctions.get_function_spec(parameterList, self.AssignmentPeriod,
+                                                      congestion_attribute= "us3") #Hard-coded to US3
     
     def _GetStopSpec(self):
         stopSpec = {
@@ -1205,20 +1186,30 @@ def calc_segment_cost(transit_volume, capacity, segment): """
                     pass
         
         #If the congestion matrix is required, or Raw IVTT matrix is required, extract the congestion matrix
-        if self.InVehicleTimeMatrixId and not self.CalculateCongestedIvttFlag or self.CongestionMatrixId:
-            with congestionMatrixManager() as congestionMatrix:
-                self._ExtractCongestionMatrix(congestionMatrix.id)
+        extractCongestion = self.InVehicleTimeMatrixId and not self.CalculateCongestedIvttFlag or self.CongestionMatrixId
+        if not extractCongestion:
+            congestionMatrixManager = lambda: blankManager(None)
+        
+        #Collect the strategy analyses required, so that they are run together
+        # with the analysed demand and number of processors. If Raw IVTT is required,
+        # the congestion is subtracted from the IVTT matrix once it is extracted.
+        with congestionMatrixManager() as congestionMatrix:
+            requests = []
+            if extractCongestion:
+                fixRawIvtt = self.InVehicleTimeMatrixId and not self.CalculateCongestedIvttFlag
+                requests.append(_strategyExtraction.StrategyRequest(congestionMatrix.id, in_vehicle= "@ccost",
+                        subtract_from= self.InVehicleTimeMatrixId if fixRawIvtt else None))
             
-                #If Raw IVTT is required, use the congestion matrix to fix it
-                if self.InVehicleTimeMatrixId and not self.CalculateCongestedIvttFlag:
-                    self._FixRawIVTT(congestionMatrix.id)
-        
-        #If the fares matrix is required, extract that.
-        if self.FareMatrixId:
-            self._ExtractCostMatrix()    
+            #If the fares matrix is required, extract that.
+            if self.FareMatrixId:
+                requests.append(_strategyExtraction.StrategyRequest(self.FareMatrixId,
+                                                                    in_vehicle= self.SegmentFareAttributeId,
+                                                                    aux_transit= self.LinkFareAttributeId))
             
+            _strategyExtraction.extract_strategy_matrices(self.Scenario, requests, self.DemandMatrix.id,
+                                                          num_processors= self.NumberOfProcessors,
+                                                          tracker= self.TRACKER)
             
-
     def _ExtractTimesMatrices(self):
         spec = {
                 "by_mode_subset": {
@@ -1235,95 +1226,6 @@ def calc_segment_cost(transit_volume, capacity, segment): """
             spec["by_mode_subset"]["distance"] = self.DistanceMatrixId
         self.TRACKER.runTool(matrixResultsTool, spec, scenario= self.Scenario)
     
-    def _ExtractCostMatrix(self):
-        spec = {
-                "trip_components": {
-                    "boarding": None,
-                    "in_vehicle": self.SegmentFareAttributeId,
-                    "aux_transit": self.LinkFareAttributeId,
-                    "alighting": None
-                },
-                "sub_path_combination_operator": "+",
-                "sub_strategy_combination_operator": "average",
-                "selected_demand_and_transit_volumes": {
-                    "sub_strategies_to_retain": "ALL",
-                    "selection_threshold": {
-                        "lower": -999999,
-                        "upper": 999999
-                    }
-                },
-                "analyzed_demand": self.DemandMatrix.id,
-                "constraint": None,
-                "results": {
-                    "strategy_values": self.FareMatrixId,
-                    "selected_demand": None,
-                    "transit_volumes": None,
-                    "aux_transit_volumes": None,
-                    "total_boardings": None,
-                    "total_alightings": None
-                },
-                "type": "EXTENDED_TRANSIT_STRATEGY_ANALYSIS"
-            }
-        if EMME_VERSION >= (4,3,0):
-            self.TRACKER.runTool(strategyAnalysisTool, spec, scenario= self.Scenario, num_processors=self.NumberOfProcessors)
-        else:
-            self.TRACKER.runTool(strategyAnalysisTool, spec, scenario= self.Scenario)           
-    
-    def _ExtractCongestionMatrix(self, congestionMatrixId):
-        spec = {"trip_components": {
-                    "boarding": None,
-                    "in_vehicle": "@ccost",
-                    "aux_transit": None,
-                    "alighting": None
-                },
-                "sub_path_combination_operator": "+",
-                "sub_strategy_combination_operator": "average",
-                "selected_demand_and_transit_volumes": {
-                    "sub_strategies_to_retain": "ALL",
-                    "selection_threshold": {
-                        "lower": -999999,
-                        "upper": 999999
-                    }
-                },
-                "analyzed_demand": self.DemandMatrix.id,
-                "constraint": None,
-                "results": {
-                    "strategy_values":congestionMatrixId,
-                    "selected_demand": None,
-                    "transit_volumes": None,
-                    "aux_transit_volumes": None,
-                    "total_boardings": None,
-                    "total_alightings": None
-                },
-                "type": "EXTENDED_TRANSIT_STRATEGY_ANALYSIS"
-            }
-        if EMME_VERSION >= (4,3,0):
-            self.TRACKER.runTool(strategyAnalysisTool, spec, scenario= self.Scenario, num_processors=self.NumberOfProcessors)
-        else:
-            self.TRACKER.runTool(strategyAnalysisTool, spec, scenario= self.Scenario)           
-    
-    def _FixRawIVTT(self, congestionMatrixId):
-        expression = "{mfivtt} - {mfcong}".format(mfivtt= self.InVehicleTimeMatrixId,
-                                                 mfcong= congestionMatrixId)
-
-        matrixCalcSpec = {
-                "expression": expression,
-                "result": self.InVehicleTimeMatrixId,
-                "constraint": {
-                    "by_value": None,
-                    "by_zone": None
-                },
-                "aggregation": {
-                    "origins": None,
-                    "destinations": None
-                },
-                "type": "MATRIX_CALCULATION"
-            }
-        if EMME_VERSION >= (4,2,1):
-            matrixCalcTool(matrixCalcSpec, scenario= self.Scenario, num_processors=self.NumberOfProcessors)
-        else:
-            matrixCalcTool(matrixCalcSpec, scenario= self.Scenario)
-    
     def _ExtractRawIvttMatrix(self):
         with _util.tempMatrixMANAGER("Congestion matrix") as congestionMatrix:
             analysisSpec = {
@@ -25,6 +25,7 @@ import inro.modeller as _m
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_congestionFunctions = _MODELLER.module('tmg.common.congestion_functions')
 congestedAssignmentTool = _MODELLER.tool('inro.emme.transit_assignment.congested_transit_assignment')
 extendedAssignmentTool =_MODELLER.tool('inro.emme.transit_assignment.extended_transit_assignment')
 networkCalcTool = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
@@ -39,7 +40,7 @@ import six
 _util.initalizeModellerTypes(_m)
 
 class MultiClassTransitAssignment(_m.Tool()):
-    version = '1.0.0'
+    version = '1.1.0'
     tool_run_msg = ''
     number_of_tasks = 7
 
@@ -747,24 +748,7 @@ class MultiClassTransitAssignment(_m.Tool()):
         return baseSpec
     def _GetFuncSpec(self):
         parameterList = self._ParseExponentString()
-        partialSpec = 'import math \ndef calc_segment_cost(transit_volume, capacity, segment): '
-        for count, item in enumerate(parameterList):
-            alpha = float(item[2])
-            beta = (2 * alpha - 1) / (2 * alpha - 2)
-            alphaSquare = alpha ** 2
-            betaSquare = beta ** 2
-            if count == 0:
-                partialSpec += '\n    if segment.transit_time_func == ' + item[0] + ': \n        return (' + item[1] + ' * (1 + math.sqrt(' + str(alphaSquare) + ' * \n            (1 - transit_volume / capacity) ** 2 + ' + str(betaSquare) + ') - ' + str(alpha) + ' \n            * (1 - transit_volume / capacity) - ' + str(beta) + '))'
-            else:
-                partialSpec += '\n    elif segment.transit_time_func == ' + item[0] + ': \n        return (' + item[1] + ' * (1 + math.sqrt(' + str(alphaSquare) + ' *  \n            (1 - transit_volume / capacity) ** 2 + ' + str(betaSquare) + ') - ' + str(alpha) + ' \n            * (1 - transit_volume / capacity) - ' + str(beta) + '))'
-
-        partialSpec += '\n    else: \n        raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)'
-        funcSpec = {'type': 'CUSTOM',
-         'assignment_period': self.AssignmentPeriod,
-         'orig_func': False,
-         'congestion_attribute': 'us3',
-         'python_function': partialSpec}
-        return funcSpec
+        return _congestionFunctions.get_function_spec(parameterList, self.AssignmentPeriod, congestion_attribute='us3')
 
     def _GetStopSpec(self):
         stopSpec = {'max_iterations': self.Iterations,
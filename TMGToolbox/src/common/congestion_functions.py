@@ -0,0 +1,206 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Generation of conical transit congestion functions, by transit time function (ttf).
+
+For each ttf, the congestion cost is
+
+    weight * (1 + sqrt(alpha^2 * (1 - v/c)^2 + beta^2) - alpha * (1 - v/c) - beta)
+
+where beta = (2 * alpha - 1) / (2 * alpha - 2). The generated custom function looks up
+precomputed coefficients by ttf in a dictionary, instead of testing every ttf value in
+an if/elif chain. Emme calls custom congestion functions one segment at a time, so the
+array version (congestion_costs) is for offline use and parity checks.
+
+Parameters are given as a list of (ttf, weight, exponent) tuples, as parsed from the
+'ttf:perception:exponent' strings of the FBTA tools.
+"""
+
+import inro.modeller as _m
+import numpy as np
+
+_MODELLER = _m.Modeller()
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Congestion Functions",
+                                description="Collection of private functions for generating conical \
+                                        transit congestion functions.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+def conical_coefficients(weight, alpha):
+    """Returns the (weight, alpha^2, beta^2, alpha, beta) coefficients of a conical function."""
+    alpha = float(alpha)
+    beta = (2 * alpha - 1) / (2 * alpha - 2)
+    return (float(weight), alpha ** 2, beta ** 2, alpha, beta)
+
+
+def coefficient_table(parameters):
+    """
+    Returns a dictionary of ttf : coefficients (see conical_coefficients). If a ttf is
+    repeated, its first parameters are used, as with the original if/elif chain.
+    """
+    table = {}
+    for ttf, weight, exponent in parameters:
+        ttf = int(ttf)
+        if ttf not in table:
+            table[ttf] = conical_coefficients(weight, exponent)
+    return table
+
+
+_FUNCTION_TEMPLATE = """import math
+_COEFFICIENTS = {table}
+def calc_segment_cost(transit_volume, capacity, segment):
+    try:
+        weight, alpha_square, beta_square, alpha, beta = _COEFFICIENTS[segment.transit_time_func]
+    except KeyError:
+        raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)
+    ratio = 1 - transit_volume / capacity
+    return weight * (1 + math.sqrt(alpha_square * ratio ** 2 + beta_square) - alpha * ratio - beta)
+"""
+
+
+def generate_function_source(parameters):
+    """Returns the source of a lookup-table calc_segment_cost custom congestion function."""
+    table = coefficient_table(parameters)
+    entries = ", ".join("%d: (%r, %r, %r, %r, %r)" % ((ttf,) + table[ttf]) for ttf in sorted(table))
+    return _FUNCTION_TEMPLATE.format(table="{" + entries + "}")
+
+
+def generate_chain_source(parameters):
+    """
+    Returns the source of the original if/elif calc_segment_cost function, which
+    recomputes the coefficients for every call. Kept as the reference for parity checks.
+    """
+    source = "import math \ndef calc_segment_cost(transit_volume, capacity, segment): "
+    for count, (ttf, weight, exponent) in enumerate(parameters):
+        alpha = float(exponent)
+        beta = (2 * alpha - 1) / (2 * alpha - 2)
+        keyword = "if" if count == 0 else "elif"
+        source += """
+    %s segment.transit_time_func == %s:
+        return (%s * (1 + math.sqrt(%s *
+            (1 - transit_volume / capacity) ** 2 + %s) - %s
+            * (1 - transit_volume / capacity) - %s))""" % (keyword, ttf, weight, str(alpha ** 2),
+                                                          str(beta ** 2), str(alpha), str(beta))
+    source += """
+    else:
+        raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)"""
+    return source
+
+
+def compile_function(source):
+    """Compiles the source of a custom congestion function, and returns calc_segment_cost."""
+    namespace = {}
+    exec(compile(source, '<congestion function>', 'exec'), namespace)
+    return namespace['calc_segment_cost']
+
+
+def get_function_spec(parameters, assignment_period, congestion_attribute="us3"):
+    """Returns the CUSTOM congestion function specification for the congested transit assignment."""
+    return {
+        "type": "CUSTOM",
+        "assignment_period": assignment_period,
+        "orig_func": False,
+        "congestion_attribute": congestion_attribute,
+        "python_function": generate_function_source(parameters)
+    }
+
+# -------------------------------------------------------------------------------------------
+
+
+def congestion_costs(transit_volumes, capacities, ttfs, parameters):
+    """
+    Computes congestion costs for arrays of segments.
+
+    Args:
+        - transit_volumes: Array of segment transit volumes
+        - capacities: Array of segment capacities
+        - ttfs: Array of segment transit time functions
+        - parameters: List of (ttf, weight, exponent)
+
+    Returns: An array of congestion costs.
+
+    Raises: KeyError if a ttf has no parameters.
+    """
+    table = coefficient_table(parameters)
+    keys = np.array(sorted(table), dtype=np.int64)
+    columns = np.array([table[key] for key in keys], dtype=np.float64).reshape(-1, 5)
+
+    ttfs = np.asarray(ttfs, dtype=np.int64)
+    if len(keys) == 0:
+        positions = np.zeros(len(ttfs), dtype=np.int64)
+        missing = np.ones(len(ttfs), dtype=bool)
+    else:
+        positions = np.minimum(np.searchsorted(keys, ttfs), len(keys) - 1)
+        missing = keys[positions] != ttfs
+    if np.any(missing):
+        raise KeyError("ttf=%s congestion values not defined in input" % ttfs[missing][0])
+
+    weight, alpha_square, beta_square, alpha, beta = (columns[positions, i] for i in range(5))
+    ratio = 1 - np.asarray(transit_volumes, dtype=np.float64) / np.asarray(capacities, dtype=np.float64)
+    return weight * (1 + np.sqrt(alpha_square * ratio ** 2 + beta_square) - alpha * ratio - beta)
+
+
+class _Segment(object):
+    __slots__ = ['transit_time_func']
+
+    def __init__(self, ttf):
+        self.transit_time_func = ttf
+
+
+def check_parity(parameters, ratios=None, capacity=100.0):
+    """
+    Compares the lookup-table function, the original if/elif function, and the array
+    version over a sweep of volume / capacity ratios, for every ttf.
+
+    Args:
+        - parameters: List of (ttf, weight, exponent)
+        - ratios (=None): Volume / capacity ratios to test. Defaults to 0 to 3, by 0.01.
+        - capacity (=100.0): The segment capacity used
+
+    Returns: A dictionary with the largest absolute differences of the lookup function
+        ('lookup') and the array version ('array') from the original function.
+    """
+    if ratios is None:
+        ratios = np.linspace(0.0, 3.0, 301)
+    lookup = compile_function(generate_function_source(parameters))
+    chain = compile_function(generate_chain_source(parameters))
+
+    ttfs = sorted(coefficient_table(parameters))
+    volumes = np.asarray(ratios, dtype=np.float64) * capacity
+    lookup_difference = 0.0
+    array_difference = 0.0
+    for ttf in ttfs:
+        segment = _Segment(ttf)
+        expected = np.array([chain(volume, capacity, segment) for volume in volumes])
+        lookup_values = np.array([lookup(volume, capacity, segment) for volume in volumes])
+        array_values = congestion_costs(volumes, np.full(len(volumes), capacity), np.full(len(volumes), ttf),
+                                       parameters)
+        lookup_difference = max(lookup_difference, float(np.abs(lookup_values - expected).max()))
+        array_difference = max(array_difference, float(np.abs(array_values - expected).max()))
+    return {'lookup': lookup_difference, 'array': array_difference}
@@ -0,0 +1,355 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Validation of centroid connectors, evaluated on arrays of the network.
+
+Connectors are the links leaving a centroid. For each connector, the 'second links'
+are the links leaving its j-node, except those back to the connector's own zone and
+those flagged as infeasible (e.g. transfer links). They are found through the CSR
+out-incidence of network_arrays.LinkIncidence, and every rule is evaluated on them
+as an array predicate:
+    - at intersection: more than 2 second links lead to regular nodes
+    - to centroid: a second link leads to another centroid
+    - dead end: no second link leads to a regular node
+    - mode mismatch: the connector allows modes which no second link to a regular
+        node allows
+
+Results are summarized by zone (number of connectors, connectors at intersections,
+connectors to other centroids, minimum connector length, dead ends and mode
+mismatches). Reports are written as CSV (one row per zone) or GeoJSON (one
+LineString per connector), and the reports of two scenarios can be compared to list
+the zones and connectors which changed.
+"""
+
+import json
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+_util = _MODELLER.module('tmg.common.utilities')
+_netArrays = _MODELLER.module('tmg.common.network_arrays')
+_selection = _MODELLER.module('tmg.common.selection_expressions')
+
+#: Zone metrics, in report order
+ZONE_METRICS = ('connectors', 'intersections', 'centroid_connections', 'min_length', 'dead_ends',
+                'mode_mismatches')
+
+#: Zone metric tested by each criteria of the Validate Connectors tool
+CRITERIA_METRICS = {1: 'connectors', 2: 'intersections', 3: 'centroid_connections', 4: 'min_length'}
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Connector Validation",
+                                description="Collection of private functions for validating centroid \
+                                        connectors with array operations.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class ConnectorReport(object):
+    """
+    Results of validate_connectors.
+
+    Attributes:
+        - zones: Sorted array of the validated zone numbers
+        - connectors: Dictionary of connector arrays, aligned with each other: 'zone', 'i',
+            'j', 'length', 'degree' (second links to regular nodes), and the rule flags
+            'at_intersection', 'to_centroid', 'dead_end' and 'mode_mismatch'
+        - missing_modes: List of the mode ids of each connector which no second link allows
+        - metrics: Dictionary of zone metric (see ZONE_METRICS) : array aligned with zones.
+            Zones without connectors have a 'min_length' of inf.
+    """
+
+    def __init__(self, zones, connectors, missing_modes, metrics):
+        self.zones = zones
+        self.connectors = connectors
+        self.missing_modes = missing_modes
+        self.metrics = metrics
+
+    def flags(self, criteria, cutoff):
+        """
+        Returns a boolean array aligned with zones, flagging the zones which meet a
+        criteria of the Validate Connectors tool (1: fewer connectors than the cutoff;
+        2, 3, 4: more intersections, centroid connections or minimum length than the cutoff).
+        """
+        values = self.metrics[CRITERIA_METRICS[criteria]]
+        if criteria == 1:
+            return values < cutoff
+        return values > cutoff
+
+
+def _second_links(incidence, connectors):
+    # Expands every connector into the links leaving its j-node, using the CSR out-incidence
+    j_positions = incidence.j_positions[connectors]
+    starts = incidence.out_offsets[j_positions]
+    counts = incidence.out_offsets[j_positions + 1] - starts
+    owners = np.repeat(np.arange(len(connectors), dtype=np.int64), counts)
+    first = np.cumsum(counts) - counts
+    offsets = np.arange(len(owners), dtype=np.int64) - np.repeat(first, counts)
+    return owners, incidence.out_links[np.repeat(starts, counts) + offsets]
+
+
+def validate_connectors(node_numbers, centroid_numbers, links, infeasible=None, zones=None, mode_ids=None):
+    """
+    Evaluates every connector rule in one pass over the network arrays.
+
+    Args:
+        - node_numbers: Sorted array of node numbers
+        - centroid_numbers: Sorted array of centroid numbers
+        - links: LinkArrays with a 'length' attribute, and a 'modes' bitmask attribute
+            (see network_arrays.load_link_modes) to check mode mismatches
+        - infeasible (=None): Boolean array aligned with links, True for links which do
+            not count as second links
+        - zones (=None): Array of the zone numbers to validate. Defaults to all centroids.
+        - mode_ids (=None): The mode ids of the bits of links['modes'], to report the
+            missing modes of each connector
+
+    Returns: A ConnectorReport.
+    """
+    centroid_numbers = np.sort(np.asarray(centroid_numbers, dtype=np.int64))
+    zones = centroid_numbers if zones is None else np.unique(np.asarray(zones, dtype=np.int64))
+    if infeasible is None:
+        infeasible = np.zeros(len(links), dtype=bool)
+    has_modes = 'modes' in links.attributes
+    modes = links['modes'] if has_modes else np.zeros(len(links), dtype=np.int64)
+
+    incidence = _netArrays.LinkIncidence(node_numbers, links)
+    connectors = np.nonzero(_netArrays.is_member(links.i, zones))[0]
+    connector_count = len(connectors)
+
+    owners, second = _second_links(incidence, connectors)
+    feasible = ~infeasible[second] & (links.j[second] != links.i[connectors][owners])
+    to_centroid = _netArrays.is_member(links.j[second], centroid_numbers)
+    to_network = feasible & ~to_centroid
+
+    degree = np.bincount(owners[to_network], minlength=connector_count)
+    reaches_centroid = np.bincount(owners[feasible & to_centroid], minlength=connector_count) > 0
+    onward_modes = np.zeros(connector_count, dtype=np.int64)
+    np.bitwise_or.at(onward_modes, owners[to_network], modes[second][to_network])
+    missing = modes[connectors] & ~onward_modes
+    mode_mismatch = (missing != 0) & has_modes
+
+    connector_arrays = {
+        'zone': links.i[connectors],
+        'i': links.i[connectors],
+        'j': links.j[connectors],
+        'length': np.asarray(links['length'], dtype=np.float64)[connectors],
+        'degree': degree,
+        'at_intersection': degree > 2,
+        'to_centroid': reaches_centroid,
+        'dead_end': degree == 0,
+        'mode_mismatch': mode_mismatch
+    }
+    missing_modes = [[mode_id for bit, mode_id in enumerate(mode_ids or ()) if value & (1 << bit)]
+                     for value in missing]
+
+    zone_positions = np.searchsorted(zones, connector_arrays['zone'])
+    zone_count = len(zones)
+    min_length = np.full(zone_count, np.inf)
+    np.minimum.at(min_length, zone_positions, connector_arrays['length'])
+    metrics = {
+        'connectors': np.bincount(zone_positions, minlength=zone_count),
+        'intersections': np.bincount(zone_positions[connector_arrays['at_intersection']], minlength=zone_count),
+        'centroid_connections': np.bincount(zone_positions[reaches_centroid], minlength=zone_count),
+        'min_length': min_length,
+        'dead_ends': np.bincount(zone_positions[connector_arrays['dead_end']], minlength=zone_count),
+        'mode_mismatches': np.bincount(zone_positions[mode_mismatch], minlength=zone_count)
+    }
+    return ConnectorReport(zones, connector_arrays, missing_modes, metrics)
+
+
+def load_connector_report(scenario, infeasible_selector=None, zone_attribute=None):
+    """
+    Validates the connectors of a scenario.
+
+    Args:
+        - scenario: The Emme Scenario
+        - infeasible_selector (=None): Link selection expression of the links which do not
+            count as second links. Evaluated with selection_expressions, falling back to
+            the Network Calculator.
+        - zone_attribute (=None): NODE attribute flagging the zones to validate (non-zero).
+            Defaults to all zones.
+
+    Returns: A tuple of (ConnectorReport, node numbers, node x coordinates, node y coordinates).
+    """
+    network = scenario.get_partial_network(['LINK'], include_attributes=True)
+    mode_ids = [mode.id for mode in network.modes()]
+    links = _netArrays.load_link_modes(network, mode_ids, ['length'])
+
+    node_attributes = ['x', 'y'] + ([zone_attribute] if zone_attribute else [])
+    node_numbers, node_tables = _netArrays.load_node_arrays(scenario, node_attributes)
+    centroid_numbers = _netArrays.load_centroid_numbers(scenario)
+    zones = None
+    if zone_attribute:
+        selected = node_tables[zone_attribute] != 0
+        zones = node_numbers[selected & _netArrays.is_member(node_numbers, centroid_numbers)]
+
+    infeasible = None
+    if infeasible_selector:
+        infeasible = _infeasible_links(scenario, links, node_numbers, infeasible_selector)
+
+    report = validate_connectors(node_numbers, centroid_numbers, links, infeasible, zones, mode_ids)
+    return report, node_numbers, node_tables['x'], node_tables['y']
+
+
+def _infeasible_links(scenario, links, node_numbers, expression):
+    incidence = _netArrays.LinkIncidence(node_numbers, links)
+    try:
+        selector = _selection.NetworkSelector(scenario)
+        mask = selector.link_mask(expression)
+        selected_i, selected_j = selector.link_i[mask], selector.link_j[mask]
+    except _selection.SelectionSyntaxError:
+        with _util.tempExtraAttributeMANAGER(scenario, 'LINK') as marker:
+            spec = {
+                "result": marker.id,
+                "expression": "1",
+                "aggregation": None,
+                "selections": {
+                    "link": expression
+                },
+                "type": "NETWORK_CALCULATION"
+            }
+            _MODELLER.tool("inro.emme.network_calculation.network_calculator")(spec, scenario=scenario)
+            marked = _netArrays.load_link_arrays(scenario, [marker.id])
+        selected = marked[marker.id] != 0
+        selected_i, selected_j = marked.i[selected], marked.j[selected]
+
+    infeasible = np.zeros(len(links), dtype=bool)
+    positions = incidence.find(_netArrays.node_positions(node_numbers, selected_i),
+                               _netArrays.node_positions(node_numbers, selected_j))
+    infeasible[positions[positions >= 0]] = True
+    return infeasible
+
+# -------------------------------------------------------------------------------------------
+
+
+def _metric_value(value):
+    value = float(value)
+    if np.isinf(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def write_zone_csv(filepath, report, flags=None):
+    """Writes one row per zone, with its metrics and (optionally) whether it was flagged."""
+    with _util.open_csv_writer(filepath) as writer:
+        header = ['zone'] + list(ZONE_METRICS)
+        if flags is not None:
+            header.append('flagged')
+        writer.writerow(header)
+        for position, zone in enumerate(report.zones):
+            row = [int(zone)] + [_metric_value(report.metrics[metric][position]) for metric in ZONE_METRICS]
+            if flags is not None:
+                row.append(int(flags[position]))
+            writer.writerow(row)
+
+
+def write_connector_geojson(filepath, report, node_numbers, x, y, flags=None):
+    """
+    Writes a GeoJSON FeatureCollection with one LineString per connector, with its rule
+    flags and (optionally) whether its zone was flagged.
+    """
+    i_positions = _netArrays.node_positions(node_numbers, report.connectors['i'])
+    j_positions = _netArrays.node_positions(node_numbers, report.connectors['j'])
+    zone_flags = None
+    if flags is not None:
+        zone_flags = np.asarray(flags)[np.searchsorted(report.zones, report.connectors['zone'])]
+
+    features = []
+    for index in six.moves.range(len(i_positions)):
+        properties = {
+            'zone': int(report.connectors['zone'][index]),
+            'i': int(report.connectors['i'][index]),
+            'j': int(report.connectors['j'][index]),
+            'length': float(report.connectors['length'][index]),
+            'degree': int(report.connectors['degree'][index]),
+            'missing_modes': ''.join(report.missing_modes[index])
+        }
+        for rule in ('at_intersection', 'to_centroid', 'dead_end', 'mode_mismatch'):
+            properties[rule] = bool(report.connectors[rule][index])
+        if zone_flags is not None:
+            properties['zone_flagged'] = bool(zone_flags[index])
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': [[float(x[i_positions[index]]), float(y[i_positions[index]])],
+                                [float(x[j_positions[index]]), float(y[j_positions[index]])]]
+            },
+            'properties': properties
+        })
+    with open(filepath, 'w') as writer:
+        json.dump({'type': 'FeatureCollection', 'features': features}, writer)
+
+
+def write_report(filepath, report, node_numbers, x, y, flags=None):
+    """Writes the report as GeoJSON if the file ends with .geojson or .json, or as CSV otherwise."""
+    if filepath.lower().endswith(('.geojson', '.json')):
+        write_connector_geojson(filepath, report, node_numbers, x, y, flags)
+    else:
+        write_zone_csv(filepath, report, flags)
+
+# -------------------------------------------------------------------------------------------
+
+
+def compare_reports(base, other):
+    """
+    Lists the differences between the connector reports of two scenarios.
+
+    Returns: A list of (zone, item, base value, other value) tuples, sorted by zone. Items
+        are zone metrics (None for a zone missing from one report, or without connectors
+        for 'min_length'), or 'connector i-j' with values 1 (present) or 0 (absent).
+    """
+    differences = []
+    zones = np.union1d(base.zones, other.zones)
+    base_positions = dict((int(zone), position) for position, zone in enumerate(base.zones))
+    other_positions = dict((int(zone), position) for position, zone in enumerate(other.zones))
+    for zone in zones:
+        zone = int(zone)
+        for metric in ZONE_METRICS:
+            base_value = _metric_value(base.metrics[metric][base_positions[zone]]) \
+                if zone in base_positions else None
+            other_value = _metric_value(other.metrics[metric][other_positions[zone]]) \
+                if zone in other_positions else None
+            if base_value != other_value:
+                differences.append((zone, metric, base_value, other_value))
+
+    base_connectors = set(zip(base.connectors['i'].tolist(), base.connectors['j'].tolist()))
+    other_connectors = set(zip(other.connectors['i'].tolist(), other.connectors['j'].tolist()))
+    for i, j in base_connectors ^ other_connectors:
+        present = (i, j) in base_connectors
+        differences.append((i, 'connector %s-%s' % (i, j), int(present), int(not present)))
+    differences.sort(key=lambda row: (row[0], row[1]))
+    return differences
+
+
+def write_differences(filepath, differences):
+    """Writes the differences from compare_reports as CSV."""
+    with _util.open_csv_writer(filepath) as writer:
+        writer.writerow(['zone', 'item', 'base', 'compared'])
+        for row in differences:
+            writer.writerow(row)
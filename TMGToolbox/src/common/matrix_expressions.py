@@ -0,0 +1,524 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+In-memory evaluation of chains of Matrix Calculator expressions, using NumPy.
+
+A MatrixPipeline is a list of MatrixCalculation steps (one result and one expression
+each, optionally constrained by value). The matrices used by the chain are read once,
+every step is evaluated in memory, and only the final outputs are written back.
+Evaluation is done in blocks of rows, over several threads; each thread runs the whole
+chain on its block, so intermediate matrices are never held in full.
+
+Supported expression syntax (the subset used by the TMG LOS tools):
+    - Numbers, and matrix ids (mf, mo, md and ms)
+    - Arithmetic: +, -, *, / (division by zero gives 0), ^ and unary -
+    - Comparisons: <, <=, >, >=, ==, != (giving 1 or 0)
+    - Logical: &&, ||, and unary ! (giving 1 or 0)
+    - Binary .max. and .min. (e.g. "(mf1 - mf2).max.0"), with a lower precedence
+        than + and -
+    - Parentheses
+"""
+
+from multiprocessing.pool import ThreadPool
+from multiprocessing import cpu_count
+import re
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Matrix Expressions",
+                                description="Collection of private functions for evaluating chains of \
+                                        Matrix Calculator expressions in memory.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class ExpressionSyntaxError(Exception):
+    pass
+
+
+_TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+        |(?P<matrix>m[fods]\d+)
+        |(?P<dotop>\.(?:max|min)\.)
+        |(?P<op>&&|\|\||<=|>=|==|!=|[-+*/^<>!()])
+    )""", re.VERBOSE | re.IGNORECASE)
+
+_BINARY_LEVELS = [
+    ('||',),
+    ('&&',),
+    ('<', '<=', '>', '>=', '==', '!='),
+    ('.max.', '.min.'),
+    ('+', '-'),
+    ('*', '/')
+]
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    text = expression.rstrip()
+    while position < len(text):
+        match = _TOKEN_REGEX.match(text, position)
+        if match is None or match.end() == position:
+            raise ExpressionSyntaxError("Unexpected character at position %s of '%s'" % (position, expression))
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            tokens.append(('number', float(value)))
+        elif kind == 'matrix':
+            tokens.append(('matrix', value.lower()))
+        else:
+            tokens.append(('op', value.lower()))
+    return tokens
+
+
+class _Parser(object):
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def _take(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionSyntaxError("Empty expression")
+        tree = self._binary(0)
+        if self.position != len(self.tokens):
+            raise ExpressionSyntaxError("Unexpected '%s' in '%s'" % (self._peek()[1], self.expression))
+        return tree
+
+    def _binary(self, level):
+        if level == len(_BINARY_LEVELS):
+            return self._unary()
+        left = self._binary(level + 1)
+        while True:
+            kind, value = self._peek()
+            if kind != 'op' or value not in _BINARY_LEVELS[level]:
+                return left
+            self._take()
+            right = self._binary(level + 1)
+            left = ('binary', value, left, right)
+
+    def _unary(self):
+        kind, value = self._peek()
+        if kind == 'op' and value in ('-', '+', '!'):
+            self._take()
+            return ('unary', value, self._unary())
+        return self._power()
+
+    def _power(self):
+        # ^ binds tighter than unary operators, and is right-associative
+        base = self._primary()
+        if self._peek() == ('op', '^'):
+            self._take()
+            return ('binary', '^', base, self._unary())
+        return base
+
+    def _primary(self):
+        kind, value = self._take()
+        if kind is None:
+            raise ExpressionSyntaxError("Unexpected end of '%s'" % self.expression)
+        if kind == 'number':
+            return ('number', value)
+        if kind == 'matrix':
+            return ('matrix', value)
+        if kind == 'op' and value == '(':
+            tree = self._binary(0)
+            if self._take() != ('op', ')'):
+                raise ExpressionSyntaxError("Missing ')' in '%s'" % self.expression)
+            return tree
+        raise ExpressionSyntaxError("Unexpected '%s' in '%s'" % (value, self.expression))
+
+
+def parse(expression):
+    """
+    Parses a Matrix Calculator expression.
+
+    Returns: A nested tuple tree of ('number', value), ('matrix', id),
+        ('unary', op, operand) and ('binary', op, left, right) nodes.
+
+    Raises: ExpressionSyntaxError
+    """
+    return _Parser(str(expression)).parse()
+
+
+def matrices_used(tree):
+    """Returns the set of matrix ids referenced by a parsed expression."""
+    if tree[0] == 'matrix':
+        return set([tree[1]])
+    if tree[0] == 'unary':
+        return matrices_used(tree[2])
+    if tree[0] == 'binary':
+        return matrices_used(tree[2]) | matrices_used(tree[3])
+    return set()
+
+
+def _divide(left, right):
+    left, right = np.broadcast_arrays(np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64))
+    result = np.zeros(left.shape)
+    np.divide(left, right, out=result, where=right != 0)
+    return result
+
+
+_BINARY_FUNCTIONS = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': _divide,
+    '^': np.power,
+    '.max.': np.maximum,
+    '.min.': np.minimum,
+    '<': lambda a, b: np.less(a, b).astype(np.float64),
+    '<=': lambda a, b: np.less_equal(a, b).astype(np.float64),
+    '>': lambda a, b: np.greater(a, b).astype(np.float64),
+    '>=': lambda a, b: np.greater_equal(a, b).astype(np.float64),
+    '==': lambda a, b: np.equal(a, b).astype(np.float64),
+    '!=': lambda a, b: np.not_equal(a, b).astype(np.float64),
+    '&&': lambda a, b: np.logical_and(a, b).astype(np.float64),
+    '||': lambda a, b: np.logical_or(a, b).astype(np.float64)
+}
+
+_UNARY_FUNCTIONS = {
+    '-': np.negative,
+    '+': lambda a: a,
+    '!': lambda a: np.logical_not(a).astype(np.float64)
+}
+
+
+def evaluate(tree, lookup):
+    """
+    Evaluates a parsed expression.
+
+    Args:
+        - tree: A parsed expression (see parse)
+        - lookup: Function returning the array (or scalar) of a matrix id
+
+    Returns: The result, broadcast from the matrices used.
+    """
+    kind = tree[0]
+    if kind == 'number':
+        return tree[1]
+    if kind == 'matrix':
+        return lookup(tree[1])
+    if kind == 'unary':
+        return _UNARY_FUNCTIONS[tree[1]](evaluate(tree[2], lookup))
+    return _BINARY_FUNCTIONS[tree[1]](evaluate(tree[2], lookup), evaluate(tree[3], lookup))
+
+# -------------------------------------------------------------------------------------------
+
+
+class MatrixCalculation(object):
+    """
+    One Matrix Calculator step.
+
+    Attributes:
+        - result: The result matrix id (a full matrix)
+        - expression: The expression string
+        - constraint: None, or a tuple of (od_values matrix id, interval_min, interval_max,
+            include flag). Cells outside the constraint keep their current result values.
+    """
+
+    def __init__(self, result, expression, constraint=None):
+        result = str(result).lower()
+        if not result.startswith('mf'):
+            raise ValueError("Only full matrix results are supported, got '%s'" % result)
+        self.result = result
+        self.expression = str(expression)
+        self.tree = parse(self.expression)
+        self.constraint = constraint
+
+    @staticmethod
+    def from_spec(spec):
+        """
+        Creates a step from a MATRIX_CALCULATION specification. Constraints by value are
+        supported; constraints by zone and aggregations are not.
+
+        Raises: ValueError for unsupported specifications
+        """
+        constraint = spec.get('constraint') or {}
+        if constraint.get('by_zone'):
+            raise ValueError("Constraints by zone are not supported")
+        aggregation = spec.get('aggregation') or {}
+        if aggregation.get('origins') or aggregation.get('destinations'):
+            raise ValueError("Aggregations are not supported")
+
+        byValue = constraint.get('by_value')
+        if byValue:
+            byValue = (str(byValue['od_values']).lower(), float(byValue['interval_min']),
+                       float(byValue['interval_max']), byValue.get('condition', 'INCLUDE').upper() == 'INCLUDE')
+        return MatrixCalculation(spec['result'], spec['expression'], byValue)
+
+    def matrices_used(self):
+        used = matrices_used(self.tree)
+        if self.constraint is not None:
+            used.add(self.constraint[0])
+        return used
+
+    def to_spec(self):
+        """Returns the equivalent MATRIX_CALCULATION specification."""
+        byValue = None
+        if self.constraint is not None:
+            odValues, low, high, include = self.constraint
+            byValue = {
+                "interval_min": low,
+                "interval_max": high,
+                "condition": "INCLUDE" if include else "EXCLUDE",
+                "od_values": odValues
+            }
+        return {
+            "expression": self.expression,
+            "result": self.result,
+            "constraint": {
+                "by_value": byValue,
+                "by_zone": None
+            },
+            "aggregation": {
+                "origins": None,
+                "destinations": None
+            },
+            "type": "MATRIX_CALCULATION"
+        }
+
+
+class MatrixPipeline(object):
+    """
+    A chain of MatrixCalculation steps, evaluated in order.
+
+    Attributes:
+        - steps: List of MatrixCalculation
+        - inputs: Sorted list of the matrix ids read before being written
+        - outputs: Sorted list of the result matrix ids which are kept (i.e. not temporary)
+    """
+
+    BLOCK_ROWS = 256
+
+    def __init__(self, steps=None, temporaries=()):
+        self.steps = []
+        self._temporaries = set(str(id).lower() for id in temporaries)
+        for step in (steps or []):
+            self.add(step)
+
+    def add(self, step, expression=None, constraint=None):
+        """
+        Adds a step, which can be a MatrixCalculation, a MATRIX_CALCULATION specification,
+        or a result id (with an expression and optional constraint).
+
+        Returns: self
+        """
+        if isinstance(step, dict):
+            step = MatrixCalculation.from_spec(step)
+        elif not isinstance(step, MatrixCalculation):
+            step = MatrixCalculation(step, expression, constraint)
+        self.steps.append(step)
+        return self
+
+    def add_temporary(self, matrix_id):
+        """Flags a result matrix as temporary, so that it is not written back."""
+        self._temporaries.add(str(matrix_id).lower())
+
+    @property
+    def inputs(self):
+        written = set()
+        inputs = set()
+        for step in self.steps:
+            inputs |= (step.matrices_used() - written)
+            if step.constraint is not None and step.result not in written:
+                inputs.add(step.result) # Unconstrained cells keep the current values
+            written.add(step.result)
+        return sorted(inputs)
+
+    @property
+    def outputs(self):
+        return sorted(set(step.result for step in self.steps) - self._temporaries)
+
+    def _run_block(self, rows, arrays, results, zones):
+        def block(id):
+            value = arrays[id]
+            if id.startswith('mf') or id.startswith('mo'):
+                return value[rows]
+            return value
+
+        computed = {}
+
+        def lookup(id):
+            if id in computed:
+                return computed[id]
+            if id not in arrays:
+                raise KeyError("Matrix '%s' was not provided" % id)
+            return block(id)
+
+        shape = (rows.stop - rows.start, zones)
+        for step in self.steps:
+            value = np.broadcast_to(np.asarray(evaluate(step.tree, lookup), dtype=np.float64), shape)
+            if step.constraint is not None:
+                odValues, low, high, include = step.constraint
+                constrained = np.broadcast_to(lookup(odValues), shape)
+                mask = (constrained >= low) & (constrained <= high)
+                if not include:
+                    mask = ~mask
+                value = np.where(mask, value, lookup(step.result))
+            computed[step.result] = value
+
+        for id in results:
+            results[id][rows] = computed[id]
+
+    def run(self, arrays, zones=None, num_threads=None):
+        """
+        Evaluates the pipeline on in-memory matrices.
+
+        Args:
+            - arrays: Dictionary of matrix id : array. Full matrices have shape
+                (zones, zones), origin matrices (zones,) or (zones, 1), destination matrices
+                (zones,) or (1, zones), and scalar matrices are numbers.
+            - zones (=None): Number of zones. Taken from the first full matrix if omitted.
+            - num_threads (=None): Number of threads, defaults to the number of processors.
+
+        Returns: A dictionary of output matrix id : array of shape (zones, zones).
+        """
+        prepared = {}
+        for id, value in six.iteritems(arrays):
+            id = str(id).lower()
+            if id.startswith('mo'):
+                value = np.asarray(value, dtype=np.float64).reshape(-1, 1)
+            elif id.startswith('md'):
+                value = np.asarray(value, dtype=np.float64).reshape(1, -1)
+            elif id.startswith('ms'):
+                value = float(value)
+            else:
+                value = np.asarray(value, dtype=np.float64)
+                if zones is None:
+                    zones = value.shape[0]
+            prepared[id] = value
+        if zones is None:
+            raise ValueError("The number of zones could not be determined")
+
+        results = dict((id, np.zeros((zones, zones))) for id in self.outputs)
+        blocks = [slice(start, min(start + self.BLOCK_ROWS, zones))
+                  for start in six.moves.range(0, zones, self.BLOCK_ROWS)]
+        num_threads = min(num_threads or cpu_count(), len(blocks))
+        if num_threads <= 1:
+            for rows in blocks:
+                self._run_block(rows, prepared, results, zones)
+        else:
+            pool = ThreadPool(num_threads)
+            try:
+                pool.map(lambda rows: self._run_block(rows, prepared, results, zones), blocks)
+            finally:
+                pool.close()
+                pool.join()
+        return results
+
+    def run_on_emmebank(self, scenario, num_threads=None):
+        """
+        Reads the input matrices of the pipeline from the Emmebank, evaluates it, and writes
+        back the outputs.
+
+        Returns: The list of output matrix ids written.
+        """
+        emmebank = scenario.emmebank
+        arrays = {}
+        for id in self.inputs:
+            matrix = emmebank.matrix(id)
+            if matrix is None:
+                raise KeyError("Matrix '%s' does not exist" % id)
+            if id.startswith('ms'):
+                arrays[id] = matrix.data
+            else:
+                arrays[id] = matrix.get_numpy_data(scenario_id=scenario.id)
+        zones = len(scenario.zone_numbers)
+
+        results = self.run(arrays, zones=zones, num_threads=num_threads)
+        for id, values in six.iteritems(results):
+            matrix = emmebank.matrix(id)
+            if matrix is None:
+                raise KeyError("Matrix '%s' does not exist" % id)
+            matrix.set_numpy_data(values, scenario_id=scenario.id)
+        return sorted(results)
+
+    def run_sequential(self, arrays):
+        """
+        Reference evaluation, one whole-matrix step at a time (as separate Matrix Calculator
+        runs would). Returns all results, including temporaries.
+        """
+        current = dict((str(id).lower(), value) for id, value in six.iteritems(arrays))
+        zones = None
+        for id, value in six.iteritems(current):
+            if id.startswith('mf'):
+                zones = np.shape(value)[0]
+                break
+        pipeline = MatrixPipeline()
+        for step in self.steps:
+            pipeline.steps = [step]
+            if step.result not in current and zones is not None:
+                current[step.result] = np.zeros((zones, zones))
+            current.update(pipeline.run(current, zones=zones, num_threads=1))
+        return dict((step.result, current[step.result]) for step in self.steps)
+
+
+def validate(pipeline, inputs, expected, tolerance=1e-6, num_threads=None):
+    """
+    Compares the outputs of a pipeline against recorded results.
+
+    Args:
+        - pipeline: A MatrixPipeline
+        - inputs: Dictionary of matrix id : recorded input values
+        - expected: Dictionary of matrix id : recorded output values
+        - tolerance (=1e-6): Largest allowed absolute difference
+
+    Returns: A dictionary of matrix id : largest absolute difference, for each matrix
+        outside the tolerance (empty if they all match).
+    """
+    results = pipeline.run(inputs, num_threads=num_threads)
+    failures = {}
+    for id, values in six.iteritems(expected):
+        id = str(id).lower()
+        difference = float(np.abs(results[id] - np.asarray(values)).max())
+        if difference > tolerance:
+            failures[id] = difference
+    return failures
+
+
+def load_recorded_matrices(filepath):
+    """Loads recorded matrices saved with numpy.savez (one array per matrix id)."""
+    with np.load(filepath) as data:
+        return dict((str(id).lower(), data[id]) for id in data.files)
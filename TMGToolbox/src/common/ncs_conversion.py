@@ -0,0 +1,484 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Conversion of networks between network coding standards (NCS), driven by mapping files.
+
+All the mapping files (zone and station centroids, mode codes, link attributes, transit
+vehicles, lane capacities and transit line codes) are loaded into one ConversionMapping,
+which can be reused for any number of scenarios. validate_mapping checks the mapping
+against a network for collisions (two elements mapped to the same number or id, or onto
+an element which is kept) and gaps (elements which are not in the network, centroid
+ranges of different lengths), before anything is changed. convert_network then applies
+the mapping:
+    - centroids are renumbered through a temporary offset, so numbers can be swapped
+    - modes and transit lines are renamed in an order which never reuses an id still
+        in use, going through a temporary id for cycles
+    - lane capacities are looked up for all links at once, from arrays of the link
+        volume delay functions
+Every change is recorded in an AuditLog; the logs of several scenarios can be written
+to one CSV file with write_audit_logs.
+"""
+
+import csv
+import string
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+_util = _MODELLER.module('tmg.common.utilities')
+_netArrays = _MODELLER.module('tmg.common.network_arrays')
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="NCS Conversion",
+                                description="Collection of private functions for converting networks \
+                                        between network coding standards.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class MappingError(Exception):
+    """Raised when a mapping can't be applied to a network. Lists every problem found."""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        Exception.__init__(self, "%s problem(s) found in the conversion files:\n%s"
+                           % (len(self.problems), "\n".join(self.problems)))
+
+
+class AuditLog(object):
+    """Record of every change made by a conversion, as (category, element, attribute, old, new) rows."""
+
+    def __init__(self):
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def record(self, category, element, attribute, old_value, new_value):
+        self.rows.append((category, element, attribute, old_value, new_value))
+
+    def counts(self):
+        """Returns a dictionary of category : number of changes."""
+        counts = {}
+        for row in self.rows:
+            counts[row[0]] = counts.get(row[0], 0) + 1
+        return counts
+
+
+class ConversionMapping(object):
+    """
+    The contents of all the mapping files.
+
+    Attributes:
+        - centroid_old, centroid_new: Aligned arrays of old and new centroid numbers, in
+            file order (zone ranges, then stations)
+        - modes: List of (old id, new id, mode type, description)
+        - link_attributes: List of (extra attribute id, description)
+        - vehicles: List of (old description, new description, seated capacity, total
+            capacity, auto equivalent)
+        - lane_vdfs, lane_capacities: Aligned arrays of volume delay functions and their
+            lane capacities
+        - line_codes: List of (old line id, new line id)
+        - problems: Problems found within the files themselves
+    """
+
+    def __init__(self):
+        self.centroid_old = np.zeros(0, dtype=np.int64)
+        self.centroid_new = np.zeros(0, dtype=np.int64)
+        self.modes = []
+        self.link_attributes = []
+        self.vehicles = []
+        self.lane_vdfs = np.zeros(0, dtype=np.int64)
+        self.lane_capacities = np.zeros(0, dtype=np.float64)
+        self.line_codes = []
+        self.problems = []
+
+    def centroid_pairs(self):
+        """
+        Returns the old and new centroid numbers, with repeated old centroids removed
+        (the first mapping of each is kept).
+        """
+        if len(self.centroid_old) == 0:
+            return self.centroid_old, self.centroid_new
+        _, first = np.unique(self.centroid_old, return_index=True)
+        first.sort()
+        return self.centroid_old[first], self.centroid_new[first]
+
+
+def _read_rows(filepath):
+    with open(filepath, mode="r") as reader:
+        rows = csv.reader(reader)
+        next(rows)
+        return [row for row in rows if row]
+
+
+def _duplicates(values):
+    seen = set()
+    repeated = []
+    for value in values:
+        if value in seen and value not in repeated:
+            repeated.append(value)
+        seen.add(value)
+    return repeated
+
+
+def load_mapping(parameters):
+    """
+    Loads every mapping file of the Convert Between NCS Scenarios tool.
+
+    Args:
+        - parameters: Dictionary with the 'zone_centroid_file', 'station_centroid_file',
+            'mode_code_definitions', 'link_attributes', 'transit_vehicle_definitions',
+            'lane_capacities' and 'transit_line_codes' file paths
+
+    Returns: A ConversionMapping.
+    """
+    mapping = ConversionMapping()
+    old_centroids = []
+    new_centroids = []
+    for row in _read_rows(parameters["zone_centroid_file"]):
+        old_range = range(int(row[1].strip()), int(row[2].strip()) + 1)
+        new_range = range(int(row[3].strip()), int(row[4].strip()) + 1)
+        if len(old_range) != len(new_range):
+            mapping.problems.append("Zone range %s-%s has %s zones, but is mapped to %s-%s (%s zones)"
+                                    % (row[1].strip(), row[2].strip(), len(old_range),
+                                       row[3].strip(), row[4].strip(), len(new_range)))
+            continue
+        old_centroids.extend(old_range)
+        new_centroids.extend(new_range)
+    for row in _read_rows(parameters["station_centroid_file"]):
+        old_station = int(row[2].strip())
+        new_station = int(row[3].strip())
+        if old_station <= 0 or new_station <= 0:
+            continue
+        old_centroids.append(old_station)
+        new_centroids.append(new_station)
+    mapping.centroid_old = np.array(old_centroids, dtype=np.int64)
+    mapping.centroid_new = np.array(new_centroids, dtype=np.int64)
+
+    for row in _read_rows(parameters["mode_code_definitions"]):
+        old_mode_id = str(row[2])
+        if old_mode_id == "":
+            continue
+        mapping.modes.append((old_mode_id, str(row[3].strip()), str(row[1].strip()), str(row[0])))
+
+    for row in _read_rows(parameters["link_attributes"]):
+        attribute_id = str(row[0].strip())
+        if not attribute_id.startswith("@"):
+            attribute_id = "@" + attribute_id
+        mapping.link_attributes.append((attribute_id, str(row[1])))
+
+    for row in _read_rows(parameters["transit_vehicle_definitions"]):
+        mapping.vehicles.append((row[1].strip(), row[6].strip(), int(row[8].strip()), int(row[9].strip()),
+                                 float(row[10].strip())))
+
+    lane_rows = [(int(row[0].strip()), int(row[1].strip())) for row in _read_rows(parameters["lane_capacities"])]
+    mapping.lane_vdfs = np.array([vdf for vdf, _ in lane_rows], dtype=np.int64)
+    mapping.lane_capacities = np.array([capacity for _, capacity in lane_rows], dtype=np.float64)
+
+    for row in _read_rows(parameters["transit_line_codes"]):
+        mapping.line_codes.append((row[0], row[1]))
+
+    _check_mapping(mapping)
+    return mapping
+
+
+def _check_mapping(mapping):
+    # Collisions within the files themselves
+    problems = mapping.problems
+    first_targets = {}
+    for old, new in zip(mapping.centroid_old.tolist(), mapping.centroid_new.tolist()):
+        if old in first_targets and first_targets[old] != new:
+            problems.append("Centroid %s is mapped to both %s and %s" % (old, first_targets[old], new))
+        first_targets.setdefault(old, new)
+    _, new_centroids = mapping.centroid_pairs()
+    for number in _duplicates(new_centroids.tolist()):
+        problems.append("Several centroids are mapped to %s" % number)
+
+    for mode_id in _duplicates([mode[0] for mode in mapping.modes]):
+        problems.append("Mode '%s' is mapped more than once" % mode_id)
+    for mode_id in _duplicates([mode[1] for mode in mapping.modes]):
+        problems.append("Several modes are mapped to '%s'" % mode_id)
+    for code in _duplicates([vehicle[0] for vehicle in mapping.vehicles]):
+        problems.append("Transit vehicle '%s' is mapped more than once" % code)
+    for line_id in _duplicates([line[0] for line in mapping.line_codes]):
+        problems.append("Transit line '%s' is mapped more than once" % line_id)
+    for line_id in _duplicates([line[1] for line in mapping.line_codes]):
+        problems.append("Several transit lines are mapped to '%s'" % line_id)
+
+    capacities = {}
+    for vdf, capacity in zip(mapping.lane_vdfs.tolist(), mapping.lane_capacities.tolist()):
+        if vdf in capacities and capacities[vdf] != capacity:
+            problems.append("VDF %s has lane capacities %s and %s" % (vdf, capacities[vdf], capacity))
+        capacities[vdf] = capacity
+
+
+def validate_mapping(mapping, network, scenario=None, skip_missing_transit_lines=True):
+    """
+    Checks a mapping against a network (and optionally its scenario's extra attributes),
+    without changing anything.
+
+    Returns: The list of problems found, including those within the mapping files.
+    """
+    problems = list(mapping.problems)
+
+    node_numbers, _ = _netArrays.load_node_arrays(network)
+    old_centroids, new_centroids = mapping.centroid_pairs()
+    present = _netArrays.is_member(old_centroids, node_numbers)
+    moved = np.sort(old_centroids[present])
+    clashes = present & _netArrays.is_member(new_centroids, node_numbers) & \
+        ~_netArrays.is_member(new_centroids, moved)
+    for old, new in zip(old_centroids[clashes], new_centroids[clashes]):
+        problems.append("Centroid %s can't be renumbered to %s, which is an existing node" % (old, new))
+
+    modes = dict((mode.id, mode) for mode in network.modes())
+    renamed_modes = set(old for old, _, _, _ in mapping.modes if old in modes)
+    for old, new, mode_type, _ in mapping.modes:
+        if old not in modes:
+            continue
+        if modes[old].type != mode_type:
+            problems.append('There is an issue with mode type "%s": mode %s is %s'
+                            % (mode_type, old, modes[old].type))
+        if new in modes and new not in renamed_modes:
+            problems.append("Mode '%s' can't be renamed to '%s', which is an existing mode" % (old, new))
+
+    descriptions = set(vehicle.description for vehicle in network.transit_vehicles())
+    for code, _, _, _, _ in mapping.vehicles:
+        if code not in descriptions:
+            problems.append("Transit vehicle '%s' does not exist" % code)
+
+    line_ids = set(line.id for line in network.transit_lines())
+    renamed_lines = set(old for old, _ in mapping.line_codes if old in line_ids)
+    for old, new in mapping.line_codes:
+        if old not in line_ids:
+            if not skip_missing_transit_lines:
+                problems.append("The transit line object {} doesn't exist".format(old))
+            continue
+        if new in line_ids and new not in renamed_lines:
+            problems.append("Transit line '%s' can't be renamed to '%s', which is an existing line" % (old, new))
+
+    if scenario is not None:
+        for attribute_id, _ in mapping.link_attributes:
+            attribute = scenario.extra_attribute(attribute_id)
+            if attribute is not None and attribute.type != "LINK":
+                problems.append("Attribute %s already exist or has some issues!" % attribute_id)
+    return problems
+
+
+def order_renames(renames, temporary_ids):
+    """
+    Orders renames so that no element is given an id which another element still holds.
+
+    Args:
+        - renames: List of (old id, new id), with unique old and new ids
+        - temporary_ids: Iterator of ids which are not in use, to break cycles (e.g. swaps)
+
+    Returns: The list of (from id, to id) steps, in order.
+    """
+    pending = [(old, new) for old, new in renames if old != new]
+    in_use = set(old for old, _ in pending)
+    steps = []
+    while pending:
+        ready = [(old, new) for old, new in pending if new not in in_use]
+        if not ready:
+            # Every remaining rename is part of a cycle; move one element out of the way
+            old, new = pending[0]
+            temporary = next(temporary_ids)
+            steps.append((old, temporary))
+            in_use.discard(old)
+            in_use.add(temporary)
+            pending[0] = (temporary, new)
+            continue
+        for old, new in ready:
+            steps.append((old, new))
+            in_use.discard(old)
+        done = set(ready)
+        pending = [rename for rename in pending if rename not in done]
+    return steps
+
+
+def _unused_ids(candidates, used):
+    for candidate in candidates:
+        if candidate not in used:
+            yield candidate
+
+# -------------------------------------------------------------------------------------------
+
+
+def renumber_centroids(network, mapping, audit):
+    """Renumbers the mapped centroids found in the network, through a temporary offset."""
+    node_numbers, _ = _netArrays.load_node_arrays(network)
+    old_centroids, new_centroids = mapping.centroid_pairs()
+    present = _netArrays.is_member(old_centroids, node_numbers) & (old_centroids != new_centroids)
+    old_centroids = old_centroids[present].tolist()
+    new_centroids = new_centroids[present].tolist()
+    if not old_centroids:
+        return
+    offset = int(node_numbers.max()) + 1
+    for old in old_centroids:
+        network.node(old).number = old + offset
+    for old, new in zip(old_centroids, new_centroids):
+        network.node(old + offset).number = new
+        audit.record("centroid", old, "number", old, new)
+
+
+def rename_modes(network, mapping, audit):
+    """Renames the mapped modes found in the network, and updates their descriptions."""
+    modes = dict((mode.id, mode) for mode in network.modes())
+    rows = [row for row in mapping.modes if row[0] in modes]
+    temporary_ids = _unused_ids(string.ascii_letters, set(modes) | set(row[1] for row in rows))
+    for old, new in order_renames([(row[0], row[1]) for row in rows], temporary_ids):
+        network.mode(old).id = new
+    for old, new, _, description in rows:
+        mode = network.mode(new)
+        # Emme allows description of the mode, up to 10 characters.
+        description = description[:10]
+        if old != new:
+            audit.record("mode", old, "id", old, new)
+        if mode.description != description:
+            audit.record("mode", new, "description", mode.description, description)
+            mode.description = description
+
+
+def update_transit_vehicles(network, mapping, audit):
+    """Updates the description and capacities of the mapped transit vehicles (found by description)."""
+    vehicles = {}
+    for vehicle in network.transit_vehicles():
+        vehicles.setdefault(vehicle.description, vehicle)
+    for code, new_code, seated_capacity, total_capacity, auto_equivalent in mapping.vehicles:
+        vehicle = vehicles[code]
+        for attribute, value in (("description", new_code), ("seated_capacity", seated_capacity),
+                                 ("total_capacity", total_capacity), ("auto_equivalent", auto_equivalent)):
+            old_value = getattr(vehicle, attribute)
+            if old_value != value:
+                audit.record("transit_vehicle", vehicle.number, attribute, old_value, value)
+                setattr(vehicle, attribute, value)
+
+
+def update_lane_capacities(network, mapping, audit):
+    """Sets the lane capacity (data3) of every link from its volume delay function."""
+    if len(mapping.lane_vdfs) == 0:
+        return
+    package = network.get_attribute_values('LINK', ['volume_delay_func', 'data3'])
+    link_index = package[0]
+    vdfs = np.asarray(package[1]).astype(np.int64)
+    capacities = np.asarray(package[2], dtype=np.float64)
+
+    # Repeated VDFs have the same capacity (see validate_mapping)
+    table_vdfs, first = np.unique(mapping.lane_vdfs, return_index=True)
+    table_capacities = mapping.lane_capacities[first]
+
+    positions = np.minimum(np.searchsorted(table_vdfs, vdfs), len(table_vdfs) - 1)
+    matched = table_vdfs[positions] == vdfs
+    updated = capacities.copy()
+    updated[matched] = table_capacities[positions[matched]]
+    changed = np.nonzero(updated != capacities)[0]
+    if len(changed) == 0:
+        return
+    network.set_attribute_values('LINK', ['data3'], [link_index, updated.tolist()])
+
+    link_names = {}
+    changed_set = set(changed.tolist())
+    for i_node, outgoing_links in six.iteritems(link_index):
+        for j_node, position in six.iteritems(outgoing_links):
+            if position in changed_set:
+                link_names[position] = "%s-%s" % (i_node, j_node)
+    for position in changed.tolist():
+        audit.record("link", link_names[position], "data3", float(capacities[position]), float(updated[position]))
+
+
+def rename_transit_lines(network, mapping, audit):
+    """Renames the mapped transit lines found in the network."""
+    line_ids = set(line.id for line in network.transit_lines())
+    renames = [(old, new) for old, new in mapping.line_codes if old in line_ids]
+    temporary_ids = _unused_ids(("~%05d" % number for number in six.moves.range(100000)),
+                                line_ids | set(new for _, new in renames))
+    for old, new in order_renames(renames, temporary_ids):
+        network.transit_line(old).id = new
+    for old, new in renames:
+        if old != new:
+            audit.record("transit_line", old, "id", old, new)
+
+
+def create_extra_attributes(scenario, mapping, audit, attribute_type="LINK", default_value=0):
+    """Creates the mapped extra attributes which do not exist yet in the scenario."""
+    for attribute_id, description in mapping.link_attributes:
+        if scenario.extra_attribute(attribute_id) is not None:
+            continue
+        attribute = scenario.create_extra_attribute(attribute_type, attribute_id, default_value)
+        # maximum length of description is 40 characters
+        attribute.description = description[:40]
+        audit.record("extra_attribute", attribute_id, "created", None, attribute_type)
+
+
+def convert_network(network, mapping, scenario=None, skip_missing_transit_lines=True, audit=None):
+    """
+    Validates a mapping against a network, then applies it.
+
+    Args:
+        - network: The Emme Network to convert (modified in place)
+        - mapping: A ConversionMapping
+        - scenario (=None): The network's scenario, in which missing extra attributes are
+            created. If None, extra attributes are left alone.
+        - skip_missing_transit_lines (=True): If False, mapped transit lines missing from
+            the network are problems
+        - audit (=None): The AuditLog to record changes in. A new one is created if None.
+
+    Returns: The AuditLog.
+
+    Raises: MappingError, before changing anything, if any problem is found.
+    """
+    problems = validate_mapping(mapping, network, scenario, skip_missing_transit_lines)
+    if problems:
+        raise MappingError(problems)
+    if audit is None:
+        audit = AuditLog()
+
+    renumber_centroids(network, mapping, audit)
+    rename_modes(network, mapping, audit)
+    if scenario is not None:
+        create_extra_attributes(scenario, mapping, audit)
+    update_transit_vehicles(network, mapping, audit)
+    update_lane_capacities(network, mapping, audit)
+    rename_transit_lines(network, mapping, audit)
+    return audit
+
+
+def write_audit_logs(filepath, logs):
+    """
+    Writes audit logs as CSV, one row per change.
+
+    Args:
+        - filepath: The output file
+        - logs: List of (scenario id, AuditLog)
+    """
+    with _util.open_csv_writer(filepath) as writer:
+        writer.writerow(["scenario", "category", "element", "attribute", "old_value", "new_value"])
+        for scenario_id, audit in logs:
+            for row in audit.rows:
+                writer.writerow([scenario_id] + list(row))
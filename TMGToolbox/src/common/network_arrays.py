@@ -0,0 +1,417 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Collection of functions for reading network topology into flat NumPy arrays
+using a single get_attribute_values call per element type, so that per-node
+and per-link scans can be done with array operations instead of walking the
+Network API one object at a time.
+
+Every loader accepts either an Emme Scenario or an Emme Network (anything
+exposing get_attribute_values). Nodes are always returned sorted by number,
+so that node numbers can be mapped to array positions with node_positions().
+
+Link modes and segment-to-link relations are not available through
+get_attribute_values, so load_link_modes and load_segment_links take a Network,
+and read them in a single walk of its links or segments. LinkIncidence indexes
+links by node, to find the in- and out-links of nodes and the reverse of links.
+"""
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Network Arrays",
+                                description="Collection of private functions for loading network topology \
+                                        and attributes into NumPy arrays.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class LinkArrays(object):
+    """
+    Flat, position-aligned link table.
+
+    Attributes:
+        - i: Array of link i-node numbers
+        - j: Array of link j-node numbers
+        - attributes: Dictionary of attribute name : array of values, aligned with i & j
+    """
+
+    def __init__(self, i, j, attributes):
+        self.i = i
+        self.j = j
+        self.attributes = attributes
+
+    def __len__(self):
+        return len(self.i)
+
+    def __getitem__(self, attribute_name):
+        return self.attributes[attribute_name]
+
+    def subset(self, mask):
+        """Returns a new LinkArrays containing only the links where mask is True."""
+        attributes = dict((name, values[mask]) for name, values in six.iteritems(self.attributes))
+        return LinkArrays(self.i[mask], self.j[mask], attributes)
+
+# -------------------------------------------------------------------------------------------
+
+
+def load_node_arrays(source, attributes=()):
+    """
+    Loads all node numbers and (optionally) node attributes in a single partial read.
+
+    Args:
+        - source: An Emme Scenario or Network object
+        - attributes: Iterable of NODE attribute names to load
+
+    Returns: A tuple of (node numbers, dictionary of attribute arrays). The node numbers
+        are sorted ascending and all attribute arrays are aligned with them.
+    """
+    attributes = list(attributes)
+    package = source.get_attribute_values('NODE', attributes)
+    indices = package[0]
+
+    numbers = np.fromiter(six.iterkeys(indices), dtype=np.int64, count=len(indices))
+    positions = np.fromiter(six.itervalues(indices), dtype=np.int64, count=len(indices))
+    order = np.argsort(numbers)
+    numbers = numbers[order]
+    positions = positions[order]
+
+    tables = {}
+    for name, table in zip(attributes, package[1:]):
+        tables[name] = np.asarray(table).take(positions)
+    return numbers, tables
+
+
+def load_link_arrays(source, attributes=()):
+    """
+    Loads the i- and j-nodes of every link, plus any requested link attributes, in a
+    single partial read.
+
+    Args:
+        - source: An Emme Scenario or Network object
+        - attributes: Iterable of LINK attribute names to load. 'vertices' is not supported.
+
+    Returns: A LinkArrays object.
+    """
+    attributes = list(attributes)
+    package = source.get_attribute_values('LINK', attributes)
+    indices = package[0]
+
+    i_nodes = []
+    j_nodes = []
+    positions = []
+    for i_node, outgoing_links in six.iteritems(indices):
+        for j_node, position in six.iteritems(outgoing_links):
+            i_nodes.append(i_node)
+            j_nodes.append(j_node)
+            positions.append(position)
+
+    positions = np.array(positions, dtype=np.int64)
+    tables = {}
+    for name, table in zip(attributes, package[1:]):
+        tables[name] = np.asarray(table).take(positions)
+    return LinkArrays(np.array(i_nodes, dtype=np.int64), np.array(j_nodes, dtype=np.int64), tables)
+
+
+def iter_segment_index(index_data):
+    """
+    Iterates through the segment index returned by get_attribute_values('TRANSIT_SEGMENT', ...),
+    yielding (line id, i-node number, data position) tuples. Supports both the pre- and post-4.1.2
+    index structures.
+    """
+    for line_id, segment_indices in six.iteritems(index_data):
+        if hasattr(segment_indices, 'items'):
+            pairs = six.iteritems(segment_indices)
+        else:
+            pairs = six.moves.zip(*segment_indices)
+        for key, position in pairs:
+            i_node = key[0] if isinstance(key, tuple) else key
+            yield line_id, i_node, position
+
+
+def load_segment_arrays(source, attributes=()):
+    """
+    Loads the line ID and i-node of every transit segment, plus any requested segment
+    attributes, in a single partial read.
+
+    Args:
+        - source: An Emme Scenario or Network object
+        - attributes: Iterable of TRANSIT_SEGMENT attribute names to load
+
+    Returns: A tuple of (line id array, i-node array, dictionary of attribute arrays)
+    """
+    attributes = list(attributes)
+    package = source.get_attribute_values('TRANSIT_SEGMENT', attributes)
+
+    line_ids = []
+    i_nodes = []
+    positions = []
+    for line_id, i_node, position in iter_segment_index(package[0]):
+        line_ids.append(line_id)
+        i_nodes.append(i_node)
+        positions.append(position)
+
+    positions = np.array(positions, dtype=np.int64)
+    tables = {}
+    for name, table in zip(attributes, package[1:]):
+        tables[name] = np.asarray(table).take(positions)
+    return np.array(line_ids, dtype=object), np.array(i_nodes, dtype=np.int64), tables
+
+
+def load_centroid_numbers(source):
+    """Returns a sorted array of centroid numbers for a Scenario or Network."""
+    if hasattr(source, 'zone_numbers'):
+        numbers = source.zone_numbers
+    else:
+        numbers = [node.number for node in source.centroids()]
+    return np.sort(np.array(numbers, dtype=np.int64))
+
+# -------------------------------------------------------------------------------------------
+
+
+def node_positions(node_numbers, query_numbers):
+    """
+    Maps node numbers to positions in a sorted array of node numbers.
+
+    Args:
+        - node_numbers: Sorted array of node numbers (e.g. from load_node_arrays)
+        - query_numbers: Array of node numbers to look up. All must be present.
+
+    Returns: Integer array of positions, aligned with query_numbers.
+    """
+    positions = np.searchsorted(node_numbers, query_numbers)
+    if len(positions) > 0:
+        found = positions < len(node_numbers)
+        found[found] = node_numbers[positions[found]] == np.asarray(query_numbers)[found]
+        if not found.all():
+            missing = np.asarray(query_numbers)[~found]
+            raise KeyError("Node(s) not found: %s" % list(missing[:10]))
+    return positions
+
+
+def is_member(values, sorted_set):
+    """Vectorized 'in' test of values against a sorted array."""
+    if len(sorted_set) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_set, values)
+    positions[positions >= len(sorted_set)] = 0
+    return sorted_set[positions] == values
+
+
+def connector_mask(links, centroid_numbers):
+    """
+    Flags centroid connectors.
+
+    Returns: A tuple of (connector mask, i-node is centroid mask, j-node is centroid mask),
+        each aligned with the given LinkArrays.
+    """
+    i_centroid = is_member(links.i, centroid_numbers)
+    j_centroid = is_member(links.j, centroid_numbers)
+    return i_centroid | j_centroid, i_centroid, j_centroid
+
+
+def stop_flags(source, node_numbers):
+    """
+    Flags nodes at which at least one transit segment allows boardings or alightings.
+
+    Args:
+        - source: An Emme Scenario or Network object
+        - node_numbers: Sorted array of node numbers to align the result with
+
+    Returns: Boolean array aligned with node_numbers.
+    """
+    line_ids, i_nodes, tables = load_segment_arrays(source, ['allow_boardings', 'allow_alightings'])
+    flags = np.zeros(len(node_numbers), dtype=bool)
+    if len(i_nodes) == 0:
+        return flags
+    is_stop = (tables['allow_boardings'] != 0) | (tables['allow_alightings'] != 0)
+    flags[node_positions(node_numbers, i_nodes[is_stop])] = True
+    return flags
+
+
+def node_degrees(node_numbers, links, mask=None):
+    """
+    Computes the number of incident links and the number of unique adjacent nodes
+    for every node, grouping over both directions of each link.
+
+    Args:
+        - node_numbers: Sorted array of node numbers
+        - links: LinkArrays object
+        - mask (=None): Optional boolean array. Links where mask is False are ignored.
+
+    Returns: A tuple of (link count array, unique neighbour count array), aligned with
+        node_numbers.
+    """
+    i = links.i
+    j = links.j
+    if mask is not None:
+        i = i[mask]
+        j = j[mask]
+    n = len(node_numbers)
+
+    own = node_positions(node_numbers, np.concatenate((i, j)))
+    other = node_positions(node_numbers, np.concatenate((j, i)))
+
+    link_counts = np.bincount(own, minlength=n)
+
+    pairs = np.unique(own * np.int64(n) + other)
+    neighbour_counts = np.bincount(pairs // n, minlength=n)
+
+    return link_counts, neighbour_counts
+
+
+def flag_incident_nodes(node_numbers, node_numbers_to_flag):
+    """Returns a boolean array aligned with node_numbers, True at each of the given nodes."""
+    flags = np.zeros(len(node_numbers), dtype=bool)
+    if len(node_numbers_to_flag) > 0:
+        flags[node_positions(node_numbers, node_numbers_to_flag)] = True
+    return flags
+
+# -------------------------------------------------------------------------------------------
+
+
+def load_link_modes(network, mode_ids, attributes=()):
+    """
+    Loads the i- and j-nodes of every link of a Network, with the link's modes packed into
+    a bitmask (bit k is set if the link allows mode_ids[k]), in one walk of the links.
+
+    Args:
+        - network: An Emme Network object
+        - mode_ids: Sequence of at most 63 mode ids, e.g. [mode.id for mode in network.modes()]
+        - attributes (=()): Iterable of LINK attribute names to read in the same walk
+
+    Returns: A LinkArrays object, with the bitmasks in the 'modes' attribute. Modes not in
+        mode_ids are ignored.
+    """
+    bits = dict((mode_id, 1 << position) for position, mode_id in enumerate(mode_ids))
+    attributes = list(attributes)
+    i_nodes = []
+    j_nodes = []
+    masks = []
+    values = []
+    for link in network.links():
+        i_nodes.append(link.i_node.number)
+        j_nodes.append(link.j_node.number)
+        masks.append(sum(bits.get(mode.id, 0) for mode in link.modes))
+        values.append([link[name] for name in attributes])
+
+    tables = {'modes': np.array(masks, dtype=np.int64)}
+    values = np.array(values, dtype=np.float64).reshape(len(i_nodes), len(attributes))
+    for column, name in enumerate(attributes):
+        tables[name] = values[:, column]
+    return LinkArrays(np.array(i_nodes, dtype=np.int64), np.array(j_nodes, dtype=np.int64), tables)
+
+
+def mode_bits(mode_ids, selected_ids):
+    """Returns the bitmask of the selected modes, with bits numbered as in load_link_modes."""
+    selected_ids = set(selected_ids)
+    return sum(1 << position for position, mode_id in enumerate(mode_ids) if mode_id in selected_ids)
+
+
+def load_segment_links(network):
+    """
+    Loads the link of every (non-hidden) transit segment of a Network, and whether the
+    segment allows boardings or alightings at its i-node, in one walk of the segments.
+
+    Returns: A tuple of (i-node array, j-node array, stop flag array).
+    """
+    i_nodes = []
+    j_nodes = []
+    stops = []
+    for segment in network.transit_segments():
+        link = segment.link
+        i_nodes.append(link.i_node.number)
+        j_nodes.append(link.j_node.number)
+        stops.append(bool(segment.allow_boardings or segment.allow_alightings))
+    return np.array(i_nodes, dtype=np.int64), np.array(j_nodes, dtype=np.int64), np.array(stops, dtype=bool)
+
+
+class LinkIncidence(object):
+    """
+    Incidence of links on nodes, in CSR form.
+
+    Attributes:
+        - node_numbers: Sorted array of node numbers
+        - i_positions, j_positions: Node positions of each link's i- and j-node
+        - out_offsets, out_links: The links leaving the node at position n are
+            out_links[out_offsets[n]:out_offsets[n + 1]]
+        - in_offsets, in_links: Likewise, for the links entering each node
+        - reverse: Position of each link's reverse link (j, i), or -1 if it has none
+    """
+
+    def __init__(self, node_numbers, links):
+        self.node_numbers = node_numbers
+        self.i_positions = node_positions(node_numbers, links.i)
+        self.j_positions = node_positions(node_numbers, links.j)
+
+        n = len(node_numbers)
+        self.out_links = np.argsort(self.i_positions, kind='mergesort')
+        self.out_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.i_positions, minlength=n))))
+        self.in_links = np.argsort(self.j_positions, kind='mergesort')
+        self.in_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.j_positions, minlength=n))))
+
+        self._keys = self.i_positions * np.int64(n) + self.j_positions
+        self._key_order = np.argsort(self._keys)
+        self.reverse = self.find(self.j_positions, self.i_positions)
+
+    def __len__(self):
+        return len(self.i_positions)
+
+    def find(self, i_positions, j_positions):
+        """Returns the positions of the links between pairs of node positions, or -1 where there is none."""
+        keys = np.asarray(i_positions, dtype=np.int64) * np.int64(len(self.node_numbers)) + j_positions
+        found = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._keys) == 0:
+            return found
+        positions = np.minimum(np.searchsorted(self._keys, keys, sorter=self._key_order), len(self._keys) - 1)
+        candidates = self._key_order[positions]
+        exists = self._keys[candidates] == keys
+        found[exists] = candidates[exists]
+        return found
+
+    def out_count(self, mask=None):
+        """Returns the number of links leaving each node (only counting links where mask is True)."""
+        return self._count(self.i_positions, mask)
+
+    def in_count(self, mask=None):
+        """Returns the number of links entering each node (only counting links where mask is True)."""
+        return self._count(self.j_positions, mask)
+
+    def _count(self, positions, mask):
+        if mask is not None:
+            positions = positions[mask]
+        return np.bincount(positions, minlength=len(self.node_numbers))
+
+    def reverse_flags(self, mask):
+        """Returns, for every link, whether its reverse link exists and is flagged in mask."""
+        flags = np.zeros(len(self.reverse), dtype=bool)
+        has_reverse = self.reverse >= 0
+        flags[has_reverse] = mask[self.reverse[has_reverse]]
+        return flags
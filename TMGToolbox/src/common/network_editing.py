@@ -134,6 +134,159 @@ def isLinkParallel(link):
 
 #===========================================================================================
 
+class NodeNumberAllocator():
+    '''
+    Hands out unused node numbers, without having to probe network.node(n) in a loop.
+
+    The allocator is seeded once from the existing node numbers. Runs of consecutive
+    used numbers are stored as pointers to the next free number (with path compression),
+    so finding a free number is constant-time on average regardless of how densely
+    the network is numbered, or how many nodes have been created so far.
+
+    Numbers can be restricted to one or more ranges (e.g. a reserved block of virtual
+    node numbers, or the node-number bands of a numbering convention such as NCS).
+    Ranges are searched in ascending order.
+
+    Usage:
+        >>> allocator = NodeNumberAllocator.fromNetwork(network, ranges=[(100001, 199999)])
+        >>> node = network.create_regular_node(allocator.next())
+    '''
+
+    def __init__(self, usedNumbers, ranges=None):
+        '''
+        Args:
+            - usedNumbers: Iterable of node numbers which are already in use
+            - ranges (=None): Optional list of (first, last) tuples of the numbers that
+                can be handed out (inclusive). A last of None means unbounded. By default,
+                all positive integers can be handed out.
+        '''
+        if ranges is None:
+            ranges = [(1, None)]
+        self._ranges = sorted((int(first), last if last is None else int(last)) for first, last in ranges)
+        for first, last in self._ranges:
+            if last is not None and last < first:
+                raise ValueError("Invalid node number range %s-%s" %(first, last))
+
+        self._used = set()
+        self._nextFree = {} #Maps a used number to the next number which MIGHT be free
+
+        runStart = None
+        previous = None
+        for number in sorted(int(n) for n in usedNumbers):
+            if number == previous: continue
+            if previous is None or number != previous + 1:
+                self._closeRun(runStart, previous)
+                runStart = number
+            self._used.add(number)
+            previous = number
+        self._closeRun(runStart, previous)
+
+    def _closeRun(self, runStart, runEnd):
+        if runStart is None: return
+        for number in six.moves.range(runStart, runEnd + 1):
+            self._nextFree[number] = runEnd + 1
+
+    @staticmethod
+    def fromNetwork(network, ranges=None):
+        '''
+        Creates an allocator seeded with the numbers of all nodes (incl. centroids) in a Network.
+        '''
+        return NodeNumberAllocator((node.number for node in network.nodes()), ranges)
+
+    @staticmethod
+    def fromScenario(scenario, ranges=None):
+        '''
+        Creates an allocator seeded with the numbers of all nodes (incl. centroids) in a
+        Scenario, using a partial read instead of loading the network.
+        '''
+        indices = scenario.get_attribute_values('NODE', [])[0]
+        return NodeNumberAllocator(six.iterkeys(indices), ranges)
+
+    def _findFree(self, number):
+        visited = []
+        while number in self._used:
+            visited.append(number)
+            number = self._nextFree.get(number, number + 1)
+        for n in visited:
+            self._nextFree[n] = number
+        return number
+
+    def isFree(self, number):
+        return number not in self._used
+
+    def markUsed(self, number):
+        '''
+        Flags a number as used, for nodes created without this allocator.
+        '''
+        number = int(number)
+        self._used.add(number)
+        self._nextFree.setdefault(number, number + 1)
+
+    def peek(self, minimum=None):
+        '''
+        Returns the lowest free number (greater than or equal to minimum, if given)
+        within the allocator's ranges, without flagging it as used.
+
+        Raises: InvalidNetworkOperationError if no free number is available.
+        '''
+        for first, last in self._ranges:
+            if minimum is not None:
+                if last is not None and last < minimum: continue
+                first = max(first, int(minimum))
+            number = self._findFree(first)
+            if last is None or number <= last:
+                return number
+
+        ranges = ", ".join("%s-%s" %(first, '' if last is None else last) for first, last in self._ranges)
+        if minimum is not None:
+            ranges += " (minimum %s)" %minimum
+        raise InvalidNetworkOperationError("No free node numbers left in range(s) %s" %ranges)
+
+    def next(self, minimum=None):
+        '''
+        Returns the lowest free number (greater than or equal to minimum, if given)
+        within the allocator's ranges, and flags it as used.
+
+        Raises: InvalidNetworkOperationError if no free number is available.
+        '''
+        number = self.peek(minimum)
+        self.markUsed(number)
+        return number
+
+    def reserveBlock(self, size, minimum=None):
+        '''
+        Reserves a block of consecutive free numbers, flagging them all as used.
+
+        Args:
+            - size: The number of node numbers to reserve.
+            - minimum (=None): Optional lowest number of the block.
+
+        Returns: A new NodeNumberAllocator which hands out numbers from the reserved
+            block only.
+
+        Raises: InvalidNetworkOperationError if no such block is available.
+        '''
+        size = int(size)
+        start = self.peek(minimum)
+        while True:
+            end = start + size - 1
+            blocked = [n for n in six.moves.range(start, end + 1) if n in self._used]
+            if not blocked and self._inRanges(start, end):
+                break
+            start = self.peek(max(blocked) + 1 if blocked else end + 1)
+
+        for number in six.moves.range(start, end + 1):
+            self.markUsed(number)
+        return NodeNumberAllocator([], [(start, end)])
+
+    def _inRanges(self, start, end):
+        for first, last in self._ranges:
+            if first <= start and (last is None or end <= last):
+                return True
+        return False
+
+#===========================================================================================
+
 TEMP_LINE_ID = '999999'
 
 def splitLink(newNodes, link, twoWay=True, onLink=True, coordFactor= COORD_FACTOR, stopOnNewNodes=False):
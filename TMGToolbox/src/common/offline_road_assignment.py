@@ -0,0 +1,674 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Pure NumPy multi-class static road assignment, used as an offline stand-in for
+Emme's SOLA traffic assignment.
+
+The engine takes the same SOLA specification that RoadAssignmentUtil builds
+(see utilities.RoadAssignmentUtil._getPrimarySOLASpec), a link table (a
+network_arrays.LinkArrays object), the demand matrices referenced by the spec,
+and Python implementations of the volume-delay functions. It assigns all
+classes jointly using Frank-Wolfe or conjugate Frank-Wolfe, and returns the
+results keyed by the same attribute and matrix ids that SOLA would write to.
+This allows the spec building, class handling and toll cost preparation of the
+road assignment tools to be tested and benchmarked without Emme.
+
+Differences from SOLA:
+    - Paths are not retained, so path analyses (e.g. toll and cost skims) are
+        computed along the shortest paths of the final iteration, rather than
+        averaged over all used paths. Each O-D pair therefore has a single path,
+        with a proportion of 1: its selection threshold, considered paths ('ALL',
+        'SELECTED' or 'UNSELECTED') and path proportion multipliers (analyzed
+        demand, path value) are applied to that path. Only the '+', '.max.' and
+        '.min.' operators are supported.
+    - Turns, cutoff and traversal analyses, and selected link and turn volumes are
+        not supported. Specs which use them raise an UnsupportedSpecError, rather
+        than being assigned without them.
+    - 'best_relative_gap' is compared with the smallest relative gap found so far.
+
+braess_reference and check_reference run the engine on Braess's network, and compare
+its link volumes and O-D times with the published equilibrium.
+
+Shortest paths use scipy.sparse.csgraph when SciPy is installed, and a pure
+Python implementation of Dijkstra's algorithm otherwise. As in Emme, paths never
+pass through centroids, and intrazonal demand is not assigned.
+"""
+
+import heapq
+
+import inro.modeller as _m
+import numpy as np
+import six
+from six.moves import range
+
+try:
+    from scipy.sparse import csr_matrix as _csr_matrix
+    from scipy.sparse.csgraph import dijkstra as _dijkstra
+    _HAS_SCIPY = True
+except ImportError:
+    _HAS_SCIPY = False
+
+_MODELLER = _m.Modeller()
+_netArrays = _MODELLER.module('tmg.common.network_arrays')
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Offline Road Assignment",
+                                description="NumPy implementation of multi-class static road assignment, \
+                                        which runs SOLA traffic assignment specifications without Emme.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+#: Emme's value for unreachable O-D pairs
+UNREACHABLE = 1.0e20
+
+#: Lower bound on link costs, so that zero-cost links are kept by the shortest path search
+_MIN_COST = 1.0e-9
+
+_PATH_OPERATORS = {
+    '+': (np.add, 0.0),
+    '.max.': (np.maximum, -np.inf),
+    '.min.': (np.minimum, np.inf)
+}
+
+_CONSIDERED_PATHS = ('ALL', 'SELECTED', 'UNSELECTED')
+
+
+class UnsupportedSpecError(ValueError):
+    """Raised for assignment specifications which use features the offline engine does not implement."""
+    pass
+
+
+class AssignmentResult(object):
+    """
+    Results of an offline assignment.
+
+    Attributes:
+        - link_volumes: Array of total auto volumes (volau), aligned with the link table
+        - link_times: Array of congested link times (timau), in minutes
+        - class_volumes: List of arrays of link volumes, one per class
+        - link_attributes: Dictionary of link attribute id : array, for every
+            'link_volumes' result named in the spec
+        - matrices: Dictionary of matrix id : array, for every 'od_travel_times'
+            and path analysis 'od_values' result named in the spec
+        - iterations: List of dictionaries of iteration statistics ('iteration',
+            'step', 'relative_gap', 'normalized_gap')
+        - stopping_criterion: The criterion which stopped the assignment
+    """
+
+    def __init__(self):
+        self.link_volumes = None
+        self.link_times = None
+        self.class_volumes = []
+        self.link_attributes = {}
+        self.matrices = {}
+        self.iterations = []
+        self.stopping_criterion = None
+
+# -------------------------------------------------------------------------------------------
+
+
+def bpr_function(alpha=0.15, beta=4.0, speed='data2', capacity='data3', lanes='num_lanes'):
+    """
+    Creates a BPR volume-delay function: t0 * (1 + alpha * (volume / capacity) ^ beta).
+
+    Args:
+        - alpha (=0.15), beta (=4.0): The BPR parameters
+        - speed (='data2'): Link attribute of the free-flow speed (km/h). The free-flow
+            time t0 (in minutes) is 60 * length / speed.
+        - capacity (='data3'): Link attribute of the capacity per lane
+        - lanes (='num_lanes'): Link attribute of the number of lanes
+
+    Returns: A function of (volume array, LinkArrays) returning an array of link times.
+    """
+    def function(volume, links):
+        free_flow_time = 60.0 * links['length'] / links[speed]
+        total_capacity = links[lanes] * links[capacity]
+        ratio = np.divide(volume, total_capacity, out=np.zeros(len(volume)), where=total_capacity > 0)
+        return free_flow_time * (1.0 + alpha * ratio ** beta)
+    return function
+
+
+def attribute_function(attribute):
+    """
+    Creates a volume-delay function returning a fixed link attribute, such as the
+    'ul2' function used for all-or-nothing assignment.
+    """
+    def function(volume, links):
+        return np.asarray(links[attribute], dtype=np.float64)
+    return function
+
+
+def add_link_modes(links, network):
+    """
+    Adds a 'modes' attribute to a LinkArrays object, holding the string of mode ids
+    allowed on each link. Modes cannot be read with get_attribute_values, so they
+    are read from a Network object.
+    """
+    modes = {}
+    for link in network.links():
+        modes[(link.i_node.number, link.j_node.number)] = "".join(str(mode.id) for mode in link.modes)
+    links.attributes['modes'] = np.array([modes[(i, j)] for i, j in zip(links.i, links.j)], dtype=object)
+    return links
+
+# -------------------------------------------------------------------------------------------
+
+
+class _ClassGraph(object):
+    """
+    Shortest path graph over the links open to one mode. Each zone is split into an
+    origin node (with its outgoing links) and a separate destination node (with its
+    incoming links), so that no path can pass through a centroid.
+    """
+
+    def __init__(self, links, zones, mask):
+        self.link_index = np.flatnonzero(mask)
+        i = links.i[self.link_index]
+        j = links.j[self.link_index]
+
+        node_numbers = np.unique(np.concatenate((links.i, links.j, zones)))
+        self.n_nodes = len(node_numbers)
+        self.n_zones = len(zones)
+        self.size = self.n_nodes + self.n_zones
+
+        zone_numbers = np.asarray(zones)
+        self.origins = np.searchsorted(node_numbers, zone_numbers)
+        self.destinations = self.n_nodes + np.arange(self.n_zones)
+
+        self.tails = np.searchsorted(node_numbers, i)
+        self.heads = np.searchsorted(node_numbers, j)
+        zone_order = np.argsort(zone_numbers)
+        zone_positions = np.searchsorted(zone_numbers[zone_order], j)
+        zone_positions[zone_positions >= self.n_zones] = 0
+        is_zone = zone_numbers[zone_order][zone_positions] == j
+        self.heads[is_zone] = self.n_nodes + zone_order[zone_positions[is_zone]]
+
+        order = np.argsort(self.tails * np.int64(self.size) + self.heads)
+        self._keys = (self.tails * np.int64(self.size) + self.heads)[order]
+        self._key_links = order
+
+        if not _HAS_SCIPY:
+            self._outgoing = [[] for _ in range(self.size)]
+            for position, (tail, head) in enumerate(zip(self.tails, self.heads)):
+                self._outgoing[tail].append((head, position))
+
+    def trees(self, costs):
+        """
+        Builds shortest path trees from every zone.
+
+        Args:
+            - costs: Array of generalized costs for the links of this graph
+
+        Returns: A tuple of (distance array, predecessor link array), each of shape
+            (zones, graph nodes). Predecessor links are positions in this graph's
+            links, or -1 if the node is unreachable (or is the origin).
+        """
+        costs = np.maximum(costs, _MIN_COST)
+        if _HAS_SCIPY:
+            graph = _csr_matrix((costs, (self.tails, self.heads)), shape=(self.size, self.size))
+            distances, predecessors = _dijkstra(graph, indices=self.origins, return_predecessors=True)
+            reachable = predecessors >= 0
+            keys = predecessors[reachable].astype(np.int64) * np.int64(self.size) + \
+                np.nonzero(reachable)[1]
+            predecessor_links = np.full(predecessors.shape, -1, dtype=np.int64)
+            predecessor_links[reachable] = self._key_links[np.searchsorted(self._keys, keys)]
+            return distances, predecessor_links
+
+        distances = np.full((self.n_zones, self.size), np.inf)
+        predecessor_links = np.full((self.n_zones, self.size), -1, dtype=np.int64)
+        for row, origin in enumerate(self.origins):
+            distance = distances[row]
+            predecessor = predecessor_links[row]
+            distance[origin] = 0.0
+            heap = [(0.0, origin)]
+            while heap:
+                d, node = heapq.heappop(heap)
+                if d > distance[node]:
+                    continue
+                for head, position in self._outgoing[node]:
+                    candidate = d + costs[position]
+                    if candidate < distance[head]:
+                        distance[head] = candidate
+                        predecessor[head] = position
+                        heapq.heappush(heap, (candidate, head))
+        return distances, predecessor_links
+
+    def load(self, distances, predecessor_links, demand):
+        """
+        Loads a demand matrix onto the shortest path trees. Returns an array of link
+        volumes for the links of this graph.
+        """
+        volumes = np.zeros(len(self.tails))
+        for row in range(self.n_zones):
+            node_flows = np.zeros(self.size)
+            node_flows[self.destinations] = demand[row]
+            node_flows[self.destinations[row]] = 0.0  # Intrazonal demand is not assigned
+            predecessor = predecessor_links[row]
+            for node in np.argsort(distances[row])[::-1]:
+                flow = node_flows[node]
+                position = predecessor[node]
+                if flow == 0.0 or position < 0:
+                    continue
+                volumes[position] += flow
+                node_flows[self.tails[position]] += flow
+        return volumes
+
+    def skim(self, distances, predecessor_links, values, operator):
+        """
+        Aggregates a link value along the shortest paths from every zone, to every zone.
+        Returns a (zones x zones) matrix.
+        """
+        ufunc, identity = _PATH_OPERATORS[operator]
+        result = np.full((self.n_zones, self.n_zones), identity)
+        for row in range(self.n_zones):
+            node_values = np.full(self.size, identity)
+            node_values[self.origins[row]] = identity
+            predecessor = predecessor_links[row]
+            for node in np.argsort(distances[row]):
+                position = predecessor[node]
+                if position < 0:
+                    continue
+                node_values[node] = ufunc(node_values[self.tails[position]], values[position])
+            result[row] = node_values[self.destinations]
+        np.fill_diagonal(result, 0.0)
+        return result
+
+    def od_costs(self, distances):
+        result = distances[:, self.destinations].copy()
+        result[~np.isfinite(result)] = UNREACHABLE
+        np.fill_diagonal(result, 0.0)
+        return result
+
+# -------------------------------------------------------------------------------------------
+
+
+class _TrafficClass(object):
+    def __init__(self, class_spec, links, zones, matrices):
+        self.spec = class_spec
+        self.mode = class_spec['mode']
+        demand_id = class_spec['demand']
+        if demand_id not in matrices:
+            raise KeyError("Demand matrix '%s' was not provided" % demand_id)
+        self.demand = np.asarray(matrices[demand_id], dtype=np.float64)
+        if self.demand.shape != (len(zones), len(zones)):
+            raise ValueError("Demand matrix '%s' has shape %s, but there are %s zones"
+                             % (demand_id, self.demand.shape, len(zones)))
+
+        cost_spec = class_spec.get('generalized_cost') or {}
+        self.link_costs = np.zeros(len(links))
+        if cost_spec.get('link_costs'):
+            self.link_costs = cost_spec.get('perception_factor', 1.0) * \
+                np.asarray(links[cost_spec['link_costs']], dtype=np.float64)
+
+        if 'modes' in links.attributes:
+            mask = np.array([self.mode in modes for modes in links['modes']], dtype=bool)
+        else:
+            mask = np.ones(len(links), dtype=bool)
+        self.graph = _ClassGraph(links, zones, mask)
+
+        if class_spec.get('path_analysis') is not None or class_spec.get('analysis') is not None:
+            raise UnsupportedSpecError("Class 'path_analysis' and 'analysis' entries are not read offline. Move them "
+                                       "into 'path_analyses' (see road_path_analysis.retain_path_analyses)")
+        if (class_spec.get('results') or {}).get('turn_volumes') is not None:
+            raise UnsupportedSpecError("Turn volumes are not supported offline")
+
+        self.analyzed_demands = []
+        for analysis in class_spec.get('path_analyses') or []:
+            results = analysis.get('results') or {}
+            if results.get('selected_link_volumes') is not None:
+                raise UnsupportedSpecError("Selected link volumes are not supported offline")
+            if results.get('selected_turn_volumes') is not None:
+                raise UnsupportedSpecError("Selected turn volumes are not supported offline")
+            if analysis.get('turn_component') is not None:
+                raise UnsupportedSpecError("Turn components are not supported offline")
+            if analysis.get('operator', '+') not in _PATH_OPERATORS:
+                raise UnsupportedSpecError("Path operator '%s' is not supported offline" % analysis['operator'])
+            composition = analysis.get('path_to_od_composition') or {}
+            considered_paths = composition.get('considered_paths', 'ALL')
+            if considered_paths not in _CONSIDERED_PATHS:
+                raise UnsupportedSpecError("Considered paths '%s' are not supported offline" % considered_paths)
+
+            analyzed_demand_id = analysis.get('analyzed_demand')
+            if analyzed_demand_id is None:
+                self.analyzed_demands.append(self.demand)
+            elif analyzed_demand_id not in matrices:
+                raise KeyError("Analyzed demand matrix '%s' was not provided" % analyzed_demand_id)
+            else:
+                self.analyzed_demands.append(np.asarray(matrices[analyzed_demand_id], dtype=np.float64))
+
+    def all_or_nothing(self, link_times):
+        """
+        Returns a tuple of (link volumes aligned with the full link table, total
+        shortest path cost, distances, predecessor links).
+        """
+        index = self.graph.link_index
+        distances, predecessor_links = self.graph.trees(link_times[index] + self.link_costs[index])
+        volumes = np.zeros(len(link_times))
+        volumes[index] = self.graph.load(distances, predecessor_links, self.demand)
+
+        od_costs = self.graph.od_costs(distances)
+        reachable = od_costs < UNREACHABLE
+        shortest_cost = (self.demand[reachable] * od_costs[reachable]).sum()
+        return volumes, shortest_cost, distances, predecessor_links
+
+
+class _VolumeDelayFunctions(object):
+    def __init__(self, links, functions, vdf_attribute):
+        self._groups = []
+        vdfs = np.asarray(links[vdf_attribute]).astype(np.int64)
+        for number in np.unique(vdfs):
+            if number not in functions:
+                raise KeyError("No volume-delay function was provided for vdf %s" % number)
+            mask = vdfs == number
+            self._groups.append((mask, links.subset(mask), functions[number]))
+        self._n_links = len(links)
+
+    def __call__(self, volumes):
+        times = np.zeros(self._n_links)
+        for mask, subset, function in self._groups:
+            times[mask] = function(volumes[mask], subset)
+        return times
+
+# -------------------------------------------------------------------------------------------
+
+
+def _line_search(vdf, background, volumes, directions, classes, tolerance=1.0e-6):
+    """
+    Finds the step size in [0, 1] minimizing the Beckmann objective along the given
+    direction, by bisection on its derivative.
+    """
+    total_volume = background + sum(volumes)
+    total_direction = sum(directions)
+    fixed = sum((direction * traffic_class.link_costs).sum()
+                for direction, traffic_class in zip(directions, classes))
+
+    def derivative(step):
+        return (total_direction * vdf(total_volume + step * total_direction)).sum() + fixed
+
+    if derivative(1.0) <= 0.0:
+        return 1.0
+    lower, upper = 0.0, 1.0
+    while upper - lower > tolerance:
+        middle = 0.5 * (lower + upper)
+        if derivative(middle) > 0.0:
+            upper = middle
+        else:
+            lower = middle
+    return 0.5 * (lower + upper)
+
+
+def _conjugate_weight(vdf, total_volume, previous_target, aon_target, max_weight=0.99):
+    """
+    Computes the weight of the previous target in a conjugate Frank-Wolfe direction
+    (Mitradjieva & Lindberg, 2013), using a numerical estimate of the link time derivatives.
+    """
+    step = np.maximum(1.0e-3 * total_volume, 1.0e-3)
+    slopes = (vdf(total_volume + step) - vdf(total_volume)) / step
+    previous_direction = previous_target - total_volume
+    numerator = (previous_direction * slopes * (aon_target - total_volume)).sum()
+    denominator = (previous_direction * slopes * (aon_target - previous_target)).sum()
+    if denominator == 0.0:
+        return 0.0
+    return min(max(numerator / denominator, 0.0), max_weight)
+
+
+def _check_spec(spec):
+    for analysis_name in ('path_analysis', 'cutoff_analysis', 'traversal_analysis'):
+        if spec.get(analysis_name) is not None:
+            raise UnsupportedSpecError("'%s' is not supported offline" % analysis_name)
+
+
+def assign(spec, links, zones, matrices, functions, method='CFW', vdf_attribute='volume_delay_func',
+           background_volumes=None):
+    """
+    Runs a multi-class static road assignment offline.
+
+    Args:
+        - spec: A SOLA_TRAFFIC_ASSIGNMENT specification dictionary, as built by
+            RoadAssignmentUtil._getPrimarySOLASpec
+        - links: A network_arrays.LinkArrays object, holding the link length, the
+            vdf number, every attribute used by the volume-delay functions, and every
+            link cost or path analysis attribute named in the spec. An optional 'modes'
+            attribute holds the string of mode ids allowed on each link (see add_link_modes).
+        - zones: Array of zone (centroid) numbers, in matrix order
+        - matrices: Dictionary of matrix id : (zones x zones) array, holding every
+            demand matrix named in the spec
+        - functions: Dictionary of vdf number : volume-delay function. Functions take an
+            array of volumes and a LinkArrays subset, and return link times in minutes.
+        - method (='CFW'): 'FW' for Frank-Wolfe, or 'CFW' for conjugate Frank-Wolfe
+        - vdf_attribute (='volume_delay_func'): Link attribute of the vdf numbers
+        - background_volumes (=None): Optional array of fixed link volumes. If omitted,
+            the spec's 'background_traffic' link component is used, if any.
+
+    Returns: An AssignmentResult. Raises an UnsupportedSpecError if the spec uses a
+        feature which the offline engine does not implement.
+    """
+    if method not in ('FW', 'CFW'):
+        raise ValueError("Unknown assignment method '%s'" % method)
+    _check_spec(spec)
+
+    zones = np.asarray(zones, dtype=np.int64)
+    classes = [_TrafficClass(class_spec, links, zones, matrices) for class_spec in spec['classes']]
+    vdf = _VolumeDelayFunctions(links, functions, vdf_attribute)
+
+    if background_volumes is None:
+        background_volumes = np.zeros(len(links))
+        background_spec = spec.get('background_traffic') or {}
+        if background_spec.get('link_component'):
+            background_volumes = np.asarray(links[background_spec['link_component']], dtype=np.float64)
+
+    criteria = spec.get('stopping_criteria') or {}
+    max_iterations = int(criteria.get('max_iterations', 100))
+    relative_gap_target = criteria.get('relative_gap') or 0.0
+    best_relative_gap_target = criteria.get('best_relative_gap') or 0.0
+    normalized_gap_target = criteria.get('normalized_gap') or 0.0
+    total_demand = sum(traffic_class.demand.sum() - np.trace(traffic_class.demand) for traffic_class in classes)
+
+    result = AssignmentResult()
+    link_times = vdf(background_volumes)
+    volumes = [traffic_class.all_or_nothing(link_times)[0] for traffic_class in classes]
+    targets = None
+    best_relative_gap = np.inf
+    trees = None
+
+    for iteration in range(1, max_iterations + 1):
+        total_volume = background_volumes + sum(volumes)
+        link_times = vdf(total_volume)
+
+        aon = [traffic_class.all_or_nothing(link_times) for traffic_class in classes]
+        trees = [(distances, predecessor_links) for _, _, distances, predecessor_links in aon]
+        total_cost = sum((volume * (link_times + traffic_class.link_costs)).sum()
+                         for volume, traffic_class in zip(volumes, classes))
+        shortest_cost = sum(shortest for _, shortest, _, _ in aon)
+        gap = total_cost - shortest_cost
+        relative_gap = gap / total_cost if total_cost > 0 else 0.0
+        normalized_gap = gap / total_demand if total_demand > 0 else 0.0
+        best_relative_gap = min(best_relative_gap, relative_gap)
+
+        if relative_gap <= relative_gap_target:
+            result.stopping_criterion = 'relative_gap'
+        elif best_relative_gap <= best_relative_gap_target:
+            result.stopping_criterion = 'best_relative_gap'
+        elif normalized_gap <= normalized_gap_target:
+            result.stopping_criterion = 'normalized_gap'
+        if result.stopping_criterion is not None:
+            result.iterations.append({'iteration': iteration, 'step': 0.0, 'relative_gap': relative_gap,
+                                      'normalized_gap': normalized_gap})
+            break
+
+        aon_volumes = [volume for volume, _, _, _ in aon]
+        if method == 'CFW' and targets is not None:
+            weight = _conjugate_weight(vdf, total_volume, background_volumes + sum(targets),
+                                       background_volumes + sum(aon_volumes))
+            targets = [weight * target + (1.0 - weight) * aon_volume
+                       for target, aon_volume in zip(targets, aon_volumes)]
+        else:
+            targets = aon_volumes
+
+        directions = [target - volume for target, volume in zip(targets, volumes)]
+        step = _line_search(vdf, background_volumes, volumes, directions, classes)
+        volumes = [volume + step * direction for volume, direction in zip(volumes, directions)]
+
+        result.iterations.append({'iteration': iteration, 'step': step, 'relative_gap': relative_gap,
+                                  'normalized_gap': normalized_gap})
+    else:
+        result.stopping_criterion = 'max_iterations'
+
+    total_volume = background_volumes + sum(volumes)
+    link_times = vdf(total_volume)
+    if result.stopping_criterion == 'max_iterations':
+        trees = [traffic_class.all_or_nothing(link_times)[2:] for traffic_class in classes]
+
+    result.link_volumes = total_volume
+    result.link_times = link_times
+    result.class_volumes = volumes
+    for traffic_class, volume, (distances, predecessor_links) in zip(classes, volumes, trees):
+        _store_class_results(result, traffic_class, links, volume, distances, predecessor_links)
+    return result
+
+
+def _store_class_results(result, traffic_class, links, volume, distances, predecessor_links):
+    results_spec = traffic_class.spec.get('results') or {}
+    if results_spec.get('link_volumes'):
+        result.link_attributes[results_spec['link_volumes']] = volume
+
+    od_times = results_spec.get('od_travel_times') or {}
+    if od_times.get('shortest_paths'):
+        result.matrices[od_times['shortest_paths']] = traffic_class.graph.od_costs(distances)
+
+    index = traffic_class.graph.link_index
+    for analysis, analyzed_demand in zip(traffic_class.spec.get('path_analyses') or [],
+                                         traffic_class.analyzed_demands):
+        od_values = (analysis.get('results') or {}).get('od_values')
+        if not od_values:
+            continue
+        values = np.asarray(links[analysis['link_component']], dtype=np.float64)[index]
+        path_values = traffic_class.graph.skim(distances, predecessor_links, values, analysis.get('operator', '+'))
+        result.matrices[od_values] = _compose_od_values(analysis, path_values, analyzed_demand)
+
+
+def _compose_od_values(analysis, path_values, analyzed_demand):
+    # Each O-D pair has one path (with a proportion of 1), so its O-D value is the
+    # product of the selected multipliers if the path is considered, and 0 otherwise.
+    threshold = analysis.get('selection_threshold') or {}
+    selected = np.ones(path_values.shape, dtype=bool)
+    if threshold.get('lower') is not None:
+        selected &= path_values >= threshold['lower']
+    if threshold.get('upper') is not None:
+        selected &= path_values <= threshold['upper']
+
+    composition = analysis.get('path_to_od_composition') or {}
+    considered_paths = composition.get('considered_paths', 'ALL')
+    if considered_paths == 'ALL':
+        considered = np.ones(path_values.shape, dtype=bool)
+    elif considered_paths == 'SELECTED':
+        considered = selected
+    else:
+        considered = ~selected
+
+    multipliers = composition.get('multiply_path_proportions_by') or {'path_value': True}
+    od_values = considered.astype(np.float64)
+    if multipliers.get('analyzed_demand'):
+        od_values = od_values * analyzed_demand
+    if multipliers.get('path_value'):
+        od_values = np.where(considered, od_values * path_values, 0.0)
+    np.fill_diagonal(od_values, 0.0)
+    return od_values
+
+# -------------------------------------------------------------------------------------------
+
+#: Braess's network (Braess, 1968; Sheffi, 1985, section 2.3), as (i, j, link time function
+#: constant, volume coefficient). Zone 1 is the origin, zone 2 the destination, and the link
+#: 3-4 is the bypass of Braess's paradox.
+BRAESS_LINKS = [(1, 3, 0.0, 10.0), (3, 2, 50.0, 1.0), (1, 4, 50.0, 1.0), (4, 2, 0.0, 10.0), (3, 4, 10.0, 1.0)]
+
+#: Trips from zone 1 to zone 2
+BRAESS_DEMAND = 6.0
+
+#: Published equilibrium of Braess's network, without and with the bypass: the volumes
+#: of the links (in BRAESS_LINKS order), and the travel time from zone 1 to zone 2
+BRAESS_EQUILIBRIUM = {
+    False: ([3.0, 3.0, 3.0, 3.0], 83.0),
+    True: ([4.0, 2.0, 2.0, 4.0, 2.0], 92.0)
+}
+
+
+def _linear_function(constant='data1', coefficient='data2'):
+    def function(volume, links):
+        return links[constant] + links[coefficient] * volume
+    return function
+
+
+def braess_reference(bypass=True):
+    """
+    Builds Braess's network for the offline engine.
+
+    Args:
+        - bypass (=True): Flag to include the link 3-4
+
+    Returns: A tuple of (spec, links, zones, matrices, functions), to pass to assign.
+        The spec has one class, writing its link volumes to '@auto' and its travel
+        times to 'mf2'.
+    """
+    rows = BRAESS_LINKS if bypass else BRAESS_LINKS[:4]
+    links = _netArrays.LinkArrays(
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[1] for row in rows], dtype=np.int64),
+        {'length': np.ones(len(rows)),
+         'volume_delay_func': np.ones(len(rows), dtype=np.int64),
+         'data1': np.array([row[2] for row in rows]),
+         'data2': np.array([row[3] for row in rows])})
+    spec = {
+        'type': 'SOLA_TRAFFIC_ASSIGNMENT',
+        'classes': [{'mode': 'c', 'demand': 'mf1', 'generalized_cost': None,
+                     'results': {'link_volumes': '@auto', 'od_travel_times': {'shortest_paths': 'mf2'}},
+                     'path_analyses': []}],
+        'stopping_criteria': {'max_iterations': 500, 'relative_gap': 1.0e-8, 'best_relative_gap': 0.0,
+                              'normalized_gap': 0.0}
+    }
+    matrices = {'mf1': np.array([[0.0, BRAESS_DEMAND], [0.0, 0.0]])}
+    return spec, links, np.array([1, 2]), matrices, {1: _linear_function()}
+
+
+def check_reference(method='CFW'):
+    """
+    Assigns Braess's network with and without the bypass, and compares the results with
+    the published equilibrium.
+
+    Args:
+        - method (='CFW'): The assignment method
+
+    Returns: A dictionary of bypass flag : dictionary of the largest absolute link
+        volume difference ('volumes') and the absolute travel time difference ('time').
+    """
+    report = {}
+    for bypass, (expected_volumes, expected_time) in six.iteritems(BRAESS_EQUILIBRIUM):
+        spec, links, zones, matrices, functions = braess_reference(bypass)
+        result = assign(spec, links, zones, matrices, functions, method=method)
+        report[bypass] = {
+            'volumes': float(np.abs(result.link_volumes - np.array(expected_volumes)).max()),
+            'time': abs(float(result.matrices['mf2'][0, 1]) - expected_time)
+        }
+    return report
@@ -0,0 +1,211 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Weighted averages of full matrices over a zone partition, computed with NumPy.
+
+Zones are sorted by group, so that every partition group is a contiguous block of
+rows and columns, and each group-to-group block is summed with np.add.reduceat.
+Group pairs whose weights sum to zero are averaged equally over their cells, as
+the Emme-based version of the Export Partition Average tool did. Any number of
+value matrices can be averaged with the same weights in one call.
+
+check_binary_round_trip writes a PartitionMatrixData with utilities.exportBinaryMatrix
+(compressed for '.gz' paths) and reads it back, to check the binary export.
+"""
+
+import array as _array
+import gzip
+
+import inro.modeller as _m
+import numpy as np
+
+_MODELLER = _m.Modeller()
+_util = _MODELLER.module('tmg.common.utilities')
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Partition Aggregation",
+                                description="Collection of private functions for averaging full \
+                                        matrices over a zone partition.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class PartitionMatrixData(object):
+    """
+    A group-to-group matrix, exposing the same 'indices', 'raw_data', 'type' and
+    'num_dimensions' as the Emme MatrixData returned by the partition aggregation tool.
+    Like MatrixData, each row of raw_data is an array.array of doubles.
+    """
+
+    def __init__(self, group_numbers, values):
+        self.indices = [[int(number) for number in group_numbers], [int(number) for number in group_numbers]]
+        self.raw_data = [_array.array('d', row) for row in np.asarray(values, dtype=np.float64)]
+        self.type = 'd'
+        self.num_dimensions = 2
+
+    def to_numpy(self):
+        return np.array(self.raw_data, dtype=np.float64)
+
+
+def get_zone_groups(partition, scenario):
+    """Returns an array of the partition group number of each zone of the scenario, in matrix order."""
+    data = partition.get_data(scenario.id)
+    groups = [data.get(zone) for zone in scenario.zone_numbers]
+    missing = [zone for zone, group in zip(scenario.zone_numbers, groups) if group is None]
+    if missing:
+        raise ValueError("%s zone(s) of scenario %s are not in partition '%s': %s"
+                         % (len(missing), scenario.id, partition.id, ", ".join(str(zone) for zone in missing[:10])
+                            + (", ..." if len(missing) > 10 else "")))
+    return np.array(groups, dtype=np.int64)
+
+
+class _GroupBlocks(object):
+    def __init__(self, zone_groups):
+        zone_groups = np.asarray(zone_groups)
+        self.order = np.argsort(zone_groups, kind='mergesort')
+        sorted_groups = zone_groups[self.order]
+        self.group_numbers, self.starts = np.unique(sorted_groups, return_index=True)
+        self.sizes = np.diff(np.append(self.starts, len(sorted_groups)))
+
+    def sort(self, matrix):
+        return np.asarray(matrix, dtype=np.float64)[np.ix_(self.order, self.order)]
+
+    def sum(self, sorted_matrix):
+        return np.add.reduceat(np.add.reduceat(sorted_matrix, self.starts, axis=0), self.starts, axis=1)
+
+
+def partition_averages(value_matrices, weight_matrix, zone_groups):
+    """
+    Computes weighted averages of value matrices over a zone partition.
+
+    Args:
+        - value_matrices: A (zones, zones) array, or a list of them
+        - weight_matrix: The (zones, zones) array of weights (e.g. demand)
+        - zone_groups: Array of the group number of each zone, in matrix order
+
+    Returns: A tuple of (sorted array of group numbers, list of (groups, groups) arrays
+        of averages, one per value matrix). For group pairs whose weights sum to zero,
+        every cell is weighted equally.
+    """
+    single = isinstance(value_matrices, np.ndarray) and value_matrices.ndim == 2
+    if single:
+        value_matrices = [value_matrices]
+
+    blocks = _GroupBlocks(zone_groups)
+    weights = blocks.sort(weight_matrix)
+    denominators = blocks.sum(weights)
+
+    # For group pairs with no weight (e.g. no trips), weight every cell with 1
+    empty = denominators == 0
+    if np.any(empty):
+        group_positions = np.repeat(np.arange(len(blocks.group_numbers)), blocks.sizes)
+        weights = np.where(empty[np.ix_(group_positions, group_positions)], 1.0, weights)
+        denominators = np.where(empty, np.outer(blocks.sizes, blocks.sizes), denominators)
+
+    averages = []
+    for values in value_matrices:
+        numerators = blocks.sum(weights * blocks.sort(values))
+        averages.append(numerators / denominators)
+    return blocks.group_numbers, averages
+
+
+def write_averages(filepath, group_numbers, averages, title=None, column_names=None):
+    """
+    Writes partition averages in third-normalized form ('O D Val', one row per group pair).
+
+    Args:
+        - filepath: The output file
+        - group_numbers: Array of group numbers
+        - averages: List of (groups, groups) arrays, written as one column each
+        - title (=None): Optional text written before the column headers
+        - column_names (=None): Headers of the value columns. Defaults to 'Val' for a
+            single matrix, and 'Val1', 'Val2', ... otherwise.
+    """
+    if column_names is None:
+        column_names = ['Val'] if len(averages) == 1 else ['Val%s' % (i + 1) for i in range(len(averages))]
+    count = len(group_numbers)
+    table = np.empty((count * count, 2 + len(averages)))
+    table[:, 0] = np.repeat(group_numbers, count)
+    table[:, 1] = np.tile(group_numbers, count)
+    for column, average in enumerate(averages):
+        table[:, 2 + column] = np.asarray(average).ravel()
+
+    header = "O D " + " ".join(column_names)
+    if title:
+        header = title + "\n" + header
+    np.savetxt(filepath, table, fmt=['%d', '%d'] + ['%.9g'] * len(averages), delimiter=' ',
+               header=header, comments='')
+
+
+def read_binary_matrix(file_path):
+    """
+    Reads a full matrix in the TMG binary matrix (.mtx) format, gzipped if the file name
+    ends in 'gz'.
+
+    Returns: A tuple of (row zone numbers, column zone numbers, 2D array of values).
+    """
+    opener = gzip.open if file_path[-2:] == "gz" else open
+    with opener(file_path, "rb") as file_stream:
+        contents = file_stream.read()
+    magic, version, data_type, num_dims = np.frombuffer(contents, dtype=np.uint32, count=4)
+    if magic != 0xC4D4F1B2 or version != 1 or num_dims != 2:
+        raise ValueError("Unexpected header in '%s': magic number: %X, version: %d, dimensions: %d"
+                         % (file_path, magic, version, num_dims))
+    rows, columns = np.frombuffer(contents, dtype=np.uint32, count=2, offset=16)
+    offset = 24
+    row_numbers = np.frombuffer(contents, dtype=np.int32, count=rows, offset=offset)
+    offset += 4 * rows
+    column_numbers = np.frombuffer(contents, dtype=np.int32, count=columns, offset=offset)
+    offset += 4 * columns
+    dtype = {1: np.float32, 2: np.float64, 3: np.int32, 4: np.uint32}[int(data_type)]
+    values = np.frombuffer(contents, dtype=dtype, count=rows * columns, offset=offset)
+    if offset + values.nbytes != len(contents):
+        raise ValueError("'%s' has %s bytes, but its header describes %s"
+                         % (file_path, len(contents), offset + values.nbytes))
+    return row_numbers, column_numbers, values.reshape(rows, columns)
+
+
+def check_binary_round_trip(file_path, group_numbers=None, averages=None):
+    """
+    Exports a PartitionMatrixData with utilities.exportBinaryMatrix and reads it back.
+
+    Args:
+        - file_path: The file to write, e.g. ending in '.mtx.gz' to check the compressed export
+        - group_numbers (=None): Array of group numbers. Defaults to 3 groups.
+        - averages (=None): The (groups, groups) array of values. Defaults to random values.
+
+    Returns: The largest absolute difference between the values read back and the
+        values exported. Raises a ValueError if the group numbers or the shape differ.
+    """
+    if group_numbers is None:
+        group_numbers = np.array([1, 2, 3])
+    if averages is None:
+        averages = np.random.RandomState(0).rand(len(group_numbers), len(group_numbers))
+    _util.exportBinaryMatrix(PartitionMatrixData(group_numbers, averages), file_path)
+    row_numbers, column_numbers, values = read_binary_matrix(file_path)
+    if list(row_numbers) != list(group_numbers) or list(column_numbers) != list(group_numbers):
+        raise ValueError("The group numbers read back from '%s' differ from those exported" % file_path)
+    return float(np.abs(values - np.asarray(averages, dtype=np.float64)).max())
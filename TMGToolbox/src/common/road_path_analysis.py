@@ -0,0 +1,266 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Path analyses on the retained paths of a single SOLA traffic assignment.
+
+The tolled road assignment tools used to re-run the full assignment once for each
+skim they needed (true travel times, tolls, path analysis results), because older
+versions of Emme only allowed one path analysis per class. SOLA retains the paths
+of each class, and evaluates every entry of the class 'path_analyses' list on them
+at the end of the assignment. The functions here move the single 'path_analysis'
+and 'analysis' of a class into that list, append the other analyses, and build the
+matrix calculation which recovers travel times from the generalized cost skim.
+
+Travel times are recovered as shortest path generalized cost - perception factor *
+path cost. At equilibrium all used paths have the same generalized cost, so this
+matches the time skim of a repeated assignment to within the convergence of the
+primary assignment. The regression harness (legacy_skims, retained_skims and
+compare_skims) runs both pipelines with the offline road assignment engine, and
+reports the differences between their skims.
+"""
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+_util = _MODELLER.module('tmg.common.utilities')
+_netArrays = _MODELLER.module('tmg.common.network_arrays')
+_offlineAssignment = _MODELLER.module('tmg.common.offline_road_assignment')
+EMME_VERSION = _util.getEmmeVersion(tuple)
+
+#: First version of Emme whose SOLA assignment accepts a list of path analyses per class
+PATH_ANALYSES_VERSION = (4, 4, 0)
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Road Path Analysis",
+                                description="Collection of private functions for running several path \
+                                        analyses on the retained paths of one SOLA traffic assignment.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+def supports_retained_paths(emme_version=None):
+    """Returns True if SOLA assignments can run several path analyses per class in this version of Emme."""
+    if emme_version is None:
+        emme_version = EMME_VERSION
+    return tuple(emme_version[:3]) >= PATH_ANALYSES_VERSION
+
+
+def get_path_analysis(link_component, od_values=None, operator="+", turn_component=None, lower=None, upper=None,
+                      considered_paths="ALL", multiply_by_demand=False, multiply_by_value=True,
+                      analyzed_demand=None, selected_link_volumes=None, selected_turn_volumes=None):
+    """
+    Returns one entry of a SOLA class 'path_analyses' list. By default, the link
+    component is summed along each path, and path values are averaged over all the
+    paths of each O-D pair (as with the path analyses of the tolled assignment tools).
+    """
+    return {
+        "link_component": link_component,
+        "turn_component": turn_component,
+        "operator": operator,
+        "selection_threshold": {
+            "lower": lower,
+            "upper": upper
+        },
+        "path_to_od_composition": {
+            "considered_paths": considered_paths,
+            "multiply_path_proportions_by": {
+                "analyzed_demand": multiply_by_demand,
+                "path_value": multiply_by_value
+            }
+        },
+        "analyzed_demand": analyzed_demand,
+        "results": {
+            "od_values": od_values,
+            "selected_link_volumes": selected_link_volumes,
+            "selected_turn_volumes": selected_turn_volumes
+        }
+    }
+
+
+def split_legacy_analysis(class_spec):
+    """
+    Removes the single 'path_analysis' and 'analysis' entries from a SOLA class
+    specification (modified in place).
+
+    Returns: The equivalent 'path_analyses' entry, or None if the class had no path analysis.
+    """
+    path_analysis = class_spec.pop("path_analysis", None)
+    analysis = class_spec.pop("analysis", None)
+    if path_analysis is None:
+        return None
+
+    merged = dict(path_analysis)
+    if analysis is not None:
+        merged.setdefault("analyzed_demand", analysis.get("analyzed_demand"))
+        merged.setdefault("results", analysis.get("results"))
+    merged.setdefault("analyzed_demand", None)
+    merged.setdefault("results", {"od_values": None, "selected_link_volumes": None,
+                                  "selected_turn_volumes": None})
+    return merged
+
+
+def retain_path_analyses(class_spec, analyses=()):
+    """
+    Converts a SOLA class specification (in place) to the 'path_analyses' form, and
+    appends more path analyses to run on the class's retained paths. Analyses without
+    any result are dropped.
+
+    Args:
+        - class_spec: One entry of the 'classes' list of a SOLA_TRAFFIC_ASSIGNMENT spec
+        - analyses (=()): List of path analyses, as returned by get_path_analysis
+
+    Returns: class_spec
+    """
+    retained = list(class_spec.get("path_analyses") or [])
+    legacy = split_legacy_analysis(class_spec)
+    if legacy is not None:
+        retained.append(legacy)
+    retained.extend(analyses)
+    class_spec["path_analyses"] = [analysis for analysis in retained
+                                   if any(six.itervalues(analysis.get("results") or {}))]
+    return class_spec
+
+
+def get_time_correction_spec(times_matrix_id, cost_matrix_id, perception_factor):
+    """
+    Returns the matrix calculation recovering travel times from a shortest path
+    generalized cost matrix (times_matrix_id, overwritten), and the path cost matrix
+    of the same assignment.
+    """
+    return {
+        "expression": "%s - %s * %s" % (times_matrix_id, float(perception_factor), cost_matrix_id),
+        "result": times_matrix_id,
+        "constraint": {
+            "by_value": None,
+            "by_zone": None
+        },
+        "aggregation": {
+            "origins": None,
+            "destinations": None
+        },
+        "type": "MATRIX_CALCULATION"
+    }
+
+# -------------------------------------------------------------------------------------------
+
+
+def _with_attribute(links, attribute_name, values):
+    attributes = dict(links.attributes)
+    attributes[attribute_name] = values
+    return _netArrays.LinkArrays(links.i, links.j, attributes)
+
+
+def _offline_spec(spec):
+    # The offline engine only reads the 'path_analyses' form of each class
+    offline = dict(spec)
+    offline["classes"] = [retain_path_analyses(dict(class_spec)) for class_spec in spec["classes"]]
+    return offline
+
+
+def legacy_skims(specs, links, zones, matrices, functions, time_attribute=None, method='CFW'):
+    """
+    Runs a sequence of full assignments offline, as the tolled tools did before paths
+    were retained: the first spec is the primary assignment, and the others repeat it
+    to produce one more skim each.
+
+    Args:
+        - specs: List of SOLA_TRAFFIC_ASSIGNMENT specifications, primary first
+        - links, zones, matrices, functions: As for offline_road_assignment.assign
+        - time_attribute (=None): Link attribute receiving the primary assignment's link
+            times (timau) before the later assignments, if any
+        - method (='CFW'): The offline assignment method
+
+    Returns: A dictionary of matrix id : array, with later assignments overwriting
+        matrices written by earlier ones.
+    """
+    skims = {}
+    for position, spec in enumerate(specs):
+        result = _offlineAssignment.assign(_offline_spec(spec), links, zones, matrices, functions, method=method)
+        skims.update(result.matrices)
+        if position == 0 and time_attribute is not None:
+            links = _with_attribute(links, time_attribute, result.link_times)
+    return skims
+
+
+def retained_skims(spec, links, zones, matrices, functions, time_corrections=(), method='CFW'):
+    """
+    Runs one assignment offline with all path analyses attached, then applies the
+    travel time corrections.
+
+    Args:
+        - spec: The SOLA_TRAFFIC_ASSIGNMENT specification, with retained path analyses
+        - links, zones, matrices, functions: As for offline_road_assignment.assign
+        - time_corrections (=()): List of (times matrix id, cost matrix id, perception
+            factor), as passed to get_time_correction_spec
+        - method (='CFW'): The offline assignment method
+
+    Returns: A dictionary of matrix id : array.
+    """
+    result = _offlineAssignment.assign(_offline_spec(spec), links, zones, matrices, functions, method=method)
+    skims = dict(result.matrices)
+    for times_matrix_id, cost_matrix_id, perception_factor in time_corrections:
+        skims[times_matrix_id] = skims[times_matrix_id] - float(perception_factor) * skims[cost_matrix_id]
+    return skims
+
+
+def compare_skims(reference, candidate, matrix_ids=None, tolerance=1.0e-4):
+    """
+    Compares two sets of skims, ignoring unreachable O-D pairs.
+
+    Args:
+        - reference: Dictionary of matrix id : array (e.g. from legacy_skims)
+        - candidate: Dictionary of matrix id : array (e.g. from retained_skims)
+        - matrix_ids (=None): The matrices to compare. Defaults to those in both sets.
+        - tolerance (=1.0e-4): Largest absolute difference for a matrix to pass
+
+    Returns: A dictionary of matrix id : dictionary of 'max_abs', 'mean_abs' and
+        'max_rel' differences, and 'passed'.
+    """
+    if matrix_ids is None:
+        matrix_ids = sorted(set(reference) & set(candidate))
+    report = {}
+    for matrix_id in matrix_ids:
+        expected = np.asarray(reference[matrix_id], dtype=np.float64)
+        actual = np.asarray(candidate[matrix_id], dtype=np.float64)
+        if expected.shape != actual.shape:
+            raise ValueError("Matrix '%s' has shape %s in the reference skims, but %s in the candidate skims"
+                             % (matrix_id, expected.shape, actual.shape))
+        reachable = (expected < _offlineAssignment.UNREACHABLE) & (actual < _offlineAssignment.UNREACHABLE)
+        difference = np.abs(actual - expected)[reachable]
+        if len(difference) == 0:
+            report[matrix_id] = {'max_abs': 0.0, 'mean_abs': 0.0, 'max_rel': 0.0, 'passed': True}
+            continue
+        scale = np.maximum(np.abs(expected[reachable]), 1.0e-9)
+        max_abs = float(difference.max())
+        report[matrix_id] = {
+            'max_abs': max_abs,
+            'mean_abs': float(difference.mean()),
+            'max_rel': float((difference / scale).max()),
+            'passed': max_abs <= tolerance
+        }
+    return report
@@ -0,0 +1,484 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Local parser and evaluator for Emme network selection expressions (the link,
+transit line, and transit segment selections used by the Network Calculator).
+
+Instead of calling the Network Calculator once per filter, a NetworkSelector pulls
+the network topology from a scenario once, and evaluates any number of selection
+expressions into boolean NumPy masks. Attribute values are pulled from the scenario
+on first use, and cached.
+
+Supported grammar:
+    - 'all'
+    - 'and', 'or', 'not' and parentheses
+    - Node numbers: 'i=10', 'j=10000,19999' (value or inclusive range)
+    - Link ids: 'link=10,20'
+    - Modes: 'mode=bp'. Links are selected if they allow ANY of the modes; lines
+        (and their segments) if their mode is one of them. Every character must be
+        a mode id of the network.
+    - Line ids: 'line=T_____'. '_' matches any single character (including the
+        blank padding of shorter ids), and '*' matches any number of characters.
+    - Vehicles: 'veh=1,5'
+    - Attributes, by Network Calculator name (e.g. 'vdf', 'ul2', 'volau', 'hdw')
+        or by Network API name (e.g. 'type', 'length', '@lfare'). '=' selects
+        a value or an inclusive range ('lanes=1,2'), and the comparison operators
+        '!=', '<', '<=', '>' and '>=' are also accepted.
+
+Expressions using anything else raise a SelectionSyntaxError, so callers can fall
+back to the Network Calculator. Values may not contain the operator characters
+'=<>!&|' (e.g. 'mode=b&line=T_____' is rejected rather than read as one mode value),
+and mode and line id values may not contain ','. check_rejected_expressions lists
+the expressions of REJECTED_EXPRESSIONS which a selector fails to reject.
+"""
+
+import re
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Selection Expressions",
+                                description="Parser and evaluator for Emme link, transit line, \
+                                        and transit segment selection expressions.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class SelectionSyntaxError(SyntaxError):
+    """
+    Raised when an expression cannot be parsed, or uses a feature which is not supported
+    by the local evaluator.
+    """
+    pass
+
+
+# Network Calculator names -> Network API attribute names
+ATTRIBUTE_ALIASES = {
+    'LINK': {'len': 'length', 'lanes': 'num_lanes', 'vdf': 'volume_delay_func',
+             'ul1': 'data1', 'ul2': 'data2', 'ul3': 'data3',
+             'volau': 'auto_volume', 'volad': 'additional_volume', 'timau': 'auto_time',
+             'volax': 'aux_transit_volume'},
+    'TRANSIT_LINE': {'hdw': 'headway', 'spd': 'speed', 'speed': 'speed',
+                     'ut1': 'data1', 'ut2': 'data2', 'ut3': 'data3'},
+    'TRANSIT_SEGMENT': {'dwt': 'dwell_time', 'ttf': 'transit_time_func',
+                        'us1': 'data1', 'us2': 'data2', 'us3': 'data3',
+                        'voltr': 'transit_volume', 'timtr': 'transit_time',
+                        'board': 'transit_boardings'}
+}
+
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<paren>[()])
+        | (?P<keyword>(?:and|or|not|all)(?![\w@.=<>!]))
+        | (?P<name>[A-Za-z@][\w@]*)\s*(?P<op><=|>=|!=|=|<|>)\s*(?P<value>[^\s()]+)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+#: Characters which can't appear in a predicate value
+_OPERATOR_CHARACTERS = set('=<>!&|')
+
+#: Expressions which must raise a SelectionSyntaxError, so the callers fall back to the
+#: Network Calculator. '{unknown_mode}' is replaced by a character which is not a mode id.
+REJECTED_EXPRESSIONS = ('mode=b&line=T_____', 'mode=b,line=T_____', 'mode=b|c', 'line=T_____,YV____',
+                        'i=10&j=20', 'vdf=1!', 'mode={unknown_mode}')
+
+_PARSE_CACHE = {}
+
+
+def tokenize(expression):
+    """
+    Splits an expression into a list of tokens: '(', ')', 'and', 'or', 'not', 'all',
+    or (name, operator, value) tuples for predicates.
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if match is None or match.end() == position:
+            raise SelectionSyntaxError("Could not parse '%s' at position %s" % (expression, position))
+        if match.group('paren'):
+            tokens.append(match.group('paren'))
+        elif match.group('keyword'):
+            tokens.append(match.group('keyword').lower())
+        else:
+            name, value = match.group('name').lower(), match.group('value')
+            if _OPERATOR_CHARACTERS.intersection(value):
+                raise SelectionSyntaxError("Value '%s' of '%s' contains an operator character" % (value, name))
+            if name in ('mode', 'line') and ',' in value:
+                raise SelectionSyntaxError("Value '%s' of '%s' can't contain ','" % (value, name))
+            tokens.append((name, match.group('op'), value))
+        position = match.end()
+        while position < len(expression) and expression[position].isspace():
+            position += 1
+    return tokens
+
+
+def parse(expression):
+    """
+    Parses a selection expression into a tree of tuples:
+        ('or', [children]), ('and', [children]), ('not', child), ('all',),
+        or ('predicate', name, operator, value).
+
+    Results are cached, since the same filters typically get evaluated for several scenarios.
+    """
+    if expression in _PARSE_CACHE:
+        return _PARSE_CACHE[expression]
+
+    tokens = tokenize(expression)
+    if not tokens:
+        raise SelectionSyntaxError("Empty selection expression")
+    tree, position = _parse_or(tokens, 0)
+    if position != len(tokens):
+        raise SelectionSyntaxError("Unexpected '%s' in '%s'" % (tokens[position], expression))
+
+    _PARSE_CACHE[expression] = tree
+    return tree
+
+
+def _parse_or(tokens, position):
+    children = []
+    child, position = _parse_and(tokens, position)
+    children.append(child)
+    while position < len(tokens) and tokens[position] == 'or':
+        child, position = _parse_and(tokens, position + 1)
+        children.append(child)
+    if len(children) == 1:
+        return children[0], position
+    return ('or', children), position
+
+
+def _parse_and(tokens, position):
+    children = []
+    child, position = _parse_factor(tokens, position)
+    children.append(child)
+    while position < len(tokens) and tokens[position] == 'and':
+        child, position = _parse_factor(tokens, position + 1)
+        children.append(child)
+    if len(children) == 1:
+        return children[0], position
+    return ('and', children), position
+
+
+def _parse_factor(tokens, position):
+    if position >= len(tokens):
+        raise SelectionSyntaxError("Unexpected end of expression")
+    token = tokens[position]
+    if token == 'not':
+        child, position = _parse_factor(tokens, position + 1)
+        return ('not', child), position
+    if token == '(':
+        child, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ')':
+            raise SelectionSyntaxError("Missing closing parenthesis")
+        return child, position + 1
+    if token == 'all':
+        return ('all',), position + 1
+    if isinstance(token, tuple):
+        name, op, value = token
+        return ('predicate', name, op, value), position + 1
+    raise SelectionSyntaxError("Unexpected '%s'" % (token,))
+
+
+def compile_wildcard(pattern):
+    """
+    Converts an Emme id pattern into a function testing ids against it. '_' matches any
+    single character (including the blank padding of shorter ids), '*' any number of
+    characters.
+    """
+    regex = re.compile(''.join('.' if c == '_' else '.*' if c == '*' else re.escape(c) for c in pattern) + '$',
+                       re.DOTALL)
+    width = len(pattern.replace('*', ''))
+
+    def test(id):
+        return regex.match(id.ljust(width)) is not None
+    return test
+
+# -------------------------------------------------------------------------------------------
+
+
+class NetworkSelector(object):
+    """
+    Evaluates selection expressions over the links, transit lines and transit segments
+    of one scenario (or network).
+
+    All masks returned are aligned with the element order of this object:
+        - links: self.link_i, self.link_j
+        - lines: self.line_ids
+        - segments (excluding hidden segments): self.segment_line, self.segment_link,
+            which hold the positions of each segment's line and link.
+    """
+
+    def __init__(self, source):
+        """
+        Args:
+            - source: An Emme Scenario or Network. For a Scenario, only the topology is
+                loaded up-front, and attribute values are pulled when first used.
+        """
+        if hasattr(source, 'get_partial_network'):
+            self._scenario = source
+            self._network = source.get_partial_network(
+                ['LINK', 'TRANSIT_SEGMENT', 'TRANSIT_LINE', 'TRANSIT_VEHICLE'], include_attributes=False)
+        else:
+            self._scenario = None
+            self._network = source
+
+        self._links = list(self._network.links())
+        self.link_i = np.array([link.i_node.number for link in self._links], dtype=np.int64)
+        self.link_j = np.array([link.j_node.number for link in self._links], dtype=np.int64)
+        self._link_positions = dict(((link.i_node.number, link.j_node.number), position)
+                                    for position, link in enumerate(self._links))
+        self._link_modes = [''.join(mode.id for mode in link.modes) for link in self._links]
+
+        self._lines = list(self._network.transit_lines())
+        self.line_ids = np.array([line.id for line in self._lines], dtype=object)
+        self._line_modes = np.array([line.mode.id for line in self._lines], dtype=object)
+        self._line_vehicles = np.array([line.vehicle.number for line in self._lines], dtype=np.int64)
+
+        self._segments = []
+        segment_line = []
+        segment_link = []
+        for line_position, line in enumerate(self._lines):
+            for segment in line.segments():
+                link = segment.link
+                self._segments.append(segment)
+                segment_line.append(line_position)
+                segment_link.append(self._link_positions[(link.i_node.number, link.j_node.number)])
+        self.segment_line = np.array(segment_line, dtype=np.int64)
+        self.segment_link = np.array(segment_link, dtype=np.int64)
+
+        if hasattr(self._network, 'modes'):
+            self.mode_ids = set(str(mode.id) for mode in self._network.modes())
+        else:
+            self.mode_ids = set(''.join(self._link_modes)) | set(self._line_modes)
+
+        self._elements = {'LINK': self._links, 'TRANSIT_LINE': self._lines, 'TRANSIT_SEGMENT': self._segments}
+        self._values = {}
+        self._masks = {}
+
+    # ---------------------------------------------------------------------------------------
+    # ---Attribute values
+
+    def _resolve_attribute(self, domain, name):
+        name = ATTRIBUTE_ALIASES[domain].get(name, name)
+        if name in self._network.attributes(domain):
+            return name
+        return None
+
+    def values(self, domain, name):
+        """
+        Returns an array of attribute values for every element of a domain ('LINK',
+        'TRANSIT_LINE' or 'TRANSIT_SEGMENT'), pulling them from the scenario on first use.
+
+        Raises: SelectionSyntaxError if the attribute does not exist.
+        """
+        attribute = self._resolve_attribute(domain, name)
+        if attribute is None:
+            raise SelectionSyntaxError("%s attribute '%s' does not exist" % (domain, name))
+
+        key = (domain, attribute)
+        if key not in self._values:
+            if self._scenario is not None:
+                data = self._scenario.get_attribute_values(domain, [attribute])
+                self._network.set_attribute_values(domain, [attribute], data)
+            self._values[key] = np.array([element[attribute] for element in self._elements[domain]],
+                                         dtype=np.float64)
+        return self._values[key]
+
+    def link_values(self, name):
+        return self.values('LINK', name)
+
+    def line_values(self, name):
+        return self.values('TRANSIT_LINE', name)
+
+    def segment_values(self, name):
+        """
+        Returns an array of values aligned with the segments. Transit line and link
+        attributes are also accepted, and are repeated for each of their segments.
+        """
+        if self._resolve_attribute('TRANSIT_SEGMENT', name) is not None:
+            return self.values('TRANSIT_SEGMENT', name)
+        if self._resolve_attribute('TRANSIT_LINE', name) is not None:
+            return self.values('TRANSIT_LINE', name)[self.segment_line]
+        return self.values('LINK', name)[self.segment_link]
+
+    # ---------------------------------------------------------------------------------------
+    # ---Masks
+
+    def link_mask(self, expression):
+        """Returns a boolean array, True for each link selected by the expression."""
+        return self._mask('LINK', expression)
+
+    def line_mask(self, expression):
+        """Returns a boolean array, True for each transit line selected by the expression."""
+        return self._mask('TRANSIT_LINE', expression)
+
+    def segment_mask(self, link_expression='all', line_expression='all'):
+        """
+        Returns a boolean array, True for each (non-hidden) segment whose link is selected by
+        the link expression AND whose line is selected by the line expression. This is
+        equivalent to a Network Calculator transit segment calculation using the two as its
+        'link' and 'transit_line' selections.
+        """
+        mask = np.ones(len(self._segments), dtype=bool)
+        if link_expression.strip().lower() != 'all':
+            mask &= self.link_mask(link_expression)[self.segment_link]
+        if line_expression.strip().lower() != 'all':
+            mask &= self.line_mask(line_expression)[self.segment_line]
+        return mask
+
+    def _mask(self, domain, expression):
+        key = (domain, expression)
+        if key not in self._masks:
+            self._masks[key] = self._evaluate(domain, parse(expression))
+        return self._masks[key]
+
+    def _size(self, domain):
+        return len(self._elements[domain])
+
+    def _evaluate(self, domain, tree):
+        kind = tree[0]
+        if kind == 'all':
+            return np.ones(self._size(domain), dtype=bool)
+        if kind == 'not':
+            return ~self._evaluate(domain, tree[1])
+        if kind == 'and':
+            mask = self._evaluate(domain, tree[1][0])
+            for child in tree[1][1:]:
+                mask = mask & self._evaluate(domain, child)
+            return mask
+        if kind == 'or':
+            mask = self._evaluate(domain, tree[1][0])
+            for child in tree[1][1:]:
+                mask = mask | self._evaluate(domain, child)
+            return mask
+        _, name, op, value = tree
+        if domain == 'LINK':
+            return self._evaluate_link_predicate(name, op, value)
+        return self._evaluate_line_predicate(name, op, value)
+
+    def _evaluate_link_predicate(self, name, op, value):
+        if name == 'link':
+            if op != '=':
+                raise SelectionSyntaxError("Link ids only support '='")
+            i, j = _parse_link_id(value)
+            mask = np.zeros(len(self._links), dtype=bool)
+            position = self._link_positions.get((i, j))
+            if position is not None:
+                mask[position] = True
+            return mask
+        if name == 'mode':
+            if op != '=':
+                raise SelectionSyntaxError("Modes only support '='")
+            self._check_modes(value)
+            return np.array([any(c in modes for c in value) for modes in self._link_modes], dtype=bool)
+        if name == 'i':
+            return _compare(self.link_i, op, value)
+        if name == 'j':
+            return _compare(self.link_j, op, value)
+        return _compare(self.link_values(name), op, value)
+
+    def _check_modes(self, value):
+        unknown = sorted(set(value) - self.mode_ids)
+        if unknown:
+            raise SelectionSyntaxError("'%s' are not mode ids of the network" % "".join(unknown))
+
+    def _evaluate_line_predicate(self, name, op, value):
+        if name == 'line':
+            if op != '=':
+                raise SelectionSyntaxError("Line ids only support '='")
+            test = compile_wildcard(value)
+            return np.array([test(id) for id in self.line_ids], dtype=bool)
+        if name == 'mode':
+            if op != '=':
+                raise SelectionSyntaxError("Modes only support '='")
+            self._check_modes(value)
+            return np.array([mode in value for mode in self._line_modes], dtype=bool)
+        if name in ('veh', 'vehicle'):
+            return _compare(self._line_vehicles, op, value)
+        return _compare(self.line_values(name), op, value)
+
+# -------------------------------------------------------------------------------------------
+
+
+def _parse_number(text):
+    try:
+        return float(text)
+    except ValueError:
+        raise SelectionSyntaxError("'%s' is not a number" % text)
+
+
+def _parse_link_id(value):
+    parts = value.replace('-', ',').split(',')
+    if len(parts) != 2:
+        raise SelectionSyntaxError("'%s' is not a link id" % value)
+    return int(_parse_number(parts[0])), int(_parse_number(parts[1]))
+
+
+def _compare(values, op, text):
+    if op == '=':
+        parts = text.split(',')
+        if len(parts) == 1:
+            return values == _parse_number(parts[0])
+        if len(parts) == 2:
+            return (values >= _parse_number(parts[0])) & (values <= _parse_number(parts[1]))
+        raise SelectionSyntaxError("'%s' is not a value or range" % text)
+    number = _parse_number(text)
+    if op == '!=':
+        return values != number
+    if op == '<':
+        return values < number
+    if op == '<=':
+        return values <= number
+    if op == '>':
+        return values > number
+    return values >= number
+
+
+def check_rejected_expressions(selector):
+    """
+    Evaluates each of REJECTED_EXPRESSIONS as link and line selections.
+
+    Args:
+        - selector: A NetworkSelector
+
+    Returns: The list of (domain, expression) which did not raise a SelectionSyntaxError
+        (empty if every expression is rejected).
+    """
+    unknown_mode = next(c for c in '~^%$#?' if c not in selector.mode_ids)
+    accepted = []
+    for template in REJECTED_EXPRESSIONS:
+        expression = template.replace('{unknown_mode}', unknown_mode)
+        for domain, evaluate in (('LINK', selector.link_mask), ('TRANSIT_LINE', selector.line_mask)):
+            try:
+                evaluate(expression)
+            except SelectionSyntaxError:
+                continue
+            accepted.append((domain, expression))
+    return accepted
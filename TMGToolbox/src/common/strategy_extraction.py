@@ -0,0 +1,152 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Extraction of several strategy-based result matrices (trip components summed along
+sub-paths, and averaged over sub-strategies) from one transit class.
+
+Requests are described with StrategyRequest objects. extract_strategy_matrices runs them through
+the extended strategy analysis tool, which only produces one strategy value matrix
+per run. A request can also name a matrix which its values are subtracted
+from (e.g. removing congestion from the in-vehicle times); these subtractions are done
+together in memory after the analyses, instead of with a matrix calculation for each.
+"""
+
+import inro.modeller as _m
+import six
+
+_MODELLER = _m.Modeller()
+_util = _MODELLER.module('tmg.common.utilities')
+EMME_VERSION = _util.getEmmeVersion(tuple)
+
+COMPONENTS = ('boarding', 'in_vehicle', 'aux_transit', 'alighting')
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Strategy Extraction",
+                                description="Collection of private functions for extracting several \
+                                        strategy-based result matrices from a transit class.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class StrategyRequest(object):
+    """
+    One strategy value matrix to extract. Each trip component is the name of a segment
+    attribute (boarding, in_vehicle, alighting) or a link attribute (aux_transit), or None.
+    Sub-path values are summed, and sub-strategies are averaged (weighted by their
+    proportions), matching the '+' and 'average' operators of the strategy analysis tool.
+    If subtract_from names a matrix, the strategy values are subtracted from it once
+    they are extracted.
+    """
+
+    def __init__(self, result, boarding=None, in_vehicle=None, aux_transit=None, alighting=None,
+                 subtract_from=None):
+        self.result = result
+        self.boarding = boarding
+        self.in_vehicle = in_vehicle
+        self.aux_transit = aux_transit
+        self.alighting = alighting
+        self.subtract_from = subtract_from
+
+    def get_spec(self, demand_matrix_id):
+        """Returns the equivalent EXTENDED_TRANSIT_STRATEGY_ANALYSIS specification."""
+        return {
+            "trip_components": dict((name, getattr(self, name)) for name in COMPONENTS),
+            "sub_path_combination_operator": "+",
+            "sub_strategy_combination_operator": "average",
+            "selected_demand_and_transit_volumes": {
+                "sub_strategies_to_retain": "ALL",
+                "selection_threshold": {
+                    "lower": -999999,
+                    "upper": 999999
+                }
+            },
+            "analyzed_demand": demand_matrix_id,
+            "constraint": None,
+            "results": {
+                "strategy_values": self.result,
+                "selected_demand": None,
+                "transit_volumes": None,
+                "aux_transit_volumes": None,
+                "total_boardings": None,
+                "total_alightings": None
+            },
+            "type": "EXTENDED_TRANSIT_STRATEGY_ANALYSIS"
+        }
+
+
+def subtract_strategy_values(requests, values, matrices):
+    """
+    Subtracts the strategy values of each request from its subtract_from matrix.
+
+    Args:
+        - requests: List of StrategyRequest. Requests without subtract_from are skipped.
+        - values: Dictionary of request result : array of strategy values
+        - matrices: Dictionary of matrix id : array, holding every subtract_from matrix
+
+    Returns: A dictionary of subtract_from matrix id : corrected array.
+    """
+    corrected = {}
+    for request in requests:
+        if request.subtract_from is None:
+            continue
+        base = corrected.get(request.subtract_from, matrices[request.subtract_from])
+        corrected[request.subtract_from] = base - values[request.result]
+    return corrected
+
+
+def extract_strategy_matrices(scenario, requests, demand_matrix_id, class_name=None, num_processors=None,
+                              tracker=None):
+    """
+    Runs the strategy analysis tool for each request, in order, then applies the
+    subtract_from corrections of the requests in memory.
+
+    Args:
+        - scenario: The Emme Scenario, with saved strategies
+        - requests: List of StrategyRequest
+        - demand_matrix_id: The analyzed demand matrix
+        - class_name (=None): The transit class (for multi-class assignments)
+        - num_processors (=None): Number of processors to use (Emme 4.3+)
+        - tracker (=None): Optional ProgressTracker to run the tool with
+    """
+    tool = _MODELLER.tool('inro.emme.transit_assignment.extended.strategy_based_analysis')
+    run_tool = tracker.runTool if tracker is not None else (lambda tool, *args, **kwargs: tool(*args, **kwargs))
+    for request in requests:
+        kwargs = {'scenario': scenario}
+        if class_name is not None:
+            kwargs['class_name'] = class_name
+        if num_processors is not None and EMME_VERSION >= (4, 3, 0):
+            kwargs['num_processors'] = num_processors
+        run_tool(tool, request.get_spec(demand_matrix_id), **kwargs)
+
+    corrections = [request for request in requests if request.subtract_from is not None]
+    if corrections:
+        bank = scenario.emmebank
+        values = dict((request.result, bank.matrix(request.result).get_numpy_data(scenario.id))
+                      for request in corrections)
+        matrices = dict((request.subtract_from, bank.matrix(request.subtract_from).get_numpy_data(scenario.id))
+                        for request in corrections)
+        for matrix_id, data in six.iteritems(subtract_strategy_values(corrections, values, matrices)):
+            bank.matrix(matrix_id).set_numpy_data(data, scenario.id)
@@ -0,0 +1,336 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+"""
+Shared engine for extracting transit boardings, by class, aggregated to transit lines
+and line groups.
+
+Class boardings are computed into one temporary segment attribute per class, and
+then read back with a single get_attribute_values call. Segment values are summed
+to lines, and lines to groups, using NumPy group-by operations. Results are returned
+as a BoardingsResult, which can be written to CSV, JSON or NumPy binary (.npz) files.
+"""
+
+from contextlib import contextmanager
+import json
+
+import inro.modeller as _m
+import numpy as np
+import six
+
+_MODELLER = _m.Modeller()
+_util = _MODELLER.module('tmg.common.utilities')
+_netArrays = _MODELLER.module('tmg.common.network_arrays')
+_selection = _MODELLER.module('tmg.common.selection_expressions')
+EMME_VERSION = _util.getEmmeVersion(tuple)
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Transit Boardings",
+                                description="Collection of private functions for extracting transit \
+                                        boardings by class, aggregated to lines and line groups.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+# -------------------------------------------------------------------------------------------
+
+
+class BoardingsResult(object):
+    """
+    Boardings by transit line (and optionally by line group), for one or more classes.
+
+    Attributes:
+        - class_names: List of class names (None for a single, unnamed class)
+        - line_ids: Sorted array of transit line ids
+        - line_boardings: Array of shape (lines, classes)
+        - group_ids: Array of group ids, or None if not grouped
+        - group_boardings: Array of shape (groups, classes), or None if not grouped
+        - unmapped_line_ids: Array of line ids which are not in any group
+    """
+
+    def __init__(self, class_names, line_ids, line_boardings):
+        self.class_names = class_names
+        self.line_ids = line_ids
+        self.line_boardings = line_boardings
+        self.group_ids = None
+        self.group_boardings = None
+        self.unmapped_line_ids = np.zeros(0, dtype=object)
+
+    def aggregate(self, line_groups, group_ids=None):
+        """
+        Sums line boardings to groups. Lines not in line_groups are skipped.
+
+        Args:
+            - line_groups: Dictionary of line id : group id
+            - group_ids (=None): Optional list of group ids, which sets the order of the
+                groups (including empty ones). If omitted, the sorted ids of the groups
+                containing at least one line are used.
+
+        Returns: self
+        """
+        if group_ids is None:
+            group_ids = sorted(set(line_groups[line_id] for line_id in self.line_ids if line_id in line_groups))
+        group_positions = dict((group_id, position) for position, group_id in enumerate(group_ids))
+        line_group_positions = np.array([group_positions.get(line_groups.get(line_id), -1)
+                                         for line_id in self.line_ids], dtype=np.int64)
+
+        mapped = line_group_positions >= 0
+        self.unmapped_line_ids = self.line_ids[~mapped]
+        self.group_ids = np.array(group_ids, dtype=object)
+        self.group_boardings = np.zeros((len(group_ids), self.line_boardings.shape[1]))
+        for column in range(self.line_boardings.shape[1]):
+            self.group_boardings[:, column] = np.bincount(line_group_positions[mapped],
+                                                          weights=self.line_boardings[mapped, column],
+                                                          minlength=len(group_ids))
+        return self
+
+    def _table(self, grouped):
+        if grouped:
+            if self.group_ids is None:
+                raise ValueError("Boardings have not been aggregated to groups")
+            return self.group_ids, self.group_boardings
+        return self.line_ids, self.line_boardings
+
+    def to_dict(self, class_index=0, grouped=True):
+        """Returns a dictionary of line (or group) id : boardings for one class."""
+        ids, boardings = self._table(grouped and self.group_ids is not None)
+        return dict((key, float(value)) for key, value in zip(ids, boardings[:, class_index]))
+
+    def write_csv(self, filepath, class_index=None, grouped=True, label='line'):
+        """
+        Writes boardings to a CSV file, sorted by id.
+
+        Args:
+            - filepath: The output file
+            - class_index (=None): If given, only this class is written, in two columns
+                (label, 'boardings'). Otherwise, all classes are written, one column each.
+            - grouped (=True): Write group results if available, otherwise line results.
+            - label (='line'): The header of the id column.
+        """
+        ids, boardings = self._table(grouped and self.group_ids is not None)
+        order = sorted(range(len(ids)), key=lambda position: ids[position])
+        with _util.open_csv_writer(filepath) as writer:
+            if class_index is not None:
+                writer.writerow([label, 'boardings'])
+                for position in order:
+                    writer.writerow([ids[position], boardings[position, class_index]])
+            else:
+                writer.writerow([label] + [name if name is not None else 'boardings' for name in self.class_names])
+                for position in order:
+                    writer.writerow([ids[position]] + list(boardings[position]))
+
+    def to_json(self):
+        """Returns the results as a JSON string."""
+        data = {
+            'classes': self.class_names,
+            'lines': dict((str(line_id), list(map(float, row)))
+                          for line_id, row in zip(self.line_ids, self.line_boardings))
+        }
+        if self.group_ids is not None:
+            data['groups'] = dict((str(group_id), list(map(float, row)))
+                                  for group_id, row in zip(self.group_ids, self.group_boardings))
+            data['unmapped_lines'] = [str(line_id) for line_id in self.unmapped_line_ids]
+        return json.dumps(data, sort_keys=True)
+
+    def write_json(self, filepath):
+        with open(filepath, 'w') as writer:
+            writer.write(self.to_json())
+
+    def write_binary(self, filepath):
+        """Writes the results to a NumPy .npz file."""
+        arrays = {
+            'class_names': np.array([name or '' for name in self.class_names]),
+            'line_ids': self.line_ids.astype(six.text_type),
+            'line_boardings': self.line_boardings
+        }
+        if self.group_ids is not None:
+            arrays['group_ids'] = self.group_ids.astype(six.text_type)
+            arrays['group_boardings'] = self.group_boardings
+        np.savez(filepath, **arrays)
+
+    def write(self, filepath):
+        """Writes the results, in a format chosen by the file extension (.json, .npz, or CSV otherwise)."""
+        lowered = filepath.lower()
+        if lowered.endswith('.json'):
+            self.write_json(filepath)
+        elif lowered.endswith('.npz'):
+            self.write_binary(filepath)
+        else:
+            self.write_csv(filepath)
+
+# -------------------------------------------------------------------------------------------
+
+
+@contextmanager
+def _temp_segment_attributes(scenario, count):
+    if count == 0:
+        yield []
+        return
+    with _util.tempExtraAttributeMANAGER(scenario, 'TRANSIT_SEGMENT', returnId=True) as attribute_id:
+        with _temp_segment_attributes(scenario, count - 1) as others:
+            yield [attribute_id] + others
+
+
+def sum_segments_to_lines(scenario, attributes):
+    """
+    Reads segment attributes in one partial read, and sums them to transit lines.
+
+    Returns: A tuple of (sorted array of line ids, array of shape (lines, attributes)).
+    """
+    package = scenario.get_attribute_values('TRANSIT_SEGMENT', list(attributes))
+    line_ids = []
+    positions = []
+    for line_id, i_node, position in _netArrays.iter_segment_index(package[0]):
+        line_ids.append(str(line_id))
+        positions.append(position)
+
+    unique_ids, line_positions = np.unique(np.array(line_ids, dtype=object).astype(six.text_type),
+                                           return_inverse=True)
+    line_positions = line_positions.ravel()
+    positions = np.array(positions, dtype=np.int64)
+    totals = np.zeros((len(unique_ids), len(attributes)))
+    for column, table in enumerate(package[1:]):
+        totals[:, column] = np.bincount(line_positions, weights=np.asarray(table, dtype=np.float64)[positions],
+                                        minlength=len(unique_ids))
+    return unique_ids.astype(object), totals
+
+
+def extract_boardings(scenario, class_demands=None, num_processors=None, tracker=None):
+    """
+    Extracts transit line boardings by class.
+
+    Args:
+        - scenario: The Emme Scenario, with transit assignment results
+        - class_demands (=None): Either a dictionary of class name : analyzed demand matrix
+            id (as returned by utilities.DetermineAnalyzedTransitDemandId), a single demand
+            matrix id, or None to use the assigned 'transit_boardings' directly.
+        - num_processors (=None): Number of processors for the network results tool (Emme 4.3.2+)
+        - tracker (=None): Optional ProgressTracker to run the network results tool with
+
+    Returns: A BoardingsResult with line boardings.
+    """
+    if class_demands is None:
+        line_ids, totals = sum_segments_to_lines(scenario, ['transit_boardings'])
+        return BoardingsResult([None], line_ids, totals)
+
+    if isinstance(class_demands, dict):
+        classes = sorted(six.iteritems(class_demands))
+    else:
+        classes = [(None, class_demands)]
+
+    network_results_tool = _MODELLER.tool('inro.emme.transit_assignment.extended.network_results')
+    run_tool = tracker.runTool if tracker is not None else (lambda tool, **kwargs: tool(**kwargs))
+    with _temp_segment_attributes(scenario, len(classes)) as attributes:
+        for (class_name, demand_id), attribute_id in zip(classes, attributes):
+            spec = {
+                "on_links": None,
+                "on_segments": {"total_boardings": attribute_id},
+                "aggregated_from_segments": None,
+                "analyzed_demand": demand_id,
+                "constraint": None,
+                "type": "EXTENDED_TRANSIT_NETWORK_RESULTS"
+            }
+            kwargs = {'scenario': scenario, 'specification': spec}
+            if class_name is not None:
+                kwargs['class_name'] = class_name
+            if num_processors is not None and EMME_VERSION >= (4, 3, 2):
+                kwargs['num_processors'] = num_processors
+            run_tool(network_results_tool, **kwargs)
+
+        line_ids, totals = sum_segments_to_lines(scenario, attributes)
+    return BoardingsResult([class_name for class_name, _ in classes], line_ids, totals)
+
+
+def line_groups_from_selections(scenario, groups, default=None):
+    """
+    Assigns transit lines to groups using line selection expressions, evaluated locally
+    (see selection_expressions). As with successive Network Calculator runs, later groups
+    override earlier ones. Groups whose expression can't be evaluated locally are marked
+    with the Network Calculator instead.
+
+    Args:
+        - scenario: The Emme Scenario
+        - groups: List of (group id, line selection expression) tuples
+        - default (=None): Group id of lines not selected by any group. None leaves them
+            out of the result.
+
+    Returns: A dictionary of line id : group id.
+    """
+    selector = _selection.NetworkSelector(scenario)
+    masks = []
+    for group_id, expression in groups:
+        try:
+            masks.append(selector.line_mask(expression))
+        except _selection.SelectionSyntaxError:
+            masks.append(None)
+
+    unparsed = [position for position, mask in enumerate(masks) if mask is None]
+    if unparsed:
+        with _util.tempExtraAttributeMANAGER(scenario, 'TRANSIT_LINE', description="Line group marker",
+                                             returnId=True) as marker_id:
+            for position in unparsed:
+                masks[position] = _network_calculator_line_mask(scenario, selector, groups[position][1], marker_id)
+
+    assigned = np.full(len(selector.line_ids), -1, dtype=np.int64)
+    for position, mask in enumerate(masks):
+        assigned[mask] = position
+
+    line_groups = {}
+    for line_id, position in zip(selector.line_ids, assigned):
+        if position >= 0:
+            line_groups[str(line_id)] = groups[position][0]
+        elif default is not None:
+            line_groups[str(line_id)] = default
+    return line_groups
+
+
+def _network_calculator_line_mask(scenario, selector, expression, marker_id):
+    #Falls back to the Network Calculator for expressions which can't be evaluated locally
+    network_calculator = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
+    for selection, value in (("all", "0"), (expression, "1")):
+        spec = {
+            "result": marker_id,
+            "expression": value,
+            "aggregation": None,
+            "selections": {"transit_line": selection},
+            "type": "NETWORK_CALCULATION"
+        }
+        network_calculator(spec, scenario=scenario)
+    line_index, values = scenario.get_attribute_values('TRANSIT_LINE', [marker_id])
+    return np.array([values[line_index[line_id]] > 0 for line_id in selector.line_ids], dtype=bool)
+
+
+def load_line_aggregation_file(filepath):
+    """
+    Loads a line aggregation file (a header row, then rows of line id, group id).
+
+    Returns: A dictionary of line id : group id (both strings).
+    """
+    mapping = {}
+    with open(filepath) as reader:
+        reader.readline()
+        for line in reader:
+            cells = line.strip().split(',')
+            if len(cells) < 2:
+                continue
+            mapping[cells[0].strip()] = cells[1].strip()
+    return mapping
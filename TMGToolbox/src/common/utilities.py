@@ -38,7 +38,14 @@ if six.PY2:
     from itertools import izip
 from json import loads as _parsedict
 from os.path import dirname
+import os
 import csv
+import json
+import locale
+import threading
+from timeit import default_timer as _timer
+import gzip
+import array as _array
 
 _MODELLER = _m.Modeller()
 _DATABANK = _MODELLER.emmebank
@@ -412,6 +419,66 @@ def tempMatricesMANAGER(number_of_matrices, description="[No description]", matr
     return
 
 
+# -------------------------------------------------------------------------------------------
+
+_BINARY_MATRIX_TYPES = {"f": 1, "d": 2, "i": 3, "I": 4}
+
+
+def saveBinaryMatrixData(file_stream, matrix_data):
+    """
+    Writes an Emme MatrixData object to an open binary stream, in the TMG binary matrix
+    (.mtx) format read by XTMF: a header of unsigned ints (magic number, version, data
+    type, number of dimensions, the size of each dimension, then the zone numbers of each
+    dimension), followed by the matrix values. Each data array is written whole.
+
+    Args:
+        - file_stream: A file (or gzip file) opened for writing in binary mode.
+        - matrix_data: An Emme MatrixData object, as returned by matrix.get_data()
+    """
+    intBuff = _array.array("I")
+    intBuff.append(0xC4D4F1B2)  # magic number
+    intBuff.append(1)  # version number
+    intBuff.append(_BINARY_MATRIX_TYPES[matrix_data.type])
+    intBuff.append(matrix_data.num_dimensions)
+    for dim in matrix_data.indices:
+        intBuff.append(len(dim))
+    for dim in matrix_data.indices:
+        intBuff.extend(dim)
+    _writeArray(file_stream, intBuff)
+    for data_array in matrix_data.raw_data:
+        _writeArray(file_stream, data_array)
+
+
+def _writeArray(file_stream, data_array):
+    # array.tofile() only accepts built-in files in Python 2, and numpy's tofile() writes
+    # to the underlying file descriptor, bypassing gzip, so the bytes are always written
+    # through the stream itself.
+    if six.PY3:
+        file_stream.write(data_array.tobytes())
+    else:
+        file_stream.write(data_array.tostring())
+
+
+def exportBinaryMatrix(matrix_data, file_path, compress=None):
+    """
+    Saves an Emme MatrixData object to a file in the TMG binary matrix (.mtx) format.
+
+    Args:
+        - matrix_data: An Emme MatrixData object, as returned by matrix.get_data()
+        - file_path: The file to write.
+        - compress (=None): Flag to gzip the file. By default, files whose name ends
+            in 'gz' (e.g. '.mtx.gz') are compressed.
+    """
+    if compress is None:
+        compress = file_path[-2:] == "gz"
+    if compress:
+        with gzip.open(file_path, "wb") as file_stream:
+            saveBinaryMatrixData(file_stream, matrix_data)
+    else:
+        with open(file_path, "wb") as file_stream:
+            saveBinaryMatrixData(file_stream, matrix_data)
+
+
 # -------------------------------------------------------------------------------------------
 
 # @deprecated: In Emme 4.1.2 the indices have been changed
@@ -1140,6 +1207,217 @@ class FloatRange:
 # -------------------------------------------------------------------------------------------
 
 
+def _getPeakMemory():
+    """Returns the peak resident set size of the current process in bytes, or None if it cannot be determined."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if _sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except Exception:
+        pass
+    return None
+
+
+class _NullSpan(object):
+    """Do-nothing span, returned when profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _TimingSpan(object):
+    def __init__(self, profiler, name, args):
+        self._profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self._profiler._enter(self)
+        return self
+
+    def __exit__(self, *args):
+        self._profiler._exit(self)
+        return False
+
+
+class TimingProfiler(object):
+
+    """
+    Lightweight profiler for recording nested, named timing spans.
+
+    Each span records its wall time and (optionally) the peak resident memory
+    of the process when it ends. Spans are aggregated by their full path (e.g.
+    'Run Assignment/Load Demand') into call counts, total time and self time
+    (total time less the time spent in child spans).
+
+    Results can be written as a Chrome trace (viewable at chrome://tracing or
+    in Perfetto) or as a flat summary table.
+
+    Usually used through startProfiling() and ProgressTracker.span(), so that
+    spans from all tools in a run are collected together. XTMF runs can switch
+    profiling on and off with the XTMF_internal profile_run tool.
+    """
+
+    def __init__(self, trackMemory=False):
+        self.trackMemory = trackMemory
+        self._origin = _timer()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.events = []
+        self.totals = {}
+
+    def span(self, name, **args):
+        """
+        Returns a context manager timing a named span. Keyword arguments are
+        stored with the span in the trace output.
+        """
+        return _TimingSpan(self, name, args)
+
+    def _getStack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, span):
+        stack = self._getStack()
+        span.path = stack[-1].path + '/' + span.name if stack else span.name
+        span.childTime = 0.0
+        span.start = _timer()
+        stack.append(span)
+
+    def _exit(self, span):
+        end = _timer()
+        stack = self._getStack()
+        stack.pop()
+        duration = end - span.start
+        if stack:
+            stack[-1].childTime += duration
+        peakMemory = _getPeakMemory() if self.trackMemory else None
+
+        with self._lock:
+            self.events.append((span.name, span.path, span.start - self._origin, duration,
+                                threading.current_thread().ident, peakMemory, span.args))
+            totals = self.totals.get(span.path)
+            if totals is None:
+                totals = self.totals[span.path] = [0, 0.0, 0.0, None]
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] += duration - span.childTime
+            if peakMemory is not None:
+                totals[3] = max(totals[3], peakMemory) if totals[3] is not None else peakMemory
+
+    def getSummary(self):
+        """
+        Returns a list of (span path, calls, total seconds, self seconds, peak memory
+        in bytes) tuples, sorted by total time in descending order.
+        """
+        with self._lock:
+            rows = [(path, t[0], t[1], t[2], t[3]) for path, t in six.iteritems(self.totals)]
+        rows.sort(key=lambda row: -row[2])
+        return rows
+
+    def formatSummary(self):
+        """Returns the summary as a fixed-width text table."""
+        rows = self.getSummary()
+        width = max([len(row[0]) for row in rows] + [4])
+        lines = ["%-*s %8s %12s %12s %12s" % (width, "Span", "Calls", "Total (s)", "Self (s)", "Peak MB")]
+        for path, calls, total, selfTime, peakMemory in rows:
+            memory = "%.1f" % (peakMemory / 1048576.0) if peakMemory is not None else "-"
+            lines.append("%-*s %8d %12.3f %12.3f %12s" % (width, path, calls, total, selfTime, memory))
+        return "\n".join(lines)
+
+    def writeSummary(self, filepath):
+        """Writes the summary to a CSV file."""
+        with open_csv_writer(filepath) as writer:
+            writer.writerow(["span", "calls", "total_seconds", "self_seconds", "peak_memory_bytes"])
+            for row in self.getSummary():
+                writer.writerow(["" if value is None else value for value in row])
+
+    def writeTrace(self, filepath):
+        """Writes all recorded spans to a Chrome trace (JSON) file."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        traceEvents = []
+        for name, path, start, duration, threadId, peakMemory, args in events:
+            args = dict(args)
+            args['path'] = path
+            if peakMemory is not None:
+                args['peak_memory_bytes'] = peakMemory
+            traceEvents.append({'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                                'pid': pid, 'tid': threadId, 'args': args})
+        with open(filepath, 'w') as writer:
+            json.dump({'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}, writer, default=str)
+
+
+_PROFILER = None
+
+
+def startProfiling(trackMemory=False):
+    """
+    Starts collecting timing spans from all ProgressTrackers in this process,
+    replacing any previous profiler. Returns the new TimingProfiler.
+    """
+    global _PROFILER
+    _PROFILER = TimingProfiler(trackMemory)
+    return _PROFILER
+
+
+def stopProfiling():
+    """Stops collecting timing spans. Returns the TimingProfiler used, or None if profiling was not started."""
+    global _PROFILER
+    profiler = _PROFILER
+    _PROFILER = None
+    return profiler
+
+
+def getProfiler():
+    """Returns the active TimingProfiler, or None if profiling is disabled."""
+    return _PROFILER
+
+
+def profileSpan(name, **args):
+    """
+    Returns a context manager timing a named span with the active profiler.
+    Does nothing if profiling is disabled.
+    """
+    if _PROFILER is None:
+        return _NULL_SPAN
+    return _PROFILER.span(name, **args)
+
+
+def _getToolName(tool):
+    # Modeller tools are named by their namespace (e.g. 'inro.emme.traffic_assignment.sola_traffic_assignment')
+    name = getattr(tool, '__MODELLER_NAMESPACE__', None)
+    return name if name else type(tool).__name__
+
+# -------------------------------------------------------------------------------------------
+
+
 class ProgressTracker:
 
     """
@@ -1154,6 +1432,10 @@ class ProgressTracker:
     Update April 2014: Can be 'reset' with a new number of tasks,
     for when two task-levels are needed but the number of full
     tasks are not known at initialization.
+
+    When profiling is enabled (see startProfiling), every call to
+    runTool is recorded as a timing span named after the tool's namespace, and
+    tools can time their own steps using span().
     """
 
     def __init__(self, numberOfTasks):
@@ -1199,12 +1481,26 @@ class ProgressTracker:
         self._activeTool = tool
         self._toolIsRunning = True
         # actually run the tool. no knowledge of the arguments is required.
-        ret = self._activeTool(*args, **kwargs)
+        if _PROFILER is None:
+            ret = self._activeTool(*args, **kwargs)
+        else:
+            with _PROFILER.span(_getToolName(tool)):
+                ret = self._activeTool(*args, **kwargs)
         self._toolIsRunning = False
         self._activeTool = None
         self.completeTask()
         return ret
 
+    def span(self, name, **args):
+        """
+        Returns a context manager timing a named step, if profiling
+        is enabled. Spans can be nested. For example:
+
+            with self.TRACKER.span("Load demand"):
+                ...
+        """
+        return profileSpan(name, **args)
+
     def startProcess(self, numberOfSubtasks):
         """
         Tells the Tracker to start up a new Task
@@ -1254,79 +1550,215 @@ class ProgressTracker:
             return (0, 1000, self._progress)
 
 
-class CSVReader:
-    def __init__(self, filepath, append_blanks=True):
-        self.filepath = filepath
-        self.header = None
-        self.append_blanks = append_blanks
+class TypedCSVReader(object):
 
-    def open(self):
-        self.__peek()
-        self.__reader = open(self.filepath, "r")
-        self.header = self.__reader.readline().strip().split(",")
+    """
+    Streaming CSV reader. Reads the file in a single pass (the number of lines is
+    not counted beforehand), supports RFC-4180 quoting (quoted fields may contain
+    commas, escaped quotes and line breaks), and converts each column to a
+    declared type.
+
+    Rows can be read one at a time as Records (for compatibility with CSVReader),
+    as lists of typed values, or in columnar batches of NumPy arrays.
+
+    Args:
+        - filepath: The path to the CSV file. The first row is the header.
+        - column_types (=None): Optional dictionary of column label : type, where
+            the type is one of int, float, bool or str. Labels refer to the cleaned
+            header (see below). Undeclared columns are read as str. Blank cells in
+            float columns are read as NaN.
+        - append_blanks (=True): Flag to pad rows which are shorter than the header
+            with blank cells. If False, short rows raise an IOError.
+        - encoding (='utf-8-sig'): The text encoding of the file. If None, the locale's
+            preferred encoding is used, as open() does (e.g. cp1252 on Windows).
+
+    Header labels are cleaned up the same way as CSVReader: spaces become
+    underscores, and '@', '+' and '*' characters are removed. Blank lines are skipped.
+    """
 
-        # Clean up special characters
-        for i in range(len(self.header)):
-            self.header[i] = self.header[i].replace(" ", "_").replace("@", "").replace("+", "").replace("*", "")
+    _NUMPY_TYPES = {int: 'int64', float: 'float64', bool: 'bool'}
 
-        self.__lincount = 1
+    def __init__(self, filepath, column_types=None, append_blanks=True, encoding='utf-8-sig'):
+        self.filepath = filepath
+        self.column_types = column_types or {}
+        self.append_blanks = append_blanks
+        self.encoding = encoding
+        self.header = None
 
-    def __peek(self):
-        count = 0
-        with open(self.filepath, "r") as reader:
-            for l in reader:
-                count += 1
-        self.__count = count
+        self._file = None
+        self._rows = None
+        self._converters = None
+        self._encoding = None
+        self._bytesRead = 0
+        self._fileSize = 0
+        self._lineNumber = 0
+
+    def open(self):
+        self._encoding = self.encoding or locale.getpreferredencoding(False)
+        self._file = open(self.filepath, 'rb')
+        self._fileSize = os.fstat(self._file.fileno()).st_size
+        self._bytesRead = 0
+        self._lineNumber = 0
+        self._rows = csv.reader(self._iterLines())
+
+        cells = next(self._rows, None)
+        if cells is None:
+            raise IOError("File '%s' is empty" % self.filepath)
+        self.header = [cell.strip().replace(" ", "_").replace("@", "").replace("+", "").replace("*", "")
+                       for cell in cells]
+
+        self._converters = []
+        for label in self.header:
+            columnType = self.column_types.get(label, str)
+            if columnType not in (int, float, bool, str):
+                raise TypeError("Column '%s' has an unsupported type %s" % (label, columnType))
+            self._converters.append(self._getConverter(columnType))
 
     def __enter__(self):
         self.open()
         return self
 
     def close(self):
-        self.__reader.close()
-        del self.__reader
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._rows = None
         self.header = None
 
     def __exit__(self, *args, **kwargs):
         self.close()
 
-    def __len__(self):
-        return self.__count
+    @property
+    def progress(self):
+        """Fraction of the file (by bytes) which has been read so far, between 0 and 1."""
+        if self._fileSize == 0:
+            return 1.0
+        return float(self._bytesRead) / self._fileSize
+
+    @property
+    def line_number(self):
+        """The last physical line number read."""
+        return self._lineNumber
+
+    def _iterLines(self):
+        for line in iter(self._file.readline, b''):
+            self._bytesRead += len(line)
+            self._lineNumber += 1
+            if six.PY2:
+                yield line
+            else:
+                yield line.decode(self._encoding)
+
+    @staticmethod
+    def _getConverter(columnType):
+        if columnType is str:
+            return None
+        elif columnType is float:
+            return lambda cell: float(cell) if cell.strip() else float('nan')
+        elif columnType is bool:
+            return lambda cell: cell.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+        return columnType
+
+    def readrows(self):
+        """
+        Iterates through the remaining rows, yielding lists of typed values
+        aligned with the header. Blank lines are skipped.
+        """
+        nColumns = len(self.header)
+        converters = list(enumerate(self._converters))
+        for cells in self._rows:
+            if not cells:
+                continue
+            try:
+                if len(cells) < nColumns:
+                    if not self.append_blanks:
+                        raise IOError("Fewer records than header")
+                    cells.extend([""] * (nColumns - len(cells)))
+                elif len(cells) > nColumns:
+                    del cells[nColumns:]
+                for i, converter in converters:
+                    if converter is not None:
+                        cells[i] = converter(cells[i])
+            except Exception as e:
+                raise IOError("Error reading line %s: %s" % (self._lineNumber, e))
+            yield cells
 
     def readline(self):
-        try:
-            cells = self.__reader.readline().strip().split(",")
-            self.__lincount += 1
-            if not self.append_blanks and len(cells) < len(self.header):
-                raise IOError("Fewer records than header")
+        """Reads the next row as a Record, or returns None at the end of the file."""
+        for cells in self.readrows():
+            return Record(self.header, cells)
+        return None
+
+    def readlines(self):
+        """Iterates through the remaining rows as Records."""
+        for cells in self.readrows():
+            yield Record(self.header, cells)
 
-            while len(cells) < len(self.header) and self.append_blanks:
-                cells.append("")
+    def readbatches(self, batch_size=100000):
+        """
+        Iterates through the remaining rows in columnar batches.
 
-            atts = {}
-            for i, column_label in enumerate(self.header):
-                atts[column_label] = cells[i]
-            return Record(atts)
+        Args:
+            - batch_size (=100000): The maximum number of rows per batch
 
-        except Exception as e:
-            raise IOError("Error reading line %s: %s" % (self.__lincount, e))
+        Returns: A generator of dictionaries of column label : NumPy array. Declared
+            int, float and bool columns get the matching NumPy type; str columns
+            are object arrays.
+        """
+        import numpy as np
+        dtypes = [self._NUMPY_TYPES.get(self.column_types.get(label, str), object) for label in self.header]
+
+        rows = []
+        for cells in self.readrows():
+            rows.append(cells)
+            if len(rows) >= batch_size:
+                yield self._toColumns(np, rows, dtypes)
+                rows = []
+        if rows:
+            yield self._toColumns(np, rows, dtypes)
+
+    def _toColumns(self, np, rows, dtypes):
+        columns = {}
+        for label, values, dtype in zip(self.header, zip(*rows), dtypes):
+            columns[label] = np.array(values, dtype=dtype)
+        return columns
+
+    def readcolumns(self):
+        """Reads all remaining rows into a single dictionary of column label : NumPy array."""
+        import numpy as np
+        batches = list(self.readbatches())
+        if not batches:
+            return dict((label, np.array([], dtype=self._NUMPY_TYPES.get(self.column_types.get(label, str), object)))
+                        for label in self.header)
+        if len(batches) == 1:
+            return batches[0]
+        return dict((label, np.concatenate([batch[label] for batch in batches])) for label in self.header)
+
+
+class CSVReader(TypedCSVReader):
 
-    def readlines(self):
-        try:
-            for line in self.__reader.readlines():
-                self.__lincount += 1
-                if not (line):
-                    continue
-                cells = line.strip().split(",")
-                if not self.append_blanks and len(cells) < len(self.header):
-                    raise IOError("Fewer records than header")
-
-                while len(cells) < len(self.header) and self.append_blanks:
-                    cells.append("")
-
-                yield Record(self.header, cells)
-        except Exception as e:
-            raise IOError("Error reading line %s: %s" % (self.__lincount, e))
+    """
+    Untyped CSV reader, where every value is read as a string. Kept for
+    compatibility with existing tools; see TypedCSVReader.
+
+    As before, files are decoded with the locale's preferred encoding (e.g. cp1252
+    on Windows). Unlike the original line-splitting reader, blank lines are skipped
+    rather than read as rows of blank cells, and quoted cells may contain commas.
+    """
+
+    def __init__(self, filepath, append_blanks=True):
+        TypedCSVReader.__init__(self, filepath, append_blanks=append_blanks, encoding=None)
+        self.__count = None
+
+    def __len__(self):
+        # Only counted when requested, as it requires reading the whole file.
+        if self.__count is None:
+            count = 0
+            with open(self.filepath, "rb") as reader:
+                for l in reader:
+                    count += 1
+            self.__count = count
+        return self.__count
 
 
 class Record:
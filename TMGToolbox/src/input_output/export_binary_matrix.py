@@ -38,6 +38,9 @@ ExportBinaryMatrix
     
     1.0.1 Tool now checks that the matrix exists.
     
+    1.0.2 The binary layout is now written by utilities.saveBinaryMatrixData, which is shared
+        with the XTMF batch matrix export.
+    
 '''
 
 import inro.modeller as _m
@@ -47,7 +50,6 @@ import shutil
 import os
 import tempfile
 import six
-import array as _array
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
@@ -62,7 +64,7 @@ if six.PY3:
 
 class ExportBinaryMatrix(_m.Tool()):
     
-    version = '1.0.1'
+    version = '1.0.2'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -191,22 +193,7 @@ class ExportBinaryMatrix(_m.Tool()):
     ##########################################################################################################    
     
     def _save_matrix_data(self, file_stream, matrix_data):
-
-        matrix_type_index = {"f" : 1, "d" : 2, 'i' : 3, 'I' : 4}[matrix_data.type]
-        intBuff = _array.array("I")
-        intBuff.append(0xC4D4F1B2) # magic number
-        intBuff.append(1) # version number
-        intBuff.append(matrix_type_index)
-        intBuff.append(matrix_data.num_dimensions)
-        for dim in matrix_data.indices:
-            intBuff.append(len(dim))
-        for dim in matrix_data.indices:
-            for entry in dim:
-                intBuff.append(entry)
-        intBuff.tofile(file_stream)
-        for data_array in matrix_data.raw_data:
-            data_array.tofile(file_stream)
-        return
+        _util.saveBinaryMatrixData(file_stream, matrix_data)
 
     #---
     #---MAIN EXECUTION CODE
@@ -28,7 +28,18 @@
     
     1.0.0 Cleaned and published 20/01/2015
     
+    1.1.0 Matches and their metadata are now fetched in one joined query, streamed in pages
+        of PAGE_SIZE entries, and capped to a maximum number of results. Added an optional
+        local search index (a SQLite copy of the logbook's attributes, with a full-text
+        trigram index where supported), which is refreshed incrementally by rowid. Also
+        fixed case-sensitive searches (LIKE is always case-insensitive in SQLite).
+    
+    1.1.1 Entries without a timestamp are reported with a blank one, instead of failing to
+        sort the matches.
+    
 '''
+import os
+import sqlite3
 import traceback as _traceback
 
 import inro.modeller as _m
@@ -43,14 +54,26 @@ _util.initalizeModellerTypes(_m)
 
 ##########################################################################################################
 
+def _quote(text):
+    return "'" + six.text_type(text).replace("'", "''") + "'"
+
+def _contains(column, text, caseSensitive):
+    #LIKE is case-insensitive in SQLite and treats % and _ as wildcards, so use instr instead
+    if caseSensitive:
+        return "instr({c}, {t}) > 0".format(c= column, t= _quote(text))
+    return "instr(LOWER({c}), {t}) > 0".format(c= column, t= _quote(text.lower()))
+
 class SearchLogbookAttribtues(_m.Tool()):
     
     BEGIN_KEY = 'begin_304A7365_C276_493A_AB3B_9B2D195E203F'
     END_KEY = 'end_304A7365_C276_493A_AB3B_9B2D195E203F'
     
-    version = '1.0.0'
+    PAGE_SIZE = 1000 #Number of matches fetched per query
+    SYNC_BATCH_SIZE = 50000 #Number of logbook attribute rows copied per query when refreshing the index
+    
+    version = '1.1.1'
     tool_run_msg = ""
-    number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
+    number_of_tasks = 2 # For progress reporting, enter the integer number of tasks here
     
     # Tool Input Parameters
     #    Only those parameters neccessary for Modeller and/or XTMF to dock with
@@ -61,6 +84,8 @@ class SearchLogbookAttribtues(_m.Tool()):
     AttributeValue = _m.Attribute(str)
     
     CaseSensitivity = _m.Attribute(bool)
+    MaxResults = _m.Attribute(int)
+    IndexFile = _m.Attribute(str)
     
     def __init__(self):
         #---Init internal variables
@@ -70,8 +95,10 @@ class SearchLogbookAttribtues(_m.Tool()):
         self.AttributeValue = _MODELLER.scenario.id
         
         self.CaseSensitivity = False
+        self.MaxResults = 1000
         
         self.matches = []
+        self.truncated = False
     
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="Search Logbook Attribtues v%s" %self.version,
@@ -90,7 +117,9 @@ class SearchLogbookAttribtues(_m.Tool()):
                 for timestamp, element_id, title in self.matches:
                     description = "%s: %s" %(title, timestamp)                    
                     html += "<li>" + self._render_entry_link(element_id, description) + "</li>"
-                html = "</ul>"
+                html += "</ul>"
+                if self.truncated:
+                    html += "<p>Only the first %s matches are shown.</p>" %len(self.matches)
                 pb.wrap_html(body= html)
         
         pb.add_text_box(tool_attribute_name= 'AttributeName',
@@ -106,6 +135,18 @@ class SearchLogbookAttribtues(_m.Tool()):
         pb.add_checkbox(tool_attribute_name= 'CaseSensitivity',
                        label= "Case sensitive?")
         
+        pb.add_text_box(tool_attribute_name= 'MaxResults',
+                        title= "Maximum results",
+                        size=10)
+        
+        pb.add_select_file(tool_attribute_name= 'IndexFile',
+                           window_type= 'save_file',
+                           file_filter= "*.sqlite",
+                           title= "Search index file",
+                           note= "Optional. Keeps a local, indexed copy of the logbook's attributes \
+                           in this file, which makes repeated searches much faster. Only entries \
+                           added since the previous search get copied.")
+        
         return pb.render()
     
     def _render_entry_link(self, id, description):
@@ -118,63 +159,72 @@ class SearchLogbookAttribtues(_m.Tool()):
     def run(self):
         self.tool_run_msg = ""
         self.matches = []
+        self.truncated = False
+        self.TRACKER.reset()
         
         try:
             self._execute()
         except Exception as e:
             self.tool_run_msg = _m.PageBuilder.format_exception(
-                e, _traceback.format_exc(e))
+                e, _traceback.format_exc())
             raise
         
         self.tool_run_msg = _m.PageBuilder.format_info("Done.")
     
     def _execute(self):
-        record_list = self._search_logbook()
+        if self.IndexFile:
+            index = LogbookIndex(self.IndexFile)
+            try:
+                index.refresh(self.SYNC_BATCH_SIZE)
+                self.TRACKER.completeTask()
+                self._collect_matches(index.iter_matches(self.AttributeName, self.AttributeValue,
+                                                         self.CaseSensitivity, self.PAGE_SIZE))
+            finally:
+                index.close()
+        else:
+            self.TRACKER.completeTask()
+            self._collect_matches(self._iter_matches())
         
-        if len(record_list) < 1:
+        if len(self.matches) < 1:
             raise Exception("No matches found.")
         
-        for element_id in record_list:
-            timestamp, title = self._query_element_metadata(element_id)
-            
-            self.matches.append((timestamp, element_id, title))
-            
         self.matches.sort()
-        
-    def _search_logbook(self):
-        if self.CaseSensitivity:
-            n = self.AttributeName
-            v = self.AttributeValue
-            condition1 = 'name'
-            condition2 = 'value'
-            
-        else:
-            n = self.AttributeName.lower()
-            v = self.AttributeValue.lower()
-            condition1 = 'LOWER(name)'
-            condition2 = 'LOWER(value)'
-
-        where = "{c1} LIKE '%{n}%' AND {c2} LIKE '%{v}%';".format(c1= condition1, n=n, c2= condition2, v=v)
-        
-        sql = '''SELECT element_id
-                FROM attributes
-                WHERE %s''' %where
-        
-        result = _m.logbook_query(sql)
-        return [t[0] for t in result]
+        self.TRACKER.completeTask()
     
-    def _query_element_metadata(self, elemnt_id):
-        sql = '''SELECT value FROM attributes WHERE element_id= '{id}' 
-            AND name = '{begin}';'''.format(id= elemnt_id, begin= self.BEGIN_KEY)
-        
-        timestamp = _m.logbook_query(sql)[0][0]
-        print(timestamp)
-        
-        sql = '''SELECT tag FROM elements WHERE element_id= %s''' %elemnt_id
-        title = _m.logbook_query(sql)[0][0]
-        print(title)
+    def _collect_matches(self, pages):
+        for page in pages:
+            for match in page:
+                if self.MaxResults and len(self.matches) >= self.MaxResults:
+                    self.truncated = True
+                    return
+                self.matches.append(match)
+    
+    def _iter_matches(self):
+        '''
+        Queries the logbook for matching entries, along with their timestamps and titles, one
+        page at a time. Yields lists of (timestamp, element id, title) tuples.
+        '''
+        where = _contains('matched.name', self.AttributeName, self.CaseSensitivity) + " AND " + \
+                _contains('matched.value', self.AttributeValue, self.CaseSensitivity)
         
-        return timestamp, title
+        lastId = -1
+        while True:
+            sql = '''SELECT DISTINCT matched.element_id, COALESCE(begin.value, ''), elements.tag
+                    FROM attributes AS matched
+                    JOIN elements ON elements.element_id = matched.element_id
+                    LEFT JOIN attributes AS begin
+                        ON begin.element_id = matched.element_id AND begin.name = {begin}
+                    WHERE {where} AND matched.element_id > {last}
+                    ORDER BY matched.element_id
+                    LIMIT {limit};'''.format(begin= _quote(self.BEGIN_KEY), where= where,
+                                              last= lastId, limit= self.PAGE_SIZE)
+            rows = _m.logbook_query(sql)
+            if not rows: return
+            
+            yield [(timestamp, element_id, title) for element_id, timestamp, title in rows]
+            
+            if len(rows) < self.PAGE_SIZE: return
+            lastId = rows[-1][0]
     
     ##########################################################################################################    
     
@@ -185,5 +235,128 @@ class SearchLogbookAttribtues(_m.Tool()):
     @_m.method(return_type=six.text_type)
     def tool_run_msg_status(self):
         return self.tool_run_msg
+
+##########################################################################################################
+
+class LogbookIndex():
+    '''
+    Local SQLite copy of the logbook's attributes and element titles, used to search large
+    logbooks without querying Modeller for every search.
+    
+    The copy is refreshed incrementally: only attribute rows with a rowid greater than the
+    last one copied are fetched from the logbook. If the SQLite build supports FTS5, a
+    trigram full-text index is kept over attribute names and values, to speed up
+    'contains' searches of 3 or more characters.
+    '''
+    
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._connection = sqlite3.connect(filepath)
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+            CREATE TABLE IF NOT EXISTS elements (element_id INTEGER PRIMARY KEY, tag TEXT);
+            CREATE TABLE IF NOT EXISTS attributes (id INTEGER PRIMARY KEY, element_id INTEGER,
+                                                   name TEXT, value TEXT);
+            CREATE INDEX IF NOT EXISTS attributes_element ON attributes (element_id, name);
+            ''')
+        try:
+            self._connection.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS attributes_fts
+                USING fts5(name, value, content='attributes', content_rowid='id', tokenize='trigram');''')
+            self.hasFullText = True
+        except sqlite3.OperationalError:
+            self.hasFullText = False #FTS5 or its trigram tokenizer is not available
+        self._connection.commit()
+    
+    def close(self):
+        self._connection.close()
+    
+    def _get_meta(self, key):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?;", (key,)).fetchone()
+        return -1 if row is None else row[0]
+    
+    def _set_meta(self, key, value):
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);", (key, value))
+    
+    def clear(self):
+        self._connection.execute("DELETE FROM attributes;")
+        self._connection.execute("DELETE FROM elements;")
+        if self.hasFullText:
+            self._connection.execute("INSERT INTO attributes_fts (attributes_fts) VALUES ('delete-all');")
+        self._connection.execute("DELETE FROM meta;")
+        self._connection.commit()
+    
+    def refresh(self, batchSize):
+        '''
+        Copies logbook attributes and elements added since the last refresh.
+        '''
+        lastRowId = self._get_meta('attributes_rowid')
+        maxRowId = _m.logbook_query("SELECT MAX(rowid) FROM attributes;")[0][0]
+        if maxRowId is None or maxRowId < lastRowId:
+            #The logbook has been cleared or replaced since the index was built.
+            self.clear()
+            lastRowId = -1
+            if maxRowId is None: return
+        
+        copied = 0
+        while lastRowId < maxRowId:
+            rows = _m.logbook_query('''SELECT rowid, element_id, name, value FROM attributes
+                WHERE rowid > {last} AND rowid <= {max} ORDER BY rowid LIMIT {limit};'''.format(
+                    last= lastRowId, max= maxRowId, limit= batchSize))
+            if not rows: break
+            
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO attributes (id, element_id, name, value) VALUES (?, ?, ?, ?);", rows)
+            if self.hasFullText:
+                self._connection.executemany(
+                    "INSERT INTO attributes_fts (rowid, name, value) VALUES (?, ?, ?);",
+                    [(row[0], row[2], row[3]) for row in rows])
+            lastRowId = rows[-1][0]
+            self._set_meta('attributes_rowid', lastRowId)
+            self._connection.commit()
+            copied += len(rows)
+        
+        lastElementId = self._get_meta('element_id')
+        rows = _m.logbook_query('''SELECT element_id, tag FROM elements
+            WHERE element_id > {last} ORDER BY element_id;'''.format(last= lastElementId))
+        if rows:
+            self._connection.executemany("INSERT OR REPLACE INTO elements (element_id, tag) VALUES (?, ?);", rows)
+            self._set_meta('element_id', rows[-1][0])
+        self._connection.commit()
+        
+        _m.logbook_write("Copied %s logbook attributes and %s entries to the search index" %(copied, len(rows)))
+    
+    def iter_matches(self, name, value, caseSensitive, pageSize):
+        '''
+        Searches the index, one page at a time. Yields lists of (timestamp, element id, title) tuples.
+        '''
+        where = _contains('matched.name', name, caseSensitive) + " AND " + \
+                _contains('matched.value', value, caseSensitive)
+        
+        #Trigrams only work for search terms of 3 or more characters
+        terms = ['{%s} : %s' %(column, self._phrase(text)) for column, text in [('name', name), ('value', value)]
+                 if len(text) >= 3]
+        if self.hasFullText and terms:
+            where += " AND matched.id IN (SELECT rowid FROM attributes_fts WHERE attributes_fts MATCH %s)" \
+                % _quote(" AND ".join(terms))
+        
+        lastId = -1
+        while True:
+            sql = '''SELECT DISTINCT matched.element_id, COALESCE(begin.value, ''), elements.tag
+                    FROM attributes AS matched
+                    JOIN elements ON elements.element_id = matched.element_id
+                    LEFT JOIN attributes AS begin
+                        ON begin.element_id = matched.element_id AND begin.name = ?
+                    WHERE {where} AND matched.element_id > ?
+                    ORDER BY matched.element_id
+                    LIMIT ?;'''.format(where= where)
+            rows = self._connection.execute(sql, (SearchLogbookAttribtues.BEGIN_KEY, lastId, pageSize)).fetchall()
+            if not rows: return
+            
+            yield [(timestamp, element_id, title) for element_id, timestamp, title in rows]
+            
+            if len(rows) < pageSize: return
+            lastId = rows[-1][0]
     
-        
\ No newline at end of file
+    @staticmethod
+    def _phrase(text):
+        return '"' + text.replace('"', '""') + '"'
@@ -19,9 +19,11 @@
 
 import os.path
 import inro.modeller as _m
+import numpy as _np
 import traceback as _traceback
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
+_netarrays = _MODELLER.module('tmg.common.network_arrays')
 # import six library for python2 to python3 conversion
 import six 
 # initalize python3 types
@@ -73,17 +75,16 @@ class CheckConnectorSpeeds(_m.Tool()):
                 attributes={
                     "version":"1.00.00"})
             
-            linksChecked = 0
-            problemLinks = 0
-            for link in self.Scenario.get_network().links():
-                
-                if link.i_node.is_centroid or link.j_node.is_centroid:
-                    #link is a centroid connector
-                    if link.data2 != 40:
-                        report += "<br>Centroid connector link <b>" + link.id + "</b> speed should be 40, instead is " + str(link.data2)
-                        problemLinks += 1
-                
-                linksChecked += 1
+            links = _netarrays.load_link_arrays(self.Scenario, ['data2'])
+            isConnector, _, _ = _netarrays.connector_mask(links, _netarrays.load_centroid_numbers(self.Scenario))
+            flagged = _np.flatnonzero(isConnector & (links['data2'] != 40))
+            
+            for index in flagged:
+                linkId = "%s-%s" %(links.i[index], links.j[index])
+                report += "<br>Centroid connector link <b>" + linkId + "</b> speed should be 40, instead is " + str(links['data2'][index])
+            
+            linksChecked = len(links)
+            problemLinks = len(flagged)
             _m.logbook_write(name="Report",
                              value=report)
                 
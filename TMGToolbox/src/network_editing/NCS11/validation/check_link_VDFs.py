@@ -19,9 +19,11 @@
 
 import os.path
 import inro.modeller as _m
+import numpy as _np
 import traceback as _traceback
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
+_netarrays = _MODELLER.module('tmg.common.network_arrays')
 # import six library for python2 to python3 conversion
 import six 
 # initalize python3 types
@@ -89,11 +91,8 @@ class CheckVDFs(_m.Tool()):
             l.par('LinkFilter').set('vdf == %s' %v)
     
     def getLinkVDFs(self):
-        network = self.Scenario.get_network()
-        vdfValues = set()
-        for link in network.links():
-            vdfValues.add(link.volume_delay_func)
-        return vdfValues
+        links = _netarrays.load_link_arrays(self.Scenario, ['volume_delay_func'])
+        return set(int(v) for v in _np.unique(links['volume_delay_func']))
     
     @_m.method(return_type=six.text_type)
     def tool_run_msg_status(self):
@@ -19,9 +19,11 @@
 
 import os.path
 import inro.modeller as _m
+import numpy as _np
 import traceback as _traceback
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
+_netarrays = _MODELLER.module('tmg.common.network_arrays')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 # import six library for python2 to python3 conversion
 import six 
@@ -90,14 +92,8 @@ class CheckLinkTypes(_m.Tool()):
             l.par('LinkFilter').set('type == %s' %t)
     
     def getLinkTypes(self):
-        network = self.Scenario.get_network()
-        typeValues = []
-        for link in network.links():
-            t = link.type
-            if typeValues.count(t) == 0:
-                typeValues.append(t)
-        typeValues.sort()
-        return typeValues
+        links = _netarrays.load_link_arrays(self.Scenario, ['type'])
+        return [int(t) for t in _np.unique(links['type'])]
     
     @_m.method(return_type=six.text_type)
     def tool_run_msg_status(self):
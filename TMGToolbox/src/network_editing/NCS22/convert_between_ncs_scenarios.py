@@ -19,20 +19,19 @@
 """
 
 import inro.modeller as _m
-import csv
 import traceback as _traceback
-from contextlib import contextmanager
 _MODELLER = _m.Modeller()
 _bank = _MODELLER.emmebank
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_conversion = _MODELLER.module('tmg.common.ncs_conversion')
 # import six library for python2 to python3 conversion
 import six 
 # initalize python3 types
 _util.initalizeModellerTypes(_m)
 
 class ConvertBetweenNCSScenarios(_m.Tool()):
-    version = "0.0.1"
+    version = "0.1.0"
     number_of_tasks = 1
     tool_run_msg = ""
 
@@ -47,6 +46,7 @@ class ConvertBetweenNCSScenarios(_m.Tool()):
     LaneCapacitiesFile = _m.Attribute(str)
     TransitLineCodeFile = _m.Attribute(str)
     SkipMissingTransitLines = _m.Attribute(bool)
+    AuditLogFile = _m.Attribute(str)
     
     def __init__(self):
         self.TRACKER = _util.ProgressTracker(self.number_of_tasks) #init the ProgressTracker
@@ -111,6 +111,13 @@ class ConvertBetweenNCSScenarios(_m.Tool()):
             tool_attribute_name="SkipMissingTransitLines",
             label="Boolean to skip missing transit lines default is True",
         )
+        pb.add_select_file(
+            tool_attribute_name="AuditLogFile",
+            window_type="save_file",
+            file_filter="*.csv",
+            title="Audit Log CSV File Location",
+            note="Optional. Lists every change made to the network.",
+        )
         return pb.render()
 
     @_m.method(return_type=str)
@@ -136,7 +143,8 @@ class ConvertBetweenNCSScenarios(_m.Tool()):
                 "transit_vehicle_definitions": self.TransitVehicleDefinitionsFile,
                 "lane_capacities": self.LaneCapacitiesFile,
                 "transit_line_codes": self.TransitLineCodeFile,
-                "skip_missing_transit_lines": self.SkipMissingTransitLines
+                "skip_missing_transit_lines": self.SkipMissingTransitLines,
+                "audit_log_file": self.AuditLogFile
             }
 
         try:
@@ -163,40 +171,57 @@ class ConvertBetweenNCSScenarios(_m.Tool()):
         except Exception as e:
             raise Exception(_util.format_reverse_stack())
 
-    def _execute(self, old_ncs_scenario, parameters):
-        centroid_dict = self.create_mapped_centroid_dict(parameters)
+    def convert_scenario_set(self, parameters, scenario_pairs):
+        """
+        Converts several scenarios with the same conversion files, which are loaded once.
+        scenario_pairs is a list of (old scenario number, new scenario number); the other
+        parameters are as for run_xtmf. The conversion files are validated against every
+        scenario before any is converted, and the changes to every scenario are written
+        to the same audit log (including those made before a failure).
+        """
+        mapping = _conversion.load_mapping(parameters)
+        scenarios = [_util.load_scenario(old_ncs_scenario) for old_ncs_scenario, _ in scenario_pairs]
+        problems = list(mapping.problems)
+        for scenario in scenarios:
+            print("Validating conversion files against scenario %s..." % scenario.id)
+            for problem in _conversion.validate_mapping(mapping, scenario.get_network(), scenario,
+                                                        parameters["skip_missing_transit_lines"]):
+                if problem not in mapping.problems:
+                    problems.append("Scenario %s: %s" % (scenario.id, problem))
+        if problems:
+            raise _conversion.MappingError(problems)
+
+        logs = []
+        try:
+            for scenario, (old_ncs_scenario, new_ncs_scenario) in zip(scenarios, scenario_pairs):
+                scenario_parameters = dict(parameters, old_ncs_scenario=old_ncs_scenario,
+                                           new_ncs_scenario=new_ncs_scenario, audit_log_file=None)
+                logs.append((scenario.id, self._execute(scenario, scenario_parameters, mapping)))
+        finally:
+            if parameters.get("audit_log_file"):
+                _conversion.write_audit_logs(parameters["audit_log_file"], logs)
+
+    def _execute(self, old_ncs_scenario, parameters, mapping=None):
+        if mapping is None:
+            mapping = _conversion.load_mapping(parameters)
         network = old_ncs_scenario.get_network()
-        # Conversion Steps
-        print("Updating zone and station centroids")
-        self.update_zone_centroid_numbers(network, centroid_dict)
-        print("Updating mode code definition...")
-        self.update_mode_code_definitions(parameters, network)
-        self.update_extra_attributes(old_ncs_scenario, "LINK", parameters["link_attributes"])
-        print("Updating transit vehicle definition...")
-        self.update_transit_vehicle_definitions(parameters, network)
-        self.update_lane_capacity(parameters, network)
-        print("Updating transit line codes")
-        self.update_transit_line_codes(parameters, network)
+        # Conversion Steps, applied once the conversion files are validated against the network
+        print("Validating conversion files...")
+        audit = _conversion.convert_network(
+            network, mapping, scenario=old_ncs_scenario,
+            skip_missing_transit_lines=parameters["skip_missing_transit_lines"]
+        )
+        for category, count in sorted(audit.counts().items()):
+            print("Updated %s %s(s)" % (count, category))
         # Copy scenario and write a new updated network
         print("Started copying %s into %s" % (parameters["old_ncs_scenario"], parameters["new_ncs_scenario"]))
         self.copy_ncs_scenario(parameters, network, title="GTAModel - NCS22")
+        if parameters.get("audit_log_file"):
+            _conversion.write_audit_logs(parameters["audit_log_file"], [(old_ncs_scenario.id, audit)])
         print(
             "Done! Scenario %s has an updated network with the most recent network coding standard." % old_ncs_scenario
         )
-
-    def update_zone_centroid_numbers(self, network, centroid_dict):
-        nodes_list = []
-        for item in network.nodes():
-            nodes_list.append(int(item))
-        max_node_number = max(nodes_list) + 1
-        for old_centroid in centroid_dict:
-            centroid_to_update = network.node(old_centroid)
-            if centroid_to_update is not None:
-                centroid_to_update.number = old_centroid + max_node_number
-        for old_centroid_node in centroid_dict:
-            centroid_to_update = network.node(old_centroid_node + max_node_number)
-            if centroid_to_update is not None:
-                centroid_to_update.number = centroid_dict[old_centroid_node]
+        return audit
 
     def copy_ncs_scenario(self, parameters, network, title="New_NCS_Scenario"):
         new_ncs_scenario = _bank.scenario(parameters["new_ncs_scenario"])
@@ -206,159 +231,3 @@ class ConvertBetweenNCSScenarios(_m.Tool()):
         new_ncs_scenario.publish_network(network, resolve_attributes=True)
         new_ncs_scenario.title = str(title)
         return new_ncs_scenario
-
-    def update_centroid_lists_with_zone_centroids(self, parameters, old_centroid_list, new_centroid_list):
-        with self.open_csv_reader(parameters["zone_centroid_file"]) as zone_centroid_file:
-            for centroid_range in zone_centroid_file:
-                old_centroid_starts = int(centroid_range[1].strip())
-                old_centroid_ends = int(centroid_range[2].strip())
-                new_centroid_starts = int(centroid_range[3].strip())
-                new_centroid_ends = int(centroid_range[4].strip())
-                old_centroid_range = range(old_centroid_starts, old_centroid_ends + 1)
-                new_centroid_range = range(new_centroid_starts, new_centroid_ends + 1)
-                for centroid in old_centroid_range:
-                    old_centroid_list.append(centroid)
-                for centroid in new_centroid_range:
-                    new_centroid_list.append(centroid)
-
-    def update_centroid_lists_with_station_centroids(self, parameters, old_centroid_list, new_centroid_list):
-        with self.open_csv_reader(parameters["station_centroid_file"]) as station_centroid_file:
-            for centroid in station_centroid_file:
-                old_station_centroid = int(centroid[2].strip())
-                new_station_centroid = int(centroid[3].strip())
-                if old_station_centroid <= 0 or new_station_centroid <= 0:
-                    continue
-                old_centroid_list.append(old_station_centroid)
-                new_centroid_list.append(new_station_centroid)
-
-    def create_mapped_centroid_dict(self, parameters):
-        centroid_dict = {}
-        old_centroid_list = []
-        new_centroid_list = []
-        self.update_centroid_lists_with_zone_centroids(parameters, old_centroid_list, new_centroid_list)
-        self.update_centroid_lists_with_station_centroids(parameters, old_centroid_list, new_centroid_list)
-        for old_centroid in old_centroid_list:
-            old_centroids = old_centroid_list.index(old_centroid)
-            centroid_dict[old_centroid] = new_centroid_list[old_centroids]
-        return centroid_dict
-
-    def update_mode_code_definitions(self, parameters, network):
-        with self.open_csv_reader(parameters["mode_code_definitions"]) as mode_code_file:
-            for mode_list in mode_code_file:
-                old_mode_id = str(mode_list[2])
-                if old_mode_id == "":
-                    continue
-                for mode in network.modes():
-                    if str(mode.id) == old_mode_id:
-                        description = str(mode_list[0])
-                        mode_type = str(mode_list[1].strip())
-                        new_mode_id = str(mode_list[3].strip())
-                        mode.id = new_mode_id
-                        if mode.type != mode_type:
-                            raise Exception('There is an issue with mode type "%s"' % mode_list)
-                        # Emme allows description of the mode, up to 10 characters.
-                        mode.description = description[:10]
-
-    def update_extra_attributes(self, scenario, attribute_type, attributes_file_name, default_value=0):
-        attribute_type = self.check_attribute_type(attribute_type)
-        with self.open_csv_reader(attributes_file_name) as attributes_file:
-            for attrib_list in attributes_file:
-                new_attribute_id = str(attrib_list[0].strip())
-                new_description = str(attrib_list[1])
-                if not new_attribute_id.startswith("@"):
-                    new_attribute_id = "@" + new_attribute_id
-                checked_extra_attribute = scenario.extra_attribute(new_attribute_id)
-                if checked_extra_attribute == None:
-                    new_attribute = scenario.create_extra_attribute(attribute_type, new_attribute_id, default_value)
-                    # maximum length of description is 40 characters
-                    new_attribute.description = new_description[:40]
-                elif checked_extra_attribute != None and checked_extra_attribute.type != attribute_type:
-                    raise Exception("Attribute %s already exist or has some issues!" % new_attribute_id)
-                else:
-                    continue
-
-    def check_attribute_type(self, attribute_type):
-        ATTRIBUTE_TYPES = ["NODE", "LINK", "TURN", "TRANSIT_LINE", "TRANSIT_SEGMENT"]
-        attribute_type = str(attribute_type).upper()
-        # check if the type provided is correct
-        if attribute_type not in ATTRIBUTE_TYPES:
-            raise TypeError("Attribute type '%s' provided is not recognized." % attribute_type)
-        return attribute_type
-
-    # code for transit vehicle changes
-    def filter_mode(self, value, network):
-        """
-        extract the id of the vehicles from the transit vehicles list
-        this is used to filter the transit vehicle to change the data
-        """
-        for i in network.transit_vehicles():
-            if value == i.description:
-                return i.id
-        return None
-
-    def copy_data(self, id, code, seated_capacity, total_capacity, auto_equivalent, network):
-        """
-        function to change the value and convert the ncs16 standard to ncs22.
-        """
-        # first extract the transit vehicle object using the id
-        vehicle_object = network.transit_vehicle(int(id))
-        # change the values of the vehicle object
-        vehicle_object.description = code
-        vehicle_object.seated_capacity = int(seated_capacity)
-        vehicle_object.total_capacity = int(total_capacity)
-        vehicle_object.auto_equivalent = float(auto_equivalent)
-
-    def update_transit_vehicle_definitions(self, parameters, network):
-        """
-        function to read the csv file
-        it also runs the copy_data() method to change the traffic vehicle data
-        """
-        with self.open_csv_reader(parameters["transit_vehicle_definitions"]) as transit_op_file:
-            for item in transit_op_file:
-                # get the vehicle id using the ncs16 standard code
-                id = self.filter_mode(item[1].strip(), network)
-                # run the copy_data function to change the data
-                self.copy_data(
-                    id=id,
-                    code=item[6].strip(),
-                    seated_capacity=item[8].strip(),
-                    total_capacity=item[9].strip(),
-                    auto_equivalent=item[10].strip(),
-                    network=network,
-                )
-
-    def update_lane_capacity(self, parameters, network):
-        with self.open_csv_reader(parameters["lane_capacities"]) as lane_capacity_file:
-            for line in lane_capacity_file:
-                vdf = int(line[0].strip())
-                new_lane_capacity = int(line[1].strip())
-                for link in network.links():
-                    volume_delay_func = int(link.volume_delay_func)
-                    if vdf == volume_delay_func:
-                        link.data3 = new_lane_capacity
-
-    def update_transit_line_codes(self, parameters, network):
-        """
-        Function to update the transit line codes
-        """
-        with self.open_csv_reader(parameters["transit_line_codes"]) as transit_line_file:
-            for item in transit_line_file:
-                # get the nc16 transit line object id
-                transit_line_object = network.transit_line(item[0])
-                # check if the transit line object is None, if it is None give the user an error
-                if transit_line_object is not None:
-                    # change the transit line object id to ncs22
-                    transit_line_object.id = item[1]
-                elif not parameters["skip_missing_transit_lines"]:
-                    raise Exception("The transit line object {} doesn't exist".format(item[0]))
-
-    @contextmanager
-    def open_csv_reader(self, file_path):
-        csv_file = open(file_path, mode="r")
-        file = csv.reader(csv_file)
-        next(file)
-        try:
-            yield file
-        finally:
-            csv_file.close()
-
@@ -68,6 +68,9 @@ Kucirek-Vaughan Automated Centroid Connector Generator (CCGen)
         loading properly after a run. Also fixed a bug where the tool would crash if
         no zones were selected to be connected.  
     
+    1.0.2 Node numbers for mid-block virtual nodes are now handed out by the common
+        NodeNumberAllocator, instead of probing the network for each new node.
+    
 '''
 
 import inro.modeller as _m
@@ -77,6 +80,7 @@ _g = _MODELLER.module('tmg.common.geometry')
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 _spindex = _MODELLER.module('tmg.common.spatial_index')
+_editing = _MODELLER.module('tmg.common.network_editing')
 # import six library for python2 to python3 conversion
 from os import path
 from itertools import combinations
@@ -97,7 +101,7 @@ def _manhattanDist(x1, y1, x2, y2):
 
 class CCGEN(_m.Tool()):
     
-    version = '1.0.1'
+    version = '1.0.2'
     tool_run_msg = ""
     report_html = ""
     
@@ -447,6 +451,8 @@ class CCGEN(_m.Tool()):
                 if self.DoFullReport:
                     fullReport = FullReport(self.FullReportFile)
                     
+                self._nodeNumbers = _editing.NodeNumberAllocator.fromNetwork(network)
+                
                 zonesHandled = 0
                 errors = 0
                 self._tracker.startProcess(len(zonesToProcess)) # TASK 4
@@ -825,10 +831,7 @@ class CCGEN(_m.Tool()):
             #if node is a virtual node, add it to the network
             if node.id =="":
                 #get node number
-                testNode = network.node(next_node)
-                while testNode is not None:
-                    next_node += 1
-                    testNode = network.node(next_node)
+                next_node = self._nodeNumbers.next(minimum= next_node)
                 node.id = str(next_node)
                 node = network.split_link(node.begin,node.end, next_node)
                 #remove any transit stops created at that node
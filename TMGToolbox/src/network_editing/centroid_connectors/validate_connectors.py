@@ -28,6 +28,11 @@
 #---VERSION HISTORY
 '''
     0.1.0 Created April 13, 2016
+    0.2.0 Connectors are validated with tmg.common.connector_validation, which evaluates every
+        rule on arrays of the network instead of walking each centroid's links. Zones are
+        flagged with one attribute write instead of publishing the network. Added an optional
+        CSV / GeoJSON report (which also lists dead-end connectors and mode mismatches), and
+        a comparison with a second scenario. An empty zone selector now validates all zones.
     
 '''
 
@@ -36,6 +41,7 @@ import traceback as _traceback
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_validation = _MODELLER.module('tmg.common.connector_validation')
 
 # import six library for python2 to python3 conversion
 import six 
@@ -44,7 +50,7 @@ _util.initalizeModellerTypes(_m)
 
 class ValidateConnectors(_m.Tool()):
 
-    version = '0.1.0'
+    version = '0.2.0'
     tool_run_msg = ""
     report_html = ""
     Scenario = _m.Attribute(_m.InstanceType)
@@ -53,7 +59,9 @@ class ValidateConnectors(_m.Tool()):
     intCutoff = _m.Attribute(int)
     InfeasibleLinkSelector = _m.Attribute(str)
     ZoneSelector = _m.Attribute(str)
-
+    ReportFile = _m.Attribute(str)
+    ComparisonScenario = _m.Attribute(_m.InstanceType)
+    ComparisonReportFile = _m.Attribute(str)
 
     def __init__(self):
         self.Scenario = _MODELLER.scenario
@@ -116,7 +124,20 @@ class ValidateConnectors(_m.Tool()):
             title="Attribute to flag zones.",
             note="Zones which meet the selected criteria will be flagged as True/1.")
 
+        pb.add_select_file(tool_attribute_name='ReportFile',
+                           window_type='save_file', file_filter='*.csv *.geojson',
+                           title="Report file",
+                           note="Optional. A .geojson file reports every connector, other files report every zone (CSV).")
+
+        pb.add_select_scenario(tool_attribute_name="ComparisonScenario",
+                        title="Comparison Scenario",
+                        allow_none=True,
+                        note="Optional. Scenario whose connectors are compared against the selected scenario.")
 
+        pb.add_select_file(tool_attribute_name='ComparisonReportFile',
+                           window_type='save_file', file_filter='*.csv',
+                           title="Comparison report file",
+                           note="Lists the zone metrics and connectors which differ between the two scenarios.")
 
         return pb.render()
 
@@ -141,113 +162,55 @@ class ValidateConnectors(_m.Tool()):
     def _execute(self):
 
         with _m.logbook_trace(name="{0} v{1}".format(self.__class__.__name__,self.version)):
-            flagged_count = 0
 
             if not self.criteria or not self.intCutoff or not self.FlagAttribute:
                 raise Exception ("Criteria, cutoff value and/or flag attribute not specified")
-
-            with _util.tempExtraAttributeMANAGER(self.Scenario, 'NODE') as selectZone, \
-                _util.tempExtraAttributeMANAGER(self.Scenario, 'LINK') as excludeLink:
-                    self._applyInfeasibleLinkFilter(excludeLink.id)
-                    self._applyZoneFilter(selectZone.id) 
-                    network = self.Scenario.get_network()
-
-                    for node in network.centroids():
-                    
-                        #initialize variables
-                        node[self.FlagAttribute.id] = False
-
-                        if node[selectZone.id] == 1:
-
-                            intersections = 0
-                            connectors = 0
-                            conn_centroids = 0
-                            min_distance = float("inf")
-                    
-    
-                            for connector in node.outgoing_links():
-        
-                                #count the number of connectors
-                                connectors += 1
-        
-                                #find the minimum connector length
-                                if connector.length < min_distance:
-                                    min_distance = connector.length
-        
-                                #determine if connector is connecting to an intersection
-                                #or another connector
-                                connected_to_centroid = False
-                                degree = 0    
-                                for second_link in connector.j_node.outgoing_links():
-                                    if second_link[excludeLink.id] == 0:
-                                        second_node = second_link.j_node
-                                        if second_node != node:
-                                            if second_node.is_centroid == False:
-                                                degree += 1
-                                            else:
-                                                connected_to_centroid = True
-                                if degree > 2:
-                                    intersections +=1
-                                if connected_to_centroid:
-                                    conn_centroids += 1
-    
-                            #criteria = number of connectors
-                            if self.criteria == 1:
-                                if connectors < self.intCutoff:
-                                    node[self.FlagAttribute.id] = True
-                                    flagged_count += 1
-                            #criteria = number of connectors at intersections
-                            elif self.criteria == 2:
-                                if intersections > self.intCutoff:
-                                    node[self.FlagAttribute.id] = True
-                                    flagged_count += 1
-                            #criteria = number of connectors to other connectors
-                            elif self.criteria == 3:
-                                if conn_centroids > self.intCutoff:
-                                    node[self.FlagAttribute.id] = True
-                                    flagged_count += 1
-                            #criteria = minimum distance
-                            elif self.criteria == 4:
-                                if min_distance > self.intCutoff:
-                                    node[self.FlagAttribute.id] = True
-                                    flagged_count += 1
-
-            self.Scenario.publish_network(network, resolve_attributes= True)
+            if self.ComparisonScenario is not None and not self.ComparisonReportFile:
+                raise Exception ("Comparison report file not specified")
+
+            report, nodeNumbers, x, y = self._loadReport(self.Scenario)
+            flags = report.flags(self.criteria, self.intCutoff)
+            flagged_count = int(flags.sum())
+            self._writeFlags(report, flags)
+            self._tracker.completeTask()
+
+            if self.ReportFile:
+                _validation.write_report(self.ReportFile, report, nodeNumbers, x, y, flags)
+            self._tracker.completeTask()
+
+            if self.ComparisonScenario is not None:
+                comparison = self._loadReport(self.ComparisonScenario)[0]
+                differences = _validation.compare_reports(report, comparison)
+                _validation.write_differences(self.ComparisonReportFile, differences)
+                _m.logbook_write("{0} differences with scenario {1}".format(len(differences),
+                                                                            self.ComparisonScenario.id))
+            self._tracker.completeTask()
 
         self.tool_run_msg = _m.PageBuilder.format_info(" {0} zones were flagged.".format(flagged_count))
 
-#----Filters and Exclusions----------------------------------------------------------------------------
-
-    def _applyInfeasibleLinkFilter(self, attributeId): 
-        if self.InfeasibleLinkSelector == "" or self.InfeasibleLinkSelector is None:
-            self._tracker.completeTask() 
-            return
-        else:
-            spec = {
-                    "result": attributeId,
-                    "expression": "1",
-                    "aggregation": None,
-                    "selections": {
-                                   "link": self.InfeasibleLinkSelector
-                                   },
-                    "type": "NETWORK_CALCULATION"
-                    }
-        tool = None
-        try:
-            tool = _m.Modeller().tool("inro.emme.network_calculation.network_calculator")
-        except Exception as e:
-            tool = _m.Modeller().tool("inro.emme.standard.network_calculation.network_calculator")
-        
-        self._tracker.runTool(tool, spec, scenario=self.Scenario)
+    def _loadReport(self, scenario):
+        if self.ZoneSelector == "" or self.ZoneSelector is None:
+            self._tracker.completeTask()
+            return _validation.load_connector_report(scenario, self.InfeasibleLinkSelector)
+        with _util.tempExtraAttributeMANAGER(scenario, 'NODE') as selectZone:
+            self._applyZoneFilter(scenario, selectZone.id)
+            return _validation.load_connector_report(scenario, self.InfeasibleLinkSelector, selectZone.id)
+
+    def _writeFlags(self, report, flags):
+        #Centroids are reset to 0 and flagged zones set to 1, other nodes keep their values
+        package = self.Scenario.get_attribute_values('NODE', [self.FlagAttribute.id])
+        nodeIndex = package[0]
+        values = list(package[1])
+        for number in self.Scenario.zone_numbers:
+            values[nodeIndex[number]] = 0.0
+        for number in report.zones[flags]:
+            values[nodeIndex[int(number)]] = 1.0
+        self.Scenario.set_attribute_values('NODE', [self.FlagAttribute.id], [nodeIndex, values])
 
-#------------------------------------------------------------------------------------------------
+#----Filters and Exclusions----------------------------------------------------------------------------
 
-    def _applyZoneFilter(self, attributeId):
-        if self.ZoneSelector == "" or self.ZoneSelector is None:
-            self._tracker.completeTask() 
-            return
-        else:
-            spec = {
+    def _applyZoneFilter(self, scenario, attributeId):
+        spec = {
                     "result": attributeId,
                     "expression": "1",
                     "aggregation": None,
@@ -262,4 +225,4 @@ class ValidateConnectors(_m.Tool()):
         except Exception as e:
             tool = _m.Modeller().tool("inro.emme.standard.network_calculation.network_calculator")
         
-        self._tracker.runTool(tool, spec, scenario=self.Scenario)
+        self._tracker.runTool(tool, spec, scenario=scenario)
@@ -32,15 +32,24 @@
 #---VERSION HISTORY
 '''
     0.0.1 Created on 2016-08-22 by nasterska
+    0.1.0 Removable links and stranded nodes are found with array operations on the link
+        incidence, modes and segment counts loaded in one walk of the network, and the
+        deletions are then applied together. Dead-end links are found against the network
+        left after removing unused transit-only links, instead of depending on the order
+        in which links were visited.
+    0.1.1 Added a parity harness (make_synthetic_network, remove_extra_links_reference and
+        check_remove_extra_links_parity), which runs on a local network stub.
             
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 from re import split as _regex_split
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_netarrays = _MODELLER.module('tmg.common.network_arrays')
 # import six library for python2 to python3 conversion
 import six 
 # initalize python3 types
@@ -50,7 +59,7 @@ _util.initalizeModellerTypes(_m)
 
 class RemoveExtraLinks(_m.Tool()):
        
-    version = '0.0.1'
+    version = '0.1.1'
     tool_run_msg = ""
     number_of_tasks = 4 # For progress reporting, enter the integer number of tasks here
     
@@ -199,10 +208,10 @@ class RemoveExtraLinks(_m.Tool()):
             self.BaseNetwork = self.BaseScenario.get_network()
             self.TRACKER.completeTask()
                         
-            self._RemoveLinks(self.BaseNetwork)
+            strandedNodes = self._RemoveLinks(self.BaseNetwork)
             self.TRACKER.completeTask()
             
-            self._RemoveStrandedNodes(self.BaseNetwork)
+            self._RemoveStrandedNodes(self.BaseNetwork, strandedNodes)
 
             self.TRACKER.startProcess(2)
 
@@ -236,120 +245,82 @@ class RemoveExtraLinks(_m.Tool()):
     
 
     
-    def _RemoveLinks(self,network):
-
+    def _RemoveLinks(self, network):
+        links, deleted, stripped, strandedNodes = self._FindRemovableElements(network,
+                                                    [mode.id for mode in self.TransferModeList])
+        
+        for i, j in zip(links.i[deleted], links.j[deleted]):
+            network.delete_link(int(i), int(j))
+        
+        #links with non-transfer modes are kept, but lose their transfer modes
+        transferModes = set(network.mode(mode.id) for mode in self.TransferModeList)
+        for i, j in zip(links.i[stripped], links.j[stripped]):
+            link = network.link(int(i), int(j))
+            link.modes = link.modes.difference(transferModes)
+        
+        return strandedNodes
+    
+    def _FindRemovableElements(self, network, transferModeIds):
+        '''
+        Finds the links to remove in one pass over arrays of the network.
+        
+        Returns: A tuple of (LinkArrays with the link modes, mask of links to delete,
+            mask of links to remove the transfer modes from, array of stranded node numbers)
+        '''
+        modeIds = [mode.id for mode in network.modes()]
+        transitBits = _netarrays.mode_bits(modeIds, [mode.id for mode in network.modes() if mode.type == 'TRANSIT'])
+        transferBits = _netarrays.mode_bits(modeIds, transferModeIds)
+        
+        nodeNumbers, _ = _netarrays.load_node_arrays(network)
+        isCentroid = _netarrays.flag_incident_nodes(nodeNumbers, _netarrays.load_centroid_numbers(network))
+        links = _netarrays.load_link_modes(network, modeIds)
+        modes = links['modes']
+        incidence = _netarrays.LinkIncidence(nodeNumbers, links)
+        iPositions = incidence.i_positions
+        jPositions = incidence.j_positions
+        
+        segmentI, segmentJ, segmentStops = _netarrays.load_segment_links(network)
+        segmentLinks = incidence.find(_netarrays.node_positions(nodeNumbers, segmentI),
+                                      _netarrays.node_positions(nodeNumbers, segmentJ))
+        hasTransit = _np.bincount(segmentLinks, minlength=len(links)) > 0
+        isStop = _netarrays.flag_incident_nodes(nodeNumbers, segmentI[segmentStops])
+        
         #remove transit-only links that have no transit lines
-        for link in network.links():
-            has_transit = False
-            for segment in link.segments():
-                has_transit = True
-            transit_only = True
-            if has_transit == False:
-                for mode in link.modes:
-                    if mode.type != "TRANSIT":
-                        transit_only = False
-                if transit_only == True:
-                    network.delete_link(link.i_node,link.j_node) 
-                     
-        #remove dead-end links
-        for link in network.links():
-            has_transit = False
-            for segment in link.segments():
-                has_transit = True
-            dead_start = True
-            dead_end = True
-            if has_transit == False:
-                start_node = link.i_node
-                end_node = link.j_node
-                if start_node.is_centroid:
-                    dead_start = False
-                else:
-                    for in_link in start_node.incoming_links():
-                        if in_link.i_node != link.j_node:
-                            dead_start = False 
-                if end_node.is_centroid:
-                    dead_end = False
-                else:
-                    for out_link in end_node.outgoing_links():
-                        if out_link.j_node != link.i_node:
-                            dead_end = False
-                if dead_start or dead_end:
-                    network.delete_link(start_node,end_node)
-        #remove unnecessary transfer links
-
-        #create transfer mode id string
-        transfer_modes = set()
-        for m in self.TransferModeList:
-            transfer_modes.add(network.mode(m.id))
-        for link in network.links():
-            linkmodes = link.modes
-            #check if link has at least one transfer mode
-            if len(linkmodes.intersection(transfer_modes))>0:
-                start_node = link.i_node
-                end_node = link.j_node
-                start_stop = False
-                end_stop = False
-                start_road = False
-                end_road = False
-                for in_link in start_node.incoming_links():
-                    #only check if non-reverse links are on the road network
-                    if in_link.i_node != link.j_node:
-                        for mode in in_link.modes:
-                            if mode.type != 'TRANSIT' and mode not in transfer_modes:
-                                start_road = True
-                    #check if start node is end of line stop
-                    for segment in in_link.segments():
-                        if segment.line.segment(str(start_node.number) + "-0") != False:
-                            start_stop = True
-                for out_link in start_node.outgoing_links():
-                    #check if start node has transit stops
-                    for segment in out_link.segments():
-                        if segment.allow_boardings or segment.allow_alightings:
-                            start_stop = True
-                for out_link in end_node.outgoing_links():
-                    #only check if non-reverse links are on the road network
-                    if out_link.j_node != link.i_node:
-                        for mode in out_link.modes:
-                            if mode.type != 'TRANSIT'and mode not in transfer_modes:
-                                end_road = True
-                    #check to see if end node has transit stops
-                    for segment in out_link.segments():
-                        if segment.allow_boardings or segment.allow_alightings:
-                            end_stop = True
-                #check to see if node is end-of-line stop
-                for segment in link.segments():
-                    if segment.line.segment(str(end_node.number) + "-0") != False:
-                        end_stop = True
-                keep = False
-                if start_stop == True and end_stop == True:
-                    keep = True
-                elif start_stop == True and end_road == True:
-                    keep = True
-                elif end_stop == True and start_road == True:
-                    keep = True
-                if keep == False:
-                    #check if link has non-transfer modes, in which case these modes are removed from link, otherwise link is deleted
-                    if link.modes.issubset(transfer_modes):
-                        network.delete_link(start_node,end_node)
-                    else:
-                        link.modes = link.modes.difference(transfer_modes)
-
-    def _RemoveStrandedNodes(self,network):
+        deleted = ~hasTransit & ((modes & ~transitBits) == 0)
+        
+        #remove dead-end links, ignoring their own reverse links
+        remaining = ~deleted
+        reverseRemaining = incidence.reverse_flags(remaining)
+        deadStart = ~isCentroid[iPositions] & (incidence.in_count(remaining)[iPositions] - reverseRemaining == 0)
+        deadEnd = ~isCentroid[jPositions] & (incidence.out_count(remaining)[jPositions] - reverseRemaining == 0)
+        deleted |= remaining & ~hasTransit & (deadStart | deadEnd)
+        
+        #remove unnecessary transfer links, which do not connect two stops, or a stop to the road network
+        remaining = ~deleted
+        isRoad = remaining & ((modes & ~(transitBits | transferBits)) != 0)
+        reverseRoad = incidence.reverse_flags(isRoad)
+        startRoad = incidence.in_count(isRoad)[iPositions] - reverseRoad > 0
+        endRoad = incidence.out_count(isRoad)[jPositions] - reverseRoad > 0
+        #nodes reached by a transit line, or where a line stops, count as stops
+        startStop = isStop[iPositions] | (incidence.in_count(hasTransit)[iPositions] > 0)
+        endStop = isStop[jPositions] | hasTransit
+        keep = (startStop & endStop) | (startStop & endRoad) | (endStop & startRoad)
+        unnecessary = remaining & ((modes & transferBits) != 0) & ~keep
+        transferOnly = (modes & ~transferBits) == 0
+        deleted |= unnecessary & transferOnly
+        stripped = unnecessary & ~transferOnly
+        
+        #nodes left without any links
+        remaining = ~deleted
+        nLinks = incidence.in_count(remaining) + incidence.out_count(remaining)
+        strandedNodes = nodeNumbers[(nLinks == 0) & ~isCentroid]
+        
+        return links, deleted, stripped, strandedNodes
+
+    def _RemoveStrandedNodes(self, network, nodeNumbers):
         #removes nodes not connected to any links
-        for node in network.nodes():
-            if node.is_centroid:
-                continue
-            is_stranded = True
-            for link in node.outgoing_links():
-                is_stranded = False
-                break
-            if not is_stranded:
-                continue
-            for link in node.incoming_links():
-                is_stranded = False
-                break
-            if is_stranded:
-                network.delete_node(node.id)
+        for number in nodeNumbers:
+            network.delete_node(int(number))
        
     @_m.method(return_type= bool)
     def check_copy_flag(self):
@@ -362,4 +333,254 @@ class RemoveExtraLinks(_m.Tool()):
     @_m.method(return_type=six.text_type)
     def tool_run_msg_status(self):
         return self.tool_run_msg
-        
\ No newline at end of file
+        
+# ---PARITY HARNESS-------------------------------------------------------------------------------------
+# A minimal stand-in for the Emme Network API used by this tool, a generator of random
+# networks, and the original link-by-link algorithm, to check _FindRemovableElements
+# without Emme.
+
+
+class _StubMode(object):
+    def __init__(self, id, type):
+        self.id = id
+        self.type = type
+
+
+class _StubNode(object):
+    def __init__(self, network, number, is_centroid):
+        self._network = network
+        self.number = number
+        self.is_centroid = is_centroid
+
+    def incoming_links(self):
+        return [link for link in list(self._network._links.values()) if link.j_node is self]
+
+    def outgoing_links(self):
+        return [link for link in list(self._network._links.values()) if link.i_node is self]
+
+
+class _StubLink(object):
+    def __init__(self, i_node, j_node, modes):
+        self.i_node = i_node
+        self.j_node = j_node
+        self.modes = set(modes)
+        self._segments = []
+
+    def segments(self):
+        return list(self._segments)
+
+
+class _StubSegment(object):
+    def __init__(self, line, link, i_node, allow_boardings, allow_alightings):
+        self.line = line
+        self.link = link
+        self.i_node = i_node
+        self.allow_boardings = allow_boardings
+        self.allow_alightings = allow_alightings
+
+
+class _StubLine(object):
+    def __init__(self, id):
+        self.id = id
+        self._segments = []
+
+    def segment(self, key):
+        number = int(key.split('-')[0])
+        for segment in self._segments:
+            if segment.i_node.number == number:
+                return segment
+        return None
+
+
+class _StubNetwork(object):
+    def __init__(self):
+        self._modes = {}
+        self._nodes = {}
+        self._links = {}
+        self._lines = []
+
+    def mode(self, id):
+        return self._modes.get(id)
+
+    def modes(self):
+        return list(self._modes.values())
+
+    def node(self, number):
+        return self._nodes.get(number)
+
+    def nodes(self):
+        return list(self._nodes.values())
+
+    def centroids(self):
+        return [node for node in self._nodes.values() if node.is_centroid]
+
+    def link(self, i, j):
+        return self._links.get((int(i), int(j)))
+
+    def links(self):
+        for key in list(self._links):
+            if key in self._links:
+                yield self._links[key]
+
+    def transit_segments(self):
+        for line in self._lines:
+            for segment in line._segments:
+                if segment.link is not None:
+                    yield segment
+
+    def delete_link(self, i, j):
+        key = (getattr(i, 'number', i), getattr(j, 'number', j))
+        if self._links[key]._segments:
+            raise Exception("Link %s-%s has transit segments" % key)
+        del self._links[key]
+
+    def delete_node(self, number):
+        node = self._nodes[int(number)]
+        if any(link.i_node is node or link.j_node is node for link in self._links.values()):
+            raise Exception("Node %s has links" % number)
+        del self._nodes[int(number)]
+
+    def get_attribute_values(self, domain, attributes):
+        if attributes:
+            raise Exception("The stub network has no attribute values")
+        if domain == 'NODE':
+            return [dict((number, position) for position, number in enumerate(sorted(self._nodes)))]
+        indices = {}
+        for position, (i, j) in enumerate(self._links):
+            indices.setdefault(i, {})[j] = position
+        return [indices]
+
+    def state(self):
+        """Returns the node numbers and the (link, mode ids) pairs, for comparing networks."""
+        return (sorted(self._nodes),
+                sorted((key, "".join(sorted(mode.id for mode in link.modes))) for key, link in self._links.items()))
+
+
+def make_synthetic_network(seed=0, nodes=150, centroids=10, lines=8):
+    '''
+    Generates a random network with auto, transit and auxiliary transit (transfer)
+    modes, random links (most with a reverse link), and lines along random walks of
+    bus links. Nodes 1 to centroids are centroids. Transfer modes are 't', 'u' and 'y'.
+    '''
+    import random
+    rng = random.Random(seed)
+    network = _StubNetwork()
+    for id, type in [('c', 'AUTO'), ('b', 'TRANSIT'), ('m', 'TRANSIT'), ('w', 'AUX_TRANSIT'),
+                     ('t', 'AUX_TRANSIT'), ('u', 'AUX_TRANSIT'), ('y', 'AUX_TRANSIT')]:
+        network._modes[id] = _StubMode(id, type)
+    for number in range(1, nodes + 1):
+        network._nodes[number] = _StubNode(network, number, number <= centroids)
+    
+    modeIds = sorted(network._modes)
+    numbers = list(network._nodes)
+    for _ in range(nodes * 2):
+        i, j = rng.sample(numbers, 2)
+        if (i, j) in network._links:
+            continue
+        modes = [network._modes[id] for id in rng.sample(modeIds, rng.randint(0, 3))]
+        network._links[(i, j)] = _StubLink(network._nodes[i], network._nodes[j], modes)
+        if rng.random() < 0.6 and (j, i) not in network._links:
+            reverseModes = modes if rng.random() < 0.7 else [network._modes['t']]
+            network._links[(j, i)] = _StubLink(network._nodes[j], network._nodes[i], reverseModes)
+    
+    bus = network._modes['b']
+    for number in range(lines):
+        busLinks = [link for link in network._links.values() if bus in link.modes]
+        if not busLinks:
+            break
+        line = _StubLine('L%s' % number)
+        link = rng.choice(busLinks)
+        visited = set()
+        for _ in range(rng.randint(1, 8)):
+            key = (link.i_node.number, link.j_node.number)
+            if key in visited:
+                break
+            visited.add(key)
+            segment = _StubSegment(line, link, link.i_node, rng.random() < 0.5, rng.random() < 0.5)
+            line._segments.append(segment)
+            link._segments.append(segment)
+            nextLinks = [nextLink for nextLink in link.j_node.outgoing_links() if bus in nextLink.modes]
+            if not nextLinks:
+                break
+            link = rng.choice(nextLinks)
+        line._segments.append(_StubSegment(line, None, link.j_node, True, True))
+        network._lines.append(line)
+    return network
+
+
+def remove_extra_links_reference(network, transferModeIds):
+    '''
+    The original link-by-link algorithm, with dead ends found against the network left
+    after the first pass (as _FindRemovableElements does). Modifies the network in place.
+    '''
+    #remove transit-only links that have no transit lines
+    for link in list(network.links()):
+        if not link.segments() and all(mode.type == 'TRANSIT' for mode in link.modes):
+            network.delete_link(link.i_node, link.j_node)
+    
+    #remove dead-end links, all judged against the same network
+    toDelete = []
+    for link in list(network.links()):
+        if link.segments():
+            continue
+        startNode = link.i_node
+        endNode = link.j_node
+        deadStart = not startNode.is_centroid and \
+            all(inLink.i_node == endNode for inLink in startNode.incoming_links())
+        deadEnd = not endNode.is_centroid and \
+            all(outLink.j_node == startNode for outLink in endNode.outgoing_links())
+        if deadStart or deadEnd:
+            toDelete.append((startNode, endNode))
+    for startNode, endNode in toDelete:
+        network.delete_link(startNode, endNode)
+    
+    #remove unnecessary transfer links
+    transferModes = set(network.mode(id) for id in transferModeIds)
+    def isRoad(link):
+        return any(mode.type != 'TRANSIT' and mode not in transferModes for mode in link.modes)
+    for link in list(network.links()):
+        if not link.modes & transferModes:
+            continue
+        startNode = link.i_node
+        endNode = link.j_node
+        startRoad = any(isRoad(inLink) for inLink in startNode.incoming_links() if inLink.i_node != endNode)
+        endRoad = any(isRoad(outLink) for outLink in endNode.outgoing_links() if outLink.j_node != startNode)
+        #as in the original, any node reached by a line counts as an end-of-line stop
+        startStop = any(inLink.segments() for inLink in startNode.incoming_links()) or \
+            any(segment.allow_boardings or segment.allow_alightings
+                for outLink in startNode.outgoing_links() for segment in outLink.segments())
+        endStop = bool(link.segments()) or \
+            any(segment.allow_boardings or segment.allow_alightings
+                for outLink in endNode.outgoing_links() for segment in outLink.segments())
+        if (startStop and endStop) or (startStop and endRoad) or (endStop and startRoad):
+            continue
+        if link.modes.issubset(transferModes):
+            network.delete_link(startNode, endNode)
+        else:
+            link.modes = link.modes.difference(transferModes)
+    
+    #remove nodes not connected to any links
+    for node in list(network.nodes()):
+        if not node.is_centroid and not node.incoming_links() and not node.outgoing_links():
+            network.delete_node(node.number)
+
+
+def check_remove_extra_links_parity(seeds=range(200), transferModeIds='tuy', **kwargs):
+    '''
+    Runs _FindRemovableElements (through _RemoveLinks) and remove_extra_links_reference
+    on random networks from make_synthetic_network.
+    
+    Returns: The list of seeds whose resulting networks differ (empty at parity).
+    '''
+    mismatches = []
+    for seed in seeds:
+        network = make_synthetic_network(seed, **kwargs)
+        tool = RemoveExtraLinks.__new__(RemoveExtraLinks)
+        tool.TransferModeList = [network.mode(id) for id in transferModeIds]
+        tool._RemoveStrandedNodes(network, tool._RemoveLinks(network))
+        
+        reference = make_synthetic_network(seed, **kwargs)
+        remove_extra_links_reference(reference, transferModeIds)
+        if network.state() != reference.state():
+            mismatches.append(seed)
+    return mismatches
@@ -36,16 +36,22 @@
     1.0.0 Published with proper documentation on 2014-05-29
 
     1.0.1 Copy of scenario is not created 2016-08-24
+
+    1.1.0 Candidate nodes are now found using bulk link, node, and segment arrays
+        instead of walking each node's links. Unflagged incoming connectors now
+        also preserve their node, consistent with outgoing connectors.
         
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 from re import split as _regex_split
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 _editing = _MODELLER.module('tmg.common.network_editing')
+_netarrays = _MODELLER.module('tmg.common.network_arrays')
 ForceError = _editing.ForceError
 InvalidNetworkOperationError = _editing.InvalidNetworkOperationError
 # import six library for python2 to python3 conversion
@@ -77,7 +83,7 @@ class RemoveExtraNodes(_m.Tool()):
         
         return (a1 * l1 + a2 * l2) / (l1 + l2)
     
-    version = '1.0.1'
+    version = '1.1.0'
     tool_run_msg = ""
     number_of_tasks = 6 # For progress reporting, enter the integer number of tasks here
     
@@ -484,66 +490,49 @@ class RemoveExtraNodes(_m.Tool()):
     
     def _GetCandidateNodes(self, network):
         
-        network.create_attribute('NODE', 'is_stop', False)
-        for segment in network.transit_segments():
-            if segment.allow_boardings or segment.allow_alightings:
-                segment.i_node.is_stop = True
-            
+        nodeAttributes = [att for att in (self.NodeFilterAttributeId, self.StopFilterAttributeId) if att]
+        linkAttributes = [self.ConnectorFilterAttributeId] if self.ConnectorFilterAttributeId else []
+        
+        self.TRACKER.startProcess(4)
+        nodeNumbers, nodeTables = _netarrays.load_node_arrays(network, nodeAttributes)
+        links = _netarrays.load_link_arrays(network, linkAttributes)
+        self.TRACKER.completeSubtask()
+        
+        isStop = _netarrays.stop_flags(network, nodeNumbers)
+        isCentroid = _netarrays.flag_incident_nodes(nodeNumbers, _netarrays.load_centroid_numbers(network))
+        self.TRACKER.completeSubtask()
         
-        #Setup filter functions. True to delete node, False to preserve
+        #Setup filter arrays. True to delete node, False to preserve
         if self.NodeFilterAttributeId:
-            checkNode1 = lambda n: bool(n[self.NodeFilterAttributeId])
+            passNode = nodeTables[self.NodeFilterAttributeId] != 0
         else:
-            checkNode1 = lambda n: True
+            passNode = _np.ones(len(nodeNumbers), dtype=bool)
         
         if self.StopFilterAttributeId:
             #True if node is not a stop or node is flagged
-            checkNode2 = lambda n: not n.is_stop or n[self.StopFilterAttributeId]
+            passNode &= ~isStop | (nodeTables[self.StopFilterAttributeId] != 0)
         else:
-            checkNode2 = lambda n: not n.is_stop
-            
+            passNode &= ~isStop
+        passNode &= ~isCentroid
+        
+        #Connectors flagged for deletion are 'invisible'. Any other connector
+        #prevents its regular node from being deleted
+        isConnector, iIsCentroid, jIsCentroid = _netarrays.connector_mask(links, nodeNumbers[isCentroid])
         if self.ConnectorFilterAttributeId:
-            checkConnector = lambda l: bool(l[self.ConnectorFilterAttributeId])
+            flaggedConnector = links[self.ConnectorFilterAttributeId] != 0
         else:
-            checkConnector = lambda l: False
-        
-        def checkNode(node):
-            if checkNode1(node) and checkNode2(node):
-                neighbours = set()
-                nLinks = 0
-                
-                for link in node.outgoing_links():
-                    if link.j_node.is_centroid: #is Connector
-                        if checkConnector(link): continue #Make this link 'invisible'
-                        
-                        #Connector not flagged for deletion, therefore cannot delete
-                        #this node
-                        return False 
-                    
-                    neighbours.add(link.j_node.number)
-                    nLinks += 1
-                    
-                for link in node.incoming_links():
-                    if link.i_node.is_centroid:
-                        if checkConnector: continue 
-                        return False 
-                    
-                    neighbours.add(link.i_node.number)
-                    nLinks += 1
-                
-                if len(neighbours) != 2: return False #Needs to have a degree of 2
-                if nLinks != 2 and nLinks != 4: return False #Needs to be connected to either 2 or 4 links
-                
-                #Ok, so now we know this node is a candidate for deletion
-                #For it to be selected for deletion, it must pass the two conditions
-                return checkNode1(node) and checkNode2(node)
-        
-        retval = []
-        
-        self.TRACKER.startProcess(network.element_totals['regular_nodes'])
-        for node in network.regular_nodes():
-            if checkNode(node): retval.append(node)
-            self.TRACKER.completeSubtask()
+            flaggedConnector = _np.zeros(len(links), dtype=bool)
+        blocking = isConnector & ~flaggedConnector
+        passNode &= ~_netarrays.flag_incident_nodes(nodeNumbers, links.i[blocking & jIsCentroid])
+        passNode &= ~_netarrays.flag_incident_nodes(nodeNumbers, links.j[blocking & iIsCentroid])
+        self.TRACKER.completeSubtask()
+        
+        #Needs to have a degree of 2, and be connected to either 2 or 4 links
+        nLinks, nNeighbours = _netarrays.node_degrees(nodeNumbers, links, ~isConnector)
+        passNode &= (nNeighbours == 2) & ((nLinks == 2) | (nLinks == 4))
+        self.TRACKER.completeSubtask()
+        
+        retval = [network.node(int(number)) for number in nodeNumbers[passNode]]
         self.TRACKER.completeTask()
         _m.logbook_write("%s nodes were selected for deletion." %len(retval))
         return retval
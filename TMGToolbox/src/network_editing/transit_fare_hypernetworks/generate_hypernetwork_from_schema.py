@@ -70,8 +70,22 @@ Fare-Based Transit Network (FBTN) From Schema
         method allows for finer control of centroids, but cannot handle multiple operators at 
         a station. 
     
+    1.5.0 Added option to re-apply fares only. The hyper network's index structures (transfer
+        grid, zone-crossing grid, line groups) are saved next to the Emmebank whenever a hyper
+        network is generated. If only the schema's fare rules have changed since, fares are
+        re-applied to the existing hyper network scenario, instead of re-generating it.
+    
+    1.5.1 Virtual node numbers are now handed out by the common NodeNumberAllocator, instead
+        of probing the network for each new node.
+
+    1.5.2 The hyper network index signature now hashes the base network's nodes, links
+        and line itineraries, instead of only its scenario number and element counts.
+    
 '''
 from copy import copy
+import hashlib
+import json
+import os
 from itertools import combinations as get_combinations
 from os import path
 import traceback as _traceback
@@ -148,7 +162,7 @@ class NodeSpatialProxy():
 
 class FBTNFromSchema(_m.Tool()):
     
-    version = '1.4.0'
+    version = '1.5.2'
     tool_run_msg = ""
     number_of_tasks = 5 # For progress reporting, enter the integer number of tasks here
     
@@ -172,6 +186,7 @@ class FBTNFromSchema(_m.Tool()):
 
     StationConnectorFlag = _m.Attribute(bool)
     IgnoreSameGroupsForStations = _m.Attribute(bool)
+    ReapplyFaresOnly = _m.Attribute(bool)
     
     __ZONE_TYPES = ['node_selection', 'from_shapefile']
     __RULE_TYPES = ['initial_boarding', 
@@ -194,6 +209,7 @@ class FBTNFromSchema(_m.Tool()):
 
         self.StationConnectorFlag = True
         self.IgnoreSameGroupsForStations = True
+        self.ReapplyFaresOnly = False
     
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="FBTN From Schema v%s" %self.version,
@@ -280,6 +296,13 @@ class FBTNFromSchema(_m.Tool()):
         pb.add_checkbox(tool_attribute_name= 'IgnoreSameGroupsForStations',
                         label= "Set false to allow transfers in the hyper-network from an agency to a station for the same agency.")           
         
+        pb.add_checkbox(tool_attribute_name= 'ReapplyFaresOnly',
+                        label= "Re-apply fares only?",
+                        note= "Re-applies the schema's fare rules to the existing new scenario, \
+                        without re-generating the hyper network. Only possible if the schema's \
+                        groups and zones (and the options above) are unchanged since the \
+                        scenario was generated; otherwise the hyper network is re-generated.")
+        
         #---JAVASCRIPT
         pb.add_html("""
 <script type="text/javascript">
@@ -349,7 +372,8 @@ class FBTNFromSchema(_m.Tool()):
         
     def __call__(self, XMLSchemaFile, xtmf_BaseScenarioNumber, NewScenarioNumber,
                  TransferModeId, SegmentFareAttributeId, LinkFareAttributeId, 
-                 VirtualNodeDomain, StationConnectorFlag, IgnoreSameGroupsForStations):
+                 VirtualNodeDomain, StationConnectorFlag, IgnoreSameGroupsForStations,
+                 ReapplyFaresOnly=False):
         
         #---1 Set up scenario
         self.BaseScenario = _MODELLER.emmebank.scenario(xtmf_BaseScenarioNumber)
@@ -377,6 +401,7 @@ class FBTNFromSchema(_m.Tool()):
         self.VirtualNodeDomain = VirtualNodeDomain
         self.StationConnectorFlag = StationConnectorFlag
         self.IgnoreSameGroupsForStations = IgnoreSameGroupsForStations
+        self.ReapplyFaresOnly = ReapplyFaresOnly
         
         try:
             self._Execute()
@@ -394,7 +419,6 @@ class FBTNFromSchema(_m.Tool()):
                 raise Exception("There are no Transit Lines defined in this scenario!")
 
             print("Starting Hyper Networking Generation")
-            self._nextNodeId = self.VirtualNodeDomain
             
             root = _ET.parse(self.XMLSchemaFile).getroot()            
             
@@ -407,6 +431,14 @@ class FBTNFromSchema(_m.Tool()):
             _m.logbook_write("Loading Fare Schema File version %s" %version)
             print("Loading Fare Schema File version %s" %version)
             
+            signature = self._GetTopologySignature(root)
+            if self.ReapplyFaresOnly:
+                hyperIndex = self._LoadHyperIndex(signature)
+                if hyperIndex is not None:
+                    self._ReapplyFares(root, hyperIndex, nRules)
+                    print("Finished re-applying fares")
+                    return
+            
             self.TRACKER.startProcess(nGroups + nZones)
             with _util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_LINE', description= "Line Group") as lineGroupAtt, _util.tempExtraAttributeMANAGER(self.BaseScenario, 'NODE', description= "Fare Zone") as zoneAtt:
                  
@@ -433,6 +465,8 @@ class FBTNFromSchema(_m.Tool()):
                 #Load and prepare the network.
                 self.TRACKER.startProcess(2)
                 network = self.BaseScenario.get_network()
+                self._nodeNumbers = _editing.NodeNumberAllocator.fromNetwork(network,
+                                                                             ranges= [(self.VirtualNodeDomain, None)])
                 print("Loaded network.")
                 self.TRACKER.completeSubtask()
                 self._PrepareNetwork(network, nodeProxies, lineGroupAtt.id)
@@ -444,6 +478,8 @@ class FBTNFromSchema(_m.Tool()):
                 transferGrid, zoneCrossingGrid = self._TransformNetwork(network, nGroups, nZones)
                 if nStationGroups > 0:
                     self._IndexStationConnectors(network, transferGrid, stationGroups, groupIds2Int)
+                hyperIndex = self._BuildHyperIndex(network, transferGrid, zoneCrossingGrid,
+                                                   groupIds2Int, zoneId2Int, signature)
                 print("Hyper network generated.")
             
             #Apply fare rules to network.
@@ -465,6 +501,7 @@ class FBTNFromSchema(_m.Tool()):
                                        copy_path_files=False, copy_strat_files=False)
             newSc.title = self.NewScenarioTitle
             newSc.publish_network(network, resolve_attributes= True)
+            self._SaveHyperIndex(hyperIndex)
             
             _MODELLER.desktop.refresh_needed(True) #Tell the desktop app that a data refresh is required
             print("Finished Hyper Network Generation")
@@ -475,6 +512,7 @@ class FBTNFromSchema(_m.Tool()):
         atts = {
                 "Scenario" : str(self.BaseScenario),
                 "Version": self.version, 
+                "Reapply Fares Only": self.ReapplyFaresOnly,
                 "self": self.__MODELLER_NAMESPACE__}
             
         return atts
@@ -1029,11 +1067,7 @@ class FBTNFromSchema(_m.Tool()):
         return transferGrid, zoneCrossingGrid
     
     def _GetNewNodeNumber(self, network, baseNodeNumber):
-        testNode = network.node(self._nextNodeId)
-        while testNode is not None:
-            self._nextNodeId += 1
-            testNode = network.node(self._nextNodeId)
-        return self._nextNodeId
+        return self._nodeNumbers.next()
     
     def _TransformSurfaceNode(self, baseNode, transferGrid, transferMode):
         network = baseNode.network
@@ -1299,9 +1333,203 @@ class FBTNFromSchema(_m.Tool()):
                     if idx in link.i_node.stopping_groups:
                         transferGrid[idx, 0].add(link)
             print("Indexed connectors for group %s" %lineGroupId)
-                
-    
-    #---              
+
+    #---
+    #---HYPER NETWORK INDEX-------------------------------------------------------------------------------
+
+    def _GetTopologySignature(self, root):
+        '''
+        Hashes everything that determines the topology of the hyper network: the schema's
+        groups, station groups and zones (but NOT its fare rules), the shapefiles they
+        refer to, the base scenario's network, and the tool options used to transform it.
+        '''
+        hasher = hashlib.sha1()
+        self._HashBaseTopology(hasher)
+        for tag in ['groups', 'station_groups', 'zones']:
+            element = root.find(tag)
+            if element is not None: hasher.update(_ET.tostring(element))
+
+        shapefiles = []
+        zonesElement = root.find('zones')
+        if zonesElement is not None:
+            for shapefileElement in zonesElement.findall('shapefile'):
+                pth = self._GetAbsoluteFilepath(shapefileElement.attrib['path'])
+                stat = os.stat(pth)
+                shapefiles.append((pth, stat.st_mtime, stat.st_size))
+
+        options = [self.BaseScenario.id, self.TransferModeId, self.VirtualNodeDomain, self.SegmentINodeAttributeId,
+                   self.StationConnectorFlag, self.IgnoreSameGroupsForStations, shapefiles]
+        hasher.update(repr(options).encode('utf-8'))
+
+        return hasher.hexdigest()
+
+    def _HashBaseTopology(self, hasher):
+        '''
+        Hashes the base network: node numbers and coordinates (which place nodes in
+        zones), link ids and modes, and the mode, vehicle and itinerary of each line.
+        '''
+        indices, xtable, ytable = self.BaseScenario.get_attribute_values('NODE', ['x', 'y'])
+        nodes = sorted((nodeNumber, xtable[index], ytable[index]) for nodeNumber, index in six.iteritems(indices))
+        hasher.update(repr(nodes).encode('utf-8'))
+
+        network = self.BaseScenario.get_partial_network(['LINK', 'TRANSIT_LINE', 'TRANSIT_SEGMENT'],
+                                                        include_attributes= False)
+        links = sorted((link.i_node.number, link.j_node.number, ''.join(sorted(mode.id for mode in link.modes)))
+                       for link in network.links())
+        hasher.update(repr(links).encode('utf-8'))
+
+        lines = sorted((line.id, line.mode.id, line.vehicle.number,
+                        [segment.i_node.number for segment in line.segments(True)])
+                       for line in network.transit_lines())
+        hasher.update(repr(lines).encode('utf-8'))
+
+    def _GetHyperIndexPath(self):
+        bankFolder = path.dirname(_MODELLER.emmebank.path)
+        return path.join(bankFolder, "FBTN_%s_index.json" %self.NewScenarioNumber)
+
+    def _BuildHyperIndex(self, network, transferGrid, zoneCrossingGrid,
+                         groupIds2Int, zoneId2Int, signature):
+        '''
+        Flattens the transformed network's index structures into node numbers and line ids,
+        so that fares can later be re-applied to the published scenario. This needs to be
+        called BEFORE fare rules are applied, in order to capture the starting fare values.
+        '''
+        transferCells = []
+        nodeZones = {}
+        for x in xrange(transferGrid.x):
+            for y in xrange(transferGrid.y):
+                links = transferGrid[x, y]
+                if not links: continue
+                transferCells.append([x, y, [[link.i_node.number, link.j_node.number] for link in links]])
+                for link in links:
+                    if link.i_node.fare_zone != 0:
+                        nodeZones[link.i_node.number] = int(link.i_node.fare_zone)
+
+        crossingCells = []
+        for x in xrange(zoneCrossingGrid.x):
+            for y in xrange(zoneCrossingGrid.y):
+                segments = zoneCrossingGrid[x, y]
+                if not segments: continue
+                crossingCells.append([x, y, [[lineId, segmentNumber] for lineId, segmentNumber in segments]])
+
+        linkFares = [[link.i_node.number, link.j_node.number, link[self.LinkFareAttributeId]]
+                     for link in network.links() if link[self.LinkFareAttributeId] != 0.0]
+        segmentFares = [[segment.line.id, segment.number, segment[self.SegmentFareAttributeId]]
+                        for segment in network.transit_segments() if segment[self.SegmentFareAttributeId] != 0.0]
+
+        return {'signature': signature,
+                'groups': groupIds2Int,
+                'zones': zoneId2Int,
+                'transfer_grid': [transferGrid.x, transferGrid.y, transferCells],
+                'zone_crossing_grid': [zoneCrossingGrid.x, zoneCrossingGrid.y, crossingCells],
+                'line_groups': [[line.id, int(line.group)] for line in network.transit_lines()],
+                'node_zones': sorted(nodeZones.items()),
+                'link_fares': linkFares,
+                'segment_fares': segmentFares}
+
+    def _SaveHyperIndex(self, hyperIndex):
+        indexPath = self._GetHyperIndexPath()
+        with open(indexPath, 'w') as writer:
+            json.dump(hyperIndex, writer)
+        _m.logbook_write("Saved hyper network index to %s" %indexPath)
+
+    def _LoadHyperIndex(self, signature):
+        '''
+        Returns the saved hyper network index, or None if fares cannot be re-applied to
+        the existing scenario (in which case the hyper network gets re-generated).
+        '''
+        indexPath = self._GetHyperIndexPath()
+        if _MODELLER.emmebank.scenario(self.NewScenarioNumber) is None:
+            reason = "scenario %s does not exist" %self.NewScenarioNumber
+        elif not path.exists(indexPath):
+            reason = "no hyper network index found at %s" %indexPath
+        else:
+            with open(indexPath) as reader:
+                hyperIndex = json.load(reader)
+            if hyperIndex.get('signature') == signature:
+                return hyperIndex
+            reason = "the base network, groups, zones, or options have changed since the hyper network was generated"
+
+        msg = "Cannot re-apply fares only: %s. Re-generating the hyper network." %reason
+        _m.logbook_write(msg)
+        print(msg)
+        return None
+
+    def _RestoreHyperIndex(self, network, hyperIndex):
+        '''
+        Rebuilds the transfer and zone-crossing grids on a network loaded from the existing
+        hyper network scenario, and resets its fares to their values prior to applying
+        fare rules.
+        '''
+        network.create_attribute('TRANSIT_LINE', 'group', 0)
+        network.create_attribute('NODE', 'fare_zone', 0)
+
+        for lineId, group in hyperIndex['line_groups']:
+            line = network.transit_line(lineId)
+            if line is None:
+                raise Exception("Hyper network index is out of date: line '%s' not found" %lineId)
+            line.group = group
+        for nodeNumber, zone in hyperIndex['node_zones']:
+            network.node(nodeNumber).fare_zone = zone
+
+        for link in network.links(): link[self.LinkFareAttributeId] = 0.0
+        for segment in network.transit_segments(): segment[self.SegmentFareAttributeId] = 0.0
+        for i, j, cost in hyperIndex['link_fares']:
+            network.link(i, j)[self.LinkFareAttributeId] = cost
+        for lineId, segmentNumber, cost in hyperIndex['segment_fares']:
+            network.transit_line(lineId).segment(segmentNumber)[self.SegmentFareAttributeId] = cost
+
+        x, y, cells = hyperIndex['transfer_grid']
+        transferGrid = grid(x, y, [])
+        for x, y, linkIds in cells:
+            links = transferGrid[x, y]
+            for i, j in linkIds:
+                link = network.link(i, j)
+                if link is None:
+                    raise Exception("Hyper network index is out of date: link %s-%s not found" %(i, j))
+                links.append(link)
+
+        x, y, cells = hyperIndex['zone_crossing_grid']
+        zoneCrossingGrid = grid(x, y, [])
+        for x, y, segmentIds in cells:
+            zoneCrossingGrid[x, y] = [(lineId, segmentNumber) for lineId, segmentNumber in segmentIds]
+
+        return transferGrid, zoneCrossingGrid
+
+    def _ReapplyFares(self, root, hyperIndex, nRules):
+        hyperScenario = _MODELLER.emmebank.scenario(self.NewScenarioNumber)
+
+        with _m.logbook_trace("Loading hyper network index"):
+            self.TRACKER.startProcess(2)
+            network = hyperScenario.get_partial_network(
+                ['LINK', 'TRANSIT_SEGMENT', 'TRANSIT_LINE', 'TRANSIT_VEHICLE'], include_attributes=False)
+            data = hyperScenario.get_attribute_values('LINK', ['length'])
+            network.set_attribute_values('LINK', ['length'], data)
+            self.TRACKER.completeSubtask()
+
+            transferGrid, zoneCrossingGrid = self._RestoreHyperIndex(network, hyperIndex)
+            self.TRACKER.completeTask()
+            print("Loaded hyper network index.")
+
+        with _m.logbook_trace("Applying fare rules"):
+            self.TRACKER.startProcess(nRules + 1)
+            fareRulesElement = root.find('fare_rules')
+            self._ApplyFareRules(network, fareRulesElement, transferGrid, zoneCrossingGrid,
+                                 hyperIndex['groups'], hyperIndex['zones'])
+            self._CheckForNegativeFares(network)
+
+            self.TRACKER.completeTask()
+            print("Applied fare rules to network.")
+
+        #Write the fares back in one call per element type
+        for elementType, attributeId in [('LINK', self.LinkFareAttributeId),
+                                         ('TRANSIT_SEGMENT', self.SegmentFareAttributeId)]:
+            data = network.get_attribute_values(elementType, [attributeId])
+            hyperScenario.set_attribute_values(elementType, [attributeId], data)
+
+        _MODELLER.desktop.refresh_needed(True)
+
+    #---
     #---LOAD FARE RULES-----------------------------------------------------------------------------------
     
     def _ApplyFareRules(self, network, fareRulesElement,
@@ -70,6 +70,9 @@ Fare-Based Transit Network (FBTN) From Schema
         method allows for finer control of centroids, but cannot handle multiple operators at 
         a station. 
     
+    Multiclass 0.0.2 Virtual node numbers are now handed out by the common NodeNumberAllocator,
+        instead of probing the network for each new node.
+    
 """
 from copy import copy
 from contextlib import contextmanager
@@ -158,7 +161,7 @@ class NodeSpatialProxy:
 
 class FBTNFromSchemaMulticlass(_m.Tool()):
 
-    version = "0.0.1"
+    version = "0.0.2"
     tool_run_msg = ""
     number_of_tasks = 5  # For progress reporting, enter the integer number of tasks here
 
@@ -401,7 +404,6 @@ class FBTNFromSchemaMulticlass(_m.Tool()):
             name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
             attributes=self._GetAtts(),
         ):
-            self._nextNodeId = self.VirtualNodeDomain
             rootBase = _ET.parse(self.XMLBaseSchemaFile).getroot()
             # Validate the XML Schema File
             nGroups, nZones, nStationGroups = self._ValidateBaseSchemaFile(rootBase)
@@ -443,6 +445,9 @@ class FBTNFromSchemaMulticlass(_m.Tool()):
                 # Load and prepare the network.
                 self.TRACKER.startProcess(2)
                 network = self.BaseScenario.get_network()
+                self._nodeNumbers = _editing.NodeNumberAllocator.fromNetwork(
+                    network, ranges=[(self.VirtualNodeDomain, None)]
+                )
                 print("Loaded network.")
                 self.TRACKER.completeSubtask()
                 self._PrepareNetwork(network, nodeProxies, lineGroupAtt.id)
@@ -1051,11 +1056,7 @@ class FBTNFromSchemaMulticlass(_m.Tool()):
         return transferGrid, zoneCrossingGrid
 
     def _GetNewNodeNumber(self, network, baseNodeNumber):
-        testNode = network.node(self._nextNodeId)
-        while testNode is not None:
-            self._nextNodeId += 1
-            testNode = network.node(self._nextNodeId)
-        return self._nextNodeId
+        return self._nodeNumbers.next()
 
     def _TransformSurfaceNode(self, baseNode, transferGrid, transferMode):
         network = baseNode.network